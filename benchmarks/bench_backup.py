@@ -0,0 +1,151 @@
+"""
+Benchmark kickstart write latency while an online backup runs.
+
+Fills a file-backed SQLite database with synthetic machines, then stores new
+machines from a writer thread (the app writes through one group-commit
+thread) and reports p50/p99 insert latency with no backup running, during a
+stepped backup, and during a backup copied in a single step.
+
+Usage:
+    uv run python benchmarks/bench_backup.py [--machines 200000] [--writers 1]
+"""
+
+import argparse
+import itertools
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import DBMachinePasswords
+from provisionR.services.backup_service import snapshot
+from provisionR.services.credential_store import SqlCredentialStore
+from provisionR.utils import MachineIdentity
+
+
+def make_identity(n: int) -> MachineIdentity:
+    """Build the identity of synthetic machine `n`."""
+    mac = ":".join(f"{(n >> s) & 0xFF:02X}" for s in (40, 32, 24, 16, 8, 0))
+    return MachineIdentity.from_raw(mac, f"uuid-{n}", f"SN{n:09d}")
+
+
+def fill(session_factory, machines: int, chunk: int = 50_000) -> None:
+    """Insert `machines` synthetic machines in chunked transactions."""
+    with session_factory() as session:
+        for offset in range(0, machines, chunk):
+            rows = []
+            for n in range(offset, min(offset + chunk, machines)):
+                identity = make_identity(n)
+                rows.append(
+                    {
+                        "mac": identity.mac,
+                        "uuid": identity.uuid,
+                        "serial": identity.serial,
+                        "identity_key": identity.key,
+                        "root_password": "r" * 24,
+                        "user_password": "u" * 24,
+                        "luks_password": "l" * 24,
+                    }
+                )
+            session.execute(insert(DBMachinePasswords), rows)
+            session.commit()
+
+
+def measure(session_factory, writers: int, ids, backup=None) -> list:
+    """
+    Insert new machines until `backup` returns (or for one second).
+
+    Returns:
+        Insert latencies in milliseconds
+    """
+    store = SqlCredentialStore()
+    done = threading.Event()
+    latencies = []
+    lock = threading.Lock()
+
+    def write() -> None:
+        with session_factory() as db:
+            while not done.is_set():
+                identity = make_identity(next(ids))
+                start = time.perf_counter()
+                store.insert(db, identity, ("r", "u", "l"))
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                # Kickstart requests arrive spread out, not back to back
+                time.sleep(0.002)
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    if backup is None:
+        time.sleep(1)
+    else:
+        backup()
+    done.set()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def report(label: str, latencies: list, seconds: Optional[float] = None) -> None:
+    """Print the p50 and p99 of insert latencies."""
+    p50 = statistics.median(latencies)
+    p99 = statistics.quantiles(latencies, n=100)[98]
+    suffix = f"  backup {seconds:.2f}s" if seconds is not None else ""
+    print(
+        f"{label:20s} inserts {len(latencies):6d}  "
+        f"p50 {p50:7.2f} ms  p99 {p99:7.2f} ms{suffix}"
+    )
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=200_000)
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--pages-per-step", type=int, default=256)
+    parser.add_argument("--pause-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{Path(tmp) / 'bench.db'}",
+            connect_args={"check_same_thread": False, "timeout": 30},
+        )
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        fill(session_factory, args.machines)
+        ids = itertools.count(args.machines)
+
+        report("no backup", measure(session_factory, args.writers, ids))
+
+        for label, pages, pause in (
+            ("stepped backup", args.pages_per_step, args.pause_ms / 1000),
+            ("single-step backup", 1 << 30, 0.0),
+        ):
+            elapsed = {}
+
+            def backup() -> None:
+                start = time.perf_counter()
+                snapshot(
+                    engine,
+                    Path(tmp) / "snapshot.db",
+                    pages_per_step=pages,
+                    pause_seconds=pause,
+                )
+                elapsed["seconds"] = time.perf_counter() - start
+
+            latencies = measure(session_factory, args.writers, ids, backup)
+            report(label, latencies, elapsed["seconds"])
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
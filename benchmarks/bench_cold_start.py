@@ -0,0 +1,88 @@
+"""
+Benchmark cold start: from importing the app to the first served kickstart.
+
+Each run starts a fresh interpreter against a new SQLite database, then
+times importing provisionR.app, create_app(), the lifespan startup and the
+first /api/v1/ks request. Fails if the median total exceeds the target.
+
+Usage:
+    uv run python benchmarks/bench_cold_start.py [--runs 5] [--target-seconds 1.5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Runs in the child interpreter; the test client is imported before timing
+# starts, since a real worker is served by uvicorn instead.
+CHILD = """
+import json, time
+from fastapi.testclient import TestClient
+
+start = time.perf_counter()
+from provisionR.app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+with TestClient(app) as client:
+    started = time.perf_counter()
+    response = client.get(
+        "/api/v1/ks", params={"mac": "00:11:22:33:44:55", "uuid": "u", "serial": "s"}
+    )
+    served = time.perf_counter()
+assert response.status_code == 200, response.text
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "startup": started - created,
+    "first_request": served - started,
+    "total": served - start,
+}))
+"""
+
+PHASES = ["import", "create_app", "startup", "first_request", "total"]
+
+
+def run_once(tmp: Path, run: int) -> dict:
+    """Time one cold start in a new interpreter."""
+    env = dict(os.environ)
+    env["PROVISIONR_DB_PATH"] = str(tmp / f"run-{run}.db")
+    env["PROVISIONR_JOBS_DIR"] = str(tmp / f"jobs-{run}")
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    """Run the benchmark and print the median of each startup phase."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-seconds", type=float, default=1.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [run_once(Path(tmp), n) for n in range(args.runs)]
+
+    for phase in PHASES:
+        median = statistics.median(run[phase] for run in runs)
+        print(f"{phase:14s} {median * 1000:8.1f} ms")
+
+    total = statistics.median(run["total"] for run in runs)
+    if total > args.target_seconds:
+        print(f"cold start {total:.2f}s exceeds target {args.target_seconds:.2f}s")
+        sys.exit(1)
+    print(f"cold start within target {args.target_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark credential lookups with the SQL and in-memory credential stores.
+
+Fills a file-backed SQLite database with synthetic machines, then times
+lookups of random known machines (the repeat-boot path of /v1/ks) through
+each store, plus the memory store's startup load.
+
+Usage:
+    uv run python benchmarks/bench_credential_store.py \
+        [--machines 100000] [--lookups 20000]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import DBMachinePasswords
+from provisionR.services.credential_store import (
+    MemoryCredentialStore,
+    SqlCredentialStore,
+)
+from provisionR.utils import MachineIdentity
+
+
+def make_identity(n: int) -> MachineIdentity:
+    """Build the identity of synthetic machine `n`."""
+    mac = ":".join(f"{(n >> s) & 0xFF:02X}" for s in (40, 32, 24, 16, 8, 0))
+    return MachineIdentity.from_raw(mac, f"uuid-{n}", f"SN{n:09d}")
+
+
+def fill(session_factory, machines: int, chunk: int = 50_000) -> None:
+    """Insert `machines` synthetic machines in chunked transactions."""
+    with session_factory() as session:
+        for offset in range(0, machines, chunk):
+            rows = []
+            for n in range(offset, min(offset + chunk, machines)):
+                identity = make_identity(n)
+                rows.append(
+                    {
+                        "mac": identity.mac,
+                        "uuid": identity.uuid,
+                        "serial": identity.serial,
+                        "identity_key": identity.key,
+                        "root_password": f"root-{n}",
+                        "user_password": f"user-{n}",
+                        "luks_password": f"luks-{n}",
+                    }
+                )
+            session.execute(insert(DBMachinePasswords), rows)
+            session.commit()
+
+
+def main():
+    """Run the benchmark and print lookups/sec for both stores."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    identities = [
+        make_identity(rng.randrange(args.machines)) for _ in range(args.lookups)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        fill(session_factory, args.machines)
+
+        sql = SqlCredentialStore()
+        memory = MemoryCredentialStore(sync_interval_seconds=1.0)
+        with session_factory() as session:
+            start = time.perf_counter()
+            memory.load(session)
+            load = time.perf_counter() - start
+
+            rates = {}
+            results = {}
+            for name, store in (("sql", sql), ("memory", memory)):
+                start = time.perf_counter()
+                results[name] = [store.lookup(session, i) for i in identities]
+                rates[name] = args.lookups / (time.perf_counter() - start)
+        engine.dispose()
+
+    assert results["sql"] == results["memory"]
+    print(f"machines={args.machines} lookups={args.lookups}")
+    print(f"memory load:  {load:10.2f} s")
+    print(f"sql store:    {rates['sql']:10.0f} lookups/sec")
+    print(
+        f"memory store: {rates['memory']:10.0f} lookups/sec "
+        f"({rates['memory'] / rates['sql']:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark new-machine credential inserts with and without group commit.
+
+Simulates a rack bring-up: many concurrent requests each storing a new
+machine. Compares one commit per machine (PasswordService without a writer)
+against the GroupCommitWriter, without and with the PassphraseIndex (whose
+claims are committed in the writer's batches), on a file-backed SQLite
+database.
+
+Usage:
+    uv run python benchmarks/bench_group_commit.py [--threads 32] [--machines 2000]
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.services.credential_writer import GroupCommitWriter
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.password_service import PasswordService
+
+
+def run(
+    threads: int,
+    machines: int,
+    use_writer: bool,
+    window_ms: float,
+    use_index: bool = False,
+) -> float:
+    """Insert `machines` new machines from `threads` threads; return inserts/sec."""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{Path(tmp) / 'bench.db'}",
+            connect_args={"check_same_thread": False, "timeout": 30},
+            pool_size=threads,
+        )
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        index = PassphraseIndex(session_factory) if use_index else None
+        writer = None
+        if use_writer:
+            writer = GroupCommitWriter(
+                session_factory, window_seconds=window_ms / 1000, passphrases=index
+            )
+            writer.start()
+
+        per_thread = machines // threads
+
+        def worker(t: int):
+            with session_factory() as session:
+                service = PasswordService(session, writer=writer, passphrases=index)
+                for i in range(per_thread):
+                    service.get_or_create_passwords(
+                        f"02:00:00:00:{t:02x}:{i % 256:02x}", f"uuid-{t}-{i}", f"SN{i}"
+                    )
+
+        workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        if writer is not None:
+            writer.stop()
+        engine.dispose()
+        return per_thread * threads / elapsed
+
+
+def main():
+    """Run the benchmark and print inserts/sec for both strategies."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--machines", type=int, default=2000)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    before = run(args.threads, args.machines, use_writer=False, window_ms=0)
+    after = run(args.threads, args.machines, use_writer=True, window_ms=args.window_ms)
+    indexed = run(
+        args.threads,
+        args.machines,
+        use_writer=True,
+        window_ms=args.window_ms,
+        use_index=True,
+    )
+
+    print(f"threads={args.threads} machines={args.machines}")
+    print(f"commit per machine: {before:10.0f} inserts/sec")
+    print(f"group commit:       {after:10.0f} inserts/sec ({after / before:.1f}x)")
+    print(f"  + passphrase index:{indexed:9.0f} inserts/sec ({indexed / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark importing machine credentials from CSV.
+
+Writes a CSV of synthetic machines in the export layout (with passwords, or
+with only mac/uuid/serial so every password is generated) and reports how
+long ImportService takes to load it into a file-backed SQLite database.
+
+Usage:
+    uv run python benchmarks/bench_import.py [--machines 200000] [--workers 4]
+"""
+
+import argparse
+import csv
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.services.export_service import CSV_HEADER
+from provisionR.services.import_service import ImportService
+
+
+def write_csv(path: Path, machines: int, passwords: bool) -> None:
+    """Write `machines` synthetic machines to a CSV file."""
+    with open(path, "w", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(CSV_HEADER if passwords else CSV_HEADER[:3])
+        for n in range(machines):
+            mac = "-".join(f"{(n >> s) & 0xFF:02x}" for s in (40, 32, 24, 16, 8, 0))
+            row = [mac, f"uuid-{n}", f"SN{n:09d}"]
+            if passwords:
+                row += ["r" * 24, "u" * 24, "l" * 24, "2024-01-01T00:00:00"]
+            writer.writerow(row)
+
+
+def run(path: Path, db_path: Path, workers: int, chunk_size: int) -> None:
+    """Import a CSV file into a new database and print the timing."""
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db, open(path, newline="") as source:
+        start = time.perf_counter()
+        result = ImportService(
+            db, chunk_size=chunk_size, workers=workers
+        ).import_machine_passwords_csv(source)
+        elapsed = time.perf_counter() - start
+    engine.dispose()
+    print(
+        f"{path.stem:20s} workers {workers}  {result.rows:7d} rows"
+        f"  {elapsed:6.2f}s  {result.rows / elapsed:8.0f} rows/s"
+        f"  ({result.generated} generated)"
+    )
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, passwords in (("with-passwords", True), ("identities-only", False)):
+            path = Path(tmp) / f"{name}.csv"
+            write_csv(path, args.machines, passwords)
+            for workers in sorted({1, args.workers}):
+                if passwords and workers > 1:
+                    continue
+                db_path = Path(tmp) / f"{name}-{workers}.db"
+                run(path, db_path, workers, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark machine inventory pages on a large fleet.
+
+Fills a file-backed SQLite database with synthetic machines, then times
+first pages, deep keyset pages, and prefix and substring searches through
+InventoryService.
+
+Usage:
+    uv run python benchmarks/bench_machine_inventory.py [--machines 1000000]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import DBMachinePasswords
+from provisionR.services import InventoryService
+from provisionR.utils import MachineIdentity
+
+
+def fill(session_factory, machines: int, chunk: int = 50_000) -> None:
+    """Insert `machines` synthetic machines in chunked transactions."""
+    start = datetime(2020, 1, 1)
+    with session_factory() as session:
+        for offset in range(0, machines, chunk):
+            rows = []
+            for n in range(offset, min(offset + chunk, machines)):
+                mac = ":".join(f"{(n >> s) & 0xFF:02X}" for s in (40, 32, 24, 16, 8, 0))
+                identity = MachineIdentity.from_raw(
+                    mac, f"{n:08x}-0000-4000-8000-{n:012x}", f"SN{n:09d}"
+                )
+                rows.append(
+                    {
+                        "mac": identity.mac,
+                        "uuid": identity.uuid,
+                        "serial": identity.serial,
+                        "identity_key": identity.key,
+                        "root_password": "r",
+                        "user_password": "u",
+                        "luks_password": "l",
+                        "created_at": start + timedelta(seconds=n),
+                    }
+                )
+            session.execute(insert(DBMachinePasswords), rows)
+            session.commit()
+
+
+def timed(label: str, fn, repeat: int = 20) -> None:
+    """Print the median and worst latency of `fn` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    median = statistics.median(samples)
+    print(f"{label:32s} median {median:7.2f} ms  max {max(samples):7.2f} ms")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        start = time.perf_counter()
+        fill(session_factory, args.machines)
+        print(
+            f"inserted {args.machines} machines in {time.perf_counter() - start:.1f}s"
+        )
+
+        with session_factory() as session:
+            service = InventoryService(session)
+
+            # Walk to a page deep in the fleet to time the seek from there
+            cursor = None
+            for _ in range(args.machines // 2 // 500):
+                cursor = service.list_machines(limit=500, cursor=cursor).next_cursor
+            mac_cursor = service.list_machines(limit=50, sort="mac").next_cursor
+
+            timed("first page", lambda: service.list_machines())
+            timed("middle page", lambda: service.list_machines(cursor=cursor))
+            timed(
+                "first page, newest first",
+                lambda: service.list_machines(descending=True),
+            )
+            timed(
+                "second page by mac",
+                lambda: service.list_machines(sort="mac", cursor=mac_cursor),
+            )
+            timed(
+                "prefix search (serial)",
+                lambda: service.list_machines(prefix="SN00012"),
+            )
+            timed(
+                "prefix search (mac)",
+                lambda: service.list_machines(prefix="00:00:00:01"),
+            )
+            timed("substring search", lambda: service.list_machines(contains="0004567"))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
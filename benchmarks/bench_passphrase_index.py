@@ -0,0 +1,83 @@
+"""
+Benchmark the passphrase uniqueness index.
+
+Fills a file-backed SQLite database with synthetic machines, then reports
+how long PassphraseIndex takes to load them, how much memory it uses next
+to a plain set of the same passphrases, and how fast unique credentials are
+generated compared to unchecked generation.
+
+Usage:
+    uv run python benchmarks/bench_passphrase_index.py [--machines 100000] [--new 5000]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_credential_store import fill
+from provisionR.database import Base
+from provisionR.models import DBMachinePasswords
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.utils import PasswordGenerator
+
+
+def set_size(passphrases: set) -> int:
+    """Approximate bytes held by a set of strings."""
+    return sys.getsizeof(passphrases) + sum(sys.getsizeof(p) for p in passphrases)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=100_000)
+    parser.add_argument("--new", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        fill(session_factory, args.machines)
+
+        index = PassphraseIndex(capacity=1)
+        with session_factory() as db:
+            start = time.perf_counter()
+            loaded = index.load(db)
+            load = time.perf_counter() - start
+            plain = {
+                p
+                for row in db.query(
+                    DBMachinePasswords.root_password,
+                    DBMachinePasswords.user_password,
+                    DBMachinePasswords.luks_password,
+                )
+                for p in row
+            }
+
+            generate = PasswordGenerator.generate_passphrase
+            start = time.perf_counter()
+            for _ in range(args.new):
+                generate(), generate(), generate()
+            unchecked = args.new / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(args.new):
+                index.new_credentials(db)
+            unique = args.new / (time.perf_counter() - start)
+        engine.dispose()
+
+    nbytes = sum(f.nbytes for f in index._filters)
+    print(f"machines={args.machines} passphrases={loaded}")
+    print(f"load:       {load:10.2f} s ({loaded / load:.0f} passphrases/s)")
+    print(f"index:      {nbytes / 1e6:10.2f} MB ({nbytes / loaded:.2f} bytes each)")
+    print(f"python set: {set_size(plain) / 1e6:10.2f} MB")
+    print(f"unchecked:  {unchecked:10.0f} machines/s")
+    print(f"unique:     {unique:10.0f} machines/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark template rule resolution with the compiled matcher index.
+
+Compares evaluating every rule in turn against CompiledRules (prefix trie,
+combined serial regex, query parameter table), for a rule set shaped like a
+mixed fleet: many vendor MAC prefixes and serial patterns.
+
+Usage:
+    uv run python benchmarks/bench_rule_resolution.py [--rules 500] [--lookups 20000]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from provisionR.models import RuleMatchType, TemplateRule
+from provisionR.services.rule_service import CompiledRules
+from provisionR.utils import MachineIdentity
+
+
+def make_rules(count: int) -> list:
+    """Build `count` rules, split between MAC prefixes and serial patterns."""
+    rules = []
+    for n in range(count):
+        if n % 2:
+            rule = TemplateRule(
+                id=n, match_type=RuleMatchType.MAC_PREFIX, pattern=f"{n:06X}"
+            )
+        else:
+            rule = TemplateRule(
+                id=n,
+                match_type=RuleMatchType.SERIAL_PATTERN,
+                pattern=f"V{n:04d}-[A-Z]{{2}}\\d+",
+            )
+        rules.append(rule)
+    return rules
+
+
+def linear_match(rules: list, identity: MachineIdentity):
+    """Evaluate every rule in priority order (the naive approach)."""
+    mac_hex = identity.mac.replace(":", "")
+    for rule in rules:
+        if rule.match_type == RuleMatchType.MAC_PREFIX:
+            if mac_hex.startswith(rule.pattern):
+                return rule
+        elif re.fullmatch(rule.pattern, identity.serial):
+            return rule
+    return None
+
+
+def main():
+    """Run the benchmark and print lookups/sec for both strategies."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rules", type=int, default=500)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules)
+    rng = random.Random(0)
+    machines = []
+    for _ in range(args.lookups):
+        n = rng.randrange(args.rules * 2)
+        mac = f"{n:06X}{rng.randrange(1 << 24):06X}"
+        mac = ":".join(mac[i : i + 2] for i in range(0, 12, 2))
+        machines.append(MachineIdentity.from_raw(mac, "uuid", f"V{n:04d}-AB{n}"))
+
+    start = time.perf_counter()
+    expected = [linear_match(rules, m) for m in machines]
+    linear = args.lookups / (time.perf_counter() - start)
+
+    compiled = CompiledRules(rules)
+    start = time.perf_counter()
+    actual = [compiled.match(m, {}) for m in machines]
+    indexed = args.lookups / (time.perf_counter() - start)
+
+    assert [r and r.id for r in actual] == [r and r.id for r in expected]
+    print(f"rules={args.rules} lookups={args.lookups}")
+    print(f"linear scan:    {linear:10.0f} lookups/sec")
+    print(f"compiled index: {indexed:10.0f} lookups/sec ({indexed / linear:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
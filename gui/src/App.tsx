@@ -1,6 +1,8 @@
 import { useState } from 'react'
 import { KickstartSection } from './components/KickstartSection'
 import { ConfigSection } from './components/ConfigSection'
+import { ActivitySection } from './components/ActivitySection'
+import { StatsSection } from './components/StatsSection'
 
 function App() {
   const [targetOS] = useState<'Rocky9' | 'Ubuntu25.04'>('Rocky9')
@@ -44,6 +46,11 @@ function App() {
           Generate Kickstart files with automatic password management
         </p>
 
+        {/* Fleet Overview Section */}
+        <div className="mb-12">
+          <StatsSection />
+        </div>
+
         {/* Kickstart Templates Section */}
         <div className="mb-12">
           <KickstartSection />
@@ -54,6 +61,11 @@ function App() {
           <ConfigSection />
         </div>
 
+        {/* Live Activity Section */}
+        <div className="mb-12">
+          <ActivitySection />
+        </div>
+
         <div className="mt-12 grid gap-6 md:grid-cols-2 lg:grid-cols-3">
           <a
             href={import.meta.env.DEV ? 'http://localhost:8000/docs' : '/docs'}
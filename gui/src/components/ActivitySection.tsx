@@ -0,0 +1,87 @@
+import { useEffect, useState } from 'react'
+
+interface ActivityEvent {
+  id: string
+  type: string
+  data: Record<string, any>
+}
+
+const EVENT_TYPES = [
+  'machine-created',
+  'kickstart-fetched',
+  'config-changed',
+  'template-uploaded',
+  'rules-changed',
+  'events-dropped',
+]
+
+const MAX_EVENTS = 50
+
+function describe(event: ActivityEvent): string {
+  const { data } = event
+  switch (event.type) {
+    case 'machine-created':
+      return `New machine ${data.mac} (${data.serial})`
+    case 'kickstart-fetched':
+      return `${data.mac} fetched ${data.template_name}`
+    case 'config-changed':
+      return `Config changed (${data.group ?? data.mac ?? data.scope})`
+    case 'template-uploaded':
+      return `Template ${data.template_name} uploaded`
+    case 'rules-changed':
+      return `Rule ${data.rule_id} ${data.action}`
+    case 'events-dropped':
+      return data.count == null ? 'Events missed' : `${data.count} events missed`
+    default:
+      return event.type
+  }
+}
+
+export function ActivitySection() {
+  const [events, setEvents] = useState<ActivityEvent[]>([])
+  const [connected, setConnected] = useState(false)
+
+  useEffect(() => {
+    // EventSource reconnects on its own and resumes with Last-Event-ID
+    const source = new EventSource('/api/v1/events')
+    source.onopen = () => setConnected(true)
+    source.onerror = () => setConnected(false)
+
+    const onEvent = (e: MessageEvent) => {
+      const event = { id: e.lastEventId, type: e.type, data: JSON.parse(e.data) }
+      setEvents((previous) => [event, ...previous].slice(0, MAX_EVENTS))
+    }
+    EVENT_TYPES.forEach((type) => source.addEventListener(type, onEvent))
+
+    return () => source.close()
+  }, [])
+
+  return (
+    <div className="space-y-6">
+      <div className="flex items-center gap-3">
+        <h2 className="text-2xl font-bold text-slate-900">Activity</h2>
+        <span
+          className={`inline-block w-2 h-2 rounded-full ${connected ? 'bg-green-500' : 'bg-slate-300'}`}
+          title={connected ? 'Live' : 'Disconnected'}
+        />
+      </div>
+
+      <div className="border border-slate-200 rounded-lg bg-white shadow-sm divide-y divide-slate-100">
+        {events.length === 0 ? (
+          <p className="p-4 text-sm text-slate-500">Waiting for provisioning activity...</p>
+        ) : (
+          events.map((event, index) => (
+            <div key={`${event.id}-${index}`} className="flex items-center justify-between p-3 text-sm">
+              <span className="text-slate-800">{describe(event)}</span>
+              <span className="text-slate-400">
+                {event.data.published_at
+                  ? new Date(event.data.published_at * 1000).toLocaleTimeString()
+                  : ''}
+              </span>
+            </div>
+          ))
+        )}
+      </div>
+    </div>
+  )
+}
@@ -8,6 +8,7 @@ interface Config {
 
 export function ConfigSection() {
   const [config, setConfig] = useState<Config | null>(null)
+  const [etag, setEtag] = useState<string | null>(null)
   const [targetOS, setTargetOS] = useState<'Rocky9' | 'Ubuntu25.04'>('Rocky9')
   const [generatePasswords, setGeneratePasswords] = useState(true)
   const [customValues, setCustomValues] = useState('')
@@ -25,6 +26,7 @@ export function ConfigSection() {
       }
       const data = await response.json()
       setConfig(data)
+      setEtag(response.headers.get('ETag'))
       setTargetOS(data.target_os)
       setGeneratePasswords(data.generate_passwords)
       setCustomValues(JSON.stringify(data.values, null, 2))
@@ -60,16 +62,22 @@ export function ConfigSection() {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
+          // Don't overwrite changes made since the config was loaded
+          ...(etag ? { 'If-Match': etag } : {}),
         },
         body: JSON.stringify(newConfig),
       })
 
+      if (response.status === 412) {
+        throw new Error('Configuration was changed elsewhere. Get the latest config and try again.')
+      }
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`)
       }
 
       const data = await response.json()
       setConfig(data)
+      setEtag(response.headers.get('ETag'))
       setSuccess('Configuration updated successfully')
     } catch (error: any) {
       console.error('Failed to update config:', error)
@@ -72,15 +72,25 @@ export function KickstartSection() {
     setLoading(true)
     setError(null)
     try {
-      const response = await fetch(`/api/v1/ks?mac=00:11:22:33:44:55&uuid=test-uuid-12345&serial=TEST-SN-001&template_name=${templateName}`)
+      // Preview renders with placeholder credentials and never creates a machine.
+      // If the template is open in the editor, render the (possibly unsaved) edits.
+      const response = await fetch('/api/v1/ks/preview', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          template_name: templateName,
+          template: template ?? undefined,
+        }),
+      })
       if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`)
+        const detail = await response.json().catch(() => null)
+        throw new Error(detail?.detail ?? `HTTP error! status: ${response.status}`)
       }
       const data = await response.text()
       setRenderedKickstart(data)
     } catch (error) {
       console.error('Failed to render template:', error)
-      setError(`Failed to render template '${templateName}'`)
+      setError(`Failed to render template '${templateName}': ${(error as Error).message}`)
     }
     setLoading(false)
   }
@@ -221,10 +231,10 @@ export function KickstartSection() {
       </div>
 
       {/* Template Content */}
-      {template && (
+      {template !== null && (
         <div className="border border-slate-200 rounded-lg p-4 bg-white shadow-sm">
           <div className="flex items-center justify-between mb-4">
-            <h3 className="text-xl font-semibold">Template Content</h3>
+            <h3 className="text-xl font-semibold">Template Editor</h3>
             <button
               onClick={() => setTemplate(null)}
               className="text-slate-400 hover:text-slate-600 transition-colors"
@@ -235,9 +245,13 @@ export function KickstartSection() {
               </svg>
             </button>
           </div>
-          <pre className="text-sm bg-slate-900 text-slate-100 p-4 rounded overflow-auto font-mono max-h-96">
-            {template}
-          </pre>
+          <textarea
+            value={template}
+            onChange={(e) => setTemplate(e.target.value)}
+            spellCheck={false}
+            rows={20}
+            className="w-full text-sm bg-slate-900 text-slate-100 p-4 rounded font-mono focus:outline-none focus:ring-2 focus:ring-blue-600"
+          />
         </div>
       )}
 
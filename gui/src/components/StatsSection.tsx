@@ -0,0 +1,92 @@
+import { useEffect, useState } from 'react'
+
+interface FleetStats {
+  total_machines: number
+  new_machines_per_day: Record<string, number>
+  new_machines_per_hour: Record<string, number>
+  fetches_per_template: Record<string, number>
+  fetches_per_os: Record<string, number>
+}
+
+const REFRESH_MS = 30000
+
+function sum(counts: Record<string, number>): number {
+  return Object.values(counts).reduce((total, count) => total + count, 0)
+}
+
+function lastValue(counts: Record<string, number>): number {
+  const values = Object.values(counts)
+  return values.length ? values[values.length - 1] : 0
+}
+
+function CountList({ title, counts }: { title: string; counts: Record<string, number> }) {
+  const entries = Object.entries(counts).sort(([, a], [, b]) => b - a)
+  return (
+    <div className="border border-slate-200 rounded-lg p-4 bg-white shadow-sm">
+      <h3 className="text-sm font-medium text-slate-500 mb-2">{title}</h3>
+      {entries.length === 0 ? (
+        <p className="text-sm text-slate-400">No fetches yet</p>
+      ) : (
+        <ul className="space-y-1 text-sm">
+          {entries.map(([name, count]) => (
+            <li key={name} className="flex justify-between">
+              <span className="text-slate-800">{name}</span>
+              <span className="text-slate-500">{count}</span>
+            </li>
+          ))}
+        </ul>
+      )}
+    </div>
+  )
+}
+
+export function StatsSection() {
+  const [stats, setStats] = useState<FleetStats | null>(null)
+
+  useEffect(() => {
+    const load = async () => {
+      try {
+        const response = await fetch('/api/v1/stats?days=7&hours=24')
+        if (response.ok) {
+          setStats(await response.json())
+        }
+      } catch (error) {
+        console.error('Failed to load stats:', error)
+      }
+    }
+    load()
+    const timer = setInterval(load, REFRESH_MS)
+    return () => clearInterval(timer)
+  }, [])
+
+  if (!stats) {
+    return null
+  }
+
+  const tiles = [
+    { label: 'Machines', value: stats.total_machines },
+    { label: 'New this hour', value: lastValue(stats.new_machines_per_hour) },
+    { label: 'New today', value: lastValue(stats.new_machines_per_day) },
+    { label: 'New last 7 days', value: sum(stats.new_machines_per_day) },
+  ]
+
+  return (
+    <div className="space-y-6">
+      <h2 className="text-2xl font-bold text-slate-900">Fleet</h2>
+
+      <div className="grid gap-4 grid-cols-2 md:grid-cols-4">
+        {tiles.map((tile) => (
+          <div key={tile.label} className="border border-slate-200 rounded-lg p-4 bg-white shadow-sm">
+            <p className="text-sm font-medium text-slate-500">{tile.label}</p>
+            <p className="text-3xl font-bold text-slate-900">{tile.value}</p>
+          </div>
+        ))}
+      </div>
+
+      <div className="grid gap-4 md:grid-cols-2">
+        <CountList title="Fetches per template" counts={stats.fetches_per_template} />
+        <CountList title="Fetches per target OS" counts={stats.fetches_per_os} />
+      </div>
+    </div>
+  )
+}
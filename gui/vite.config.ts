@@ -13,6 +13,8 @@ export default defineConfig({
   build: {
     outDir: '../provisionR/static',
     emptyOutDir: true,
+    // .vite/manifest.json tells the backend which files are content-hashed
+    manifest: true,
   },
   server: {
     proxy: {
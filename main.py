@@ -1,13 +1,228 @@
 """Main entry point for the provisionR FastAPI application."""
 
+import argparse
+import sys
+from datetime import datetime
+
 import uvicorn
 from provisionR.app import create_app
 
 
+def rotate_passwords(args: argparse.Namespace) -> int:
+    """Run, resume or roll back a password rotation job in this process."""
+    from provisionR.database import Database
+    from provisionR.models import RotationScope
+    from provisionR.services.passphrase_index import PassphraseIndex
+    from provisionR.services.rotation_service import PasswordRotator, RotationError
+    from provisionR.settings import get_settings
+
+    settings = get_settings()
+    database = Database.for_path(settings.db_path)
+    database.init()
+    rotator = PasswordRotator(
+        database.session_factory,
+        chunk_size=settings.rotation_chunk_size,
+        workers=args.workers or settings.rotation_workers,
+        passphrases=PassphraseIndex(
+            capacity=settings.passphrase_index_capacity,
+            error_rate=settings.passphrase_index_error_rate,
+        ),
+    )
+
+    try:
+        if args.rollback is not None:
+            rotator.rollback(args.rollback)
+            print(f"Rolled back rotation job {args.rollback}")
+            return 0
+
+        job_id = args.resume
+        if job_id is None:
+            scope = RotationScope(
+                prefix=args.prefix,
+                contains=args.contains,
+                group=args.group,
+                created_before=args.created_before,
+            )
+            with database.session_factory() as db:
+                job_id = rotator.create_job(db, scope).id
+            print(f"Started rotation job {job_id}")
+
+        status = rotator.run(
+            job_id,
+            on_progress=lambda rotated, total: print(
+                f"\rRotated {rotated}/{total}", end="", flush=True
+            ),
+        )
+    except RotationError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"\nRotation job {job_id} {status}")
+    return 0
+
+
+def backup(args: argparse.Namespace) -> int:
+    """Write a snapshot of the live database, gzip-compressed if it ends in .gz."""
+    from pathlib import Path
+
+    from provisionR.database import Database
+    from provisionR.services.backup_service import gzip_chunks, snapshot
+    from provisionR.settings import get_settings
+
+    settings = get_settings()
+    output = Path(args.output)
+    engine = Database.for_path(settings.db_path).engine
+
+    def progress(done: int, total: int) -> None:
+        print(f"\rCopied {done}/{total} pages", end="", flush=True)
+
+    kwargs = dict(
+        pages_per_step=settings.backup_pages_per_step,
+        pause_seconds=settings.backup_pause_ms / 1000,
+        on_progress=progress,
+    )
+    if output.suffix == ".gz":
+        plain = output.with_suffix(output.suffix + ".part")
+        try:
+            snapshot(engine, plain, **kwargs)
+            with open(output, "wb") as compressed:
+                for chunk in gzip_chunks(plain):
+                    compressed.write(chunk)
+        finally:
+            plain.unlink(missing_ok=True)
+    else:
+        snapshot(engine, output, **kwargs)
+    print(f"\nWrote {output}")
+    return 0
+
+
+def restore(args: argparse.Namespace) -> int:
+    """Replace the database with a snapshot (stop the app first)."""
+    from pathlib import Path
+
+    from provisionR.database import Database
+    from provisionR.services.backup_service import BackupError
+    from provisionR.services.backup_service import restore as restore_snapshot
+    from provisionR.settings import get_settings
+
+    database = Database.for_path(get_settings().db_path)
+    try:
+        restore_snapshot(Path(args.snapshot), database.engine)
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    # Snapshots of older versions are migrated like any existing database
+    database.init()
+    print(f"Restored {args.snapshot} to {database.path}")
+    return 0
+
+
+def import_machines(args: argparse.Namespace) -> int:
+    """Import machine credentials from a CSV file in this process."""
+    from contextlib import nullcontext
+
+    from provisionR.database import Database
+    from provisionR.services.import_service import CsvImportError, ImportService
+    from provisionR.services.passphrase_index import PassphraseIndex
+    from provisionR.settings import get_settings
+
+    settings = get_settings()
+    database = Database.for_path(settings.db_path)
+    database.init()
+
+    def progress(result) -> None:
+        print(
+            f"\rImported {result.rows - result.rejected} rows"
+            f" ({result.rejected} rejected)",
+            end="",
+            flush=True,
+        )
+
+    rejects = open(args.rejects, "w", newline="") if args.rejects else nullcontext()
+    try:
+        with (
+            database.session_factory() as db,
+            open(args.csv, newline="") as source,
+            rejects as rejects_file,
+        ):
+            result = ImportService(
+                db,
+                chunk_size=args.chunk_size or settings.import_chunk_size,
+                workers=args.workers or settings.import_workers,
+                passphrases=PassphraseIndex(
+                    capacity=settings.passphrase_index_capacity,
+                    error_rate=settings.passphrase_index_error_rate,
+                ),
+            ).import_machine_passwords_csv(
+                source, rejects=rejects_file, on_progress=progress
+            )
+    except CsvImportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(
+        f"\n{result.inserted} new, {result.updated} updated,"
+        f" {result.rejected} rejected, {result.generated} with generated passwords"
+    )
+    return 0
+
+
 def main():
-    """Run the FastAPI application with uvicorn."""
+    """Run the FastAPI application with uvicorn, or a maintenance command."""
+    parser = argparse.ArgumentParser(prog="provisionr")
+    commands = parser.add_subparsers(dest="command")
+
+    rotate = commands.add_parser(
+        "rotate-passwords", help="Replace the passwords of (some) known machines"
+    )
+    rotate.add_argument("--prefix", help="MAC, UUID or serial starts with")
+    rotate.add_argument("--contains", help="MAC, UUID or serial contains")
+    rotate.add_argument("--group", help="Only machines in this config group")
+    rotate.add_argument(
+        "--created-before",
+        type=datetime.fromisoformat,
+        help="Only machines first seen before this ISO 8601 time",
+    )
+    rotate.add_argument("--workers", type=int, help="Processes generating passwords")
+    rotate.add_argument("--resume", type=int, metavar="JOB", help="Resume a job")
+    rotate.add_argument(
+        "--rollback", type=int, metavar="JOB", help="Restore a job's old passwords"
+    )
+
+    backup_parser = commands.add_parser(
+        "backup", help="Snapshot the database while the app keeps running"
+    )
+    backup_parser.add_argument("output", help="Snapshot file (.gz to compress)")
+    restore_parser = commands.add_parser(
+        "restore", help="Replace the database with a snapshot (app stopped)"
+    )
+    restore_parser.add_argument("snapshot", help="Snapshot file, optionally .gz")
+
+    import_parser = commands.add_parser(
+        "import", help="Import machine credentials from a CSV file"
+    )
+    import_parser.add_argument("csv", help="CSV file in the export layout")
+    import_parser.add_argument("--rejects", help="Write rejected rows to this CSV")
+    import_parser.add_argument(
+        "--workers", type=int, help="Processes generating missing passwords"
+    )
+    import_parser.add_argument(
+        "--chunk-size", type=int, help="Machines written per transaction"
+    )
+
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+
+    args = parser.parse_args()
+    if args.command == "rotate-passwords":
+        sys.exit(rotate_passwords(args))
+    if args.command == "backup":
+        sys.exit(backup(args))
+    if args.command == "restore":
+        sys.exit(restore(args))
+    if args.command == "import":
+        sys.exit(import_machines(args))
+
     app = create_app()
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host=args.host, port=args.port)
 
 
 if __name__ == "__main__":
@@ -1,27 +1,92 @@
 """FastAPI application factory and configuration."""
 
 from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 
 from provisionR.routes import api_router
-from provisionR.database import init_db
+from provisionR.database import Database
+from provisionR.services.access_log import AccessLog
+from provisionR.services.admission import AdmissionController
+from provisionR.services.archive_service import archive_job
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.credential_store import (
+    MemoryCredentialStore,
+    SqlCredentialStore,
+)
+from provisionR.services.credential_writer import GroupCommitWriter
+from provisionR.services.event_bus import EventBus
+from provisionR.services.export_service import export_job
+from provisionR.services.hash_cache import HashCache, parse_hash_costs
+from provisionR.services.import_service import import_job
+from provisionR.services.job_runner import JobRunner
+from provisionR.services.kickstart_service import create_template_env
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.prerender import KickstartWarmer
+from provisionR.services.primary_client import PrimaryClient
+from provisionR.services.replica import ReplicaSync
+from provisionR.services.rotation_service import PasswordRotator
+from provisionR.services.rule_service import RuleEngine
+from provisionR.settings import Settings, get_settings
+from provisionR.utils.static_manifest import StaticManifest
 
 NOT_FOUND = HTTPException(status_code=404, detail="Not found")
 
+# Requests a replica serves besides reads: previews render without writing
+REPLICA_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+REPLICA_SAFE_PATHS = {"/api/v1/ks/preview"}
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle application lifespan events."""
     # Startup: Initialize database
-    init_db()
+    app.state.database.init()
+    if isinstance(app.state.credential_store, MemoryCredentialStore):
+        with app.state.database.session_factory() as db:
+            app.state.credential_store.load(db)
+    replica = app.state.replica
+    if replica is None:
+        app.state.passphrase_index.start()
+    app.state.credential_writer.start()
+    if app.state.access_log is not None:
+        app.state.access_log.start()
+    if replica is None:
+        # Rotations and jobs write, so they only run on the primary
+        app.state.password_rotator.resume_interrupted()
+        app.state.job_runner.start()
+    else:
+        replica.start()
+    if app.state.kickstart_warmer is not None:
+        app.state.kickstart_warmer.start()
     yield
+    # Shutdown: Flush pending writes (rotations and jobs resume on the next start)
+    if app.state.kickstart_warmer is not None:
+        app.state.kickstart_warmer.stop()
+    if replica is not None:
+        replica.stop()
+    app.state.job_runner.stop()
+    app.state.password_rotator.stop()
+    if app.state.access_log is not None:
+        app.state.access_log.stop()
+    app.state.credential_writer.stop()
+    app.state.database.dispose()
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Create and configure the FastAPI application.
 
+    Nothing here touches the database or starts threads; that happens in
+    the lifespan, so creating an app is cheap.
 
-def create_app() -> FastAPI:
-    """Create and configure the FastAPI application."""
+    Args:
+        settings: Settings for this app (defaults to the process settings)
+    """
     app = FastAPI(
         title="provisionR",
         description="An application for generating Kickstart files on the fly with a GUI for configuration.",
@@ -29,43 +94,170 @@ def create_app() -> FastAPI:
         lifespan=lifespan,
     )
 
+    settings = settings or get_settings()
+
+    # App-scoped resources (background threads are started by the lifespan)
+    app.state.settings = settings
+    # Every kickstart slot holds a connection; overflow serves everything else
+    app.state.database = Database.for_path(
+        settings.db_path, pool_size=settings.ks_max_concurrent
+    )
+    session_factory = app.state.database.session_factory
+    app.state.template_env = create_template_env(settings)
+    if settings.credential_store == "memory":
+        app.state.credential_store = MemoryCredentialStore(
+            sync_interval_seconds=settings.credential_store_sync_seconds
+        )
+    else:
+        app.state.credential_store = SqlCredentialStore()
+    app.state.passphrase_index = PassphraseIndex(
+        session_factory,
+        capacity=settings.passphrase_index_capacity,
+        error_rate=settings.passphrase_index_error_rate,
+    )
+    app.state.hash_cache = HashCache(
+        max_entries=settings.hash_cache_size,
+        latency_budget_ms=settings.hash_latency_budget_ms,
+        costs=parse_hash_costs(settings.hash_costs),
+    )
+    app.state.credential_writer = GroupCommitWriter(
+        session_factory,
+        window_seconds=settings.group_commit_window_ms / 1000,
+        max_batch=settings.group_commit_max_batch,
+        passphrases=app.state.passphrase_index,
+    )
+    app.state.primary_client = None
+    if settings.replica_of is not None:
+        app.state.primary_client = PrimaryClient(
+            settings.replica_of, timeout_seconds=settings.replica_timeout_seconds
+        )
+    # Fetch times written on a replica would be lost with its next snapshot
+    app.state.access_log = None
+    if app.state.primary_client is None:
+        app.state.access_log = AccessLog(
+            session_factory,
+            max_queue=settings.access_log_queue_size,
+            batch_size=settings.access_log_batch_size,
+            flush_interval_seconds=settings.access_log_flush_interval_ms / 1000,
+        )
+    app.state.admission = AdmissionController(
+        max_concurrent=settings.ks_max_concurrent,
+        max_queue=settings.ks_max_queue,
+        max_wait_seconds=settings.ks_max_wait_seconds,
+        retry_after_seconds=settings.ks_retry_after_seconds,
+    )
+    app.state.rule_engine = RuleEngine(cache_size=settings.rule_cache_size)
+    app.state.event_bus = EventBus(
+        buffer_size=settings.events_buffer_size,
+        heartbeat_seconds=settings.events_heartbeat_seconds,
+    )
+    app.state.config_layers = ConfigLayers(events=app.state.event_bus)
+    app.state.kickstart_warmer = None
+    if settings.prerender_enabled:
+        app.state.kickstart_warmer = KickstartWarmer(
+            session_factory,
+            rule_engine=app.state.rule_engine,
+            config_layers=app.state.config_layers,
+            store=app.state.credential_store,
+            jinja_env=app.state.template_env,
+            renders_per_second=settings.prerender_renders_per_second,
+            max_entries=settings.prerender_max_entries,
+            hash_cache=app.state.hash_cache,
+        )
+        app.state.event_bus.add_listener(app.state.kickstart_warmer.on_event)
+    app.state.replica = None
+    if app.state.primary_client is not None:
+        app.state.replica = ReplicaSync(
+            app.state.primary_client,
+            app.state.database,
+            refresh_seconds=settings.replica_refresh_seconds,
+            store=app.state.credential_store,
+            config_layers=app.state.config_layers,
+            rule_engine=app.state.rule_engine,
+            warmer=app.state.kickstart_warmer,
+        )
+
+        @app.middleware("http")
+        async def read_only(request: Request, call_next):
+            """Refuse writes; they belong on the primary."""
+            if (
+                request.method in REPLICA_SAFE_METHODS
+                or request.url.path in REPLICA_SAFE_PATHS
+            ):
+                return await call_next(request)
+            return JSONResponse(
+                status_code=403,
+                content={
+                    "detail": f"Read-only replica; send writes to {settings.replica_of}"
+                },
+            )
+
+    app.state.password_rotator = PasswordRotator(
+        session_factory,
+        chunk_size=settings.rotation_chunk_size,
+        workers=settings.rotation_workers,
+        passphrases=app.state.passphrase_index,
+    )
+    app.state.job_runner = JobRunner(
+        session_factory,
+        results_dir=Path(settings.jobs_dir),
+        max_concurrent=settings.jobs_max_concurrent,
+        stale_after_seconds=settings.jobs_stale_after_seconds,
+        retention_seconds=settings.jobs_retention_hours * 3600,
+    )
+    app.state.job_runner.register(
+        "export", export_job, filename="machine_passwords.csv", media_type="text/csv"
+    )
+    app.state.job_runner.register(
+        "import",
+        partial(
+            import_job,
+            store=app.state.credential_store,
+            chunk_size=settings.import_chunk_size,
+            workers=settings.import_workers,
+            passphrases=app.state.passphrase_index,
+        ),
+        filename="import_rejects.csv",
+        media_type="text/csv",
+    )
+    app.state.job_runner.register(
+        "archive",
+        partial(
+            archive_job,
+            store=app.state.credential_store,
+            chunk_size=settings.archive_chunk_size,
+        ),
+        filename="archived_machines.csv",
+        media_type="text/csv",
+    )
+
     # Include API routes
     app.include_router(api_router, prefix="/api")
 
     # Get the static directory path
     static_dir = Path(__file__).parent / "static"
 
-    # Serve static files
+    # Serve static files from a manifest computed once at startup
     if static_dir.exists():
+        manifest = StaticManifest.build(static_dir)
+        app.state.static_manifest = manifest
 
         @app.get("/", include_in_schema=False)
-        async def serve_index():
+        async def serve_index(request: Request):
             """Serve index.html at root."""
-            index_file = static_dir / "index.html"
-            if index_file.exists():
-                return FileResponse(index_file)
-            return NOT_FOUND
+            asset = manifest.get("index.html")
+            if asset is None:
+                raise NOT_FOUND
+            return manifest.response(asset, request.headers)
 
         @app.get("/{full_path:path}", include_in_schema=False)
-        async def serve_static(full_path: str):
+        async def serve_static(full_path: str, request: Request):
             """Serve static files from the static directory."""
-            # Build the file path
-            file_path = static_dir / full_path
-
-            # Security: ensure the resolved path is within static_dir
-            try:
-                file_path = file_path.resolve()
-                static_dir_resolved = static_dir.resolve()
-                if not str(file_path).startswith(str(static_dir_resolved)):
-                    # Path traversal attempt
-                    raise NOT_FOUND
-            except (ValueError, OSError):
+            # Only files listed in the manifest can be served, so path
+            # traversal attempts simply miss the lookup
+            asset = manifest.get(full_path)
+            if asset is None:
                 raise NOT_FOUND
-
-            # If file exists, serve it
-            if file_path.is_file():
-                return FileResponse(file_path)
-
-            raise NOT_FOUND
+            return manifest.response(asset, request.headers)
 
     return app
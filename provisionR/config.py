@@ -1,13 +1,39 @@
 """Global configuration management with database persistence."""
 
 import json
+from typing import Optional, Tuple
+
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from provisionR.models import GlobalConfig, DBGlobalConfig, TargetOS
 
 
-def get_global_config_from_db(db: Session) -> GlobalConfig:
+class ConfigVersionConflict(Exception):
+    """Raised when the stored config no longer has the expected version."""
+
+    def __init__(self, current_version: int):
+        """
+        Initialize the conflict.
+
+        Args:
+            current_version: Version of the config currently stored
+        """
+        super().__init__(f"Config has changed (current version {current_version})")
+        self.current_version = current_version
+
+
+def _to_global_config(db_config: DBGlobalConfig) -> GlobalConfig:
+    """Convert the DB model to the Pydantic model."""
+    return GlobalConfig(
+        target_os=TargetOS(db_config.target_os),
+        generate_passwords=db_config.generate_passwords,
+        values=json.loads(db_config.values) if db_config.values else {},
+    )
+
+
+def load_global_config(db: Session) -> Tuple[GlobalConfig, int]:
     """
-    Get the global configuration from the database.
+    Get the global configuration and its version from the database.
 
     If no config exists, create and return the default config.
     """
@@ -20,46 +46,68 @@ def get_global_config_from_db(db: Session) -> GlobalConfig:
             target_os=default_config.target_os.value,
             generate_passwords=default_config.generate_passwords,
             values=json.dumps(default_config.values),
+            version=1,
         )
         db.add(db_config)
         db.commit()
         db.refresh(db_config)
 
-    # Convert DB model to Pydantic model
-    return GlobalConfig(
-        target_os=TargetOS(db_config.target_os),
-        generate_passwords=db_config.generate_passwords,
-        values=json.loads(db_config.values) if db_config.values else {},
-    )
+    return _to_global_config(db_config), db_config.version
 
 
-def update_global_config_in_db(db: Session, new_config: GlobalConfig) -> GlobalConfig:
+def save_global_config(
+    db: Session, new_config: GlobalConfig, expected_version: Optional[int] = None
+) -> Tuple[GlobalConfig, int]:
     """
-    Update the global configuration in the database.
+    Store the global configuration, incrementing its version.
 
-    If no config exists, create it. Otherwise update the existing one.
+    Args:
+        db: Database session
+        new_config: Configuration to store
+        expected_version: Only update if the stored version still matches
+
+    Returns:
+        The stored configuration and its new version
+
+    Raises:
+        ConfigVersionConflict: If expected_version no longer matches
     """
-    db_config = db.query(DBGlobalConfig).first()
+    _, current_version = load_global_config(db)
+    if expected_version is None:
+        expected_version = current_version
 
-    if db_config is None:
-        # Create new config
-        db_config = DBGlobalConfig(
+    # Compare-and-swap, so concurrent writers can't both win
+    result = db.execute(
+        update(DBGlobalConfig)
+        .where(DBGlobalConfig.version == expected_version)
+        .values(
             target_os=new_config.target_os.value,
             generate_passwords=new_config.generate_passwords,
             values=json.dumps(new_config.values),
+            version=DBGlobalConfig.version + 1,
         )
-        db.add(db_config)
-    else:
-        # Update existing config
-        db_config.target_os = new_config.target_os.value
-        db_config.generate_passwords = new_config.generate_passwords
-        db_config.values = json.dumps(new_config.values)
-
+    )
+    if result.rowcount == 0:
+        db.rollback()
+        raise ConfigVersionConflict(load_global_config(db)[1])
     db.commit()
-    db.refresh(db_config)
 
-    return GlobalConfig(
-        target_os=TargetOS(db_config.target_os),
-        generate_passwords=db_config.generate_passwords,
-        values=json.loads(db_config.values),
-    )
+    return load_global_config(db)
+
+
+def get_global_config_from_db(db: Session) -> GlobalConfig:
+    """
+    Get the global configuration from the database.
+
+    If no config exists, create and return the default config.
+    """
+    return load_global_config(db)[0]
+
+
+def update_global_config_in_db(db: Session, new_config: GlobalConfig) -> GlobalConfig:
+    """
+    Update the global configuration in the database.
+
+    If no config exists, create it. Otherwise update the existing one.
+    """
+    return save_global_config(db, new_config)[0]
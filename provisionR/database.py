@@ -1,49 +1,113 @@
 """Database configuration and session management."""
 
-import os
+from functools import lru_cache
 from typing import Generator
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session, declarative_base
-
-# Check if we're running in test mode
-TEST_MODE = os.getenv("PROVISIONR_TEST_MODE", "false").lower() == "true"
-
-# Use in-memory database for tests, SQLite file for production
-if TEST_MODE:
-    SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-    connect_args = {"check_same_thread": False}
-else:
-    SQLALCHEMY_DATABASE_URL = "sqlite:///./provisionr.db"
-    connect_args = {"check_same_thread": False}
-
-# Create engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args,
-    # Enable connection pooling for better thread safety
-    pool_pre_ping=True,
-)
-
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+from fastapi import Request
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Base class for declarative models
 Base = declarative_base()
 
 
-def get_db() -> Generator[Session, None, None]:
+class Database:
+    """
+    Engine and session factory for one SQLite database.
+
+    Nothing is created at import time: a Database is built by create_app()
+    (or for_path() for scripts) from the process settings, and SQLAlchemy
+    only connects on first use.
+    """
+
+    def __init__(self, path: str, pool_size: int = 5):
+        """
+        Initialize the database.
+
+        Args:
+            path: SQLite database file, or ":memory:" for a private database
+            pool_size: Connections kept open to the file; up to 10 more are
+                opened while they are all in use
+        """
+        self.path = path
+        if path == ":memory:":
+            # Every session must see the same in-memory database
+            self.engine: Engine = create_engine(
+                "sqlite://",
+                connect_args={"check_same_thread": False},
+                poolclass=StaticPool,
+            )
+        else:
+            self.engine = create_engine(
+                f"sqlite:///{path}",
+                connect_args={"check_same_thread": False},
+                # Enable connection pooling for better thread safety
+                pool_pre_ping=True,
+                pool_size=pool_size,
+            )
+        self.session_factory = sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine
+        )
+
+    @staticmethod
+    @lru_cache
+    def for_path(path: str, pool_size: int = 5) -> "Database":
+        """Get the shared Database of a file, so apps and scripts share a pool."""
+        return Database(path, pool_size=pool_size)
+
+    def init(self) -> None:
+        """
+        Migrate existing tables and create missing ones.
+
+        create_all() is skipped when every table already exists, so restarts
+        against an up-to-date database only read the schema version and the
+        table list.
+        """
+        from provisionR.migrations import run_migrations
+
+        run_migrations(self.engine)
+        with self.engine.connect() as conn:
+            existing = set(inspect(conn).get_table_names())
+        if not existing.issuperset(Base.metadata.tables):
+            Base.metadata.create_all(bind=self.engine)
+
+    def dispose(self) -> None:
+        """Close every pooled connection."""
+        self.engine.dispose()
+
+
+def get_database() -> Database:
+    """Get the database configured by the process settings."""
+    from provisionR.settings import get_settings
+
+    settings = get_settings()
+    return Database.for_path(settings.db_path, pool_size=settings.ks_max_concurrent)
+
+
+def __getattr__(name: str):
+    """Resolve the legacy module-level `engine` and `SessionLocal` lazily."""
+    if name == "engine":
+        return get_database().engine
+    if name == "SessionLocal":
+        return get_database().session_factory
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_db(request: Request) -> Generator[Session, None, None]:
     """
     Get database session.
 
     Use with FastAPI Depends() to inject database session into routes.
     """
-    db = SessionLocal()
+    db = request.app.state.database.session_factory()
     try:
         yield db
     finally:
         db.close()
 
 
-def init_db():
-    """Initialize the database by creating all tables."""
-    Base.metadata.create_all(bind=engine)
+def init_db() -> None:
+    """Initialize the database configured by the process settings."""
+    get_database().init()
@@ -0,0 +1,102 @@
+"""FastAPI dependencies for app-scoped resources."""
+
+from typing import Optional
+
+from fastapi import Request
+from jinja2 import Environment
+
+from provisionR.database import Database
+from provisionR.services.access_log import AccessLog
+from provisionR.services.admission import AdmissionController
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.credential_store import CredentialStore
+from provisionR.services.credential_writer import GroupCommitWriter
+from provisionR.services.event_bus import EventBus
+from provisionR.services.hash_cache import HashCache
+from provisionR.services.job_runner import JobRunner
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.prerender import KickstartWarmer
+from provisionR.services.primary_client import PrimaryClient
+from provisionR.services.rotation_service import PasswordRotator
+from provisionR.services.rule_service import RuleEngine
+from provisionR.settings import Settings, get_settings
+
+
+def get_app_settings(request: Request) -> Settings:
+    """Get the settings the app was created with."""
+    return getattr(request.app.state, "settings", None) or get_settings()
+
+
+def get_app_database(request: Request) -> Database:
+    """Get the app's database."""
+    return request.app.state.database
+
+
+def get_credential_writer(request: Request) -> Optional[GroupCommitWriter]:
+    """Get the app's group-commit writer for new machine credentials."""
+    return getattr(request.app.state, "credential_writer", None)
+
+
+def get_template_env(request: Request) -> Optional[Environment]:
+    """Get the app's shared kickstart template environment."""
+    return getattr(request.app.state, "template_env", None)
+
+
+def get_credential_store(request: Request) -> Optional[CredentialStore]:
+    """Get the app's credential store."""
+    return getattr(request.app.state, "credential_store", None)
+
+
+def get_passphrase_index(request: Request) -> Optional[PassphraseIndex]:
+    """Get the app's index of stored passphrases."""
+    return getattr(request.app.state, "passphrase_index", None)
+
+
+def get_hash_cache(request: Request) -> Optional[HashCache]:
+    """Get the app's cache of password hashes."""
+    return getattr(request.app.state, "hash_cache", None)
+
+
+def get_access_log(request: Request) -> Optional[AccessLog]:
+    """Get the app's kickstart access log."""
+    return getattr(request.app.state, "access_log", None)
+
+
+def get_rule_engine(request: Request) -> Optional[RuleEngine]:
+    """Get the app's template rule engine."""
+    return getattr(request.app.state, "rule_engine", None)
+
+
+def get_config_layers(request: Request) -> Optional[ConfigLayers]:
+    """Get the app's materialized layered config."""
+    return getattr(request.app.state, "config_layers", None)
+
+
+def get_event_bus(request: Request) -> Optional[EventBus]:
+    """Get the app's provisioning event bus."""
+    return getattr(request.app.state, "event_bus", None)
+
+
+def get_password_rotator(request: Request) -> Optional[PasswordRotator]:
+    """Get the app's password rotator."""
+    return getattr(request.app.state, "password_rotator", None)
+
+
+def get_job_runner(request: Request) -> Optional[JobRunner]:
+    """Get the app's background job runner."""
+    return getattr(request.app.state, "job_runner", None)
+
+
+def get_admission(request: Request) -> Optional[AdmissionController]:
+    """Get the app's kickstart admission controller."""
+    return getattr(request.app.state, "admission", None)
+
+
+def get_kickstart_warmer(request: Request) -> Optional[KickstartWarmer]:
+    """Get the app's kickstart pre-render cache, if enabled."""
+    return getattr(request.app.state, "kickstart_warmer", None)
+
+
+def get_primary_client(request: Request) -> Optional[PrimaryClient]:
+    """Get the client of the app's primary, if the app is a replica."""
+    return getattr(request.app.state, "primary_client", None)
@@ -0,0 +1,183 @@
+"""Fleet summary counters kept up to date by SQLite triggers."""
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATS_TABLE = "fleet_stats"
+
+# Counter names, each split into buckets (empty for a single total)
+MACHINES = "machines"
+MACHINES_PER_DAY = "machines_per_day"
+MACHINES_PER_HOUR = "machines_per_hour"
+FETCHES_PER_TEMPLATE = "fetches_per_template"
+FETCHES_PER_OS = "fetches_per_os"
+
+DAY_FORMAT = "%Y-%m-%d"
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+_UPSERT = f"ON CONFLICT(metric, bucket) DO UPDATE SET count = {STATS_TABLE}.count"
+
+# Every write that changes a counter goes through one of these, whichever code
+# path (or process) made it, so the counters can't drift from the tables.
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fleet_stats_machine_ai
+    AFTER INSERT ON machine_passwords BEGIN
+        INSERT INTO {STATS_TABLE}(metric, bucket, count) VALUES
+            ('{MACHINES}', '', 1),
+            ('{MACHINES_PER_DAY}', strftime('{DAY_FORMAT}',
+                coalesce(new.created_at, CURRENT_TIMESTAMP)), 1),
+            ('{MACHINES_PER_HOUR}', strftime('{HOUR_FORMAT}',
+                coalesce(new.created_at, CURRENT_TIMESTAMP)), 1)
+        {_UPSERT} + 1;
+    END
+    """,
+    # New machines per day/hour are history, so only the total goes down
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fleet_stats_machine_ad
+    AFTER DELETE ON machine_passwords BEGIN
+        INSERT INTO {STATS_TABLE}(metric, bucket, count)
+        VALUES ('{MACHINES}', '', -1)
+        {_UPSERT} - 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fleet_stats_fetch_ai
+    AFTER INSERT ON kickstart_access_log BEGIN
+        INSERT INTO {STATS_TABLE}(metric, bucket, count)
+        VALUES ('{FETCHES_PER_TEMPLATE}', new.template_name, 1)
+        {_UPSERT} + 1;
+        INSERT INTO {STATS_TABLE}(metric, bucket, count)
+        SELECT '{FETCHES_PER_OS}', new.target_os, 1
+        WHERE new.target_os IS NOT NULL
+        {_UPSERT} + 1;
+    END
+    """,
+]
+
+# Counts machines with id > :after_id, for inserts that bypassed the trigger
+_ADD = (
+    f"ON CONFLICT(metric, bucket) DO UPDATE SET count = {STATS_TABLE}.count"
+    " + excluded.count"
+)
+_COUNT_MACHINES_AFTER = [
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{MACHINES}', '', count(*) FROM machine_passwords WHERE id > :after_id
+    {_ADD}
+    """,
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{MACHINES_PER_DAY}', strftime('{DAY_FORMAT}',
+        coalesce(created_at, CURRENT_TIMESTAMP)), count(*)
+    FROM machine_passwords WHERE id > :after_id GROUP BY 2
+    {_ADD}
+    """,
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{MACHINES_PER_HOUR}', strftime('{HOUR_FORMAT}',
+        coalesce(created_at, CURRENT_TIMESTAMP)), count(*)
+    FROM machine_passwords WHERE id > :after_id GROUP BY 2
+    {_ADD}
+    """,
+]
+
+# A restored machine is inserted again, which the insert trigger counts as a
+# new machine on its original creation day/hour; take that back out.
+_UNCOUNT_RESTORED = f"""
+    UPDATE {STATS_TABLE} SET count = count - 1
+    WHERE (metric, bucket) IN (
+        SELECT '{MACHINES_PER_DAY}', strftime('{DAY_FORMAT}',
+            coalesce(created_at, CURRENT_TIMESTAMP))
+        FROM machine_passwords WHERE id = :machine_id
+        UNION ALL
+        SELECT '{MACHINES_PER_HOUR}', strftime('{HOUR_FORMAT}',
+            coalesce(created_at, CURRENT_TIMESTAMP))
+        FROM machine_passwords WHERE id = :machine_id
+    )
+"""
+
+# Rebuilds every counter from the tables; only run when creating the triggers
+# on an existing database.
+_BACKFILL = [
+    f"DELETE FROM {STATS_TABLE}",
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{MACHINES}', '', count(*) FROM machine_passwords
+    """,
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{MACHINES_PER_DAY}', strftime('{DAY_FORMAT}', created_at), count(*)
+    FROM machine_passwords WHERE created_at IS NOT NULL GROUP BY 2
+    """,
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{MACHINES_PER_HOUR}', strftime('{HOUR_FORMAT}', created_at), count(*)
+    FROM machine_passwords WHERE created_at IS NOT NULL GROUP BY 2
+    """,
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{FETCHES_PER_TEMPLATE}', template_name, count(*)
+    FROM kickstart_access_log GROUP BY 2
+    """,
+    f"""
+    INSERT INTO {STATS_TABLE}(metric, bucket, count)
+    SELECT '{FETCHES_PER_OS}', target_os, count(*)
+    FROM kickstart_access_log WHERE target_os IS NOT NULL GROUP BY 2
+    """,
+]
+
+
+def create_stats_triggers(conn: Connection, backfill: bool = False) -> None:
+    """
+    Create the triggers maintaining fleet_stats.
+
+    Args:
+        conn: Connection to a database that has all provisionR tables
+        backfill: Recount everything already in the tables first
+    """
+    if backfill:
+        for statement in _BACKFILL:
+            conn.execute(text(statement))
+    for statement in _TRIGGERS:
+        conn.execute(text(statement))
+
+
+@contextmanager
+def deferred_counting(conn: Connection) -> Iterator[None]:
+    """
+    Count machines inserted in the block with a few statements at its end.
+
+    For bulk loads: the per-row insert trigger is dropped for the block and
+    recreated afterwards. This happens inside the caller's transaction, so
+    other connections never see the trigger missing; roll back if the block
+    fails.
+
+    Args:
+        conn: Connection inside a transaction
+    """
+    after_id = conn.execute(
+        text("SELECT coalesce(max(id), 0) FROM machine_passwords")
+    ).scalar_one()
+    conn.execute(text("DROP TRIGGER fleet_stats_machine_ai"))
+    yield
+    for statement in _COUNT_MACHINES_AFTER:
+        conn.execute(text(statement), {"after_id": after_id})
+    conn.execute(text(_TRIGGERS[0]))
+
+
+def uncount_restored(conn: Connection, machine_id: int) -> None:
+    """
+    Keep a machine restored from the archive out of the new-machine counts.
+
+    Call in the restoring transaction, after the machine is inserted again;
+    only the machine total counts it (back) in.
+
+    Args:
+        conn: Connection inside a transaction
+        machine_id: Id of the restored machine
+    """
+    conn.execute(text(_UNCOUNT_RESTORED), {"machine_id": machine_id})
@@ -0,0 +1,92 @@
+"""In-process metrics exposed in the Prometheus text format."""
+
+import threading
+from typing import Callable, Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    """Turn a label dict into a hashable, order-independent key."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_sample(name: str, labels: LabelKey, value: float) -> str:
+    """Format a single sample line."""
+    if labels:
+        rendered = ",".join(f'{key}="{value}"' for key, value in labels)
+        return f"{name}{{{rendered}}} {value:g}"
+    return f"{name} {value:g}"
+
+
+class Metrics:
+    """Thread-safe registry of counters and gauges."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauge_callbacks: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Increment a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge to an absolute value."""
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def register_gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """Register a gauge whose value is read from a callback at scrape time."""
+        with self._lock:
+            self._gauge_callbacks[name] = callback
+
+    def get(self, name: str, **labels: str) -> float:
+        """Get the current value of a counter or gauge (0 if never recorded)."""
+        key = _label_key(labels)
+        with self._lock:
+            callback = self._gauge_callbacks.get(name)
+            if callback is None:
+                for store in (self._counters, self._gauges):
+                    if name in store:
+                        return store[name].get(key, 0)
+                return 0
+        return callback()
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            callbacks = dict(self._gauge_callbacks)
+
+        lines = []
+        for name in sorted(counters):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(_format_sample(name, labels, value))
+        for name in sorted(gauges):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in sorted(gauges[name].items()):
+                lines.append(_format_sample(name, labels, value))
+        for name in sorted(callbacks):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(_format_sample(name, (), callbacks[name]()))
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Clear every metric (used by tests)."""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._gauge_callbacks.clear()
+
+
+# Process-wide registry
+metrics = Metrics()
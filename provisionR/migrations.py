@@ -0,0 +1,243 @@
+"""In-place schema migrations for existing SQLite databases."""
+
+import logging
+from typing import Callable, Dict, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from provisionR.fleet_stats import create_stats_triggers
+from provisionR.models import DBAccessLog, DBFleetStat, DBPassphrase
+from provisionR.search_index import create_search_index
+from provisionR.utils.identity import MachineIdentity
+
+logger = logging.getLogger(__name__)
+
+
+def _add_machine_identity_key(conn: Connection) -> None:
+    """
+    Add and backfill machine_passwords.identity_key.
+
+    Identifiers of existing rows are normalized in place. Rows that only
+    differed by formatting (e.g. MAC case or separators) collapse to the same
+    identity; the earliest row is kept and the later duplicates, whose
+    passwords may be in use, are moved to machine_passwords_duplicates
+    unchanged, with the id of the row they duplicate.
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns("machine_passwords")}
+    if "identity_key" not in columns:
+        conn.execute(
+            text("ALTER TABLE machine_passwords ADD COLUMN identity_key VARCHAR(32)")
+        )
+
+    rows = conn.execute(
+        text(
+            "SELECT id, mac, uuid, serial FROM machine_passwords "
+            "ORDER BY created_at, id"
+        )
+    ).all()
+
+    seen: Dict[str, int] = {}
+    updates = []
+    duplicates = []
+    for row in rows:
+        identity = MachineIdentity.from_raw(row.mac, row.uuid, row.serial)
+        if identity.key in seen:
+            duplicates.append({"id": row.id, "duplicate_of": seen[identity.key]})
+            continue
+        seen[identity.key] = row.id
+        updates.append(
+            {
+                "id": row.id,
+                "mac": identity.mac,
+                "uuid": identity.uuid,
+                "serial": identity.serial,
+                "identity_key": identity.key,
+            }
+        )
+
+    if duplicates:
+        logger.warning(
+            "Moving %d machine_passwords rows that duplicate an earlier machine "
+            "after identity normalization to machine_passwords_duplicates",
+            len(duplicates),
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS machine_passwords_duplicates ("
+                "id INTEGER PRIMARY KEY, duplicate_of INTEGER NOT NULL, "
+                "mac VARCHAR NOT NULL, uuid VARCHAR NOT NULL, serial VARCHAR NOT NULL, "
+                "root_password VARCHAR NOT NULL, user_password VARCHAR NOT NULL, "
+                "luks_password VARCHAR NOT NULL, created_at DATETIME)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO machine_passwords_duplicates (id, duplicate_of, mac, "
+                "uuid, serial, root_password, user_password, luks_password, "
+                "created_at) SELECT id, :duplicate_of, mac, uuid, serial, "
+                "root_password, user_password, luks_password, created_at "
+                "FROM machine_passwords WHERE id = :id"
+            ),
+            duplicates,
+        )
+        conn.execute(text("DELETE FROM machine_passwords WHERE id = :id"), duplicates)
+    if updates:
+        conn.execute(
+            text(
+                "UPDATE machine_passwords SET mac = :mac, uuid = :uuid, "
+                "serial = :serial, identity_key = :identity_key WHERE id = :id"
+            ),
+            updates,
+        )
+
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_machine_passwords_identity_key "
+            "ON machine_passwords (identity_key)"
+        )
+    )
+
+
+def _add_global_config_version(conn: Connection) -> None:
+    """Add global_config.version, used for ETags and optimistic concurrency."""
+    if not inspect(conn).has_table("global_config"):
+        return
+    columns = {c["name"] for c in inspect(conn).get_columns("global_config")}
+    if "version" not in columns:
+        conn.execute(
+            text(
+                "ALTER TABLE global_config "
+                "ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+            )
+        )
+
+
+def _add_machine_inventory_indexes(conn: Connection) -> None:
+    """Index machines by creation time and build the substring search index."""
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_machine_passwords_created_at "
+            "ON machine_passwords (created_at)"
+        )
+    )
+    create_search_index(conn, rebuild=True)
+
+
+def _add_fleet_stats(conn: Connection) -> None:
+    """Record target OS per fetch and count the fleet into fleet_stats."""
+    if inspect(conn).has_table("kickstart_access_log"):
+        columns = {c["name"] for c in inspect(conn).get_columns("kickstart_access_log")}
+        if "target_os" not in columns:
+            conn.execute(
+                text("ALTER TABLE kickstart_access_log ADD COLUMN target_os VARCHAR")
+            )
+    else:
+        DBAccessLog.__table__.create(conn)
+    DBFleetStat.__table__.create(conn, checkfirst=True)
+    create_stats_triggers(conn, backfill=True)
+
+
+def _add_config_layers_revision(conn: Connection) -> None:
+    """Add global_config.layers_revision, bumped by group and machine layers."""
+    if not inspect(conn).has_table("global_config"):
+        return
+    columns = {c["name"] for c in inspect(conn).get_columns("global_config")}
+    if "layers_revision" not in columns:
+        conn.execute(
+            text(
+                "ALTER TABLE global_config "
+                "ADD COLUMN layers_revision INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+
+
+def _add_job_heartbeat(conn: Connection) -> None:
+    """Add jobs.owner and jobs.heartbeat_at, used to find abandoned jobs."""
+    if not inspect(conn).has_table("jobs"):
+        return
+    columns = {c["name"] for c in inspect(conn).get_columns("jobs")}
+    if "owner" not in columns:
+        conn.execute(text("ALTER TABLE jobs ADD COLUMN owner VARCHAR"))
+    if "heartbeat_at" not in columns:
+        conn.execute(text("ALTER TABLE jobs ADD COLUMN heartbeat_at DATETIME"))
+
+
+def _add_passphrases(conn: Connection) -> None:
+    """Register every stored passphrase in the passphrases table."""
+    DBPassphrase.__table__.create(conn, checkfirst=True)
+    for table in (
+        "machine_passwords",
+        "machine_archive",
+        "machine_password_history",
+    ):
+        if not inspect(conn).has_table(table):
+            continue
+        for column in ("root_password", "user_password", "luks_password"):
+            conn.execute(
+                text(
+                    f"INSERT OR IGNORE INTO passphrases (passphrase) "
+                    f"SELECT {column} FROM {table} WHERE {column} != ''"
+                )
+            )
+
+
+def _add_job_cancel_requested(conn: Connection) -> None:
+    """Add jobs.cancel_requested, used to cancel a job another process runs."""
+    if not inspect(conn).has_table("jobs"):
+        return
+    columns = {c["name"] for c in inspect(conn).get_columns("jobs")}
+    if "cancel_requested" not in columns:
+        conn.execute(
+            text(
+                "ALTER TABLE jobs ADD COLUMN cancel_requested BOOLEAN "
+                "NOT NULL DEFAULT 0"
+            )
+        )
+
+
+# Ordered migrations. The SQLite user_version pragma records how many have been
+# applied; append new steps to the end and never reorder existing ones.
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _add_machine_identity_key,
+    _add_global_config_version,
+    _add_machine_inventory_indexes,
+    _add_fleet_stats,
+    _add_config_layers_revision,
+    _add_job_heartbeat,
+    _add_passphrases,
+    _add_job_cancel_requested,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    Bring an existing database up to the current schema version.
+
+    Must run before Base.metadata.create_all(). A database without any
+    provisionR tables is new: create_all() builds the current schema, so it is
+    only stamped with the latest version.
+
+    Args:
+        engine: Engine of the database to migrate
+
+    Returns:
+        Number of migrations applied
+    """
+    with engine.begin() as conn:
+        version = conn.execute(text("PRAGMA user_version")).scalar_one()
+        if version >= SCHEMA_VERSION:
+            return 0
+
+        applied = 0
+        if inspect(conn).has_table("machine_passwords"):
+            for migration in MIGRATIONS[version:]:
+                logger.info("Applying migration %s", migration.__name__)
+                migration(conn)
+                applied += 1
+
+        # PRAGMA does not accept bound parameters
+        conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION:d}"))
+        return applied
@@ -1,11 +1,14 @@
 """Database models for provisionR."""
 
+import re
 from enum import Enum
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from datetime import datetime, UTC
-from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
+from pydantic import BaseModel, Field, model_validator
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, event
 from provisionR.database import Base
+from provisionR.fleet_stats import create_stats_triggers
+from provisionR.search_index import create_search_index, drop_search_index
 
 
 class TargetOS(str, Enum):
@@ -31,6 +34,127 @@ class GlobalConfig(BaseModel):
     )
 
 
+class ConfigGroup(BaseModel):
+    """Values shared by a group of machines, overriding the global values."""
+
+    name: str = Field(description="Group name")
+    values: Dict[str, Any] = Field(
+        default_factory=dict, description="Values overriding the global values"
+    )
+
+
+class MachineConfig(BaseModel):
+    """Per-machine group membership and value overrides."""
+
+    mac: str = Field(description="MAC address of the machine")
+    uuid: str = Field(description="UUID of the machine")
+    serial: str = Field(description="Serial number of the machine")
+    group: Optional[str] = Field(default=None, description="Config group name")
+    values: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Values overriding the global and group values",
+    )
+
+
+class RotationScope(BaseModel):
+    """Which machines a password rotation job covers (all if empty)."""
+
+    prefix: Optional[str] = Field(
+        default=None, description="MAC, UUID or serial starts with"
+    )
+    contains: Optional[str] = Field(
+        default=None, description="MAC, UUID or serial contains"
+    )
+    group: Optional[str] = Field(
+        default=None, description="Only machines in this config group"
+    )
+    created_before: Optional[datetime] = Field(
+        default=None, description="Only machines first seen before this time"
+    )
+
+
+class JobRequest(BaseModel):
+    """Request body for submitting a background job."""
+
+    kind: str = Field(description="Kind of job, e.g. export")
+    params: Dict[str, Any] = Field(
+        default_factory=dict, description="Parameters for the job"
+    )
+
+
+class KickstartPreviewRequest(BaseModel):
+    """Request body for rendering a template preview."""
+
+    template: Optional[str] = Field(
+        default=None,
+        description="Template content to render (e.g. unsaved editor content). "
+        "If omitted, the stored template named by template_name is used.",
+    )
+    template_name: str = Field(
+        default="default", description="Stored template name (without .ks.j2)"
+    )
+    mac: str = Field(default="00:11:22:33:44:55", description="Example MAC address")
+    uuid: str = Field(
+        default="00000000-0000-0000-0000-000000000000", description="Example UUID"
+    )
+    serial: str = Field(default="PREVIEW-SN-001", description="Example serial")
+    values: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Extra variables, as if passed on the /v1/ks query string",
+    )
+
+
+class RuleMatchType(str, Enum):
+    """How a template rule matches a machine."""
+
+    MAC_PREFIX = "mac_prefix"
+    SERIAL_PATTERN = "serial_pattern"
+    QUERY_PARAM = "query_param"
+
+
+class TemplateRule(BaseModel):
+    """Server-side rule selecting a template and extra values for machines."""
+
+    id: Optional[int] = Field(default=None, description="Rule ID (set by server)")
+    priority: int = Field(
+        default=100, description="Lower values win when several rules match"
+    )
+    match_type: RuleMatchType = Field(description="What the rule matches on")
+    pattern: str = Field(
+        description="MAC prefix (e.g. 00:1A:2B), serial regex (full match), "
+        "or the exact query parameter value"
+    )
+    param_name: Optional[str] = Field(
+        default=None, description="Query parameter name (query_param rules only)"
+    )
+    template_name: Optional[str] = Field(
+        default=None, description="Template to use (without .ks.j2)"
+    )
+    values: Dict[str, Any] = Field(
+        default_factory=dict, description="Extra values available during templating"
+    )
+
+    @model_validator(mode="after")
+    def check_pattern(self) -> "TemplateRule":
+        """Validate the pattern for the rule's match type."""
+        if self.match_type == RuleMatchType.MAC_PREFIX:
+            compact = re.sub(r"[\s:\-.]", "", self.pattern).upper()
+            if (
+                not compact
+                or len(compact) > 12
+                or not re.fullmatch(r"[0-9A-F]+", compact)
+            ):
+                raise ValueError("mac_prefix must be 1-12 hexadecimal digits")
+        elif self.match_type == RuleMatchType.SERIAL_PATTERN:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid serial_pattern regex: {e}")
+        elif not self.param_name:
+            raise ValueError("query_param rules require param_name")
+        return self
+
+
 # SQLAlchemy models for database persistence
 class DBGlobalConfig(Base):
     """Database model for global configuration."""
@@ -41,6 +165,11 @@ class DBGlobalConfig(Base):
     target_os = Column(String, nullable=False, default="Rocky9")
     generate_passwords = Column(Boolean, nullable=False, default=True)
     values = Column(Text, nullable=False, default="{}")  # JSON string
+    # Incremented on every update; exposed as the config's ETag
+    version = Column(Integer, nullable=False, default=1)
+    # Incremented on every change to a group or machine layer, so workers
+    # notice layers changed by another process (see ConfigLayers)
+    layers_revision = Column(Integer, nullable=False, default=0)
     updated_at = Column(
         DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
     )
@@ -52,13 +181,208 @@ class DBMachinePasswords(Base):
     __tablename__ = "machine_passwords"
 
     id = Column(Integer, primary_key=True, index=True)
+    # Normalized identifiers (see provisionR.utils.identity)
     mac = Column(String, nullable=False, index=True)
     uuid = Column(String, nullable=False, index=True)
     serial = Column(String, nullable=False, index=True)
+    # Fixed-width hash of the normalized mac+uuid+serial, used for lookups
+    identity_key = Column(String(32), nullable=False, unique=True, index=True)
     root_password = Column(String, nullable=False)
     user_password = Column(String, nullable=False)
     luks_password = Column(String, nullable=False)
-    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), index=True)
 
-    # Composite unique constraint on mac+uuid+serial
     __table_args__ = ({"sqlite_autoincrement": True},)
+
+
+# Substring search over mac/uuid/serial lives in an FTS5 table that SQLAlchemy
+# doesn't model; create and drop it together with machine_passwords.
+event.listen(
+    DBMachinePasswords.__table__,
+    "after_create",
+    lambda target, connection, **kw: create_search_index(connection),
+)
+event.listen(
+    DBMachinePasswords.__table__,
+    "before_drop",
+    lambda target, connection, **kw: drop_search_index(connection),
+)
+
+
+class DBArchivedMachine(Base):
+    """A decommissioned machine moved out of machine_passwords."""
+
+    __tablename__ = "machine_archive"
+
+    # The machine's id in machine_passwords, kept for when it is restored
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    mac = Column(String, nullable=False)
+    uuid = Column(String, nullable=False)
+    serial = Column(String, nullable=False)
+    identity_key = Column(String(32), nullable=False, unique=True, index=True)
+    root_password = Column(String, nullable=False)
+    user_password = Column(String, nullable=False)
+    luks_password = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+
+class DBRotationJob(Base):
+    """A fleet-wide password rotation and its progress."""
+
+    __tablename__ = "rotation_jobs"
+
+    id = Column(Integer, primary_key=True)
+    # pending, running, completed, failed, rolling_back or rolled_back
+    status = Column(String, nullable=False, default="pending")
+    scope = Column(Text, nullable=False, default="{}")  # JSON RotationScope
+    # Machines created after the job started already have fresh passwords
+    max_machine_id = Column(Integer, nullable=False, default=0)
+    # Resume point: every matching machine up to this id has been rotated
+    last_machine_id = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    rotated = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    updated_at = Column(
+        DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
+    )
+
+
+class DBPasswordHistory(Base):
+    """Passwords replaced by a rotation job, kept so it can be rolled back."""
+
+    __tablename__ = "machine_password_history"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, nullable=False, index=True)
+    machine_id = Column(Integer, nullable=False, index=True)
+    root_password = Column(String, nullable=False)
+    user_password = Column(String, nullable=False)
+    luks_password = Column(String, nullable=False)
+    rotated_at = Column(DateTime, nullable=False)
+
+
+class DBPassphrase(Base):
+    """
+    Every passphrase stored for a machine (see PassphraseIndex).
+
+    The unique constraint makes claiming a passphrase atomic across processes.
+    """
+
+    __tablename__ = "passphrases"
+
+    id = Column(Integer, primary_key=True)
+    passphrase = Column(String, nullable=False, unique=True)
+
+
+class DBJob(Base):
+    """A background job and its progress (see provisionR.services.job_runner)."""
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    # queued, running, completed, failed or cancelled
+    status = Column(String, nullable=False, default="queued", index=True)
+    params = Column(Text, nullable=False, default="{}")  # JSON string
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Runner running the job, and when it last showed it was alive
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    # Set when a running job is cancelled, so that its owner stops it
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+
+
+class DBAccessLog(Base):
+    """Append-only log of kickstart fetches."""
+
+    __tablename__ = "kickstart_access_log"
+
+    id = Column(Integer, primary_key=True)
+    identity_key = Column(String(32), nullable=False, index=True)
+    mac = Column(String, nullable=False)
+    uuid = Column(String, nullable=False)
+    serial = Column(String, nullable=False)
+    template_name = Column(String, nullable=False)
+    target_os = Column(String, nullable=True)
+    remote_addr = Column(String, nullable=True)
+    fetched_at = Column(DateTime, nullable=False)
+
+
+class DBFleetStat(Base):
+    """One bucket of a fleet summary counter, maintained by triggers."""
+
+    __tablename__ = "fleet_stats"
+
+    metric = Column(String, primary_key=True)
+    bucket = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DBMachineLastSeen(Base):
+    """Most recent kickstart fetch per machine."""
+
+    __tablename__ = "machine_last_seen"
+
+    identity_key = Column(String(32), primary_key=True)
+    last_seen_at = Column(DateTime, nullable=False)
+    last_template = Column(String, nullable=False)
+    fetch_count = Column(Integer, nullable=False, default=0)
+
+
+class DBTemplateRule(Base):
+    """Database model for template selection rules."""
+
+    __tablename__ = "template_rules"
+
+    id = Column(Integer, primary_key=True)
+    priority = Column(Integer, nullable=False, default=100)
+    match_type = Column(String, nullable=False)
+    pattern = Column(String, nullable=False)
+    param_name = Column(String, nullable=True)
+    template_name = Column(String, nullable=True)
+    values = Column(Text, nullable=False, default="{}")  # JSON string
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+
+class DBConfigGroup(Base):
+    """Database model for config groups (the middle config layer)."""
+
+    __tablename__ = "config_groups"
+
+    name = Column(String, primary_key=True)
+    values = Column(Text, nullable=False, default="{}")  # JSON string
+    updated_at = Column(
+        DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
+    )
+
+
+class DBMachineConfig(Base):
+    """Database model for per-machine config (the most specific config layer)."""
+
+    __tablename__ = "machine_config"
+
+    identity_key = Column(String(32), primary_key=True)
+    mac = Column(String, nullable=False)
+    uuid = Column(String, nullable=False)
+    serial = Column(String, nullable=False)
+    group_name = Column(String, nullable=True, index=True)
+    values = Column(Text, nullable=False, default="{}")  # JSON string
+    updated_at = Column(
+        DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
+    )
+
+
+# The fleet_stats triggers span several tables, so they are created once all
+# tables exist; dropping the tables drops them too.
+event.listen(
+    Base.metadata,
+    "after_create",
+    lambda target, connection, **kw: create_stats_triggers(connection),
+)
@@ -1,10 +1,14 @@
 """API routes for provisionR."""
 
+import secrets
+from datetime import UTC, datetime
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Any, Dict, List, Literal, Optional
 
 from fastapi import (
     APIRouter,
+    Body,
+    Header,
     HTTPException,
     Query,
     Request,
@@ -12,15 +16,94 @@ from fastapi import (
     UploadFile,
     File,
     Form,
+    Response,
 )
-from fastapi.responses import PlainTextResponse, StreamingResponse
-from jinja2 import TemplateNotFound
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from jinja2 import Environment, TemplateNotFound, TemplateSyntaxError
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
-from provisionR.models import GlobalConfig
-from provisionR.config import get_global_config_from_db, update_global_config_in_db
-from provisionR.database import get_db
-from provisionR.services import KickstartService, ExportService
+from provisionR.models import (
+    ConfigGroup,
+    DBJob,
+    DBMachineLastSeen,
+    DBMachinePasswords,
+    DBRotationJob,
+    GlobalConfig,
+    JobRequest,
+    KickstartPreviewRequest,
+    MachineConfig,
+    RotationScope,
+    TemplateRule,
+)
+from provisionR.config import ConfigVersionConflict, get_global_config_from_db
+from provisionR.database import Database, get_db
+from provisionR.dependencies import (
+    get_access_log,
+    get_admission,
+    get_app_database,
+    get_app_settings,
+    get_config_layers,
+    get_credential_store,
+    get_credential_writer,
+    get_event_bus,
+    get_hash_cache,
+    get_job_runner,
+    get_kickstart_warmer,
+    get_passphrase_index,
+    get_password_rotator,
+    get_primary_client,
+    get_rule_engine,
+    get_template_env,
+)
+from provisionR.metrics import metrics
+from provisionR.services import (
+    KickstartService,
+    ExportService,
+    InventoryService,
+    PasswordService,
+)
+from provisionR.services.access_log import AccessEvent, AccessLog
+from provisionR.services.admission import AdmissionController
+from provisionR.services.archive_service import ArchiveService
+from provisionR.services.backup_service import stream_snapshot
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.credential_store import CredentialStore
+from provisionR.services.credential_writer import GroupCommitWriter
+from provisionR.services.event_bus import (
+    KICKSTART_FETCHED,
+    RULES_CHANGED,
+    TEMPLATE_UPLOADED,
+    EventBus,
+)
+from provisionR.services.hash_cache import HashCache
+from provisionR.services.import_service import upload_path
+from provisionR.services.inventory_service import InvalidCursor
+from provisionR.services.ipxe_service import IpxeService, kickstart_url
+from provisionR.services.job_runner import JobError, JobRunner, job_to_dict
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.prerender import KickstartWarmer
+from provisionR.services.primary_client import (
+    SNAPSHOT_TIME_HEADER,
+    PrimaryClient,
+    PrimaryUnavailable,
+)
+from provisionR.services.rotation_service import (
+    PasswordRotator,
+    RotationError,
+    rotation_to_dict,
+)
+from provisionR.services.rule_service import (
+    RuleEngine,
+    create_rule,
+    delete_rule,
+    list_rules,
+)
+from provisionR.services.stats_service import StatsService
+from provisionR.settings import Settings
+from provisionR.utils import MachineIdentity, TemplateRenderLimitExceeded
 
 api_router = APIRouter(tags=["provisionR API"])
 
@@ -31,31 +114,593 @@ async def health_check():
     return {"status": "healthy", "service": "provisionR"}
 
 
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose in-process metrics in the Prometheus text format."""
+    return metrics.render()
+
+
+def _config_etag(version: int) -> str:
+    """ETag for a version of the global config."""
+    return f'"config-{version}"'
+
+
+def _etags(header: str) -> List[str]:
+    """Split an If-Match/If-None-Match header into its entity tags."""
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def _expected_config_version(
+    if_match: Optional[str], current_version: int
+) -> Optional[int]:
+    """
+    Check an If-Match header against the current config version.
+
+    Returns:
+        Version the update must apply to, or None without a precondition
+
+    Raises:
+        HTTPException: 412 if no listed ETag matches
+    """
+    if if_match is None:
+        return None
+    tags = _etags(if_match)
+    if "*" in tags:
+        return None
+    if _config_etag(current_version) in tags:
+        return current_version
+    raise _config_changed(current_version)
+
+
+def _config_changed(current_version: int) -> HTTPException:
+    """412 response for a failed If-Match precondition."""
+    return HTTPException(
+        status_code=412,
+        detail="Config has changed since it was read",
+        headers={"ETag": _config_etag(current_version)},
+    )
+
+
+@api_router.get("/v1/events")
+async def stream_events(
+    types: Annotated[
+        Optional[str],
+        Query(description="Comma-separated event types to receive (default: all)"),
+    ] = None,
+    last_event_id: Annotated[Optional[int], Header()] = None,
+    events: EventBus = Depends(get_event_bus),
+):
+    """
+    Stream provisioning activity as server-sent events.
+
+    Event types are machine-created, kickstart-fetched, config-changed and
+    template-uploaded. A client that falls too far behind receives an
+    events-dropped event with the number of events it missed. Reconnecting
+    with Last-Event-ID resumes from that event if it is still buffered; an
+    id from before a server restart resumes from the oldest buffered event.
+    """
+    wanted = {t.strip() for t in types.split(",")} if types else None
+    return StreamingResponse(
+        events.subscribe(last_event_id=last_event_id, types=wanted),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @api_router.get("/v1/config", response_model=GlobalConfig)
-async def get_config(db: Session = Depends(get_db)):
-    """Get the current global configuration from the database."""
-    return get_global_config_from_db(db)
+async def get_config(
+    response: Response,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """
+    Get the current global configuration.
+
+    Served from memory with an ETag; polling with If-None-Match returns 304
+    until the config changes.
+    """
+    config, version = layers.global_config(db)
+    etag = _config_etag(version)
+    if if_none_match is not None:
+        tags = _etags(if_none_match)
+        if "*" in tags or etag in tags or f"W/{etag}" in tags:
+            return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    # Let browsers revalidate with the ETag instead of guessing freshness
+    response.headers["Cache-Control"] = "no-cache"
+    return config
 
 
 @api_router.put("/v1/config", response_model=GlobalConfig)
-async def update_config(new_config: GlobalConfig, db: Session = Depends(get_db)):
-    """Update the global configuration in the database."""
-    return update_global_config_in_db(db, new_config)
+async def update_config(
+    new_config: GlobalConfig,
+    response: Response,
+    if_match: Annotated[Optional[str], Header()] = None,
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """Replace the global configuration (If-Match makes the update conditional)."""
+    expected = _expected_config_version(if_match, layers.global_config(db)[1])
+    try:
+        config, version = layers.update_global(db, new_config, expected)
+    except ConfigVersionConflict as e:
+        raise _config_changed(e.current_version)
+    response.headers["ETag"] = _config_etag(version)
+    return config
+
+
+@api_router.patch("/v1/config", response_model=GlobalConfig)
+async def patch_config(
+    patch: Annotated[Dict[str, Any], Body()],
+    response: Response,
+    if_match: Annotated[Optional[str], Header()] = None,
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """
+    Update the global configuration with a JSON Merge Patch (RFC 7396).
+
+    Only the members present in the patch change; null removes a value.
+    If-Match makes the update conditional on the config's ETag.
+    """
+    expected = _expected_config_version(if_match, layers.global_config(db)[1])
+    try:
+        config, version = layers.patch_global(db, patch, expected)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except ConfigVersionConflict as e:
+        raise _config_changed(e.current_version)
+    response.headers["ETag"] = _config_etag(version)
+    return config
+
+
+@api_router.get("/v1/config/groups", response_model=List[ConfigGroup])
+async def get_config_groups(
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """List config groups."""
+    return layers.list_groups(db)
+
+
+@api_router.put("/v1/config/groups/{name}", response_model=ConfigGroup)
+async def put_config_group(
+    name: str,
+    values: Annotated[Dict[str, Any], Body(embed=True)],
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """Create or replace a config group's values."""
+    return layers.put_group(db, ConfigGroup(name=name, values=values))
+
+
+@api_router.delete("/v1/config/groups/{name}", status_code=204)
+async def delete_config_group(
+    name: str,
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """Delete a config group."""
+    if not layers.delete_group(db, name):
+        raise HTTPException(status_code=404, detail=f"Group '{name}' not found")
+
+
+@api_router.get("/v1/config/machines")
+async def get_machine_config(
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """Get a machine's own config layer and its effective (merged) values."""
+    identity = MachineIdentity.from_raw(mac, uuid, serial)
+    layer = layers.get_machine(db, identity)
+    effective = layers.effective(db, identity)
+    return {
+        "machine": layer,
+        "group": effective.group,
+        "values": effective.values,
+    }
+
+
+@api_router.put("/v1/config/machines", response_model=MachineConfig)
+async def put_machine_config(
+    machine: MachineConfig,
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """Create or replace a machine's group membership and value overrides."""
+    return layers.put_machine(db, machine)
+
+
+@api_router.delete("/v1/config/machines", status_code=204)
+async def delete_machine_config(
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    db: Session = Depends(get_db),
+    layers: ConfigLayers = Depends(get_config_layers),
+):
+    """Delete a machine's config layer."""
+    identity = MachineIdentity.from_raw(mac, uuid, serial)
+    if not layers.delete_machine(db, identity):
+        raise HTTPException(status_code=404, detail="Machine has no config layer")
+
+
+@api_router.get("/v1/machines")
+async def list_machines(
+    limit: Annotated[int, Query(ge=1, le=500, description="Page size")] = 50,
+    sort: Annotated[
+        Literal["created_at", "mac", "uuid", "serial"], Query(description="Sort key")
+    ] = "created_at",
+    order: Annotated[Literal["asc", "desc"], Query(description="Sort order")] = "asc",
+    cursor: Annotated[
+        Optional[str], Query(description="next_cursor from the previous page")
+    ] = None,
+    prefix: Annotated[
+        Optional[str], Query(description="MAC, UUID or serial starts with")
+    ] = None,
+    contains: Annotated[
+        Optional[str], Query(description="MAC, UUID or serial contains")
+    ] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    List machines a page at a time, with optional search.
+
+    Pass next_cursor back as cursor to get the following page; it is null on
+    the last page. Passwords are not included (see /v1/machines/export).
+    """
+    try:
+        page = InventoryService(db).list_machines(
+            limit=limit,
+            sort=sort,
+            descending=order == "desc",
+            cursor=cursor,
+            prefix=prefix,
+            contains=contains,
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": page.items, "next_cursor": page.next_cursor}
 
 
 @api_router.get("/v1/machines/export")
-async def export_machine_passwords(db: Session = Depends(get_db)):
+async def export_machine_passwords(
+    archived: Annotated[
+        bool, Query(description="Export archived machines instead")
+    ] = False,
+    db: Session = Depends(get_db),
+    store: Optional[CredentialStore] = Depends(get_credential_store),
+):
     """Export all machine passwords as a CSV file."""
-    export_service = ExportService(db)
-    csv_content = export_service.export_machine_passwords_csv()
+    export_service = ExportService(db, store=store)
+    csv_content = export_service.export_machine_passwords_csv(archived=archived)
+    filename = "archived_machine_passwords" if archived else "machine_passwords"
 
     return StreamingResponse(
         iter([csv_content]),
         media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=machine_passwords.csv"},
+        headers={"Content-Disposition": f"attachment; filename={filename}.csv"},
+    )
+
+
+@api_router.post("/v1/machines/import", status_code=202)
+async def import_machine_passwords(
+    request: Request,
+    db: Session = Depends(get_db),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """
+    Import machine credentials from a CSV file sent as the request body.
+
+    The file uses the layout of /v1/machines/export; only mac, uuid and
+    serial are required and missing passwords are generated. The body is
+    streamed to disk and imported by a background "import" job, which is
+    returned. Its result is a CSV of the rejected rows and why.
+
+    The body is received on the event loop, but the file writes and the job
+    submission run in the threadpool so they never block it.
+    """
+    name = f"import-{secrets.token_hex(8)}.csv"
+    path = upload_path(runner.results_dir, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    submitted = False
+    try:
+        upload = await run_in_threadpool(open, path, "wb")
+        try:
+            async for chunk in request.stream():
+                await run_in_threadpool(upload.write, chunk)
+        finally:
+            await run_in_threadpool(upload.close)
+        job = await run_in_threadpool(runner.submit, db, "import", {"upload": name})
+        submitted = True
+    finally:
+        if not submitted:
+            path.unlink(missing_ok=True)
+    return job_to_dict(job)
+
+
+@api_router.get("/v1/backup")
+async def download_backup(
+    database: Database = Depends(get_app_database),
+    settings: Settings = Depends(get_app_settings),
+):
+    """
+    Download a gzip-compressed snapshot of the live database.
+
+    The snapshot is taken with SQLite's online backup API a few pages at a
+    time, pausing between steps so kickstart requests keep writing while it
+    runs. Restore it with `provisionr restore <file>`. Replicas refresh
+    from this endpoint.
+    """
+    now = datetime.now(UTC)
+    stamp = now.strftime("%Y%m%dT%H%M%SZ")
+    return StreamingResponse(
+        stream_snapshot(
+            database.engine,
+            pages_per_step=settings.backup_pages_per_step,
+            pause_seconds=settings.backup_pause_ms / 1000,
+        ),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition": f"attachment; filename=provisionr-{stamp}.db.gz",
+            # Replicas measure their lag from this
+            SNAPSHOT_TIME_HEADER: now.isoformat(),
+        },
     )
 
 
+@api_router.post("/v1/machines/credentials")
+def get_or_create_machine_credentials(
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    db: Session = Depends(get_db),
+    writer: Optional[GroupCommitWriter] = Depends(get_credential_writer),
+    store: Optional[CredentialStore] = Depends(get_credential_store),
+    passphrases: Optional[PassphraseIndex] = Depends(get_passphrase_index),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
+    """
+    Get a machine's passwords, creating the machine if it is new.
+
+    Replicas forward kickstart requests of machines they don't know here.
+    """
+    root, user, luks = PasswordService(
+        db, writer=writer, events=events, store=store, passphrases=passphrases
+    ).get_or_create_passwords(mac, uuid, serial)
+    return {"root_password": root, "user_password": user, "luks_password": luks}
+
+
+@api_router.get("/v1/stats")
+async def get_stats(
+    days: Annotated[
+        int, Query(ge=1, le=366, description="Days of new-machine counts")
+    ] = 30,
+    hours: Annotated[
+        int, Query(ge=1, le=336, description="Hours of new-machine counts")
+    ] = 48,
+    db: Session = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Get fleet statistics.
+
+    Returns the total number of machines, new machines per day and per hour
+    (oldest first), and kickstart fetches per template and per target OS.
+    The counters are kept up to date as machines and fetches are written, so
+    this reads a few rows regardless of fleet size.
+    """
+    return StatsService(db).summary(days=days, hours=hours)
+
+
+@api_router.get("/v1/machines/last-seen")
+async def get_machine_last_seen(
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    db: Session = Depends(get_db),
+):
+    """Get when a machine last fetched its kickstart, and with which template."""
+    identity = MachineIdentity.from_raw(mac, uuid, serial)
+    last_seen = db.get(DBMachineLastSeen, identity.key)
+    if last_seen is None:
+        raise HTTPException(
+            status_code=404, detail="Machine has not fetched a kickstart"
+        )
+    return {
+        "mac": identity.mac,
+        "uuid": identity.uuid,
+        "serial": identity.serial,
+        "last_seen_at": last_seen.last_seen_at.isoformat(),
+        "last_template": last_seen.last_template,
+        "fetch_count": last_seen.fetch_count,
+    }
+
+
+@api_router.post("/v1/machines/rotations", status_code=202)
+async def start_password_rotation(
+    scope: RotationScope,
+    db: Session = Depends(get_db),
+    rotator: PasswordRotator = Depends(get_password_rotator),
+):
+    """Start replacing the passwords of every machine in a scope."""
+    job = rotator.create_job(db, scope)
+    rotator.start(job.id)
+    return rotation_to_dict(job)
+
+
+@api_router.get("/v1/machines/rotations")
+async def list_password_rotations(db: Session = Depends(get_db)):
+    """List password rotation jobs, newest first."""
+    jobs = db.query(DBRotationJob).order_by(DBRotationJob.id.desc()).all()
+    return [rotation_to_dict(job) for job in jobs]
+
+
+@api_router.get("/v1/machines/rotations/{job_id}")
+async def get_password_rotation(job_id: int, db: Session = Depends(get_db)):
+    """Get a password rotation job and its progress."""
+    job = db.get(DBRotationJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Rotation job {job_id} not found")
+    return rotation_to_dict(job)
+
+
+@api_router.post("/v1/machines/rotations/{job_id}/rollback")
+def rollback_password_rotation(
+    job_id: int,
+    db: Session = Depends(get_db),
+    rotator: PasswordRotator = Depends(get_password_rotator),
+):
+    """Restore the passwords a rotation job replaced."""
+    if db.get(DBRotationJob, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Rotation job {job_id} not found")
+    try:
+        rotator.rollback(job_id)
+    except RotationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    db.expire_all()
+    return rotation_to_dict(db.get(DBRotationJob, job_id))
+
+
+def _get_job(db: Session, job_id: int) -> DBJob:
+    """Get a job or raise 404."""
+    job = db.get(DBJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@api_router.post("/v1/jobs", status_code=202)
+async def submit_job(
+    request: JobRequest,
+    db: Session = Depends(get_db),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """Queue a background job (e.g. kind "export")."""
+    try:
+        job = runner.submit(db, request.kind, request.params)
+    except JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job_to_dict(job)
+
+
+@api_router.get("/v1/jobs")
+async def list_jobs(db: Session = Depends(get_db)):
+    """List background jobs, newest first."""
+    jobs = db.query(DBJob).order_by(DBJob.id.desc()).all()
+    return [job_to_dict(job) for job in jobs]
+
+
+@api_router.get("/v1/jobs/{job_id}")
+async def get_job(job_id: int, db: Session = Depends(get_db)):
+    """Get a background job and its progress."""
+    return job_to_dict(_get_job(db, job_id))
+
+
+@api_router.post("/v1/jobs/{job_id}/cancel")
+async def cancel_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """Cancel a queued or running background job."""
+    _get_job(db, job_id)
+    try:
+        job = runner.cancel(db, job_id)
+    except JobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job_to_dict(job)
+
+
+@api_router.delete("/v1/jobs/{job_id}", status_code=204)
+async def delete_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """Delete a finished background job and its result file."""
+    _get_job(db, job_id)
+    try:
+        runner.delete(db, job_id)
+    except JobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@api_router.get("/v1/jobs/{job_id}/result")
+async def download_job_result(
+    job_id: int,
+    db: Session = Depends(get_db),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """Download the result file of a completed background job."""
+    _get_job(db, job_id)
+    try:
+        path, filename, media_type = runner.result(db, job_id)
+    except JobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # Sent from disk by the server (sendfile where supported), not via Python
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+
+@api_router.get("/v1/rules", response_model=List[TemplateRule])
+async def get_rules(db: Session = Depends(get_db)):
+    """List template selection rules, in the order they are evaluated."""
+    return list_rules(db)
+
+
+@api_router.post("/v1/rules", response_model=TemplateRule, status_code=201)
+async def add_rule(
+    rule: TemplateRule,
+    db: Session = Depends(get_db),
+    engine: RuleEngine = Depends(get_rule_engine),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
+    """Add a template selection rule."""
+    created = create_rule(db, rule, engine)
+    if events is not None:
+        events.publish(RULES_CHANGED, {"rule_id": created.id, "action": "created"})
+    return created
+
+
+@api_router.delete("/v1/rules/{rule_id}", status_code=204)
+async def remove_rule(
+    rule_id: int,
+    db: Session = Depends(get_db),
+    engine: RuleEngine = Depends(get_rule_engine),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
+    """Delete a template selection rule."""
+    if not delete_rule(db, rule_id, engine):
+        raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
+    if events is not None:
+        events.publish(RULES_CHANGED, {"rule_id": rule_id, "action": "deleted"})
+
+
+@api_router.get("/v1/rules/resolve")
+def resolve_rule(
+    request: Request,
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    db: Session = Depends(get_db),
+    engine: RuleEngine = Depends(get_rule_engine),
+):
+    """Show which rule /v1/ks would apply to a machine."""
+    match = engine.resolve(
+        db, MachineIdentity.from_raw(mac, uuid, serial), request.query_params
+    )
+    if match is None:
+        return {"rule_id": None, "template_name": "default", "values": {}}
+    return {
+        "rule_id": match.rule_id,
+        "template_name": match.template_name or "default",
+        "values": match.values,
+    }
+
+
 @api_router.get("/v1/templates/{template_name}", response_class=PlainTextResponse)
 async def get_template(template_name: str = "default"):
     """Get the content of a template file."""
@@ -78,6 +723,7 @@ async def upload_template(
     file: UploadFile = File(...),
     template_name: str = Form(...),
     use_as_default: bool = Form(False),
+    events: Optional[EventBus] = Depends(get_event_bus),
 ):
     """Upload a new template file."""
     templates_dir = Path(__file__).parent / "templates"
@@ -100,28 +746,89 @@ async def upload_template(
         if use_as_default:
             default_file = templates_dir / "default.ks.j2"
             default_file.write_text(content_str)
-
-        return {
-            "message": "Template uploaded successfully",
-            "template_name": template_name,
-            "use_as_default": use_as_default,
-        }
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error uploading template: {str(e)}"
         )
 
+    if events is not None:
+        events.publish(
+            TEMPLATE_UPLOADED,
+            {"template_name": template_name, "use_as_default": use_as_default},
+        )
+    return {
+        "message": "Template uploaded successfully",
+        "template_name": template_name,
+        "use_as_default": use_as_default,
+    }
+
 
-@api_router.get("/v1/ks", response_class=PlainTextResponse)
-async def generate_kickstart(
+def _is_returning_machine(
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    database: Database = Depends(get_app_database),
+) -> bool:
+    """Whether the machine asking for a kickstart already has credentials."""
+    identity = MachineIdentity.from_raw(mac, uuid, serial)
+    # Its own session: the connection goes back to the pool before the
+    # request waits for a slot, so waiting requests can't exhaust the pool
+    with database.session_factory() as db:
+        return (
+            db.query(DBMachinePasswords.id)
+            .filter(DBMachinePasswords.identity_key == identity.key)
+            .first()
+            is not None
+        ) or ArchiveService(db).is_archived(identity)
+
+
+async def _kickstart_slot(
+    returning: bool = Depends(_is_returning_machine),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+):
+    """Hold a kickstart slot for the request, or answer 503 when saturated."""
+    if admission is None:
+        yield
+        return
+    # Waiting happens on the event loop, not in a threadpool thread
+    if not await admission.acquire(priority=returning):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many kickstart requests, retry later",
+            headers={"Retry-After": str(admission.retry_after_seconds)},
+        )
+    try:
+        yield
+    finally:
+        admission.release()
+
+
+@api_router.get(
+    "/v1/ks",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(_kickstart_slot)],
+)
+def generate_kickstart(
     request: Request,
     mac: Annotated[str, Query(description="MAC address of the machine")],
     uuid: Annotated[str, Query(description="UUID of the machine")],
     serial: Annotated[str, Query(description="Serial number of the machine")],
     template_name: Annotated[
-        str, Query(description="Template name (without .ks.j2)")
-    ] = "default",
+        Optional[str],
+        Query(description="Template name (without .ks.j2); overrides rules"),
+    ] = None,
     db: Session = Depends(get_db),
+    writer: Optional[GroupCommitWriter] = Depends(get_credential_writer),
+    store: Optional[CredentialStore] = Depends(get_credential_store),
+    passphrases: Optional[PassphraseIndex] = Depends(get_passphrase_index),
+    hash_cache: Optional[HashCache] = Depends(get_hash_cache),
+    access_log: Optional[AccessLog] = Depends(get_access_log),
+    rule_engine: Optional[RuleEngine] = Depends(get_rule_engine),
+    config_layers: Optional[ConfigLayers] = Depends(get_config_layers),
+    events: Optional[EventBus] = Depends(get_event_bus),
+    warmer: Optional[KickstartWarmer] = Depends(get_kickstart_warmer),
+    jinja_env: Optional[Environment] = Depends(get_template_env),
+    primary: Optional[PrimaryClient] = Depends(get_primary_client),
 ):
     """
     Generate a Kickstart file from the provided parameters.
@@ -131,23 +838,206 @@ async def generate_kickstart(
 
     If the machine (identified by mac+uuid+serial) has been seen before,
     previously generated passwords will be reused.
+
+    Unless template_name is given, the template is picked by the best
+    matching rule (see /v1/rules), falling back to "default". Values of the
+    matching rule are also made available to the template.
+
+    This is a sync endpoint so that it runs in the threadpool: concurrent
+    requests for new machines share group commits instead of serializing.
+    Admission control caps how many run at once; machines seen before are
+    admitted ahead of new ones, and requests that can't get a slot receive
+    503 with Retry-After.
+
+    Plain requests (only mac, uuid and serial) from known machines are
+    answered from the pre-render cache when it holds a current render.
+
+    On a replica, machines missing from the local snapshot are created by
+    the primary; if it can't be reached the response is 503.
     """
-    kickstart_service = KickstartService(db)
+    identity = MachineIdentity.from_raw(mac, uuid, serial)
+    query_params = dict(request.query_params)
+    # Only requests the warmer can reproduce exactly are cacheable
+    cacheable = warmer is not None and query_params.keys() == {"mac", "uuid", "serial"}
+
+    rule_values = None
+    if rule_engine is not None:
+        match = rule_engine.resolve(db, identity, query_params)
+        if match is not None:
+            rule_values = match.values
+            template_name = template_name or match.template_name
+    template_name = template_name or "default"
+
+    rendered = None
+    if cacheable:
+        rendered = warmer.lookup(db, identity, template_name, (mac, uuid, serial))
+
+    kickstart_service = KickstartService(
+        db,
+        jinja_env=jinja_env,
+        password_service=PasswordService(
+            db,
+            writer=writer,
+            events=events,
+            store=store,
+            passphrases=passphrases,
+            primary=primary,
+        ),
+        config_layers=config_layers,
+        hash_cache=hash_cache,
+    )
 
     try:
-        rendered = kickstart_service.generate(
-            mac=mac,
-            uuid=uuid,
-            serial=serial,
-            template_name=template_name,
-            query_params=dict(request.query_params),
-        )
-        return rendered
+        if rendered is None:
+            rendered = kickstart_service.generate(
+                mac=mac,
+                uuid=uuid,
+                serial=serial,
+                template_name=template_name,
+                query_params=query_params,
+                extra_values=rule_values,
+            )
     except TemplateNotFound:
         raise HTTPException(
             status_code=404,
             detail=f"Template '{template_name}' not found. Expected file: {template_name}.ks.j2",
         )
+    except TemplateRenderLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except PrimaryUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error rendering template: {str(e)}"
+        )
+
+    # Queued, not written: the access log never adds a write to this request
+    if access_log is not None:
+        if config_layers is not None:
+            target_os = config_layers.effective(db, identity).config.target_os
+        else:
+            target_os = get_global_config_from_db(db).target_os
+        access_log.record(
+            AccessEvent(
+                identity=identity,
+                template_name=template_name,
+                fetched_at=datetime.now(UTC),
+                remote_addr=request.client.host if request.client else None,
+                target_os=target_os.value,
+            )
+        )
+    if events is not None:
+        events.publish(
+            KICKSTART_FETCHED,
+            {
+                "mac": identity.mac,
+                "uuid": identity.uuid,
+                "serial": identity.serial,
+                "template_name": template_name,
+            },
+        )
+    return rendered
+
+
+@api_router.get("/v1/ipxe", response_class=PlainTextResponse)
+async def generate_ipxe_script(
+    request: Request,
+    mac: Annotated[str, Query(description="MAC address of the machine")],
+    uuid: Annotated[str, Query(description="UUID of the machine")],
+    serial: Annotated[str, Query(description="Serial number of the machine")],
+    db: Session = Depends(get_db),
+    settings: Settings = Depends(get_app_settings),
+    config_layers: Optional[ConfigLayers] = Depends(get_config_layers),
+    warmer: Optional[KickstartWarmer] = Depends(get_kickstart_warmer),
+    jinja_env: Optional[Environment] = Depends(get_template_env),
+):
+    """
+    Generate a machine's iPXE boot script.
+
+    Chain to this from the embedded iPXE script, e.g.
+    `chain http://provisionr/api/v1/ipxe?mac=${mac}&uuid=${uuid}&serial=${serial}`.
+    The script is rendered from <target_os>.ipxe.j2 (falling back to
+    default.ipxe.j2) and points inst.ks at /v1/ks for this machine. All query
+    parameters are available in the template.
+
+    Rendering involves no passwords and no database writes, and it queues
+    the machine's kickstart to be pre-rendered, so the installer's kickstart
+    fetch that follows is usually a cache hit.
+    """
+    identity = MachineIdentity.from_raw(mac, uuid, serial)
+    path = request.app.url_path_for("generate_kickstart")
+    base_url = (settings.public_url or str(request.base_url)).rstrip("/")
+    try:
+        script = IpxeService(
+            db, jinja_env=jinja_env, config_layers=config_layers
+        ).generate(
+            identity,
+            kickstart_url(f"{base_url}{path}", mac, uuid, serial),
+            dict(request.query_params),
+        )
+    except TemplateNotFound:
+        raise HTTPException(status_code=404, detail="No iPXE template found")
+    except TemplateRenderLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error rendering template: {str(e)}"
+        )
+
+    if warmer is not None:
+        warmer.prefetch(identity, (mac, uuid, serial))
+    return script
+
+
+@api_router.post("/v1/ks/preview", response_class=PlainTextResponse)
+def preview_kickstart(
+    preview: KickstartPreviewRequest,
+    db: Session = Depends(get_db),
+    config_layers: Optional[ConfigLayers] = Depends(get_config_layers),
+    jinja_env: Optional[Environment] = Depends(get_template_env),
+):
+    """
+    Render a template preview with placeholder credentials.
+
+    Renders either the supplied template content or a stored template. No
+    machine record is created and no passwords are generated or hashed, so
+    this is cheap enough to call on every edit in the GUI. Renders of
+    uploaded templates may run up to the render budgets, so like /v1/ks this
+    is a sync endpoint running in the threadpool, not on the event loop.
+    """
+    kickstart_service = KickstartService(
+        db, jinja_env=jinja_env, config_layers=config_layers
+    )
+
+    try:
+        if preview.template is not None:
+            return kickstart_service.generate_from_string(
+                mac=preview.mac,
+                uuid=preview.uuid,
+                serial=preview.serial,
+                template_string=preview.template,
+                query_params=preview.values,
+                preview=True,
+            )
+        return kickstart_service.generate(
+            mac=preview.mac,
+            uuid=preview.uuid,
+            serial=preview.serial,
+            template_name=preview.template_name,
+            query_params=preview.values,
+            preview=True,
+        )
+    except TemplateNotFound:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Template '{preview.template_name}' not found",
+        )
+    except TemplateSyntaxError as e:
+        raise HTTPException(
+            status_code=422, detail=f"Template syntax error on line {e.lineno}: {e}"
+        )
+    except TemplateRenderLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error rendering template: {str(e)}"
@@ -0,0 +1,131 @@
+"""FTS5 trigram index for substring search over machine identifiers."""
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+SEARCH_TABLE = "machine_search"
+
+# External-content FTS5 table: it stores only the trigram index and reads
+# mac/uuid/serial from machine_passwords, kept in sync by triggers.
+_CREATE = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        mac, uuid, serial,
+        content='machine_passwords', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS machine_search_ai
+    AFTER INSERT ON machine_passwords BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, mac, uuid, serial)
+        VALUES (new.id, new.mac, new.uuid, new.serial);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS machine_search_ad
+    AFTER DELETE ON machine_passwords BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, mac, uuid, serial)
+        VALUES ('delete', old.id, old.mac, old.uuid, old.serial);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS machine_search_au
+    AFTER UPDATE OF mac, uuid, serial ON machine_passwords BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, mac, uuid, serial)
+        VALUES ('delete', old.id, old.mac, old.uuid, old.serial);
+        INSERT INTO {SEARCH_TABLE}(rowid, mac, uuid, serial)
+        VALUES (new.id, new.mac, new.uuid, new.serial);
+    END
+    """,
+]
+
+_INDEX_AFTER = f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, mac, uuid, serial)
+    SELECT id, mac, uuid, serial FROM machine_passwords WHERE id > :after_id
+"""
+
+_DROP = [
+    "DROP TRIGGER IF EXISTS machine_search_ai",
+    "DROP TRIGGER IF EXISTS machine_search_ad",
+    "DROP TRIGGER IF EXISTS machine_search_au",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+]
+
+
+def trigram_supported(conn: Connection) -> bool:
+    """Check whether this SQLite build has FTS5 with the trigram tokenizer."""
+    try:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE temp._trigram_probe USING fts5(x, tokenize='trigram')"
+        )
+    except Exception:
+        return False
+    conn.exec_driver_sql("DROP TABLE temp._trigram_probe")
+    return True
+
+
+def create_search_index(conn: Connection, rebuild: bool = False) -> bool:
+    """
+    Create the search table and its sync triggers if SQLite supports them.
+
+    Args:
+        conn: Connection inside a transaction
+        rebuild: Index rows already in machine_passwords
+
+    Returns:
+        True if the index exists
+    """
+    if not trigram_supported(conn):
+        return False
+    for statement in _CREATE:
+        conn.execute(text(statement))
+    if rebuild:
+        conn.execute(
+            text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+        )
+    return True
+
+
+def drop_search_index(conn: Connection) -> None:
+    """Drop the search table and its triggers."""
+    for statement in _DROP:
+        conn.execute(text(statement))
+
+
+def has_search_index(conn: Connection) -> bool:
+    """Check whether the search table exists."""
+    return (
+        conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SEARCH_TABLE},
+        ).first()
+        is not None
+    )
+
+
+@contextmanager
+def deferred_indexing(conn: Connection) -> Iterator[None]:
+    """
+    Index machines inserted in the block with one statement at its end.
+
+    For bulk loads: the per-row insert trigger is dropped for the block and
+    recreated afterwards. This happens inside the caller's transaction, so
+    other connections never see the trigger missing; roll back if the block
+    fails.
+
+    Args:
+        conn: Connection inside a transaction
+    """
+    if not has_search_index(conn):
+        yield
+        return
+    after_id = conn.execute(
+        text("SELECT coalesce(max(id), 0) FROM machine_passwords")
+    ).scalar_one()
+    conn.execute(text("DROP TRIGGER machine_search_ai"))
+    yield
+    conn.execute(text(_INDEX_AFTER), {"after_id": after_id})
+    conn.execute(text(_CREATE[1]))
@@ -3,5 +3,6 @@
 from provisionR.services.kickstart_service import KickstartService
 from provisionR.services.password_service import PasswordService
 from provisionR.services.export_service import ExportService
+from provisionR.services.inventory_service import InventoryService
 
-__all__ = ["KickstartService", "PasswordService", "ExportService"]
+__all__ = ["KickstartService", "PasswordService", "ExportService", "InventoryService"]
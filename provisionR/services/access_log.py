@@ -0,0 +1,246 @@
+"""Batched, asynchronous log of kickstart fetches."""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import case, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from provisionR.metrics import metrics
+from provisionR.models import DBAccessLog, DBMachineLastSeen
+from provisionR.utils import MachineIdentity
+
+DROPPED_METRIC = "provisionr_access_log_dropped_total"
+WRITTEN_METRIC = "provisionr_access_log_written_total"
+QUEUE_DEPTH_METRIC = "provisionr_access_log_queue_depth"
+
+
+@dataclass(frozen=True)
+class AccessEvent:
+    """A single kickstart fetch."""
+
+    identity: MachineIdentity
+    template_name: str
+    fetched_at: datetime
+    remote_addr: Optional[str] = None
+    target_os: Optional[str] = None
+
+
+class AccessLog:
+    """
+    Records kickstart fetches without adding a write to the request path.
+
+    Requests call record(), which folds the fetch into a per-machine
+    last-seen entry and appends the event to a bounded in-memory queue. A
+    background thread drains the queue in batches, appends them to
+    kickstart_access_log with a single executemany, and upserts the pending
+    machine_last_seen entries, one per machine however many fetches it made.
+    When the queue is full, new events are dropped and counted rather than
+    making requests wait for the database; only their audit rows are lost,
+    since last-seen entries take one slot per machine and are always kept.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_queue: int = 10_000,
+        batch_size: int = 500,
+        flush_interval_seconds: float = 1.0,
+    ):
+        """
+        Initialize the access log.
+
+        Args:
+            session_factory: Creates the sessions used to write batches
+            max_queue: Events buffered before new ones are dropped
+            batch_size: Maximum events written per transaction
+            flush_interval_seconds: Maximum delay before an event is written
+        """
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self._queue: "queue.Queue[AccessEvent]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Serializes flushes from the background thread and flush() callers
+        self._write_lock = threading.Lock()
+        # Last-seen upserts not written yet, by identity key
+        self._last_seen: Dict[str, dict] = {}
+        self._last_seen_lock = threading.Lock()
+        metrics.register_gauge(QUEUE_DEPTH_METRIC, self._queue.qsize)
+
+    def record(self, event: AccessEvent) -> bool:
+        """
+        Queue a fetch event without blocking.
+
+        Args:
+            event: Fetch to record
+
+        Returns:
+            True if the event was queued, False if its audit row was dropped
+            (the machine's last-seen entry is recorded either way)
+        """
+        entry = {
+            "identity_key": event.identity.key,
+            "last_seen_at": event.fetched_at,
+            "last_template": event.template_name,
+            "fetch_count": 1,
+        }
+        with self._last_seen_lock:
+            _merge_last_seen(self._last_seen, entry)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            metrics.inc(DROPPED_METRIC)
+            return False
+        return True
+
+    def start(self) -> None:
+        """Start the background flush thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="provisionr-access-log", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and write everything still queued."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        """
+        Write every queued event.
+
+        Returns:
+            Number of events written
+        """
+        written = 0
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                if self._last_seen:
+                    # Machines whose events were dropped
+                    self._write([])
+                return written
+            self._write(batch)
+            written += len(batch)
+
+    def _drain(self, limit: int) -> List[AccessEvent]:
+        """Take up to `limit` events off the queue without blocking."""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        """Write batches until stopped."""
+        while not self._stop.is_set():
+            try:
+                # Wake up regularly to notice stop()
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._last_seen:
+                    # Machines whose events were dropped
+                    self._write_logged([])
+                continue
+
+            # Collect until the batch is full or the oldest event is due
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval_seconds
+            while len(batch) < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+                except queue.Empty:
+                    continue
+
+            self._write_logged(batch)
+
+    def _write_logged(self, batch: List[AccessEvent]) -> None:
+        """Write a batch, counting its audit rows as dropped if that fails."""
+        try:
+            self._write(batch)
+        except Exception:
+            # Losing some audit rows must never take down the writer
+            metrics.inc(DROPPED_METRIC, len(batch))
+
+    def _write(self, batch: List[AccessEvent]) -> None:
+        """Append a batch to the log and upsert every pending last-seen entry."""
+        rows = [
+            {
+                "identity_key": event.identity.key,
+                "mac": event.identity.mac,
+                "uuid": event.identity.uuid,
+                "serial": event.identity.serial,
+                "template_name": event.template_name,
+                "target_os": event.target_os,
+                "remote_addr": event.remote_addr,
+                "fetched_at": event.fetched_at,
+            }
+            for event in batch
+        ]
+
+        table = DBMachineLastSeen.__table__
+        upsert = sqlite_insert(table)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.identity_key],
+            set_={
+                "last_seen_at": func.max(
+                    table.c.last_seen_at, upsert.excluded.last_seen_at
+                ),
+                "last_template": case(
+                    (
+                        upsert.excluded.last_seen_at >= table.c.last_seen_at,
+                        upsert.excluded.last_template,
+                    ),
+                    else_=table.c.last_template,
+                ),
+                "fetch_count": table.c.fetch_count + upsert.excluded.fetch_count,
+            },
+        )
+
+        with self._write_lock:
+            with self._last_seen_lock:
+                last_seen, self._last_seen = self._last_seen, {}
+            try:
+                with self.session_factory() as session:
+                    if rows:
+                        session.execute(insert(DBAccessLog.__table__), rows)
+                    if last_seen:
+                        session.execute(upsert, list(last_seen.values()))
+                    session.commit()
+            except Exception:
+                # Keep the entries for the next write
+                with self._last_seen_lock:
+                    for entry in last_seen.values():
+                        _merge_last_seen(self._last_seen, entry)
+                raise
+        metrics.inc(WRITTEN_METRIC, len(rows))
+
+
+def _merge_last_seen(pending: Dict[str, dict], entry: dict) -> None:
+    """Fold a last-seen entry into the pending entry of its machine."""
+    seen = pending.get(entry["identity_key"])
+    if seen is None:
+        pending[entry["identity_key"]] = dict(entry)
+        return
+    seen["fetch_count"] += entry["fetch_count"]
+    if entry["last_seen_at"] >= seen["last_seen_at"]:
+        seen["last_seen_at"] = entry["last_seen_at"]
+        seen["last_template"] = entry["last_template"]
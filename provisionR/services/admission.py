@@ -0,0 +1,114 @@
+"""Admission control for kickstart requests during boot storms."""
+
+import asyncio
+from collections import deque
+from typing import Deque, Dict
+
+from provisionR.metrics import metrics
+
+QUEUE_DEPTH_METRIC = "provisionr_ks_queue_depth"
+IN_FLIGHT_METRIC = "provisionr_ks_in_flight"
+REJECTED_METRIC = "provisionr_ks_rejected_total"
+
+
+class AdmissionController:
+    """
+    Limits how many kickstarts are generated at once.
+
+    Requests beyond max_concurrent wait in a bounded queue instead of piling
+    up inside the server. A request is rejected straight away when the queue
+    is full, or after waiting max_wait_seconds, so the caller can answer 503
+    and the installer retries later instead of timing out.
+
+    Priority requests (machines that have been provisioned before) have their
+    own queue, which is always served first and has its own max_queue
+    allowance, so new machines flooding in can't lock them out.
+
+    All state is only touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        max_queue: int = 256,
+        max_wait_seconds: float = 10.0,
+        retry_after_seconds: int = 5,
+    ):
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrent: Kickstarts generated at the same time
+            max_queue: Requests waiting per queue before new ones are rejected
+            max_wait_seconds: How long a request waits before it is rejected
+            retry_after_seconds: When rejected requests should retry
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self._active = 0
+        self._waiting: Dict[bool, Deque[asyncio.Future]] = {
+            True: deque(),
+            False: deque(),
+        }
+        metrics.register_gauge(QUEUE_DEPTH_METRIC, lambda: self.queue_depth)
+        metrics.register_gauge(IN_FLIGHT_METRIC, lambda: self._active)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a slot."""
+        return len(self._waiting[True]) + len(self._waiting[False])
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests holding a slot."""
+        return self._active
+
+    async def acquire(self, priority: bool = False) -> bool:
+        """
+        Wait for a slot.
+
+        Args:
+            priority: Serve this request before any non-priority waiters
+
+        Returns:
+            True if a slot was acquired (release() it when done), False if
+            the request should be rejected
+        """
+        if self._active < self.max_concurrent and not self.queue_depth:
+            self._active += 1
+            return True
+        waiting = self._waiting[priority]
+        if len(waiting) >= self.max_queue:
+            metrics.inc(REJECTED_METRIC, reason="queue_full")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        waiting.append(future)
+        try:
+            # Shielded so a slot handed over as the wait times out isn't lost
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                self.release()
+            else:
+                future.cancel()
+                waiting.remove(future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            metrics.inc(REJECTED_METRIC, reason="timeout")
+            return False
+        return True
+
+    def release(self) -> None:
+        """Release a slot, handing it to the next waiter if there is one."""
+        for priority in (True, False):
+            waiting = self._waiting[priority]
+            while waiting:
+                future = waiting.popleft()
+                if not future.done():
+                    # The slot moves to the waiter; _active stays the same
+                    future.set_result(None)
+                    return
+        self._active -= 1
@@ -0,0 +1,276 @@
+"""Archive of decommissioned machines, kept out of machine_passwords."""
+
+import csv
+from datetime import UTC, datetime, timedelta
+from typing import Any, Callable, Iterator, List, Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, Session
+
+from provisionR.fleet_stats import uncount_restored
+from provisionR.metrics import metrics
+from provisionR.models import DBArchivedMachine, DBMachineLastSeen, DBMachinePasswords
+from provisionR.services.credential_store import (
+    CredentialStore,
+    Credentials,
+    SqlCredentialStore,
+)
+from provisionR.services.inventory_service import InventoryService
+from provisionR.services.job_runner import JobContext
+from provisionR.utils import MachineIdentity
+
+ARCHIVED_METRIC = "provisionr_machines_archived_total"
+RESTORED_METRIC = "provisionr_machines_restored_total"
+
+# Columns a machine keeps while archived, id included
+_COLUMNS = (
+    "id",
+    "mac",
+    "uuid",
+    "serial",
+    "identity_key",
+    "root_password",
+    "user_password",
+    "luks_password",
+    "created_at",
+)
+
+ARCHIVE_CSV_HEADER = ["mac", "uuid", "serial"]
+
+
+class ArchiveService:
+    """
+    Moves machines that stopped provisioning out of machine_passwords.
+
+    Lookups, exports and backups all read machine_passwords, which otherwise
+    only grows. Archiving moves idle machines to machine_archive, a chunk per
+    short transaction, with their ids and passwords; their config, last-seen
+    record and password history stay where they are. A machine that asks for
+    a kickstart again is restored by its first request with the passwords it
+    had, so archiving is invisible to machines. Archived machines are left
+    out of rotations and exported separately (see ExportService).
+    """
+
+    def __init__(self, db: Session, store: Optional[CredentialStore] = None):
+        """
+        Initialize the archive service.
+
+        Args:
+            db: Database session
+            store: Credential store to tell about archived and restored machines
+        """
+        self.db = db
+        self.store = store or SqlCredentialStore()
+
+    def idle_query(
+        self,
+        not_seen_since: datetime,
+        prefix: Optional[str] = None,
+        contains: Optional[str] = None,
+    ) -> Query:
+        """
+        Query machines that haven't fetched a kickstart since a time.
+
+        Machines that never fetched one count as seen when they were created.
+
+        Args:
+            not_seen_since: Machines last seen before this are idle
+            prefix: Only machines whose MAC, UUID or serial starts with this
+            contains: Only machines whose MAC, UUID or serial contains this
+
+        Returns:
+            Query of (id, identity_key, mac, uuid, serial) rows
+        """
+        last_seen = func.coalesce(
+            DBMachineLastSeen.last_seen_at, DBMachinePasswords.created_at
+        )
+        return (
+            self.db.query(
+                DBMachinePasswords.id,
+                DBMachinePasswords.identity_key,
+                DBMachinePasswords.mac,
+                DBMachinePasswords.uuid,
+                DBMachinePasswords.serial,
+            )
+            .outerjoin(
+                DBMachineLastSeen,
+                DBMachineLastSeen.identity_key == DBMachinePasswords.identity_key,
+            )
+            .filter(
+                last_seen < not_seen_since,
+                *InventoryService(self.db).search_filters(prefix, contains),
+            )
+        )
+
+    def archive_idle(
+        self,
+        not_seen_since: datetime,
+        prefix: Optional[str] = None,
+        contains: Optional[str] = None,
+        chunk_size: int = 500,
+        on_chunk: Optional[Callable[[List[Any]], None]] = None,
+    ) -> int:
+        """
+        Archive every idle machine, a chunk per transaction.
+
+        Args:
+            not_seen_since: Machines last seen before this are archived
+            prefix: Only machines whose MAC, UUID or serial starts with this
+            contains: Only machines whose MAC, UUID or serial contains this
+            chunk_size: Machines moved per transaction
+            on_chunk: Called with the rows of each archived chunk
+
+        Returns:
+            Number of machines archived
+        """
+        archived = 0
+        last_id = 0
+        while True:
+            rows = (
+                self.idle_query(not_seen_since, prefix, contains)
+                .filter(DBMachinePasswords.id > last_id)
+                .order_by(DBMachinePasswords.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                return archived
+            self._move([row.id for row in rows])
+            self.store.archived([row.identity_key for row in rows])
+            metrics.inc(ARCHIVED_METRIC, len(rows))
+            archived += len(rows)
+            last_id = rows[-1].id
+            if on_chunk is not None:
+                on_chunk(rows)
+
+    def _move(self, machine_ids: List[int]) -> None:
+        """Move machines to the archive in one transaction."""
+        # A machine fetching its kickstart meanwhile is simply restored again
+        columns = [getattr(DBMachinePasswords, name) for name in _COLUMNS]
+        self.db.execute(
+            insert(DBArchivedMachine).from_select(
+                [*_COLUMNS, "archived_at"],
+                select(*columns, literal(datetime.now(UTC), DateTime)).where(
+                    DBMachinePasswords.id.in_(machine_ids)
+                ),
+            )
+        )
+        self.db.execute(
+            delete(DBMachinePasswords).where(DBMachinePasswords.id.in_(machine_ids))
+        )
+        self.db.commit()
+
+    def restore(self, identity: MachineIdentity) -> Optional[Credentials]:
+        """
+        Move an archived machine back to machine_passwords.
+
+        Args:
+            identity: Normalized machine identity
+
+        Returns:
+            The machine's (root, user, luks) passwords, or None if it isn't
+            archived
+        """
+        archived = (
+            self.db.query(DBArchivedMachine)
+            .filter(DBArchivedMachine.identity_key == identity.key)
+            .first()
+        )
+        if archived is None:
+            return None
+        credentials = (
+            archived.root_password,
+            archived.user_password,
+            archived.luks_password,
+        )
+        self.db.execute(
+            insert(DBMachinePasswords).values(
+                {name: getattr(archived, name) for name in _COLUMNS}
+            )
+        )
+        uncount_restored(self.db.connection(), archived.id)
+        self.db.delete(archived)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # A concurrent request restored the machine first
+            self.db.rollback()
+            return self.store.lookup(self.db, identity)
+        self.store.stored(identity, credentials)
+        metrics.inc(RESTORED_METRIC)
+        return credentials
+
+    def is_archived(self, identity: MachineIdentity) -> bool:
+        """Whether a machine is in the archive."""
+        return (
+            self.db.query(DBArchivedMachine.id)
+            .filter(DBArchivedMachine.identity_key == identity.key)
+            .first()
+            is not None
+        )
+
+    def machines(self, batch_size: int = 1000) -> Iterator:
+        """
+        Iterate over every archived machine, oldest first.
+
+        Yields:
+            Rows with mac, uuid, serial, the passwords and created_at
+        """
+        return iter(
+            self.db.query(DBArchivedMachine)
+            .order_by(DBArchivedMachine.created_at)
+            .yield_per(batch_size)
+        )
+
+    def count(self) -> int:
+        """Number of archived machines."""
+        return self.db.query(DBArchivedMachine).count()
+
+
+def archive_job(
+    context: JobContext,
+    store: Optional[CredentialStore] = None,
+    chunk_size: int = 500,
+) -> None:
+    """
+    Job handler archiving idle machines (bind the keyword arguments).
+
+    The job's params are idle_days, the days since a machine's last kickstart
+    after which it is archived, and optionally prefix and contains to narrow
+    the machines down. The job's result is a CSV of the archived machines.
+    """
+    params = context.params
+    if "idle_days" not in params:
+        raise ValueError("Archive jobs need idle_days")
+    idle_days = float(params["idle_days"])
+    if idle_days < 0:
+        raise ValueError("idle_days must not be negative")
+    not_seen_since = datetime.now(UTC) - timedelta(days=idle_days)
+    prefix = params.get("prefix")
+    contains = params.get("contains")
+
+    with (
+        context.session_factory() as db,
+        open(context.output_path, "w", newline="") as output,
+    ):
+        archive = ArchiveService(db, store=store)
+        total = archive.idle_query(not_seen_since, prefix, contains).count()
+        writer = csv.writer(output)
+        writer.writerow(ARCHIVE_CSV_HEADER)
+        done = 0
+
+        def on_chunk(rows: List[Any]) -> None:
+            nonlocal done
+            writer.writerows((row.mac, row.uuid, row.serial) for row in rows)
+            done += len(rows)
+            context.progress(done, total)
+
+        archive.archive_idle(
+            not_seen_since,
+            prefix=prefix,
+            contains=contains,
+            chunk_size=chunk_size,
+            on_chunk=on_chunk,
+        )
+        context.progress(done, total)
@@ -0,0 +1,184 @@
+"""Online snapshots and restores of the SQLite database."""
+
+import gzip
+import logging
+import shutil
+import sqlite3
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy.engine import Engine
+
+from provisionR.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RESTARTS_METRIC = "provisionr_backup_restarts_total"
+BACKUPS_METRIC = "provisionr_backups_total"
+
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 64 * 1024
+
+
+class BackupError(Exception):
+    """Raised when a snapshot can't be taken or restored."""
+
+
+class _Restarted(Exception):
+    """The source changed between steps, so SQLite restarted the copy."""
+
+
+def _copy(
+    source: sqlite3.Connection,
+    target: sqlite3.Connection,
+    pages_per_step: int,
+    pause_seconds: float,
+    on_progress: Optional[Callable[[int, int], None]],
+) -> int:
+    """
+    Copy source into target a few pages at a time.
+
+    Between steps no lock is held, so writers proceed, but a write by another
+    connection makes SQLite start the copy over. Each time that happens the
+    step size doubles, so a busy database is still copied eventually: at
+    worst in one step, which holds the read lock only as long as the copy.
+
+    Returns:
+        Number of pages copied
+    """
+    pages = pages_per_step
+    while True:
+        last_remaining = None
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            nonlocal last_remaining
+            # A step that made no progress copied the first pages again
+            if last_remaining is not None and remaining >= last_remaining:
+                raise _Restarted
+            last_remaining = remaining
+            if on_progress is not None:
+                on_progress(total - remaining, total)
+
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=pause_seconds)
+        except _Restarted:
+            metrics.inc(RESTARTS_METRIC)
+            pages *= 2
+            logger.debug("Database changed during backup, retrying %d pages", pages)
+            continue
+        return target.execute("PRAGMA page_count").fetchone()[0]
+
+
+def snapshot(
+    engine: Engine,
+    target: Path,
+    pages_per_step: int = 256,
+    pause_seconds: float = 0.005,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    Write a consistent copy of a live database with SQLite's online backup API.
+
+    Args:
+        engine: Engine of the database to copy
+        target: File to write the snapshot to (replaced if it exists)
+        pages_per_step: Pages copied while holding the read lock
+        pause_seconds: Pause between steps, leaving the database to writers
+        on_progress: Called with (pages copied, total pages) after each step
+
+    Returns:
+        Number of pages in the snapshot
+    """
+    target.unlink(missing_ok=True)
+    raw = engine.raw_connection()
+    destination = sqlite3.connect(target)
+    try:
+        source = raw.driver_connection
+        pages = _copy(source, destination, pages_per_step, pause_seconds, on_progress)
+    finally:
+        destination.close()
+        raw.close()
+    metrics.inc(BACKUPS_METRIC)
+    return pages
+
+
+def gzip_chunks(path: Path) -> Iterator[bytes]:
+    """Compress a file into gzip format a chunk at a time, for streaming."""
+    compressor = zlib.compressobj(wbits=31)
+    with open(path, "rb") as source:
+        while chunk := source.read(CHUNK_SIZE):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def stream_snapshot(engine: Engine, **kwargs) -> Iterator[bytes]:
+    """
+    Take a snapshot and stream it gzip-compressed, removing it afterwards.
+
+    Args:
+        engine: Engine of the database to copy
+        **kwargs: Passed through to snapshot()
+
+    Yields:
+        Chunks of the gzip-compressed snapshot
+    """
+    with tempfile.TemporaryDirectory(prefix="provisionr-backup-") as tmp:
+        path = Path(tmp) / "provisionr.db"
+        snapshot(engine, path, **kwargs)
+        yield from gzip_chunks(path)
+
+
+def restore(snapshot_path: Path, engine: Engine) -> int:
+    """
+    Replace the contents of a database with a snapshot.
+
+    The snapshot may be gzip-compressed. It is checked before anything is
+    overwritten, and copied in a single step of SQLite's backup API, which
+    holds the database's write lock for the whole copy: other connections
+    may keep reading, and see either the old or the new contents, never a
+    mix (a read waits for the copy to finish). Writes by other connections
+    made before the copy are overwritten by it, so stop a primary before
+    restoring its database; a replica restores snapshots while it serves.
+
+    Args:
+        snapshot_path: Snapshot written by snapshot() or downloaded from the API
+        engine: Engine of the database to overwrite
+
+    Returns:
+        Number of pages restored
+
+    Raises:
+        BackupError: If the snapshot isn't a valid SQLite database
+    """
+    with tempfile.TemporaryDirectory(prefix="provisionr-restore-") as tmp:
+        path = Path(tmp) / "provisionr.db"
+        with open(snapshot_path, "rb") as source:
+            compressed = source.read(2) == GZIP_MAGIC
+        opener = gzip.open if compressed else open
+        try:
+            with opener(snapshot_path, "rb") as source, open(path, "wb") as unpacked:
+                shutil.copyfileobj(source, unpacked, CHUNK_SIZE)
+        except (EOFError, gzip.BadGzipFile) as e:
+            raise BackupError(f"{snapshot_path} is not a valid gzip file") from e
+
+        snapshot_db = sqlite3.connect(path)
+        try:
+            try:
+                result = snapshot_db.execute("PRAGMA quick_check").fetchone()[0]
+            except sqlite3.DatabaseError as e:
+                raise BackupError(f"{snapshot_path} is not a SQLite database") from e
+            if result != "ok":
+                raise BackupError(f"{snapshot_path} is corrupt: {result}")
+
+            raw = engine.raw_connection()
+            try:
+                snapshot_db.backup(raw.driver_connection)
+            finally:
+                raw.close()
+            return snapshot_db.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            snapshot_db.close()
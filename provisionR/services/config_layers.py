@@ -0,0 +1,437 @@
+"""Layered configuration (global -> group -> machine) with materialized merges."""
+
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from provisionR.config import (
+    ConfigVersionConflict,
+    load_global_config,
+    save_global_config,
+)
+from provisionR.metrics import metrics
+from provisionR.services.event_bus import CONFIG_CHANGED, EventBus
+from provisionR.models import (
+    ConfigGroup,
+    DBConfigGroup,
+    DBGlobalConfig,
+    DBMachineConfig,
+    GlobalConfig,
+    MachineConfig,
+)
+from provisionR.utils import MachineIdentity, apply_merge_patch
+
+REBUILT_METRIC = "provisionr_config_contexts_rebuilt_total"
+MATERIALIZED_METRIC = "provisionr_config_contexts_materialized"
+
+
+def merge_values(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge two layers of values.
+
+    Nested dicts are merged key by key; any other value in `override`
+    replaces the one in `base`. Neither argument is modified.
+
+    Args:
+        base: Less specific layer
+        override: More specific layer
+
+    Returns:
+        Merged values
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_values(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def stored_revision(db: Session) -> Optional[Tuple[int, int]]:
+    """
+    Get the stored (global config version, layers revision).
+
+    Both change with every write to a config layer, in any process, so
+    anything derived from the layers is current while this is unchanged.
+    """
+    stored = db.query(DBGlobalConfig.version, DBGlobalConfig.layers_revision).first()
+    return None if stored is None else tuple(stored)
+
+
+@dataclass(frozen=True)
+class EffectiveConfig:
+    """A machine's merged configuration, shared between requests."""
+
+    config: GlobalConfig
+    values: Dict[str, Any]
+    group: Optional[str] = None
+    # Top-level keys set by the group or machine layer
+    override_keys: FrozenSet[str] = frozenset()
+    # Whether values hold dicts/lists, which callers must copy before use
+    nested: bool = False
+
+
+@dataclass(frozen=True)
+class _MachineLayer:
+    group: Optional[str]
+    values: Dict[str, Any]
+
+
+def _effective(
+    config: GlobalConfig,
+    values: Dict[str, Any],
+    group: Optional[str] = None,
+    override_keys: Iterable[str] = (),
+) -> EffectiveConfig:
+    return EffectiveConfig(
+        config=config,
+        values=values,
+        group=group,
+        override_keys=frozenset(override_keys),
+        nested=any(isinstance(v, (dict, list)) for v in values.values()),
+    )
+
+
+def _identity_data(identity: MachineIdentity) -> Dict[str, str]:
+    return {"mac": identity.mac, "uuid": identity.uuid, "serial": identity.serial}
+
+
+class ConfigLayers:
+    """
+    Materialized effective configuration for every machine.
+
+    Values are layered global -> group -> machine. The merged values of each
+    machine that has a group or machine layer are computed once and kept in
+    memory; machines without one share the global entry. When a layer
+    changes, only the machines it applies to are re-merged: a machine layer
+    affects one machine, a group the machines in it, and the global layer
+    every machine with its own entry.
+
+    The database is the source of truth and is loaded on first use. Changes
+    must go through this class so the materialized entries stay current.
+    Every write bumps the global config's version or its layers_revision, and
+    every read first compares both with the loaded ones (a primary key
+    lookup), so layers changed by another worker are reloaded before use.
+    """
+
+    def __init__(self, events: Optional[EventBus] = None):
+        """
+        Initialize an empty, not yet loaded, set of layers.
+
+        Args:
+            events: Optional event bus notified of every layer change
+        """
+        self.events = events
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._global: Optional[GlobalConfig] = None
+        self._global_version = 0
+        self._layers_revision = 0
+        self._global_entry: Optional[EffectiveConfig] = None
+        self._groups: Dict[str, Dict[str, Any]] = {}
+        self._machines: Dict[str, _MachineLayer] = {}
+        self._members: Dict[str, Set[str]] = {}
+        self._merged: Dict[str, EffectiveConfig] = {}
+        metrics.register_gauge(MATERIALIZED_METRIC, lambda: len(self._merged))
+
+    def _is_current(self, db: Session) -> bool:
+        """Whether the loaded layers are those in the database."""
+        if not self._loaded:
+            return False
+        return stored_revision(db) == (self._global_version, self._layers_revision)
+
+    def _ensure_loaded(self, db: Session) -> None:
+        if self._is_current(db):
+            return
+        with self._lock:
+            if self._is_current(db):
+                return
+            # Empty unless the layers were loaded before
+            self._groups = {}
+            self._machines = {}
+            self._members = {}
+            self._merged = {}
+            self._set_global(*load_global_config(db))
+            # Read with the global config, before the layers: a change made
+            # meanwhile leaves this behind, so the next read reloads again
+            self._layers_revision = db.query(DBGlobalConfig.layers_revision).scalar()
+            self._groups = {
+                group.name: json.loads(group.values)
+                for group in db.query(DBConfigGroup)
+            }
+            for row in db.query(DBMachineConfig):
+                self._add_machine(
+                    row.identity_key,
+                    _MachineLayer(row.group_name, json.loads(row.values)),
+                )
+            self._rebuild(self._machines)
+            self._loaded = True
+
+    def invalidate(self) -> None:
+        """Reload every layer on next use (the database was replaced)."""
+        with self._lock:
+            self._loaded = False
+
+    def _bump_layers_revision(self, db: Session) -> int:
+        """Record a group or machine layer change in the current transaction."""
+        db.execute(
+            update(DBGlobalConfig).values(
+                layers_revision=DBGlobalConfig.layers_revision + 1
+            )
+        )
+        return db.query(DBGlobalConfig.layers_revision).scalar()
+
+    def _layers_written(self, revision: int) -> None:
+        """Note the revision of a layer change this instance committed."""
+        if revision == self._layers_revision + 1:
+            self._layers_revision = revision
+        else:
+            # Another worker changed layers too; load its changes on next use
+            self._loaded = False
+
+    def _set_global(self, config: GlobalConfig, version: int) -> None:
+        self._global = config
+        self._global_version = version
+        self._global_entry = _effective(config, config.values)
+
+    def _add_machine(self, key: str, layer: _MachineLayer) -> None:
+        self._remove_machine(key)
+        self._machines[key] = layer
+        if layer.group is not None:
+            self._members.setdefault(layer.group, set()).add(key)
+
+    def _remove_machine(self, key: str) -> None:
+        previous = self._machines.pop(key, None)
+        if previous is not None and previous.group is not None:
+            members = self._members.get(previous.group)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._members[previous.group]
+        self._merged.pop(key, None)
+
+    def _rebuild(self, keys: Iterable[str]) -> None:
+        """Re-merge the effective config of the given machines."""
+        rebuilt = 0
+        for key in list(keys):
+            layer = self._machines.get(key)
+            if layer is None:
+                self._merged.pop(key, None)
+                continue
+            group_values = self._groups.get(layer.group, {})
+            values = merge_values(
+                merge_values(self._global.values, group_values), layer.values
+            )
+            self._merged[key] = _effective(
+                self._global, values, layer.group, [*group_values, *layer.values]
+            )
+            rebuilt += 1
+        metrics.inc(REBUILT_METRIC, rebuilt)
+
+    def _changed(self, scope: str, **data: Any) -> None:
+        """Announce a layer change."""
+        if self.events is not None:
+            self.events.publish(CONFIG_CHANGED, {"scope": scope, **data})
+
+    def effective(self, db: Session, identity: MachineIdentity) -> EffectiveConfig:
+        """
+        Get a machine's effective configuration.
+
+        Args:
+            db: Database session (checked for changes by other workers)
+            identity: Normalized machine identity
+
+        Returns:
+            Merged configuration; treat it as read-only
+        """
+        self._ensure_loaded(db)
+        entry = self._merged.get(identity.key)
+        return entry if entry is not None else self._global_entry
+
+    def global_config(self, db: Session) -> Tuple[GlobalConfig, int]:
+        """Get the global config and its version without querying the database."""
+        self._ensure_loaded(db)
+        with self._lock:
+            return self._global, self._global_version
+
+    def update_global(
+        self,
+        db: Session,
+        config: GlobalConfig,
+        expected_version: Optional[int] = None,
+    ) -> Tuple[GlobalConfig, int]:
+        """
+        Store the global layer and re-merge every machine with its own entry.
+
+        Args:
+            db: Database session
+            config: New global config
+            expected_version: Only update if the stored version still matches
+
+        Returns:
+            The stored config and its new version
+
+        Raises:
+            ConfigVersionConflict: If expected_version no longer matches
+        """
+        self._ensure_loaded(db)
+        with self._lock:
+            try:
+                stored, version = save_global_config(db, config, expected_version)
+            except ConfigVersionConflict:
+                # Another worker wrote it; serve its version from now on
+                self._loaded = False
+                raise
+            self._set_global(stored, version)
+            self._rebuild(self._machines)
+        self._changed("global", version=version)
+        return stored, version
+
+    def patch_global(
+        self,
+        db: Session,
+        patch: Dict[str, Any],
+        expected_version: Optional[int] = None,
+    ) -> Tuple[GlobalConfig, int]:
+        """
+        Apply a JSON Merge Patch (RFC 7396) to the global config.
+
+        A patch that changes nothing is not written and keeps the version.
+
+        Args:
+            db: Database session
+            patch: Merge patch for the GlobalConfig document
+            expected_version: Only update if the stored version still matches
+
+        Returns:
+            The stored config and its version
+
+        Raises:
+            pydantic.ValidationError: If the patched config is invalid
+            ConfigVersionConflict: If expected_version no longer matches
+        """
+        self._ensure_loaded(db)
+        with self._lock:
+            current = self._global.model_dump(mode="json")
+            patched = GlobalConfig.model_validate(apply_merge_patch(current, patch))
+            if patched.model_dump(mode="json") == current and (
+                expected_version in (None, self._global_version)
+            ):
+                return self._global, self._global_version
+            return self.update_global(db, patched, expected_version)
+
+    def list_groups(self, db: Session) -> List[ConfigGroup]:
+        """Get every config group."""
+        self._ensure_loaded(db)
+        return [
+            ConfigGroup(name=name, values=values)
+            for name, values in sorted(self._groups.items())
+        ]
+
+    def put_group(self, db: Session, group: ConfigGroup) -> ConfigGroup:
+        """Create or replace a group and re-merge its members."""
+        self._ensure_loaded(db)
+        with self._lock:
+            db_group = db.get(DBConfigGroup, group.name)
+            if db_group is None:
+                db_group = DBConfigGroup(name=group.name)
+                db.add(db_group)
+            db_group.values = json.dumps(group.values)
+            revision = self._bump_layers_revision(db)
+            db.commit()
+            self._layers_written(revision)
+            self._groups[group.name] = group.values
+            self._rebuild(self._members.get(group.name, ()))
+        self._changed("group", group=group.name)
+        return group
+
+    def delete_group(self, db: Session, name: str) -> bool:
+        """
+        Delete a group and re-merge its members.
+
+        Members keep their group name, so re-creating the group applies to
+        them again.
+
+        Returns:
+            True if the group existed
+        """
+        self._ensure_loaded(db)
+        with self._lock:
+            deleted = (
+                db.query(DBConfigGroup).filter(DBConfigGroup.name == name).delete()
+            )
+            revision = self._bump_layers_revision(db)
+            db.commit()
+            self._layers_written(revision)
+            self._groups.pop(name, None)
+            self._rebuild(self._members.get(name, ()))
+        if deleted:
+            self._changed("group", group=name)
+        return deleted > 0
+
+    def get_machine(
+        self, db: Session, identity: MachineIdentity
+    ) -> Optional[MachineConfig]:
+        """Get a machine's own layer, if it has one."""
+        self._ensure_loaded(db)
+        layer = self._machines.get(identity.key)
+        if layer is None:
+            return None
+        return MachineConfig(
+            mac=identity.mac,
+            uuid=identity.uuid,
+            serial=identity.serial,
+            group=layer.group,
+            values=layer.values,
+        )
+
+    def put_machine(self, db: Session, machine: MachineConfig) -> MachineConfig:
+        """Create or replace a machine's layer and re-merge that machine."""
+        self._ensure_loaded(db)
+        identity = MachineIdentity.from_raw(machine.mac, machine.uuid, machine.serial)
+        with self._lock:
+            row = db.get(DBMachineConfig, identity.key)
+            if row is None:
+                row = DBMachineConfig(identity_key=identity.key)
+                db.add(row)
+            row.mac = identity.mac
+            row.uuid = identity.uuid
+            row.serial = identity.serial
+            row.group_name = machine.group
+            row.values = json.dumps(machine.values)
+            revision = self._bump_layers_revision(db)
+            db.commit()
+            self._layers_written(revision)
+            self._add_machine(
+                identity.key, _MachineLayer(machine.group, machine.values)
+            )
+            self._rebuild([identity.key])
+        self._changed("machine", **_identity_data(identity))
+        return self.get_machine(db, identity)
+
+    def delete_machine(self, db: Session, identity: MachineIdentity) -> bool:
+        """
+        Delete a machine's layer; it falls back to the global entry.
+
+        Returns:
+            True if the machine had a layer
+        """
+        self._ensure_loaded(db)
+        with self._lock:
+            deleted = (
+                db.query(DBMachineConfig)
+                .filter(DBMachineConfig.identity_key == identity.key)
+                .delete()
+            )
+            revision = self._bump_layers_revision(db)
+            db.commit()
+            self._layers_written(revision)
+            self._remove_machine(identity.key)
+        if deleted:
+            self._changed("machine", **_identity_data(identity))
+        return deleted > 0
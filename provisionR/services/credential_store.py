@@ -0,0 +1,278 @@
+"""Interchangeable backends for looking up and storing machine credentials."""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords, DBPasswordHistory, DBRotationJob
+from provisionR.services.rotation_service import ROLLED_BACK
+from provisionR.utils import MachineIdentity
+
+Credentials = Tuple[str, str, str]
+
+MEMORY_HITS_METRIC = "provisionr_credential_store_memory_hits_total"
+MEMORY_ENTRIES_METRIC = "provisionr_credential_store_memory_entries"
+
+
+class CredentialStore(ABC):
+    """
+    Where machine credentials are kept.
+
+    Every method takes the caller's database session, so backends that
+    need the database use the request's transaction.
+    """
+
+    @abstractmethod
+    def lookup(self, db: Session, identity: MachineIdentity) -> Optional[Credentials]:
+        """
+        Get a machine's (root, user, luks) passwords.
+
+        Args:
+            db: Database session
+            identity: Normalized machine identity
+
+        Returns:
+            The passwords, or None for an unknown machine
+        """
+
+    @abstractmethod
+    def insert(
+        self, db: Session, identity: MachineIdentity, credentials: Credentials
+    ) -> Credentials:
+        """
+        Store passwords for a new machine.
+
+        Args:
+            db: Database session
+            identity: Normalized machine identity
+            credentials: Newly generated (root, user, luks) passwords
+
+        Returns:
+            The passwords stored for the machine, which are those of a
+            concurrent request if it created the machine first
+        """
+
+    def stored(self, identity: MachineIdentity, credentials: Credentials) -> None:
+        """Note credentials written to the database by someone else."""
+
+    def archived(self, identity_keys: Iterable[str]) -> None:
+        """Note machines moved to the archive (see ArchiveService)."""
+
+    @abstractmethod
+    def machines(self, db: Session, batch_size: int = 1000) -> Iterator:
+        """
+        Iterate over every stored machine, oldest first.
+
+        Yields:
+            Rows with mac, uuid, serial, the passwords and created_at
+        """
+
+    @abstractmethod
+    def count(self, db: Session) -> int:
+        """Number of stored machines."""
+
+
+class SqlCredentialStore(CredentialStore):
+    """Credentials read from and written to machine_passwords on every call."""
+
+    def lookup(self, db: Session, identity: MachineIdentity) -> Optional[Credentials]:
+        """Look up a machine by its identity key (single unique index probe)."""
+        row = (
+            db.query(
+                DBMachinePasswords.root_password,
+                DBMachinePasswords.user_password,
+                DBMachinePasswords.luks_password,
+            )
+            .filter(DBMachinePasswords.identity_key == identity.key)
+            .first()
+        )
+        return tuple(row) if row is not None else None
+
+    def insert(
+        self, db: Session, identity: MachineIdentity, credentials: Credentials
+    ) -> Credentials:
+        """Insert a machine, falling back to the row of a concurrent insert."""
+        root_pw, user_pw, luks_pw = credentials
+        db.add(
+            DBMachinePasswords(
+                mac=identity.mac,
+                uuid=identity.uuid,
+                serial=identity.serial,
+                identity_key=identity.key,
+                root_password=root_pw,
+                user_password=user_pw,
+                luks_password=luks_pw,
+            )
+        )
+        try:
+            db.commit()
+        except IntegrityError:
+            # A concurrent request stored this machine first; use its passwords
+            db.rollback()
+            return self.lookup(db, identity)
+        return credentials
+
+    def machines(self, db: Session, batch_size: int = 1000) -> Iterator:
+        """Stream machines from the database a batch at a time."""
+        return iter(
+            db.query(DBMachinePasswords)
+            .order_by(DBMachinePasswords.created_at)
+            .yield_per(batch_size)
+        )
+
+    def count(self, db: Session) -> int:
+        """Count machines in the database."""
+        return db.query(DBMachinePasswords).count()
+
+
+class MemoryCredentialStore(SqlCredentialStore):
+    """
+    Keeps every machine's credentials in a dict in front of the database.
+
+    All identities are loaded once, after which lookups of known machines
+    never touch the database. Inserts are written through to SQL before
+    they are cached, and lookups of identities missing from the dict fall
+    back to SQL (e.g. machines created by another worker process). Bulk
+    reads such as exports still stream from SQL.
+
+    Rotations change passwords underneath the cache, possibly from another
+    process. At most once every sync_interval_seconds a lookup checks
+    rotation_jobs for activity, and reloads only the machines that were
+    rotated or rolled back since. Machines archived by another process stay
+    cached, and keep being served their passwords, until the next load.
+    """
+
+    def __init__(self, sync_interval_seconds: float = 1.0):
+        """
+        Initialize the store.
+
+        Args:
+            sync_interval_seconds: How often to look for rotated passwords
+        """
+        self.sync_interval_seconds = sync_interval_seconds
+        self._lock = threading.Lock()
+        self._credentials: Optional[Dict[str, Credentials]] = None
+        self._next_sync = 0.0
+        self._synced_at: Optional[datetime] = None
+        self._history_id = 0
+        metrics.register_gauge(
+            MEMORY_ENTRIES_METRIC, lambda: len(self._credentials or ())
+        )
+
+    def load(self, db: Session) -> int:
+        """
+        Load every machine's credentials into memory.
+
+        Returns:
+            Number of machines loaded
+        """
+        with self._lock:
+            # Rotations up to now are included in what is loaded below
+            self._synced_at = db.scalar(func.max(DBRotationJob.updated_at))
+            self._history_id = db.scalar(func.max(DBPasswordHistory.id)) or 0
+            self._credentials = {
+                row.identity_key: (
+                    row.root_password,
+                    row.user_password,
+                    row.luks_password,
+                )
+                for row in db.query(
+                    DBMachinePasswords.identity_key,
+                    DBMachinePasswords.root_password,
+                    DBMachinePasswords.user_password,
+                    DBMachinePasswords.luks_password,
+                ).yield_per(10_000)
+            }
+            self._next_sync = time.monotonic() + self.sync_interval_seconds
+            return len(self._credentials)
+
+    def _sync(self, db: Session) -> None:
+        """Reload machines whose passwords a rotation job changed."""
+        query = db.query(
+            DBRotationJob.id, DBRotationJob.status, DBRotationJob.updated_at
+        )
+        if self._synced_at is not None:
+            query = query.filter(DBRotationJob.updated_at > self._synced_at)
+        jobs = query.all()
+        if not jobs:
+            return
+
+        machine_ids: Set[int] = set()
+        history = db.query(DBPasswordHistory.id, DBPasswordHistory.machine_id).filter(
+            DBPasswordHistory.id > self._history_id
+        )
+        for history_id, machine_id in history:
+            machine_ids.add(machine_id)
+            self._history_id = max(self._history_id, history_id)
+        rolled_back = [job.id for job in jobs if job.status == ROLLED_BACK]
+        if rolled_back:
+            machine_ids.update(
+                machine_id
+                for (machine_id,) in db.query(DBPasswordHistory.machine_id).filter(
+                    DBPasswordHistory.job_id.in_(rolled_back)
+                )
+            )
+
+        machine_list = list(machine_ids)
+        for start in range(0, len(machine_list), 500):
+            batch = machine_list[start : start + 500]
+            for row in db.query(
+                DBMachinePasswords.identity_key,
+                DBMachinePasswords.root_password,
+                DBMachinePasswords.user_password,
+                DBMachinePasswords.luks_password,
+            ).filter(DBMachinePasswords.id.in_(batch)):
+                self._credentials[row.identity_key] = (
+                    row.root_password,
+                    row.user_password,
+                    row.luks_password,
+                )
+        self._synced_at = max(job.updated_at for job in jobs)
+
+    def _ready(self, db: Session) -> Dict[str, Credentials]:
+        """Load on first use and apply rotations when due."""
+        if self._credentials is None:
+            self.load(db)
+        elif time.monotonic() >= self._next_sync:
+            with self._lock:
+                if time.monotonic() >= self._next_sync:
+                    self._next_sync = time.monotonic() + self.sync_interval_seconds
+                    self._sync(db)
+        return self._credentials
+
+    def lookup(self, db: Session, identity: MachineIdentity) -> Optional[Credentials]:
+        """Look up a machine in memory, then in SQL."""
+        credentials = self._ready(db).get(identity.key)
+        if credentials is not None:
+            metrics.inc(MEMORY_HITS_METRIC)
+            return credentials
+        credentials = super().lookup(db, identity)
+        if credentials is not None:
+            self.stored(identity, credentials)
+        return credentials
+
+    def insert(
+        self, db: Session, identity: MachineIdentity, credentials: Credentials
+    ) -> Credentials:
+        """Write a new machine through to SQL, then cache it."""
+        stored = super().insert(db, identity, credentials)
+        self.stored(identity, stored)
+        return stored
+
+    def stored(self, identity: MachineIdentity, credentials: Credentials) -> None:
+        """Cache credentials written to SQL elsewhere (e.g. by group commit)."""
+        if self._credentials is not None:
+            self._credentials[identity.key] = credentials
+
+    def archived(self, identity_keys: Iterable[str]) -> None:
+        """Forget archived machines, so their next lookup restores them."""
+        if self._credentials is not None:
+            for key in identity_keys:
+                self._credentials.pop(key, None)
@@ -0,0 +1,227 @@
+"""Group-commit writer for new machine credentials."""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.utils import MachineIdentity
+
+Passwords = Tuple[str, str, str]
+
+PASSWORD_COLUMNS = ("root_password", "user_password", "luks_password")
+
+# Sentinel placed on the queue to stop the writer thread
+_STOP = object()
+
+
+class _PendingInsert:
+    """A credential insert waiting for its batch to commit."""
+
+    __slots__ = ("identity", "passwords", "done", "result", "created", "error")
+
+    def __init__(self, identity: MachineIdentity, passwords: Passwords):
+        self.identity = identity
+        self.passwords = passwords
+        self.done = threading.Event()
+        self.result: Optional[Passwords] = None
+        self.created = False
+        self.error: Optional[BaseException] = None
+
+
+class GroupCommitWriter:
+    """
+    Batches credential inserts from concurrent requests into one transaction.
+
+    With SQLite every commit is an fsync, so committing each new machine on
+    its own caps throughput during a rack bring-up. Requests instead hand
+    their row to submit(), a background thread collects everything that
+    arrives within a short window and writes it in a single transaction, and
+    each caller is released only after that transaction has committed.
+
+    If two requests race to create the same machine, the first stored row
+    wins and both callers receive its passwords.
+
+    With a passphrase index, the batch's passphrases are registered with it
+    in the same transaction, so claiming them costs no commit of its own.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        window_seconds: float = 0.005,
+        max_batch: int = 256,
+        passphrases: Optional[PassphraseIndex] = None,
+    ):
+        """
+        Initialize the writer.
+
+        Args:
+            session_factory: Creates the sessions used to write batches
+            window_seconds: How long to wait for more inserts after the first
+            max_batch: Maximum number of inserts per transaction
+            passphrases: Index the submitted passwords were drawn from
+        """
+        self.session_factory = session_factory
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.passphrases = passphrases
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        # Guards _running so nothing is queued behind the stop sentinel
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        """Whether the background thread is accepting inserts."""
+        return self._running
+
+    def start(self) -> None:
+        """Start the background writer thread."""
+        with self._lock:
+            if self._running:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="provisionr-group-commit", daemon=True
+            )
+            self._thread.start()
+            self._running = True
+
+    def stop(self) -> None:
+        """Flush pending inserts and stop the background thread."""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(
+        self, identity: MachineIdentity, passwords: Passwords
+    ) -> Tuple[Passwords, bool]:
+        """
+        Store credentials for a new machine and wait until they are durable.
+
+        Args:
+            identity: Normalized machine identity
+            passwords: Newly generated (root, user, luks) passwords
+
+        Returns:
+            The passwords stored for the machine, which are those of a
+            concurrent request if it created the machine first (or redrawn
+            ones if another process registered them first), and whether this
+            request created it
+        """
+        pending = _PendingInsert(identity, passwords)
+        with self._lock:
+            queued = self._running
+            if queued:
+                self._queue.put(pending)
+
+        if queued:
+            pending.done.wait()
+        else:
+            # No background thread (e.g. outside the app lifespan): write inline
+            self._write_batch([pending])
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.result, pending.created
+
+    def _run(self) -> None:
+        """Collect inserts into batches and write them until stopped."""
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = (
+                        self._queue.get(timeout=remaining)
+                        if remaining > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List[_PendingInsert]) -> None:
+        """Write a batch in one transaction and release its callers."""
+        rows: Dict[str, dict] = {}
+        providers: Dict[str, _PendingInsert] = {}
+        for pending in batch:
+            # The first request for an identity in a batch provides its row
+            if pending.identity.key not in rows:
+                providers[pending.identity.key] = pending
+                rows[pending.identity.key] = {
+                    "mac": pending.identity.mac,
+                    "uuid": pending.identity.uuid,
+                    "serial": pending.identity.serial,
+                    "identity_key": pending.identity.key,
+                    **dict(zip(PASSWORD_COLUMNS, pending.passwords)),
+                }
+
+        try:
+            with self.session_factory() as session:
+                if self.passphrases is not None:
+                    self._register(session, list(rows.values()))
+                session.execute(
+                    sqlite_insert(DBMachinePasswords).on_conflict_do_nothing(
+                        index_elements=["identity_key"]
+                    ),
+                    list(rows.values()),
+                )
+                stored = {
+                    machine.identity_key: (
+                        machine.root_password,
+                        machine.user_password,
+                        machine.luks_password,
+                    )
+                    for machine in session.query(DBMachinePasswords).filter(
+                        DBMachinePasswords.identity_key.in_(list(rows))
+                    )
+                }
+                session.commit()
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            return
+
+        metrics.inc("provisionr_group_commit_batches_total")
+        metrics.inc("provisionr_group_commit_rows_total", len(rows))
+        for key, row in rows.items():
+            if stored[key] == tuple(row[name] for name in PASSWORD_COLUMNS):
+                providers[key].created = True
+        for pending in batch:
+            pending.result = stored[pending.identity.key]
+            pending.done.set()
+
+    def _register(self, session: Session, rows: List[dict]) -> None:
+        """Register the rows' passphrases first thing in the batch transaction."""
+        registered = iter(
+            self.passphrases.register(
+                session, [row[name] for row in rows for name in PASSWORD_COLUMNS]
+            )
+        )
+        for row in rows:
+            for name in PASSWORD_COLUMNS:
+                row[name] = next(registered)
@@ -0,0 +1,212 @@
+"""In-process publish/subscribe bus for provisioning activity."""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Collection,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from provisionR.metrics import metrics
+
+MACHINE_CREATED = "machine-created"
+KICKSTART_FETCHED = "kickstart-fetched"
+CONFIG_CHANGED = "config-changed"
+TEMPLATE_UPLOADED = "template-uploaded"
+RULES_CHANGED = "rules-changed"
+# Sent to a subscriber that fell too far behind and missed events
+EVENTS_DROPPED = "events-dropped"
+
+PUBLISHED_METRIC = "provisionr_events_published_total"
+DROPPED_METRIC = "provisionr_events_dropped_total"
+SUBSCRIBERS_METRIC = "provisionr_event_subscribers"
+
+
+@dataclass(frozen=True)
+class Event:
+    """A published event."""
+
+    id: int
+    type: str
+    data: Dict[str, Any]
+    published_at: float
+
+    def to_sse(self) -> str:
+        """Format the event as a server-sent event."""
+        payload = json.dumps({**self.data, "published_at": self.published_at})
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+
+class EventBus:
+    """
+    Fans provisioning events out to any number of subscribers.
+
+    Events are appended to one bounded ring buffer and each subscriber only
+    keeps a cursor into it, so publishing costs the same however many
+    dashboards are connected, and never waits for them. A subscriber that
+    falls behind by more than the buffer size skips ahead and is told how
+    many events it missed, instead of holding memory or slowing publishers.
+
+    publish() may be called from any thread; subscribers run on the event
+    loop and are woken with at most one scheduled callback per burst.
+    Listeners are called synchronously by publish(), in the publisher's
+    thread, for in-process reactions such as cache invalidation.
+    """
+
+    def __init__(self, buffer_size: int = 1024, heartbeat_seconds: float = 15.0):
+        """
+        Initialize the bus.
+
+        Args:
+            buffer_size: Events kept for subscribers that are behind
+            heartbeat_seconds: Idle time before a keep-alive comment is sent
+        """
+        self.heartbeat_seconds = heartbeat_seconds
+        self._lock = threading.Lock()
+        self._events: "deque[Event]" = deque(maxlen=buffer_size)
+        self._next_id = 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._wakeup_pending = False
+        self._subscribers = 0
+        self._listeners: List[Callable[[Event], None]] = []
+        metrics.register_gauge(SUBSCRIBERS_METRIC, lambda: self._subscribers)
+
+    @property
+    def last_id(self) -> int:
+        """ID of the most recently published event (0 if none)."""
+        return self._next_id - 1
+
+    def add_listener(self, listener: Callable[[Event], None]) -> None:
+        """
+        Call `listener` with every event published from now on.
+
+        Listeners run in the publishing thread, so they must be quick and
+        must not raise.
+        """
+        with self._lock:
+            self._listeners = [*self._listeners, listener]
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> Event:
+        """
+        Publish an event without blocking.
+
+        Args:
+            event_type: Event type, e.g. MACHINE_CREATED
+            data: JSON-serializable payload
+
+        Returns:
+            The published event
+        """
+        with self._lock:
+            event = Event(self._next_id, event_type, data, time.time())
+            self._next_id += 1
+            self._events.append(event)
+            loop = self._loop
+            wake = loop is not None and not self._wakeup_pending
+            if wake:
+                self._wakeup_pending = True
+            listeners = self._listeners
+        metrics.inc(PUBLISHED_METRIC, type=event_type)
+        for listener in listeners:
+            listener(event)
+
+        if wake:
+            try:
+                loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # The loop has been closed; no subscriber is waiting on it
+                with self._lock:
+                    self._wakeup_pending = False
+        return event
+
+    def _wake(self) -> None:
+        """Wake every waiting subscriber (runs on the event loop)."""
+        with self._lock:
+            self._wakeup_pending = False
+            changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def events_after(self, last_id: int) -> Tuple[List[Event], int]:
+        """
+        Get buffered events newer than `last_id`.
+
+        Returns:
+            The events, and how many newer events are no longer buffered
+        """
+        with self._lock:
+            if not self._events or last_id >= self._events[-1].id:
+                return [], 0
+            first_id = self._events[0].id
+            start = max(last_id + 1, first_id)
+            events = list(itertools.islice(self._events, start - first_id, None))
+        return events, start - (last_id + 1)
+
+    def _bind_loop(self) -> asyncio.Event:
+        """Attach the bus to the running loop; return the wake-up event."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._loop is not loop:
+                self._loop = loop
+                self._changed = asyncio.Event()
+                self._wakeup_pending = False
+            return self._changed
+
+    async def subscribe(
+        self,
+        last_event_id: Optional[int] = None,
+        types: Optional[Collection[str]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream events as server-sent event messages.
+
+        Args:
+            last_event_id: Resume after this event (e.g. from Last-Event-ID);
+                by default only new events are sent
+            types: Only send these event types (all by default)
+
+        Yields:
+            SSE-formatted messages, with keep-alive comments while idle
+        """
+        cursor = self.last_id if last_event_id is None else last_event_id
+        self._subscribers += 1
+        try:
+            if cursor > self.last_id:
+                # An id from before a restart (ids start over with the process):
+                # how many events were missed is unknown, so count is null
+                payload = json.dumps({"count": None})
+                yield f"event: {EVENTS_DROPPED}\ndata: {payload}\n\n"
+                cursor = 0
+            while True:
+                # Take the wake-up event before reading so no publish is missed
+                changed = self._bind_loop()
+                events, dropped = self.events_after(cursor)
+                if dropped:
+                    metrics.inc(DROPPED_METRIC, dropped)
+                    # No id, so the client's Last-Event-ID is kept
+                    payload = json.dumps({"count": dropped})
+                    yield f"event: {EVENTS_DROPPED}\ndata: {payload}\n\n"
+                for event in events:
+                    if types is None or event.type in types:
+                        yield event.to_sse()
+                if events:
+                    cursor = events[-1].id
+                    continue
+
+                try:
+                    await asyncio.wait_for(changed.wait(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            self._subscribers -= 1
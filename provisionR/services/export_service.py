@@ -2,49 +2,83 @@
 
 import csv
 import io
+from typing import Callable, Optional, TextIO
 from sqlalchemy.orm import Session
-from provisionR.models import DBMachinePasswords
+from provisionR.services.archive_service import ArchiveService
+from provisionR.services.credential_store import CredentialStore, SqlCredentialStore
+from provisionR.services.job_runner import JobContext
+
+CSV_HEADER = [
+    "mac",
+    "uuid",
+    "serial",
+    "root_password",
+    "user_password",
+    "luks_password",
+    "created_at",
+]
 
 
 class ExportService:
     """Service for exporting data to various formats."""
 
-    def __init__(self, db: Session):
-        """Initialize the export service with a database session."""
+    def __init__(self, db: Session, store: Optional[CredentialStore] = None):
+        """
+        Initialize the export service.
+
+        Args:
+            db: Database session
+            store: Where credentials are kept (defaults to plain SQL)
+        """
         self.db = db
+        self.store = store or SqlCredentialStore()
 
-    def export_machine_passwords_csv(self) -> str:
+    def export_machine_passwords_csv(self, archived: bool = False) -> str:
         """
         Export all machine passwords as CSV content.
 
+        Args:
+            archived: Export archived machines instead of the active ones
+
         Returns:
             CSV content as a string
         """
-        # Query all machines ordered by creation date
-        machines = (
-            self.db.query(DBMachinePasswords)
-            .order_by(DBMachinePasswords.created_at)
-            .all()
-        )
-
-        # Create CSV in memory
         output = io.StringIO()
-        writer = csv.writer(output)
+        self.write_machine_passwords_csv(output, archived=archived)
+        return output.getvalue()
 
-        # Write header
-        writer.writerow(
-            [
-                "mac",
-                "uuid",
-                "serial",
-                "root_password",
-                "user_password",
-                "luks_password",
-                "created_at",
-            ]
-        )
+    def write_machine_passwords_csv(
+        self,
+        output: TextIO,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        batch_size: int = 1000,
+        archived: bool = False,
+    ) -> int:
+        """
+        Write all machine passwords as CSV to a file, a batch at a time.
 
-        # Write data rows
+        Args:
+            output: Text file to write to
+            on_progress: Called with (rows written, total rows) after each batch
+            batch_size: Rows fetched from the database at a time
+            archived: Write archived machines instead of the active ones
+
+        Returns:
+            Number of machines written
+        """
+        # All machines ordered by creation date
+        if archived:
+            archive = ArchiveService(self.db)
+            total = archive.count()
+            machines = archive.machines(batch_size=batch_size)
+        else:
+            total = self.store.count(self.db)
+            machines = self.store.machines(self.db, batch_size=batch_size)
+
+        writer = csv.writer(output)
+        writer.writerow(CSV_HEADER)
+
+        written = 0
         for machine in machines:
             writer.writerow(
                 [
@@ -57,7 +91,27 @@ class ExportService:
                     machine.created_at.isoformat() if machine.created_at else "",
                 ]
             )
+            written += 1
+            if on_progress is not None and written % batch_size == 0:
+                on_progress(written, total)
 
-        # Return CSV content
-        output.seek(0)
-        return output.getvalue()
+        if on_progress is not None:
+            on_progress(written, total)
+        return written
+
+
+def export_job(context: JobContext) -> None:
+    """
+    Job handler writing the machine passwords CSV to the job's result file.
+
+    Set the job's archived param to export the archived machines instead.
+    """
+    with (
+        context.session_factory() as db,
+        open(context.output_path, "w", newline="") as output,
+    ):
+        ExportService(db).write_machine_passwords_csv(
+            output,
+            on_progress=context.progress,
+            archived=bool(context.params.get("archived", False)),
+        )
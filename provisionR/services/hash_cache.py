@@ -0,0 +1,169 @@
+"""Per-machine cache of password hashes in every registered format."""
+
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from provisionR.metrics import metrics
+from provisionR.utils.password_hasher import (
+    HASH_FORMATS,
+    PasswordHasher,
+    calibrate_cost,
+)
+
+HITS_METRIC = "provisionr_hash_cache_hits_total"
+COMPUTED_METRIC = "provisionr_hashes_computed_total"
+ENTRIES_METRIC = "provisionr_hash_cache_entries"
+
+# Which of a machine's passwords each template variable prefix refers to
+PASSWORD_NAMES = ("root", "user", "luks")
+
+# Format of the plain {root,user,luks}_password variables
+DEFAULT_FORMAT = "sha512"
+
+# Shorthand variables: name -> (password, format)
+HASH_ALIASES = {"grub_pbkdf2": ("root", "grub_pbkdf2")}
+
+Credentials = Tuple[str, str, str]
+
+
+def hash_variables() -> List[str]:
+    """Names of the template variables holding password hashes."""
+    names = []
+    for password_name in PASSWORD_NAMES:
+        names.append(f"{password_name}_password")
+        names.extend(f"{password_name}_password_{f}" for f in HASH_FORMATS)
+    return names + list(HASH_ALIASES)
+
+
+def parse_hash_costs(spec: str) -> Dict[str, int]:
+    """
+    Parse per-format costs such as "yescrypt=7,grub_pbkdf2=100000".
+
+    Raises:
+        ValueError: If an entry is malformed or names an unknown format
+    """
+    costs = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, cost = entry.partition("=")
+        name = name.strip()
+        if name not in HASH_FORMATS:
+            raise ValueError(f"Unknown hash format {name!r}")
+        costs[name] = int(cost)
+    return costs
+
+
+class HashCache:
+    """
+    Hashes machine passwords on demand and remembers the hashes per machine.
+
+    Crypt hashes are slow on purpose, so a kickstart only pays for the
+    formats its template references (see template_values) and a returning
+    machine gets the hashes it got last time, salt included. Entries are
+    keyed by machine, password and format; a rotated password misses and is
+    hashed afresh. The least recently used hashes are dropped beyond
+    max_entries.
+
+    Each format's cost is, in order of preference: the one configured, the
+    highest that fits latency_budget_ms on this host (measured on first
+    use), or the format's default.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 65_536,
+        latency_budget_ms: Optional[float] = None,
+        costs: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of hashes kept
+            latency_budget_ms: Time one hash may take when calibrating costs
+            costs: Fixed costs by format name
+        """
+        self.max_entries = max_entries
+        self.latency_budget_ms = latency_budget_ms
+        self._costs: Dict[str, int] = dict(costs or {})
+        self._lock = threading.Lock()
+        self._calibration_lock = threading.Lock()
+        self._cache: "OrderedDict[tuple, str]" = OrderedDict()
+        metrics.register_gauge(ENTRIES_METRIC, lambda: len(self._cache))
+
+    def cost(self, format_name: str) -> int:
+        """Get the cost a format is hashed with, calibrating it on first use."""
+        cost = self._costs.get(format_name)
+        if cost is not None:
+            return cost
+        hash_format = HASH_FORMATS[format_name]
+        if self.latency_budget_ms is None:
+            return hash_format.default_cost
+        with self._calibration_lock:
+            if format_name not in self._costs:
+                self._costs[format_name] = calibrate_cost(
+                    hash_format, self.latency_budget_ms / 1000
+                )
+            return self._costs[format_name]
+
+    def hash(self, identity_key: str, password: str, format_name: str) -> str:
+        """
+        Get a machine's password hash in a format, hashing it if not cached.
+
+        Args:
+            identity_key: Machine the password belongs to
+            password: Plain text password
+            format_name: Name of a registered hash format
+
+        Returns:
+            The hash
+        """
+        key = (identity_key, password, format_name)
+        with self._lock:
+            hashed = self._cache.get(key)
+            if hashed is not None:
+                self._cache.move_to_end(key)
+        if hashed is not None:
+            metrics.inc(HITS_METRIC)
+            return hashed
+
+        # Concurrent misses for one key both hash; the last one is kept
+        hashed = PasswordHasher.hash(password, format_name, self.cost(format_name))
+        metrics.inc(COMPUTED_METRIC, format=format_name)
+        with self._lock:
+            self._cache[key] = hashed
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return hashed
+
+    def template_values(
+        self, identity_key: str, credentials: Credentials
+    ) -> Dict[str, Callable[[], str]]:
+        """
+        Build lazy template variables for a machine's password hashes.
+
+        Variables are <password>_password_<format> for every registered
+        format, <password>_password in the default format, and the
+        HASH_ALIASES. Pass them to LazyValues so only referenced ones are
+        computed.
+
+        Args:
+            identity_key: Machine the passwords belong to
+            credentials: (root, user, luks) plain text passwords
+
+        Returns:
+            Variable name -> function computing the hash
+        """
+        lazy = {}
+        for password_name, password in zip(PASSWORD_NAMES, credentials):
+            for format_name in HASH_FORMATS:
+                lazy[f"{password_name}_password_{format_name}"] = partial(
+                    self.hash, identity_key, password, format_name
+                )
+            lazy[f"{password_name}_password"] = lazy[
+                f"{password_name}_password_{DEFAULT_FORMAT}"
+            ]
+        for alias, (password_name, format_name) in HASH_ALIASES.items():
+            lazy[alias] = lazy[f"{password_name}_password_{format_name}"]
+        return lazy
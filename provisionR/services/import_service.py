@@ -0,0 +1,394 @@
+"""Service for importing machine credentials from CSV."""
+
+import csv
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from provisionR.fleet_stats import deferred_counting
+from provisionR.metrics import metrics
+from provisionR.models import DBArchivedMachine, DBMachinePasswords
+from provisionR.search_index import deferred_indexing
+from provisionR.services.credential_store import CredentialStore, SqlCredentialStore
+from provisionR.services.export_service import CSV_HEADER
+from provisionR.services.job_runner import JobContext, JobInterrupted
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.rotation_service import generate_credentials
+from provisionR.utils import MachineIdentity
+
+IMPORTED_METRIC = "provisionr_machines_imported_total"
+
+REQUIRED_COLUMNS = ("mac", "uuid", "serial")
+PASSWORD_COLUMNS = ("root_password", "user_password", "luks_password")
+REJECTS_HEADER = ["line", "error"] + CSV_HEADER
+
+# Subdirectory of the job results directory uploaded files wait in
+UPLOADS_DIR = "uploads"
+
+# (line number, CSV record)
+Record = Tuple[int, Dict[str, str]]
+
+
+class CsvImportError(Exception):
+    """Raised when a CSV file can't be imported at all."""
+
+
+@dataclass
+class ImportResult:
+    """Counts of an import so far."""
+
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    generated: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        """Serialize the counts."""
+        return dict(self.__dict__)
+
+
+@dataclass
+class _Row:
+    identity: MachineIdentity
+    passwords: Tuple[str, str, str]
+    created_at: datetime
+    # Positions of the passwords that were generated
+    generated: Tuple[int, ...] = ()
+
+
+@dataclass
+class _Prepared:
+    rows: List[_Row]
+    # (line number, reason, record)
+    rejects: List[Tuple[int, str, Dict[str, str]]]
+
+
+def _parse(record: Dict[str, str]) -> Tuple[MachineIdentity, datetime]:
+    """
+    Validate and normalize the identity and creation time of a CSV record.
+
+    Raises:
+        ValueError: If the record can't be imported
+    """
+    missing = [name for name in REQUIRED_COLUMNS if not (record.get(name) or "")]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    # Identifiers are normalized like PasswordService does, without rejecting
+    # any it accepts (such as MACs that aren't 48 bits), so exports re-import
+    identity = MachineIdentity.from_raw(record["mac"], record["uuid"], record["serial"])
+    if not identity.serial:
+        raise ValueError("missing serial")
+
+    created_at = datetime.now(UTC)
+    if record.get("created_at"):
+        try:
+            created_at = datetime.fromisoformat(record["created_at"])
+        except ValueError:
+            raise ValueError(f"invalid created_at {record['created_at']!r}")
+    return identity, created_at
+
+
+def prepare_records(records: List[Record]) -> _Prepared:
+    """
+    Validate records, compute identity keys and fill in missing passwords.
+
+    Module-level so it can run in worker processes.
+    """
+    prepared = _Prepared(rows=[], rejects=[])
+    incomplete = []
+    for line, record in records:
+        try:
+            identity, created_at = _parse(record)
+        except ValueError as e:
+            prepared.rejects.append((line, str(e), record))
+            continue
+        passwords = tuple(record.get(name) or "" for name in PASSWORD_COLUMNS)
+        row = _Row(identity, passwords, created_at)
+        if not all(passwords):
+            incomplete.append(row)
+        prepared.rows.append(row)
+
+    for row, generated in zip(incomplete, generate_credentials(len(incomplete))):
+        row.generated = tuple(i for i, given in enumerate(row.passwords) if not given)
+        row.passwords = tuple(
+            given or new for given, new in zip(row.passwords, generated)
+        )
+    return prepared
+
+
+class ImportService:
+    """
+    Service for importing machine credentials in the layout ExportService writes.
+
+    The file is read a chunk of rows at a time, so memory stays constant
+    however many machines it holds. Validation, identity keys and passwords
+    missing from the file are computed for each chunk by worker processes
+    (while the previous chunk is being written) and the chunk is upserted by
+    identity key in one executemany transaction: new machines are inserted,
+    known ones get the file's passwords and keep their first-seen time.
+    Archived machines in the file are brought back as new ones.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        store: Optional[CredentialStore] = None,
+        chunk_size: int = 5000,
+        workers: int = 1,
+        passphrases: Optional[PassphraseIndex] = None,
+    ):
+        """
+        Initialize the import service.
+
+        Args:
+            db: Database session
+            store: Credential store told about imported passwords
+            chunk_size: Rows validated and written per transaction
+            workers: Processes preparing rows (1 prepares them inline)
+            passphrases: Index keeping generated passphrases unique
+        """
+        self.db = db
+        self.store = store or SqlCredentialStore()
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.passphrases = passphrases
+
+    def import_machine_passwords_csv(
+        self,
+        source: TextIO,
+        rejects: Optional[TextIO] = None,
+        on_progress: Optional[Callable[[ImportResult], None]] = None,
+    ) -> ImportResult:
+        """
+        Import machine credentials from a CSV file.
+
+        Only mac, uuid and serial columns are required; blank or missing
+        passwords are generated for new machines and left as stored for known
+        ones, and a blank created_at means now. Rows that
+        can't be imported are skipped and written to `rejects` with their line
+        number and the reason.
+
+        Args:
+            source: Text file to read
+            rejects: Text file rejected rows are written to
+            on_progress: Called with the counts so far after each chunk
+
+        Returns:
+            Counts of the import
+
+        Raises:
+            CsvImportError: If the file lacks a header with the required columns
+        """
+        reader = csv.DictReader(source)
+        columns = reader.fieldnames or []
+        missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+        if missing:
+            raise CsvImportError(f"CSV header lacks {', '.join(missing)}")
+        reject_writer = None
+        if rejects is not None:
+            reject_writer = csv.writer(rejects)
+            reject_writer.writerow(REJECTS_HEADER)
+
+        result = ImportResult()
+        chunks = self._read(reader, result)
+        executor = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            if executor is None:
+                prepared_chunks = map(prepare_records, chunks)
+            else:
+                prepared_chunks = self._prepare_ahead(chunks, executor)
+            for prepared in prepared_chunks:
+                result.rejected += len(prepared.rejects)
+                if reject_writer is not None:
+                    for line, reason, record in prepared.rejects:
+                        reject_writer.writerow(
+                            [line, reason]
+                            + [record.get(name) or "" for name in CSV_HEADER]
+                        )
+                if prepared.rows:
+                    self._write(prepared.rows, result)
+                if on_progress is not None:
+                    on_progress(result)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        return result
+
+    def _read(
+        self, reader: csv.DictReader, result: ImportResult
+    ) -> Iterator[List[Record]]:
+        """Yield the file's records a chunk at a time."""
+        chunk: List[Record] = []
+        for record in reader:
+            result.rows += 1
+            chunk.append((reader.line_num, record))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _prepare_ahead(
+        self, chunks: Iterator[List[Record]], executor: ProcessPoolExecutor
+    ) -> Iterator[_Prepared]:
+        """Prepare chunks across the workers, one chunk ahead of the writer."""
+        pending: Optional[List[Future]] = None
+        for chunk in chunks:
+            share = -(-len(chunk) // self.workers)
+            futures = [
+                executor.submit(prepare_records, chunk[start : start + share])
+                for start in range(0, len(chunk), share)
+            ]
+            if pending is not None:
+                yield self._merge(pending)
+            pending = futures
+        if pending is not None:
+            yield self._merge(pending)
+
+    @staticmethod
+    def _merge(futures: List[Future]) -> _Prepared:
+        """Combine the parts of a chunk prepared by different workers."""
+        merged = _Prepared(rows=[], rejects=[])
+        for future in futures:
+            part = future.result()
+            merged.rows.extend(part.rows)
+            merged.rejects.extend(part.rejects)
+        return merged
+
+    def _write(self, chunk: List[_Row], result: ImportResult) -> None:
+        """Upsert a chunk of prepared rows in one transaction."""
+        # A machine listed twice keeps its last row
+        rows = list({row.identity.key: row for row in chunk}.values())
+        keys = [row.identity.key for row in rows]
+        existing = {
+            key: passwords
+            for key, *passwords in self.db.query(
+                DBMachinePasswords.identity_key,
+                DBMachinePasswords.root_password,
+                DBMachinePasswords.user_password,
+                DBMachinePasswords.luks_password,
+            ).filter(DBMachinePasswords.identity_key.in_(keys))
+        }
+        for row in rows:
+            if row.generated and row.identity.key in existing:
+                # Blank cells keep a known machine's passwords
+                stored = existing[row.identity.key]
+                row.passwords = tuple(
+                    stored[i] if i in row.generated else password
+                    for i, password in enumerate(row.passwords)
+                )
+                row.generated = ()
+        if self.passphrases is not None:
+            self._claim_generated(rows)
+
+        table = DBMachinePasswords.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.identity_key],
+            set_={name: statement.excluded[name] for name in PASSWORD_COLUMNS},
+        )
+        conn = self.db.connection()
+        # Per-row triggers would cost more than the inserts themselves
+        with deferred_indexing(conn), deferred_counting(conn):
+            conn.execute(
+                statement,
+                [
+                    {
+                        "mac": row.identity.mac,
+                        "uuid": row.identity.uuid,
+                        "serial": row.identity.serial,
+                        "identity_key": row.identity.key,
+                        "root_password": row.passwords[0],
+                        "user_password": row.passwords[1],
+                        "luks_password": row.passwords[2],
+                        "created_at": row.created_at,
+                    }
+                    for row in rows
+                ],
+            )
+        # The imported row replaces an archived copy of the machine
+        conn.execute(
+            delete(DBArchivedMachine).where(DBArchivedMachine.identity_key.in_(keys))
+        )
+        if self.passphrases is not None:
+            # Registered with the machines, so every process's index sees them
+            self.passphrases.add(self.db, (p for row in rows for p in row.passwords))
+        self.db.commit()
+
+        for row in rows:
+            self.store.stored(row.identity, row.passwords)
+        result.inserted += len(rows) - len(existing)
+        result.updated += len(existing)
+        result.generated += sum(bool(row.generated) for row in rows)
+        metrics.inc(IMPORTED_METRIC, len(rows))
+
+    def _claim_generated(self, rows: List[_Row]) -> None:
+        """Replace generated passwords the fleet already uses."""
+        generated = [row for row in rows if row.generated]
+        if not generated:
+            return
+        claimed = iter(
+            self.passphrases.claim(
+                self.db,
+                [row.passwords[i] for row in generated for i in row.generated],
+            )
+        )
+        for row in generated:
+            passwords = list(row.passwords)
+            for i in row.generated:
+                passwords[i] = next(claimed)
+            row.passwords = tuple(passwords)
+
+
+def upload_path(results_dir: Path, name: str) -> Path:
+    """Where an uploaded file waits for its import job (never outside of it)."""
+    return Path(results_dir) / UPLOADS_DIR / Path(name).name
+
+
+def import_job(
+    context: JobContext,
+    store: Optional[CredentialStore] = None,
+    chunk_size: int = 5000,
+    workers: int = 1,
+    passphrases: Optional[PassphraseIndex] = None,
+) -> None:
+    """
+    Job handler importing an uploaded CSV file (bind the keyword arguments).
+
+    The job's params name the uploaded file (see upload_path). The job's
+    result is the CSV of rejected rows; the upload is removed once the import
+    finishes, fails or is cancelled, and kept if it is interrupted to run
+    again.
+    """
+    upload = upload_path(context.runner.results_dir, context.params["upload"])
+    interrupted = False
+    try:
+        with (
+            context.session_factory() as db,
+            open(upload, newline="") as source,
+            open(context.output_path, "w", newline="") as rejects,
+        ):
+            ImportService(
+                db,
+                store=store,
+                chunk_size=chunk_size,
+                workers=workers,
+                passphrases=passphrases,
+            ).import_machine_passwords_csv(
+                source,
+                rejects=rejects,
+                on_progress=lambda result: context.progress(result.rows),
+            )
+    except JobInterrupted:
+        interrupted = True
+        raise
+    finally:
+        if not interrupted:
+            upload.unlink(missing_ok=True)
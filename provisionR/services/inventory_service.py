@@ -0,0 +1,214 @@
+"""Service for browsing and searching the machine inventory."""
+
+import base64
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, column, or_, text, tuple_
+from sqlalchemy.orm import Session
+
+from provisionR.models import DBMachinePasswords
+from provisionR.search_index import SEARCH_TABLE, has_search_index
+
+SORT_COLUMNS = {
+    "created_at": DBMachinePasswords.created_at,
+    "mac": DBMachinePasswords.mac,
+    "uuid": DBMachinePasswords.uuid,
+    "serial": DBMachinePasswords.serial,
+}
+
+# Shorter substrings can't use the trigram index and fall back to a scan
+MIN_TRIGRAM_LENGTH = 3
+
+_MAC_PREFIX = re.compile(r"[0-9A-Fa-f:\-.]+")
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor can't be used for the request."""
+
+
+@dataclass(frozen=True)
+class MachinePage:
+    """One page of machines."""
+
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str]
+
+
+def _encode_cursor(sort: str, descending: bool, value: Any, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, descending, value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str, descending: bool) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, cursor_desc, value, row_id = json.loads(
+            base64.urlsafe_b64decode(padded)
+        )
+        if sort == "created_at" and value is not None:
+            value = datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if (cursor_sort, cursor_desc) != (sort, descending):
+        raise InvalidCursor("Cursor was issued for a different sort order")
+    if not isinstance(row_id, int):
+        raise InvalidCursor("Malformed cursor")
+    return value, row_id
+
+
+def _prefix_range(col, prefix: str):
+    """Index-friendly `col LIKE 'prefix%'` (case-sensitive)."""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(col >= prefix, col < upper)
+
+
+def _mac_prefix(prefix: str) -> Optional[str]:
+    """Normalize a partial MAC address the way stored MACs are normalized."""
+    if not _MAC_PREFIX.fullmatch(prefix):
+        return None
+    digits = re.sub(r"[:\-.]", "", prefix).upper()
+    if not digits or not all(c in "0123456789ABCDEF" for c in digits):
+        return None
+    return ":".join(digits[i : i + 2] for i in range(0, len(digits), 2))
+
+
+class InventoryService:
+    """Service for listing machines with keyset pagination and search."""
+
+    def __init__(self, db: Session):
+        """
+        Initialize the inventory service.
+
+        Args:
+            db: Database session
+        """
+        self.db = db
+
+    def _prefix_filter(self, prefix: str):
+        """Match machines whose MAC, UUID or serial starts with `prefix`."""
+        conditions = [
+            _prefix_range(DBMachinePasswords.uuid, prefix.lower()),
+            _prefix_range(DBMachinePasswords.serial, prefix),
+        ]
+        mac = _mac_prefix(prefix)
+        if mac:
+            conditions.append(_prefix_range(DBMachinePasswords.mac, mac))
+        return or_(*conditions)
+
+    def _contains_filter(self, term: str):
+        """Match machines whose MAC, UUID or serial contains `term`."""
+        if len(term) >= MIN_TRIGRAM_LENGTH and has_search_index(self.db.connection()):
+            # Quoted as a phrase so FTS5 treats the term literally
+            phrase = '"' + term.replace('"', '""') + '"'
+            matches = (
+                text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :q")
+                .bindparams(q=phrase)
+                .columns(column("rowid"))
+            )
+            return DBMachinePasswords.id.in_(matches)
+        return or_(
+            DBMachinePasswords.mac.contains(term, autoescape=True),
+            DBMachinePasswords.uuid.contains(term, autoescape=True),
+            DBMachinePasswords.serial.contains(term, autoescape=True),
+        )
+
+    def search_filters(
+        self, prefix: Optional[str] = None, contains: Optional[str] = None
+    ) -> List[Any]:
+        """
+        Build the filters for a prefix and/or substring search.
+
+        Args:
+            prefix: Only machines whose MAC, UUID or serial starts with this
+            contains: Only machines whose MAC, UUID or serial contains this
+
+        Returns:
+            Conditions on DBMachinePasswords to apply together
+        """
+        conditions = []
+        if prefix:
+            conditions.append(self._prefix_filter(prefix))
+        if contains:
+            conditions.append(self._contains_filter(contains))
+        return conditions
+
+    def list_machines(
+        self,
+        limit: int = 50,
+        sort: str = "created_at",
+        descending: bool = False,
+        cursor: Optional[str] = None,
+        prefix: Optional[str] = None,
+        contains: Optional[str] = None,
+    ) -> MachinePage:
+        """
+        Get one page of machines.
+
+        Pages are found by seeking past the last row of the previous page on
+        the (sort column, id) index, so every page costs the same however deep
+        it is.
+
+        Args:
+            limit: Maximum number of machines to return
+            sort: Column to sort by (one of SORT_COLUMNS)
+            descending: Sort in descending order
+            cursor: next_cursor of the previous page
+            prefix: Only machines whose MAC, UUID or serial starts with this
+            contains: Only machines whose MAC, UUID or serial contains this
+                (case-insensitive)
+
+        Returns:
+            The page and the cursor for the next one (None on the last page)
+
+        Raises:
+            InvalidCursor: If the cursor is malformed or for another sort
+        """
+        sort_col = SORT_COLUMNS[sort]
+        id_col = DBMachinePasswords.id
+        query = self.db.query(
+            id_col,
+            DBMachinePasswords.mac,
+            DBMachinePasswords.uuid,
+            DBMachinePasswords.serial,
+            DBMachinePasswords.created_at,
+        )
+
+        query = query.filter(*self.search_filters(prefix, contains))
+        if cursor:
+            value, last_id = _decode_cursor(cursor, sort, descending)
+            key = tuple_(sort_col, id_col)
+            query = query.filter(
+                key < tuple_(value, last_id)
+                if descending
+                else key > tuple_(value, last_id)
+            )
+
+        if descending:
+            query = query.order_by(sort_col.desc(), id_col.desc())
+        else:
+            query = query.order_by(sort_col.asc(), id_col.asc())
+
+        # Fetch one extra row to learn whether there is a next page
+        rows = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_cursor(sort, descending, getattr(last, sort), last.id)
+
+        items = [
+            {
+                "mac": row.mac,
+                "uuid": row.uuid,
+                "serial": row.serial,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+            }
+            for row in rows
+        ]
+        return MachinePage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,111 @@
+"""Service for generating per-machine iPXE boot scripts."""
+
+import copy
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+from jinja2 import Environment
+from sqlalchemy.orm import Session
+
+from provisionR.config import get_global_config_from_db
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.kickstart_service import create_template_env
+from provisionR.settings import get_settings
+from provisionR.utils import GuardedEnvironment, MachineIdentity
+
+IPXE_SUFFIX = ".ipxe.j2"
+DEFAULT_IPXE_TEMPLATE = f"default{IPXE_SUFFIX}"
+
+
+def kickstart_url(base_url: str, mac: str, uuid: str, serial: str) -> str:
+    """
+    Build the URL a machine fetches its kickstart from.
+
+    Only mac, uuid and serial are passed, spelled as the machine sent them,
+    so the request can be answered from the pre-render cache.
+
+    Args:
+        base_url: Absolute URL of the /v1/ks endpoint
+        mac: MAC address of the machine
+        uuid: UUID of the machine
+        serial: Serial number of the machine
+
+    Returns:
+        The kickstart URL
+    """
+    return f"{base_url}?{urlencode({'mac': mac, 'uuid': uuid, 'serial': serial})}"
+
+
+class IpxeService:
+    """
+    Service for generating iPXE boot scripts from templates.
+
+    Scripts are rendered from <target_os>.ipxe.j2, or default.ipxe.j2 if the
+    machine's target OS has no template of its own, with the machine's
+    effective config values. Unlike kickstarts they hold no credentials, so
+    rendering one never looks up or creates passwords.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        jinja_env: Optional[Environment] = None,
+        config_layers: Optional[ConfigLayers] = None,
+    ):
+        """
+        Initialize the iPXE service.
+
+        Args:
+            db: Database session
+            jinja_env: Jinja2 environment (defaults to a new one per service)
+            config_layers: Materialized group/machine config; without it only
+                the global config is read from the database
+        """
+        self.db = db
+        self.config_layers = config_layers
+        if jinja_env is None:
+            jinja_env = create_template_env(get_settings())
+        self.jinja_env = jinja_env
+
+    def generate(
+        self,
+        identity: MachineIdentity,
+        ks_url: str,
+        query_params: Dict[str, Any],
+    ) -> str:
+        """
+        Generate a machine's iPXE boot script.
+
+        Args:
+            identity: Normalized machine identity
+            ks_url: URL the installer fetches the kickstart from
+            query_params: Request query parameters, passed to the template
+
+        Returns:
+            Rendered iPXE script
+
+        Raises:
+            TemplateNotFound: If neither template exists
+            TemplateRenderLimitExceeded: If rendering exceeds a render budget
+        """
+        if self.config_layers is not None:
+            effective = self.config_layers.effective(self.db, identity)
+            config, values = effective.config, effective.values
+            if effective.nested:
+                # Shared between requests, so templates must not mutate it
+                values = copy.deepcopy(values)
+        else:
+            config = get_global_config_from_db(self.db)
+            values = config.values
+
+        context = dict(query_params)
+        context["target_os"] = config.target_os.value
+        context.update(values)
+        context["kickstart_url"] = ks_url
+
+        template = self.jinja_env.select_template(
+            [f"{config.target_os.value}{IPXE_SUFFIX}", DEFAULT_IPXE_TEMPLATE]
+        )
+        if isinstance(self.jinja_env, GuardedEnvironment):
+            return self.jinja_env.render_template(template, context)
+        return template.render(**context)
@@ -0,0 +1,553 @@
+"""In-process runner for long operations whose results are downloaded later."""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from provisionR.metrics import metrics
+from provisionR.models import DBJob
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+RUNNING_METRIC = "provisionr_jobs_running"
+FINISHED_METRIC = "provisionr_jobs_finished_total"
+EXPIRED_METRIC = "provisionr_jobs_expired_total"
+
+# How often expired jobs and leftover files are removed
+SWEEP_INTERVAL_SECONDS = 3600.0
+
+
+class JobError(Exception):
+    """Raised when a job can't be submitted, cancelled or downloaded."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job handler when its job has been cancelled."""
+
+
+class JobInterrupted(Exception):
+    """
+    Raised inside a job handler when the runner is shutting down.
+
+    The job runs again from the start later, so handlers must keep its inputs.
+    """
+
+
+@dataclass(frozen=True)
+class JobKind:
+    """A registered kind of job."""
+
+    handler: Callable[["JobContext"], None]
+    filename: str
+    media_type: str
+
+
+class JobContext:
+    """What a job handler gets to work with."""
+
+    def __init__(
+        self,
+        runner: "JobRunner",
+        job_id: int,
+        params: Dict[str, Any],
+        output_path: Path,
+    ):
+        """
+        Initialize the context.
+
+        Args:
+            runner: Runner executing the job
+            job_id: Job being run
+            params: Parameters the job was submitted with
+            output_path: File the handler writes its result to
+        """
+        self.runner = runner
+        self.job_id = job_id
+        self.params = params
+        self.output_path = output_path
+        self.session_factory = runner.session_factory
+        self._last_saved = 0.0
+
+    def check_cancelled(self) -> None:
+        """Stop the handler if the job was cancelled or the runner is stopping."""
+        if self.job_id in self.runner._cancelled:
+            raise JobCancelled()
+        if self.runner._stopping.is_set():
+            raise JobInterrupted()
+
+    def progress(self, done: int, total: Optional[int] = None) -> None:
+        """
+        Report progress and check for cancellation.
+
+        Progress is saved at most every progress_interval_seconds, so handlers
+        can call this as often as they like.
+        """
+        self.check_cancelled()
+        now = time.monotonic()
+        if now - self._last_saved < self.runner.progress_interval_seconds:
+            return
+        self._last_saved = now
+        with self.session_factory() as db:
+            job = db.get(DBJob, self.job_id)
+            job.progress = done
+            job.total = total
+            job.heartbeat_at = datetime.now(UTC)
+            cancel_requested = job.cancel_requested
+            db.commit()
+        if cancel_requested:
+            self.runner._cancelled.add(self.job_id)
+
+
+def job_to_dict(job: DBJob) -> Dict[str, Any]:
+    """Serialize a job for the API."""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "params": json.loads(job.params),
+        "progress": job.progress,
+        "total": job.total,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class JobRunner:
+    """
+    Runs registered kinds of jobs on a small, bounded pool of threads.
+
+    Job state lives in the jobs table rather than in memory: a submitted job
+    is queued there, progress is saved as it runs, and its result is written
+    to a file under results_dir that is downloaded once it completes.
+
+    Several processes may share the jobs table. Each runner claims a queued
+    job with a conditional update and records itself as the job's owner; while
+    the job runs, a maintenance thread renews its heartbeat. Running jobs
+    whose heartbeat is older than stale_after_seconds were left by a process
+    that died and are run again from the start; live ones are left alone.
+    Finished jobs are deleted retention_seconds after they finished, along
+    with their result files and any other file in results_dir (such as an
+    upload no job used) untouched for that long.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        results_dir: Path,
+        max_concurrent: int = 2,
+        progress_interval_seconds: float = 0.5,
+        heartbeat_seconds: float = 10.0,
+        stale_after_seconds: float = 60.0,
+        retention_seconds: float = 7 * 24 * 3600.0,
+    ):
+        """
+        Initialize the runner.
+
+        Args:
+            session_factory: Creates the sessions used to track jobs
+            results_dir: Directory job results are written to
+            max_concurrent: Jobs run at the same time; the rest wait queued
+            progress_interval_seconds: Minimum time between progress saves
+            heartbeat_seconds: How often running jobs' heartbeats are renewed
+                and other processes' stale jobs looked for
+            stale_after_seconds: Heartbeat age after which a running job is
+                taken to be abandoned
+            retention_seconds: How long finished jobs and their results are kept
+        """
+        self.session_factory = session_factory
+        self.results_dir = Path(results_dir)
+        self.max_concurrent = max_concurrent
+        self.progress_interval_seconds = progress_interval_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.retention_seconds = retention_seconds
+        self.owner = uuid.uuid4().hex
+        self._kinds: Dict[str, JobKind] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._cancelled: set = set()
+        self._queued: Set[int] = set()
+        self._active: Set[int] = set()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._running = 0
+        metrics.register_gauge(RUNNING_METRIC, lambda: self._running)
+
+    @property
+    def kinds(self) -> Dict[str, JobKind]:
+        """Registered kinds of jobs by name."""
+        return dict(self._kinds)
+
+    def register(
+        self,
+        kind: str,
+        handler: Callable[[JobContext], None],
+        filename: str,
+        media_type: str = "application/octet-stream",
+    ) -> None:
+        """
+        Register a kind of job.
+
+        Args:
+            kind: Name jobs are submitted with
+            handler: Does the work, writing its result to context.output_path
+            filename: File name the result is downloaded as
+            media_type: Content type of the result
+        """
+        self._kinds[kind] = JobKind(handler, filename, media_type)
+
+    def result_path(self, job_id: int) -> Path:
+        """Path of a job's result file."""
+        return self.results_dir / f"job-{job_id}"
+
+    def _enqueue(self, job_id: int) -> None:
+        with self._lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+            if self._executor is None:
+                self._stopping.clear()
+                self._executor = ThreadPoolExecutor(
+                    self.max_concurrent, thread_name_prefix="provisionr-job"
+                )
+            self._executor.submit(self._run, job_id)
+
+    def start(self) -> None:
+        """Run abandoned jobs again and start the maintenance thread."""
+        self._stopping.clear()
+        self.reclaim()
+        self.sweep()
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._maintain, name="provisionr-jobs", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Interrupt running jobs; they are queued again to run from the start."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._queued.clear()
+
+    def reclaim(self) -> List[int]:
+        """
+        Queue again the jobs no live runner is going to run.
+
+        These are running jobs whose heartbeat is stale, and queued jobs, which
+        any runner may claim.
+
+        Returns:
+            Ids of the jobs queued
+        """
+        now = datetime.now(UTC)
+        stale_since = now - timedelta(seconds=self.stale_after_seconds)
+        with self.session_factory() as db:
+            db.execute(
+                update(DBJob)
+                .where(
+                    DBJob.status == RUNNING,
+                    or_(DBJob.heartbeat_at.is_(None), DBJob.heartbeat_at < stale_since),
+                )
+                .values(status=QUEUED, progress=0, owner=None)
+            )
+            # Jobs cancelled while running that no runner finished cancelling
+            db.execute(
+                update(DBJob)
+                .where(DBJob.status == QUEUED, DBJob.cancel_requested.is_(True))
+                .values(status=CANCELLED, finished_at=now)
+            )
+            db.commit()
+            job_ids = [
+                job_id
+                for (job_id,) in db.query(DBJob.id)
+                .filter(DBJob.status == QUEUED)
+                .order_by(DBJob.id)
+            ]
+        for job_id in job_ids:
+            logger.info("Queuing unfinished job %d", job_id)
+            self._enqueue(job_id)
+        return job_ids
+
+    def sweep(self) -> int:
+        """
+        Delete expired jobs and files left in results_dir.
+
+        Returns:
+            Number of jobs deleted
+        """
+        cutoff = datetime.now(UTC) - timedelta(seconds=self.retention_seconds)
+        with self.session_factory() as db:
+            job_ids = [
+                job_id
+                for (job_id,) in db.query(DBJob.id).filter(
+                    DBJob.status.in_(FINISHED), DBJob.finished_at < cutoff
+                )
+            ]
+            if job_ids:
+                db.query(DBJob).filter(DBJob.id.in_(job_ids)).delete()
+                db.commit()
+        for job_id in job_ids:
+            self.result_path(job_id).unlink(missing_ok=True)
+        if job_ids:
+            metrics.inc(EXPIRED_METRIC, len(job_ids))
+
+        if self.results_dir.is_dir():
+            for path in self.results_dir.rglob("*"):
+                try:
+                    if path.is_file() and path.stat().st_mtime < cutoff.timestamp():
+                        path.unlink()
+                except FileNotFoundError:
+                    pass  # Removed meanwhile, e.g. by the job using it
+        return len(job_ids)
+
+    def _maintain(self) -> None:
+        """Renew heartbeats, reclaim abandoned jobs and sweep expired ones."""
+        next_sweep = time.monotonic() + SWEEP_INTERVAL_SECONDS
+        while not self._stopping.wait(self.heartbeat_seconds):
+            try:
+                self._heartbeat()
+                self.reclaim()
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + SWEEP_INTERVAL_SECONDS
+                    self.sweep()
+            except Exception:
+                logger.exception("Background job maintenance failed")
+
+    def _heartbeat(self) -> None:
+        """Record that the jobs this runner runs are still alive."""
+        with self._lock:
+            job_ids = list(self._active)
+        if not job_ids:
+            return
+        with self.session_factory() as db:
+            db.execute(
+                update(DBJob)
+                .where(DBJob.id.in_(job_ids), DBJob.owner == self.owner)
+                .values(heartbeat_at=datetime.now(UTC))
+            )
+            db.commit()
+            cancelled = {
+                job_id
+                for (job_id,) in db.query(DBJob.id).filter(
+                    DBJob.id.in_(job_ids), DBJob.cancel_requested.is_(True)
+                )
+            }
+        with self._lock:
+            self._cancelled |= cancelled & self._active
+
+    def submit(self, db: Session, kind: str, params: Dict[str, Any]) -> DBJob:
+        """
+        Queue a job.
+
+        Args:
+            db: Database session
+            kind: Registered kind of job
+            params: Parameters for the handler (JSON-serializable)
+
+        Returns:
+            The queued job
+
+        Raises:
+            JobError: If the kind isn't registered
+        """
+        if kind not in self._kinds:
+            raise JobError(f"Unknown job kind: {kind}")
+        job = DBJob(kind=kind, status=QUEUED, params=json.dumps(params))
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._enqueue(job.id)
+        return job
+
+    def cancel(self, db: Session, job_id: int) -> DBJob:
+        """
+        Cancel a queued or running job.
+
+        Args:
+            db: Database session
+            job_id: Job to cancel
+
+        Returns:
+            The job (a running job stops at its next progress report)
+
+        Raises:
+            JobError: If the job doesn't exist or has already finished
+        """
+        job = db.get(DBJob, job_id)
+        if job is None:
+            raise JobError(f"Job {job_id} not found")
+        if job.status in FINISHED:
+            raise JobError(f"Job {job_id} is already {job.status}")
+        # Cancel the job if it is still queued; otherwise a runner, maybe in
+        # another process, runs it and stops when it sees cancel_requested
+        cancelled = db.execute(
+            update(DBJob)
+            .where(DBJob.id == job_id, DBJob.status == QUEUED)
+            .values(status=CANCELLED, finished_at=datetime.now(UTC))
+        ).rowcount
+        if not cancelled:
+            db.execute(
+                update(DBJob)
+                .where(DBJob.id == job_id, DBJob.status == RUNNING)
+                .values(cancel_requested=True)
+            )
+        db.commit()
+        self._cancelled.add(job_id)
+        db.refresh(job)
+        return job
+
+    def delete(self, db: Session, job_id: int) -> None:
+        """
+        Delete a finished job and its result file.
+
+        Raises:
+            JobError: If the job doesn't exist or hasn't finished
+        """
+        job = db.get(DBJob, job_id)
+        if job is None:
+            raise JobError(f"Job {job_id} not found")
+        if job.status not in FINISHED:
+            raise JobError(f"Job {job_id} is still {job.status}")
+        db.delete(job)
+        db.commit()
+        self.result_path(job_id).unlink(missing_ok=True)
+
+    def result(self, db: Session, job_id: int) -> Tuple[Path, str, str]:
+        """
+        Get the result file of a completed job.
+
+        Returns:
+            (path, download file name, media type)
+
+        Raises:
+            JobError: If the job doesn't exist or has no result
+        """
+        job = db.get(DBJob, job_id)
+        if job is None:
+            raise JobError(f"Job {job_id} not found")
+        path = self.result_path(job_id)
+        if job.status != COMPLETED or not path.exists():
+            raise JobError(f"Job {job_id} has no result")
+        kind = self._kinds.get(job.kind)
+        if kind is None:
+            return path, path.name, "application/octet-stream"
+        return path, kind.filename, kind.media_type
+
+    def _claim(self, job_id: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Mark a queued job as running in this runner.
+
+        Returns:
+            The job's (kind, params), or None if it was cancelled or claimed
+            by another runner meanwhile
+        """
+        with self.session_factory() as db:
+            now = datetime.now(UTC)
+            claimed = db.execute(
+                update(DBJob)
+                .where(
+                    DBJob.id == job_id,
+                    DBJob.status == QUEUED,
+                    DBJob.cancel_requested.is_(False),
+                )
+                .values(
+                    status=RUNNING, owner=self.owner, started_at=now, heartbeat_at=now
+                )
+            ).rowcount
+            db.commit()
+            if not claimed:
+                return None
+            job = db.get(DBJob, job_id)
+            return job.kind, json.loads(job.params)
+
+    def _requeue(self, job_id: int) -> None:
+        with self.session_factory() as db:
+            db.execute(
+                update(DBJob)
+                .where(DBJob.id == job_id, DBJob.owner == self.owner)
+                .values(status=QUEUED, progress=0, owner=None)
+            )
+            db.commit()
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        with self.session_factory() as db:
+            job = db.get(DBJob, job_id)
+            kind = job.kind
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.now(UTC)
+            if status == COMPLETED and job.total is not None:
+                job.progress = job.total
+            db.commit()
+        metrics.inc(FINISHED_METRIC, kind=kind, status=status)
+
+    def _run(self, job_id: int) -> None:
+        """Run one job on a pool thread."""
+        with self._lock:
+            self._queued.discard(job_id)
+        if self._stopping.is_set():
+            return
+        claimed = self._claim(job_id)
+        if claimed is None:
+            self._cancelled.discard(job_id)
+            return
+
+        kind_name, params = claimed
+        kind = self._kinds.get(kind_name)
+        output_path = self.result_path(job_id)
+        partial_path = output_path.with_suffix(".part")
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        context = JobContext(self, job_id, params, partial_path)
+
+        with self._lock:
+            self._running += 1
+            self._active.add(job_id)
+        try:
+            if kind is None:
+                raise JobError(f"Unknown job kind: {kind_name}")
+            kind.handler(context)
+            context.check_cancelled()
+            partial_path.replace(output_path)
+            self._finish(job_id, COMPLETED)
+        except JobCancelled:
+            partial_path.unlink(missing_ok=True)
+            self._finish(job_id, CANCELLED)
+        except JobInterrupted:
+            # Run again from the start, here after start() or by another runner
+            partial_path.unlink(missing_ok=True)
+            self._requeue(job_id)
+        except Exception as e:
+            logger.exception("Job %d (%s) failed", job_id, kind_name)
+            partial_path.unlink(missing_ok=True)
+            self._finish(job_id, FAILED, str(e))
+        finally:
+            with self._lock:
+                self._cancelled.discard(job_id)
+                self._running -= 1
+                self._active.discard(job_id)
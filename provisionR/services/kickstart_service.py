@@ -1,13 +1,51 @@
 """Service for generating kickstart files."""
 
-from typing import Dict, Any, Optional
+import copy
+from typing import Dict, Any, Mapping, Optional
 from pathlib import Path
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, Template
 from sqlalchemy.orm import Session
 
 from provisionR.config import get_global_config_from_db
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.hash_cache import HashCache, hash_variables
 from provisionR.services.password_service import PasswordService
-from provisionR.utils import PasswordHasher
+from provisionR.settings import Settings, get_settings
+from provisionR.utils import (
+    GuardedEnvironment,
+    LazyValues,
+    MachineIdentity,
+    RenderLimits,
+)
+
+# Stand-in credentials used when previewing a template. They look like crypt
+# hashes so templates render realistically, but are obviously not real.
+PREVIEW_PASSWORDS = {
+    "root_password": "$6$preview$root-password-placeholder",
+    "user_password": "$6$preview$user-password-placeholder",
+    "luks_password": "$6$preview$luks-password-placeholder",
+}
+
+TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
+
+
+def create_template_env(settings: Settings) -> GuardedEnvironment:
+    """
+    Create the sandboxed Jinja2 environment kickstarts are rendered with.
+
+    Compiled templates are cached in the environment, so the app shares one
+    across requests; uploaded templates are reloaded when their file changes.
+
+    Args:
+        settings: Process settings providing the render budgets
+
+    Returns:
+        Environment loading templates from the templates directory
+    """
+    return GuardedEnvironment(
+        limits=RenderLimits.from_settings(settings),
+        loader=FileSystemLoader(str(TEMPLATES_DIR)),
+    )
 
 
 class KickstartService:
@@ -18,52 +56,76 @@ class KickstartService:
         db: Session,
         jinja_env: Optional[Environment] = None,
         password_service: Optional[PasswordService] = None,
+        config_layers: Optional[ConfigLayers] = None,
+        hash_cache: Optional[HashCache] = None,
     ):
         """
         Initialize the kickstart service.
 
         Args:
             db: Database session
-            jinja_env: Optional Jinja2 environment (for testing)
+            jinja_env: Jinja2 environment (defaults to a new one per service)
             password_service: Optional password service (for testing)
+            config_layers: Materialized group/machine config; without it only
+                the global config is read from the database
+            hash_cache: Shared cache of password hashes (defaults to one per
+                service)
         """
         self.db = db
+        self.config_layers = config_layers
         self.password_service = password_service or PasswordService(db)
-        self.password_hasher = PasswordHasher()
+        self.hash_cache = hash_cache or HashCache()
 
-        # Set up Jinja2 environment
+        # Set up a sandboxed Jinja2 environment with render budgets
         if jinja_env is None:
-            templates_dir = Path(__file__).parent.parent / "templates"
-            self.jinja_env = Environment(loader=FileSystemLoader(str(templates_dir)))
-        else:
-            self.jinja_env = jinja_env
+            jinja_env = create_template_env(get_settings())
+        self.jinja_env = jinja_env
 
-    def generate(
+    def _render(self, template: Template, context: Mapping[str, Any]) -> str:
+        """Render a template, enforcing render budgets when the env supports it."""
+        if isinstance(self.jinja_env, GuardedEnvironment):
+            return self.jinja_env.render_template(template, context)
+        return template.render(**context)
+
+    def _build_context(
         self,
         mac: str,
         uuid: str,
         serial: str,
-        template_name: str,
         query_params: Dict[str, Any],
-    ) -> str:
+        preview: bool,
+        extra_values: Optional[Dict[str, Any]] = None,
+    ) -> Mapping[str, Any]:
         """
-        Generate a kickstart file from a template.
+        Build the template context for a machine.
 
         Args:
             mac: MAC address of the machine
             uuid: UUID of the machine
             serial: Serial number of the machine
-            template_name: Name of the template to use (without .ks.j2 extension)
             query_params: Additional query parameters to pass to template
+            preview: Use placeholder credentials instead of real ones
+            extra_values: Values from a matching template rule, which take
+                precedence over global but not group or machine values
 
         Returns:
-            Rendered kickstart file content
-
-        Raises:
-            TemplateNotFound: If the specified template doesn't exist
+            Template context; password hashes are only computed if rendering
+            looks them up
         """
-        # Get config from database
-        config = get_global_config_from_db(self.db)
+        identity = MachineIdentity.from_raw(mac, uuid, serial)
+        # Get the machine's effective config (global -> group -> machine)
+        if self.config_layers is not None:
+            effective = self.config_layers.effective(self.db, identity)
+            config = effective.config
+            values = effective.values
+            if effective.nested:
+                # Shared between requests, so templates must not mutate it
+                values = copy.deepcopy(values)
+            override_keys = effective.override_keys
+        else:
+            config = get_global_config_from_db(self.db)
+            values = config.values
+            override_keys = frozenset()
 
         # Build template context from query parameters
         context = dict(query_params)
@@ -85,27 +147,72 @@ class KickstartService:
         )
 
         # Add custom values from config to context
-        context.update(config.values)
-
-        # Generate passwords if enabled
-        if config.generate_passwords:
-            root_pw, user_pw, luks_pw = self.password_service.get_or_create_passwords(
-                mac, uuid, serial
+        context.update(values)
+        if extra_values:
+            # Rule values override global values but not group/machine ones
+            context.update(
+                {k: v for k, v in extra_values.items() if k not in override_keys}
             )
 
-            # Hash passwords for use in kickstart (--iscrypted)
+        if not config.generate_passwords:
+            return context
+
+        if preview:
+            # Previews never touch stored credentials and skip the hashing
             context.update(
                 {
-                    "root_password": self.password_hasher.hash_sha512(root_pw),
-                    "user_password": self.password_hasher.hash_sha512(user_pw),
-                    "luks_password": self.password_hasher.hash_sha512(luks_pw),
+                    name: f"$preview${name.replace('_', '-')}-placeholder"
+                    for name in hash_variables()
                 }
             )
+            context.update(PREVIEW_PASSWORDS)
+            return context
+
+        credentials = self.password_service.get_or_create_passwords(mac, uuid, serial)
+
+        # Hash passwords for use in kickstart (--iscrypted), in the formats
+        # the template uses
+        return LazyValues(
+            context, self.hash_cache.template_values(identity.key, credentials)
+        )
+
+    def generate(
+        self,
+        mac: str,
+        uuid: str,
+        serial: str,
+        template_name: str,
+        query_params: Dict[str, Any],
+        preview: bool = False,
+        extra_values: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        Generate a kickstart file from a template.
+
+        Args:
+            mac: MAC address of the machine
+            uuid: UUID of the machine
+            serial: Serial number of the machine
+            template_name: Name of the template to use (without .ks.j2 extension)
+            query_params: Additional query parameters to pass to template
+            preview: Render with placeholder credentials, without DB writes
+            extra_values: Values from a matching template rule
+
+        Returns:
+            Rendered kickstart file content
+
+        Raises:
+            TemplateNotFound: If the specified template doesn't exist
+            TemplateRenderLimitExceeded: If rendering exceeds a render budget
+        """
+        context = self._build_context(
+            mac, uuid, serial, query_params, preview, extra_values
+        )
 
         # Load and render the template
         template_file = f"{template_name}.ks.j2"
         template = self.jinja_env.get_template(template_file)
-        rendered = template.render(**context)
+        rendered = self._render(template, context)
 
         return rendered
 
@@ -116,9 +223,13 @@ class KickstartService:
         serial: str,
         template_string: str,
         query_params: Dict[str, Any],
+        preview: bool = False,
+        extra_values: Optional[Dict[str, Any]] = None,
     ) -> str:
         """
-        Generate a kickstart file from a template string (useful for testing).
+        Generate a kickstart file from a template string.
+
+        Used for testing and for previewing unsaved templates from the GUI.
 
         Args:
             mac: MAC address of the machine
@@ -126,52 +237,21 @@ class KickstartService:
             serial: Serial number of the machine
             template_string: Template content as a string
             query_params: Additional query parameters to pass to template
+            preview: Render with placeholder credentials, without DB writes
+            extra_values: Values from a matching template rule
 
         Returns:
             Rendered kickstart file content
-        """
-        # Get config from database
-        config = get_global_config_from_db(self.db)
-
-        # Build template context from query parameters
-        context = dict(query_params)
-
-        # Ensure required fields are present
-        context.update(
-            {
-                "mac": mac,
-                "uuid": uuid,
-                "serial": serial,
-            }
-        )
 
-        # Add config values to context
-        context.update(
-            {
-                "target_os": config.target_os.value,
-            }
+        Raises:
+            TemplateRenderLimitExceeded: If rendering exceeds a render budget
+        """
+        context = self._build_context(
+            mac, uuid, serial, query_params, preview, extra_values
         )
 
-        # Add custom values from config to context
-        context.update(config.values)
-
-        # Generate passwords if enabled
-        if config.generate_passwords:
-            root_pw, user_pw, luks_pw = self.password_service.get_or_create_passwords(
-                mac, uuid, serial
-            )
-
-            # Hash passwords for use in kickstart (--iscrypted)
-            context.update(
-                {
-                    "root_password": self.password_hasher.hash_sha512(root_pw),
-                    "user_password": self.password_hasher.hash_sha512(user_pw),
-                    "luks_password": self.password_hasher.hash_sha512(luks_pw),
-                }
-            )
-
         # Render the template string
         template = self.jinja_env.from_string(template_string)
-        rendered = template.render(**context)
+        rendered = self._render(template, context)
 
         return rendered
@@ -0,0 +1,372 @@
+"""Fleet-wide uniqueness of generated passphrases."""
+
+import logging
+import threading
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, insert, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from provisionR.metrics import metrics
+from provisionR.models import (
+    DBArchivedMachine,
+    DBMachinePasswords,
+    DBPassphrase,
+    DBPasswordHistory,
+)
+from provisionR.utils import PasswordGenerator
+from provisionR.utils.bloom_filter import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+ENTRIES_METRIC = "provisionr_passphrase_index_entries"
+BYTES_METRIC = "provisionr_passphrase_index_bytes"
+REDRAWS_METRIC = "provisionr_passphrase_redraws_total"
+
+Passwords = Tuple[str, str, str]
+
+# One cheap statement on every check; rows are read only when ids moved on
+_LATEST_IDS = text(
+    "SELECT (SELECT max(id) FROM machine_passwords),"
+    " (SELECT max(id) FROM machine_password_history),"
+    " (SELECT max(id) FROM passphrases)"
+)
+
+
+class PassphraseIndex:
+    """
+    Remembers every stored passphrase so newly generated ones are unique.
+
+    Root, user and LUKS passphrases of every machine are kept in Bloom
+    filters, about 1.2 bytes each at a 1% error rate, so millions of machines
+    fit in a few megabytes and a check costs the same however many there
+    are. A filter never misses a passphrase it was given; a candidate it
+    reports as (possibly) taken is simply redrawn, which wastes a sliver of
+    the passphrase space instead of querying the unindexed password columns.
+    When the filters fill up another, twice as large, is added.
+
+    The filters only make collisions rare; the passphrases table decides.
+    Claimed passphrases are inserted there in the transaction storing them,
+    and its unique constraint rejects any another process claimed first,
+    which are then redrawn. Imported passphrases are registered there too.
+
+    Before each check the index reads from the database what other processes
+    stored since the last one: new machines by id, rotated machines from
+    machine_password_history, and new rows of passphrases. Passphrases are
+    never removed, so replaced or deleted ones are not reused either.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        capacity: int = 1_000_000,
+        error_rate: float = 0.01,
+        generate: Callable[[], str] = PasswordGenerator.generate_passphrase,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            session_factory: Creates the session start() loads the index with
+            capacity: Passphrases the first filter is sized for (at least)
+            error_rate: Share of candidates redrawn needlessly
+            generate: Draws a random passphrase
+        """
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generate = generate
+        # Reentrant so the first check can load the index while holding it
+        self._lock = threading.RLock()
+        self._filters: Optional[List[BloomFilter]] = None
+        self._machine_id = 0
+        self._history_id = 0
+        self._passphrase_id = 0
+        self._thread: Optional[threading.Thread] = None
+        metrics.register_gauge(ENTRIES_METRIC, lambda: len(self))
+        metrics.register_gauge(
+            BYTES_METRIC, lambda: sum(f.nbytes for f in self._filters or ())
+        )
+
+    def start(self) -> None:
+        """Load the index in a background thread (checks wait for it)."""
+        if self._thread is not None or self.session_factory is None:
+            return
+        self._thread = threading.Thread(
+            target=self._load_in_background,
+            name="provisionr-passphrase-index",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _load_in_background(self) -> None:
+        try:
+            with self._lock, self.session_factory() as db:
+                if self._filters is None:
+                    self.load(db)
+        except Exception:
+            # The first check retries the load
+            logger.exception("Loading the passphrase index failed")
+
+    def load(self, db: Session) -> int:
+        """
+        Load every stored passphrase, archived machines' included, into the index.
+
+        Returns:
+            Number of passphrases loaded
+        """
+        with self._lock:
+            # Rows stored from here on are picked up by the next sync
+            machine_id = db.scalar(func.max(DBMachinePasswords.id)) or 0
+            history_id = db.scalar(func.max(DBPasswordHistory.id)) or 0
+            passphrase_id = db.scalar(func.max(DBPassphrase.id)) or 0
+            machines = (
+                db.query(DBMachinePasswords).count()
+                + db.query(DBArchivedMachine).count()
+            )
+            # Room for the fleet to double before a second filter is needed
+            self._filters = [
+                BloomFilter(max(self.capacity, 6 * machines), self.error_rate)
+            ]
+            loaded = self._add_rows(
+                db.query(
+                    DBMachinePasswords.root_password,
+                    DBMachinePasswords.user_password,
+                    DBMachinePasswords.luks_password,
+                )
+                .filter(DBMachinePasswords.id <= machine_id)
+                .yield_per(10_000)
+            )
+            # Read second, so a machine archived meanwhile is read twice at worst
+            loaded += self._add_rows(
+                db.query(
+                    DBArchivedMachine.root_password,
+                    DBArchivedMachine.user_password,
+                    DBArchivedMachine.luks_password,
+                ).yield_per(10_000)
+            )
+            # Mostly the same passphrases again, but also those imported over
+            # a machine's earlier ones
+            loaded += self._add_rows(
+                db.query(DBPassphrase.passphrase)
+                .filter(DBPassphrase.id <= passphrase_id)
+                .yield_per(10_000)
+            )
+            self._machine_id = machine_id
+            self._history_id = history_id
+            self._passphrase_id = passphrase_id
+            return loaded
+
+    def _add_rows(self, rows: Iterable[Passwords]) -> int:
+        """Add the passphrases of machine rows."""
+        count = 0
+        for row in rows:
+            for passphrase in row:
+                if passphrase:
+                    self._add(passphrase)
+                    count += 1
+        return count
+
+    def _last(self) -> BloomFilter:
+        """The filter new passphrases go in, adding a larger one when full."""
+        last = self._filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * 2, self.error_rate)
+            self._filters.append(last)
+        return last
+
+    def _add(self, passphrase: str) -> None:
+        last = self._last()
+        # Synced passphrases include this process's own claims
+        if not any(passphrase in f for f in self._filters[:-1]):
+            last.add(passphrase)
+
+    def _sync(self, db: Session) -> None:
+        """Add passphrases stored by other processes since the last check."""
+        machine_id, history_id, passphrase_id = db.execute(_LATEST_IDS).one()
+        if (machine_id or 0) > self._machine_id:
+            self._sync_machines(db)
+        if (history_id or 0) > self._history_id:
+            self._sync_history(db)
+        if (passphrase_id or 0) > self._passphrase_id:
+            self._sync_passphrases(db)
+
+    def _sync_machines(self, db: Session) -> None:
+        """Add the passphrases of machines created since the last check."""
+        new = (
+            db.query(
+                DBMachinePasswords.id,
+                DBMachinePasswords.root_password,
+                DBMachinePasswords.user_password,
+                DBMachinePasswords.luks_password,
+            )
+            .filter(DBMachinePasswords.id > self._machine_id)
+            .order_by(DBMachinePasswords.id)
+            .all()
+        )
+        if new:
+            self._add_rows(row[1:] for row in new)
+            self._machine_id = new[-1].id
+
+    def _sync_history(self, db: Session) -> None:
+        """Add the passphrases of machines rotated since the last check."""
+        rotated: Set[int] = set()
+        history = db.query(DBPasswordHistory.id, DBPasswordHistory.machine_id).filter(
+            DBPasswordHistory.id > self._history_id
+        )
+        for history_id, machine_id in history:
+            rotated.add(machine_id)
+            self._history_id = max(self._history_id, history_id)
+        machine_list = list(rotated)
+        for start in range(0, len(machine_list), 500):
+            self._add_rows(
+                db.query(
+                    DBMachinePasswords.root_password,
+                    DBMachinePasswords.user_password,
+                    DBMachinePasswords.luks_password,
+                ).filter(DBMachinePasswords.id.in_(machine_list[start : start + 500]))
+            )
+
+    def _sync_passphrases(self, db: Session) -> None:
+        """Add the passphrases claimed or imported since the last check."""
+        new = (
+            db.query(DBPassphrase.id, DBPassphrase.passphrase)
+            .filter(DBPassphrase.id > self._passphrase_id)
+            .order_by(DBPassphrase.id)
+            .all()
+        )
+        if new:
+            self._add_rows(row[1:] for row in new)
+            self._passphrase_id = new[-1].id
+
+    def _ready(self, db: Session) -> None:
+        """Load on first use, otherwise catch up with the database."""
+        if self._filters is None:
+            self.load(db)
+        else:
+            self._sync(db)
+
+    def _claim(self, passphrase: str) -> bool:
+        """Add a passphrase unless it may be taken."""
+        last = self._last()
+        taken = any(passphrase in f for f in self._filters[:-1])
+        # Adding to the last filter doubles as its membership test
+        if taken or not last.add(passphrase):
+            metrics.inc(REDRAWS_METRIC)
+            return False
+        return True
+
+    def _draw(self) -> str:
+        """Draw a passphrase that isn't taken and claim it."""
+        while True:
+            passphrase = self.generate()
+            if self._claim(passphrase):
+                return passphrase
+
+    def register(self, db: Session, passphrases: List[str]) -> List[str]:
+        """
+        Insert claimed passphrases into the passphrases table.
+
+        The insert joins the caller's transaction, to be committed with the
+        machines that use them, and must be its first write: if another
+        process registered one of them since the filters were last synced,
+        the transaction is rolled back and the taken ones are redrawn until
+        the insert succeeds.
+
+        Args:
+            db: Database session whose transaction stores the passphrases
+            passphrases: Passphrases claimed from this index
+
+        Returns:
+            The registered passphrases in the same order
+        """
+        while True:
+            try:
+                db.execute(
+                    insert(DBPassphrase), [{"passphrase": p} for p in passphrases]
+                )
+                return passphrases
+            except IntegrityError:
+                db.rollback()
+            taken: Set[str] = set()
+            for start in range(0, len(passphrases), 500):
+                taken.update(
+                    passphrase
+                    for (passphrase,) in db.query(DBPassphrase.passphrase).filter(
+                        DBPassphrase.passphrase.in_(passphrases[start : start + 500])
+                    )
+                )
+            metrics.inc(REDRAWS_METRIC, len(taken))
+            with self._lock:
+                passphrases = [self._draw() if p in taken else p for p in passphrases]
+
+    def new_credentials(self, db: Session) -> Passwords:
+        """
+        Generate (root, user, luks) passphrases used by no stored machine.
+
+        They are only claimed in this process; register() them in the
+        transaction that stores the machine (GroupCommitWriter does).
+
+        Args:
+            db: Database session to catch up from
+
+        Returns:
+            Three claimed passphrases, distinct from each other
+        """
+        with self._lock:
+            self._ready(db)
+            return self._draw(), self._draw(), self._draw()
+
+    def claim(self, db: Session, passphrases: Iterable[str]) -> List[str]:
+        """
+        Claim passphrases generated elsewhere (e.g. by worker processes).
+
+        Passphrases that may already be taken, including by an earlier one of
+        `passphrases`, are replaced with fresh ones, and the claim is
+        registered and committed.
+
+        Args:
+            db: Database session to catch up from; the claim is committed in
+                it, so it must not have changes pending
+            passphrases: Candidate passphrases
+
+        Returns:
+            Claimed passphrases in the same order
+        """
+        with self._lock:
+            self._ready(db)
+            claimed = [p if self._claim(p) else self._draw() for p in passphrases]
+        if not claimed:
+            return claimed
+        claimed = self.register(db, claimed)
+        db.commit()
+        return claimed
+
+    def claim_credentials(
+        self, db: Session, credentials: List[Passwords]
+    ) -> List[Passwords]:
+        """Claim (root, user, luks) passphrases per machine; see claim()."""
+        flat = [p for passwords in credentials for p in passwords]
+        claimed = iter(self.claim(db, flat))
+        return [(next(claimed), next(claimed), next(claimed)) for _ in credentials]
+
+    def add(self, db: Session, passphrases: Iterable[str]) -> None:
+        """
+        Register passphrases that are stored as given (e.g. imported ones).
+
+        They may repeat stored ones, so they are inserted unless present, in
+        the caller's transaction; commit it with the machines that use them.
+        """
+        rows = [{"passphrase": p} for p in dict.fromkeys(passphrases) if p]
+        if not rows:
+            return
+        db.execute(sqlite_insert(DBPassphrase).on_conflict_do_nothing(), rows)
+        with self._lock:
+            if self._filters is not None:
+                self._add_rows([row["passphrase"]] for row in rows)
+
+    def __len__(self) -> int:
+        """Number of passphrases in the index."""
+        return sum(len(f) for f in self._filters or ())
@@ -1,17 +1,46 @@
 """Service for managing machine passwords."""
 
-from typing import Tuple
+from typing import Optional, Tuple
 from sqlalchemy.orm import Session
-from provisionR.models import DBMachinePasswords
-from provisionR.utils import PasswordGenerator
+from provisionR.services.archive_service import ArchiveService
+from provisionR.services.credential_store import CredentialStore, SqlCredentialStore
+from provisionR.services.credential_writer import GroupCommitWriter
+from provisionR.services.event_bus import MACHINE_CREATED, EventBus
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.primary_client import PrimaryClient
+from provisionR.utils import MachineIdentity, PasswordGenerator
 
 
 class PasswordService:
     """Service for generating and retrieving machine passwords."""
 
-    def __init__(self, db: Session):
-        """Initialize the password service with a database session."""
+    def __init__(
+        self,
+        db: Session,
+        writer: Optional[GroupCommitWriter] = None,
+        events: Optional[EventBus] = None,
+        store: Optional[CredentialStore] = None,
+        passphrases: Optional[PassphraseIndex] = None,
+        primary: Optional[PrimaryClient] = None,
+    ):
+        """
+        Initialize the password service.
+
+        Args:
+            db: Database session
+            writer: Optional group-commit writer used to store new machines
+                (built with `passphrases`, which it registers new ones with)
+            events: Optional event bus notified when a machine is created
+            store: Where credentials are kept (defaults to plain SQL)
+            passphrases: Index keeping new passphrases unique across machines
+            primary: Primary creating new machines, when this is a replica
+        """
         self.db = db
+        self.writer = writer
+        self.events = events
+        self.store = store or SqlCredentialStore()
+        self.passphrases = passphrases
+        self.primary = primary
         self.password_gen = PasswordGenerator()
 
     def get_or_create_passwords(
@@ -20,6 +49,10 @@ class PasswordService:
         """
         Get existing passwords for a machine or generate new ones.
 
+        Identifiers are normalized first, so formatting differences such as
+        MAC case or separators resolve to the same machine. An archived
+        machine is restored with its old passwords.
+
         Args:
             mac: MAC address of the machine
             uuid: UUID of the machine
@@ -28,40 +61,54 @@ class PasswordService:
         Returns:
             Tuple of (root_password, user_password, luks_password)
         """
-        # Check if we've seen this machine before
-        existing_machine = (
-            self.db.query(DBMachinePasswords)
-            .filter(
-                DBMachinePasswords.mac == mac,
-                DBMachinePasswords.uuid == uuid,
-                DBMachinePasswords.serial == serial,
-            )
-            .first()
-        )
+        identity = MachineIdentity.from_raw(mac, uuid, serial)
 
-        if existing_machine:
+        existing = self.store.lookup(self.db, identity)
+        if existing is not None:
             # Reuse existing passwords
-            return (
-                existing_machine.root_password,
-                existing_machine.user_password,
-                existing_machine.luks_password,
-            )
+            return existing
+
+        if self.primary is not None:
+            # A replica's database is replaced by the next snapshot, so the
+            # primary creates the machine; the local copy serves until then
+            credentials = self.primary.credentials(identity)
+            return self.store.insert(self.db, identity, credentials)
+
+        restored = ArchiveService(self.db, store=self.store).restore(identity)
+        if restored is not None:
+            return restored
+
+        # Generate new passwords, unique across the fleet when indexed
+        if self.passphrases is not None:
+            credentials = self.passphrases.new_credentials(self.db)
         else:
-            # Generate new passwords
-            root_pw = self.password_gen.generate_passphrase()
-            user_pw = self.password_gen.generate_passphrase()
-            luks_pw = self.password_gen.generate_passphrase()
-
-            # Store passwords in database
-            new_machine = DBMachinePasswords(
-                mac=mac,
-                uuid=uuid,
-                serial=serial,
-                root_password=root_pw,
-                user_password=user_pw,
-                luks_password=luks_pw,
+            credentials = (
+                self.password_gen.generate_passphrase(),
+                self.password_gen.generate_passphrase(),
+                self.password_gen.generate_passphrase(),
             )
-            self.db.add(new_machine)
-            self.db.commit()
 
-            return root_pw, user_pw, luks_pw
+        # Store passwords in database, batched with concurrent inserts
+        if self.writer is not None:
+            stored, created = self.writer.submit(identity, credentials)
+            self.store.stored(identity, stored)
+        else:
+            if self.passphrases is not None:
+                # Registered in the transaction that inserts the machine
+                root, user, luks = self.passphrases.register(self.db, list(credentials))
+                credentials = (root, user, luks)
+            stored = self.store.insert(self.db, identity, credentials)
+            # Another request may have created the machine first
+            created = stored == credentials
+
+        if created:
+            self._created(identity)
+        return stored
+
+    def _created(self, identity: MachineIdentity) -> None:
+        """Announce a newly stored machine."""
+        if self.events is not None:
+            self.events.publish(
+                MACHINE_CREATED,
+                {"mac": identity.mac, "uuid": identity.uuid, "serial": identity.serial},
+            )
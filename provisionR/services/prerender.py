@@ -0,0 +1,367 @@
+"""Ahead-of-time rendering of kickstarts for known machines."""
+
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from jinja2 import Environment
+from sqlalchemy.orm import Session
+
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords
+from provisionR.services.config_layers import ConfigLayers, stored_revision
+from provisionR.services.credential_store import CredentialStore, SqlCredentialStore
+from provisionR.services.event_bus import (
+    CONFIG_CHANGED,
+    RULES_CHANGED,
+    TEMPLATE_UPLOADED,
+    Event,
+)
+from provisionR.services.hash_cache import HashCache
+from provisionR.services.kickstart_service import KickstartService
+from provisionR.services.rule_service import RuleEngine
+from provisionR.utils import MachineIdentity
+
+logger = logging.getLogger(__name__)
+
+HITS_METRIC = "provisionr_prerender_hits_total"
+MISSES_METRIC = "provisionr_prerender_misses_total"
+RENDERED_METRIC = "provisionr_prerender_rendered_total"
+ENTRIES_METRIC = "provisionr_prerender_entries"
+HIT_RATIO_METRIC = "provisionr_prerender_hit_ratio"
+
+# Events after which every cached kickstart may render differently
+INVALIDATING_EVENTS = frozenset({CONFIG_CHANGED, TEMPLATE_UPLOADED, RULES_CHANGED})
+
+# (mac, uuid, serial) exactly as a machine sends them
+RequestForm = Tuple[str, str, str]
+
+
+def credentials_fingerprint(root: str, user: str, luks: str) -> str:
+    """Digest of a machine's stored passwords, to detect rotations."""
+    return hashlib.sha256(f"{root}\0{user}\0{luks}".encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class _Entry:
+    template_name: str
+    form: RequestForm
+    fingerprint: str
+    # stored_revision() of the config layers it was rendered with
+    config_revision: Optional[Tuple[int, int]]
+    rendered: str
+
+
+class KickstartWarmer:
+    """
+    Keeps rendered kickstarts of known machines ready for their next boot.
+
+    A background thread renders the kickstart every known machine would get
+    for a plain request (mac, uuid and serial only, template picked by the
+    rules) into memory, at most renders_per_second at a time. It renders
+    everything again after startup and whenever the config, a template or
+    the rules change, and renders a machine on its own after a request for
+    it missed the cache.
+
+    A hit is served only if the cached render matches the request exactly:
+    same template, the identifiers spelled the same way (they appear
+    verbatim in the kickstart), the config layers and the machine's stored
+    passwords unchanged since it was rendered. The config is checked against
+    the database and the passwords against the credential store, so changes
+    made by another process are not served once stored (for passwords, once
+    the store sees the rotation; immediately for the SQL store).
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        rule_engine: Optional[RuleEngine] = None,
+        config_layers: Optional[ConfigLayers] = None,
+        store: Optional[CredentialStore] = None,
+        jinja_env: Optional[Environment] = None,
+        renders_per_second: float = 50.0,
+        max_entries: int = 100_000,
+        hash_cache: Optional[HashCache] = None,
+    ):
+        """
+        Initialize the warmer.
+
+        Args:
+            session_factory: Creates the sessions used while rendering
+            rule_engine: Picks each machine's template and rule values
+            config_layers: Materialized group/machine config
+            store: Where machine credentials are looked up
+            jinja_env: Environment templates are rendered with
+            renders_per_second: Maximum background render rate
+            max_entries: Maximum number of cached kickstarts
+            hash_cache: Password hashes shared with live renders
+        """
+        self.session_factory = session_factory
+        self.rule_engine = rule_engine
+        self.config_layers = config_layers
+        self.store = store or SqlCredentialStore()
+        self.jinja_env = jinja_env
+        self.renders_per_second = renders_per_second
+        self.max_entries = max_entries
+        self.hash_cache = hash_cache or HashCache()
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        # How each machine spells its identifiers, kept across invalidations
+        self._forms: Dict[str, RequestForm] = {}
+        self._pending: Set[str] = set()
+        self._generation = 0
+        self._full_pass = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_render = 0.0
+        metrics.register_gauge(ENTRIES_METRIC, lambda: len(self._entries))
+        metrics.register_gauge(HIT_RATIO_METRIC, self.hit_ratio)
+
+    @staticmethod
+    def hit_ratio() -> float:
+        """Share of cacheable requests served from the cache so far."""
+        hits = metrics.get(HITS_METRIC)
+        total = hits + metrics.get(MISSES_METRIC)
+        return hits / total if total else 0.0
+
+    def start(self) -> None:
+        """Start the background thread and warm every known machine."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="provisionr-prerender", daemon=True
+        )
+        self._thread.start()
+        self.invalidate()
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def on_event(self, event: Event) -> None:
+        """Event bus listener: re-render everything after relevant changes."""
+        if event.type in INVALIDATING_EVENTS:
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """Drop every cached kickstart and schedule a full re-render."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._pending.clear()
+            self._full_pass = True
+        self._wake.set()
+
+    def lookup(
+        self,
+        db: Session,
+        identity: MachineIdentity,
+        template_name: str,
+        form: RequestForm,
+    ) -> Optional[str]:
+        """
+        Get the cached kickstart for a plain request, if it is still valid.
+
+        On a miss, the machine is queued to be rendered in the background.
+
+        Args:
+            db: Database session
+            identity: Normalized machine identity
+            template_name: Template the request resolved to
+            form: (mac, uuid, serial) as given in the request
+
+        Returns:
+            The rendered kickstart, or None if it has to be rendered now
+        """
+        entry = self._entries.get(identity.key)
+        if entry is not None and entry.config_revision != stored_revision(db):
+            # The config was changed by another process: every render is stale
+            self.invalidate()
+            entry = None
+        if (
+            entry is not None
+            and entry.template_name == template_name
+            and entry.form == form
+        ):
+            credentials = self.store.lookup(db, identity)
+            if (
+                credentials is not None
+                and credentials_fingerprint(*credentials) == entry.fingerprint
+            ):
+                metrics.inc(HITS_METRIC)
+                return entry.rendered
+
+        metrics.inc(MISSES_METRIC)
+        self._schedule(identity, form)
+        return None
+
+    def prefetch(self, identity: MachineIdentity, form: RequestForm) -> None:
+        """
+        Make sure a machine's kickstart is rendered before it asks for it.
+
+        Used when a machine is about to fetch its kickstart (e.g. it just got
+        its boot script); does nothing if a render for this form is cached.
+        Machines that have no credentials yet are skipped by the background
+        thread, so this never creates any.
+
+        Args:
+            identity: Normalized machine identity
+            form: (mac, uuid, serial) as the machine will send them
+        """
+        entry = self._entries.get(identity.key)
+        if entry is None or entry.form != form:
+            self._schedule(identity, form)
+
+    def _schedule(self, identity: MachineIdentity, form: RequestForm) -> None:
+        """Queue a machine to be rendered in the background."""
+        with self._lock:
+            if identity.key in self._forms or len(self._forms) < self.max_entries:
+                self._forms[identity.key] = form
+            if self._thread is not None and len(self._pending) < self.max_entries:
+                self._pending.add(identity.key)
+        self._wake.set()
+
+    def _run(self) -> None:
+        """Render whatever is scheduled until stopped."""
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                with self._lock:
+                    full_pass, self._full_pass = self._full_pass, False
+                if full_pass:
+                    self.warm()
+                self._render_pending()
+            except Exception:
+                logger.exception("Pre-rendering kickstarts failed")
+
+    def _throttle(self) -> bool:
+        """Wait for the next render slot; False if stopping."""
+        delay = self._next_render - time.monotonic()
+        if delay > 0 and self._stop.wait(delay):
+            return False
+        self._next_render = max(self._next_render, time.monotonic()) + (
+            1 / self.renders_per_second
+        )
+        return not self._stop.is_set()
+
+    def warm(self, batch_size: int = 100) -> int:
+        """
+        Render every known machine, until done or invalidated again.
+
+        Returns:
+            Number of kickstarts rendered
+        """
+        generation = self._generation
+        rendered = 0
+        last_id = 0
+        while generation == self._generation and len(self._entries) < self.max_entries:
+            with self.session_factory() as db:
+                machines = (
+                    db.query(DBMachinePasswords)
+                    .filter(DBMachinePasswords.id > last_id)
+                    .order_by(DBMachinePasswords.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not machines:
+                    break
+                last_id = machines[-1].id
+                for machine in machines:
+                    if generation != self._generation or not self._throttle():
+                        return rendered
+                    rendered += self._render(db, machine, generation)
+        return rendered
+
+    def _render_pending(self) -> None:
+        """Render the machines whose requests missed the cache."""
+        with self._lock:
+            keys, self._pending = list(self._pending), set()
+            generation = self._generation
+        for start in range(0, len(keys), 100):
+            batch = keys[start : start + 100]
+            with self.session_factory() as db:
+                machines: List[DBMachinePasswords] = (
+                    db.query(DBMachinePasswords)
+                    .filter(DBMachinePasswords.identity_key.in_(batch))
+                    .all()
+                )
+                for machine in machines:
+                    if generation != self._generation or not self._throttle():
+                        return
+                    self._render(db, machine, generation)
+
+    def _render(self, db: Session, machine: DBMachinePasswords, generation: int) -> int:
+        """Render one machine's kickstart into the cache; 1 if it was cached."""
+        identity = MachineIdentity(
+            mac=machine.mac,
+            uuid=machine.uuid,
+            serial=machine.serial,
+            key=machine.identity_key,
+        )
+        form = self._forms.get(
+            identity.key, (machine.mac, machine.uuid, machine.serial)
+        )
+        mac, uuid, serial = form
+        query_params = {"mac": mac, "uuid": uuid, "serial": serial}
+        # Read before rendering: a change made meanwhile leaves this behind
+        config_revision = stored_revision(db)
+
+        template_name = "default"
+        rule_values = None
+        if self.rule_engine is not None:
+            match = self.rule_engine.resolve(db, identity, query_params)
+            if match is not None:
+                rule_values = match.values
+                template_name = match.template_name or template_name
+
+        try:
+            rendered = KickstartService(
+                db,
+                jinja_env=self.jinja_env,
+                config_layers=self.config_layers,
+                hash_cache=self.hash_cache,
+            ).generate(
+                mac=mac,
+                uuid=uuid,
+                serial=serial,
+                template_name=template_name,
+                query_params=query_params,
+                extra_values=rule_values,
+            )
+        except Exception as e:
+            # Requests for this machine will render it themselves
+            logger.debug("Could not pre-render %s: %s", identity.mac, e)
+            return 0
+        if config_revision is None:
+            # Rendering stored the default config
+            config_revision = stored_revision(db)
+
+        entry = _Entry(
+            template_name=template_name,
+            form=form,
+            fingerprint=credentials_fingerprint(
+                machine.root_password, machine.user_password, machine.luks_password
+            ),
+            config_revision=config_revision,
+            rendered=rendered,
+        )
+        with self._lock:
+            if generation != self._generation or (
+                identity.key not in self._entries
+                and len(self._entries) >= self.max_entries
+            ):
+                return 0
+            self._entries[identity.key] = entry
+        metrics.inc(RENDERED_METRIC)
+        return 1
@@ -0,0 +1,95 @@
+"""Client a replica uses to reach its primary."""
+
+import hashlib
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Tuple
+
+from provisionR.metrics import metrics
+from provisionR.services.backup_service import CHUNK_SIZE
+from provisionR.utils import MachineIdentity
+
+FORWARDED_METRIC = "provisionr_replica_forwarded_total"
+
+# Sent by the primary with /v1/backup: when the snapshot was started
+SNAPSHOT_TIME_HEADER = "X-Provisionr-Snapshot-Time"
+
+Credentials = Tuple[str, str, str]
+
+
+class PrimaryUnavailable(Exception):
+    """Raised when a replica can't reach its primary."""
+
+
+class PrimaryClient:
+    """HTTP client for the API of a replica's primary."""
+
+    def __init__(self, base_url: str, timeout_seconds: float = 10.0):
+        """
+        Initialize the client.
+
+        Args:
+            base_url: Where the primary is served, e.g. http://primary:8000
+            timeout_seconds: Timeout of each request
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout_seconds = timeout_seconds
+
+    def _open(self, path: str, method: str = "GET"):
+        data = b"" if method == "POST" else None
+        request = urllib.request.Request(
+            f"{self.base_url}{path}", data=data, method=method
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout_seconds)
+        except (urllib.error.URLError, OSError) as e:
+            raise PrimaryUnavailable(f"Primary {self.base_url} failed: {e}") from e
+
+    def credentials(self, identity: MachineIdentity) -> Credentials:
+        """
+        Get a machine's passwords, letting the primary create the machine.
+
+        Args:
+            identity: Normalized machine identity
+
+        Returns:
+            The (root, user, luks) passwords stored on the primary
+
+        Raises:
+            PrimaryUnavailable: If the primary can't be reached
+        """
+        query = urllib.parse.urlencode(
+            {"mac": identity.mac, "uuid": identity.uuid, "serial": identity.serial}
+        )
+        with self._open(f"/api/v1/machines/credentials?{query}", "POST") as response:
+            data = json.load(response)
+        metrics.inc(FORWARDED_METRIC)
+        return data["root_password"], data["user_password"], data["luks_password"]
+
+    def download_snapshot(self, target: Path) -> Tuple[float, str]:
+        """
+        Download a (gzip-compressed) snapshot of the primary's database.
+
+        Args:
+            target: File to write the snapshot to
+
+        Returns:
+            (when the primary took it as a Unix time, SHA-256 of the download)
+
+        Raises:
+            PrimaryUnavailable: If the primary can't be reached
+        """
+        requested_at = time.time()
+        digest = hashlib.sha256()
+        with self._open("/api/v1/backup") as response, open(target, "wb") as output:
+            stamp = response.headers.get(SNAPSHOT_TIME_HEADER)
+            while chunk := response.read(CHUNK_SIZE):
+                digest.update(chunk)
+                output.write(chunk)
+        taken_at = datetime.fromisoformat(stamp).timestamp() if stamp else requested_at
+        return taken_at, digest.hexdigest()
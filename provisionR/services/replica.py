@@ -0,0 +1,179 @@
+"""Read-only replicas serving kickstarts from snapshots of a primary."""
+
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from provisionR.database import Database
+from provisionR.metrics import metrics
+from provisionR.models import (
+    DBConfigGroup,
+    DBGlobalConfig,
+    DBMachineConfig,
+    DBTemplateRule,
+)
+from provisionR.services.backup_service import restore
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.credential_store import (
+    CredentialStore,
+    MemoryCredentialStore,
+)
+from provisionR.services.prerender import KickstartWarmer
+from provisionR.services.primary_client import PrimaryClient
+from provisionR.services.rule_service import RuleEngine
+
+logger = logging.getLogger(__name__)
+
+LAG_METRIC = "provisionr_replica_lag_seconds"
+REFRESHES_METRIC = "provisionr_replica_refreshes_total"
+
+
+def config_fingerprint(db: Session) -> tuple:
+    """
+    Cheaply tell whether config or rules differ between two databases.
+
+    Every write to these tables bumps a version, an update time or an id, or
+    changes a count.
+    """
+    return (
+        db.query(func.max(DBGlobalConfig.version)).scalar(),
+        db.query(func.count(), func.max(DBConfigGroup.updated_at)).one(),
+        db.query(func.count(), func.max(DBMachineConfig.updated_at)).one(),
+        db.query(func.count(), func.max(DBTemplateRule.id)).one(),
+    )
+
+
+class ReplicaSync:
+    """
+    Keeps a replica's database and caches a recent copy of the primary's.
+
+    Every refresh_seconds a background thread downloads a snapshot from the
+    primary's /v1/backup and restores it over the local database in one
+    step while requests keep using it (see restore()), so they see either
+    the old copy or the new one. An identical
+    snapshot is not restored again. After a restore the memory credential
+    store is reloaded, and the rules, config layers and pre-rendered
+    kickstarts are invalidated if the config or rules changed.
+
+    Lag is the age of the primary's state the replica serves: the time
+    since the last snapshot was taken, or since the replica started if none
+    has been applied yet.
+    """
+
+    def __init__(
+        self,
+        client: PrimaryClient,
+        database: Database,
+        refresh_seconds: float = 30.0,
+        store: Optional[CredentialStore] = None,
+        config_layers: Optional[ConfigLayers] = None,
+        rule_engine: Optional[RuleEngine] = None,
+        warmer: Optional[KickstartWarmer] = None,
+    ):
+        """
+        Initialize the sync.
+
+        Args:
+            client: Client of the primary
+            database: The replica's local database, overwritten by snapshots
+            refresh_seconds: Time between snapshot downloads
+            store: Credential store to reload after a restore
+            config_layers: Materialized config to invalidate on changes
+            rule_engine: Rule engine to invalidate on changes
+            warmer: Pre-render cache to invalidate on changes
+        """
+        self.client = client
+        self.database = database
+        self.refresh_seconds = refresh_seconds
+        self.store = store
+        self.config_layers = config_layers
+        self.rule_engine = rule_engine
+        self.warmer = warmer
+        self.snapshot_at: Optional[float] = None
+        self._started_at = time.time()
+        self._digest: Optional[str] = None
+        self._config: Optional[tuple] = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        metrics.register_gauge(LAG_METRIC, self.lag_seconds)
+
+    def lag_seconds(self) -> float:
+        """Age of the primary's state served by this replica."""
+        return time.time() - (self.snapshot_at or self._started_at)
+
+    def start(self) -> None:
+        """Refresh now and then periodically in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="provisionr-replica", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop refreshing."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                metrics.inc(REFRESHES_METRIC, result="failed")
+                logger.warning("Refreshing from the primary failed: %s", e)
+            self._stop.wait(self.refresh_seconds)
+
+    def refresh(self) -> bool:
+        """
+        Download a snapshot from the primary and apply it if it changed.
+
+        Returns:
+            True if the local database was replaced
+
+        Raises:
+            PrimaryUnavailable: If the primary can't be reached
+            BackupError: If the snapshot is unusable
+        """
+        with (
+            self._refresh_lock,
+            tempfile.TemporaryDirectory(prefix="provisionr-replica-") as tmp,
+        ):
+            path = Path(tmp) / "snapshot.db.gz"
+            taken_at, digest = self.client.download_snapshot(path)
+            if digest == self._digest:
+                self.snapshot_at = taken_at
+                metrics.inc(REFRESHES_METRIC, result="unchanged")
+                return False
+            restore(path, self.database.engine)
+            # Snapshots of an older primary are migrated like any database
+            self.database.init()
+            self._digest = digest
+            self.snapshot_at = taken_at
+            self._refresh_caches()
+        metrics.inc(REFRESHES_METRIC, result="applied")
+        return True
+
+    def _refresh_caches(self) -> None:
+        """Bring in-memory caches in line with the restored database."""
+        with self.database.session_factory() as db:
+            config = config_fingerprint(db)
+            if isinstance(self.store, MemoryCredentialStore):
+                self.store.load(db)
+        if config == self._config:
+            return
+        self._config = config
+        for cache in (self.rule_engine, self.config_layers, self.warmer):
+            if cache is not None:
+                cache.invalidate()
@@ -0,0 +1,435 @@
+"""Fleet-wide password rotation in resumable, chunked jobs."""
+
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import UTC, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Query, Session
+
+from provisionR.metrics import metrics
+from provisionR.models import (
+    DBArchivedMachine,
+    DBMachineConfig,
+    DBMachinePasswords,
+    DBPasswordHistory,
+    DBRotationJob,
+    RotationScope,
+)
+from provisionR.services.inventory_service import InventoryService
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.utils import PasswordGenerator
+
+logger = logging.getLogger(__name__)
+
+Passwords = Tuple[str, str, str]
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+ROLLING_BACK = "rolling_back"
+ROLLED_BACK = "rolled_back"
+
+ROTATED_METRIC = "provisionr_passwords_rotated_total"
+
+
+class RotationError(Exception):
+    """Raised when a rotation job can't be run or rolled back."""
+
+
+def generate_credentials(count: int) -> List[Passwords]:
+    """
+    Generate new (root, user, luks) passwords for `count` machines.
+
+    Module-level so it can run in worker processes.
+    """
+    generate = PasswordGenerator.generate_passphrase
+    return [(generate(), generate(), generate()) for _ in range(count)]
+
+
+def rotation_to_dict(job: DBRotationJob) -> Dict[str, Any]:
+    """Serialize a rotation job for the API."""
+    return {
+        "id": job.id,
+        "status": job.status,
+        "scope": RotationScope.model_validate_json(job.scope).model_dump(
+            mode="json", exclude_none=True
+        ),
+        "total": job.total,
+        "rotated": job.rotated,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+class PasswordRotator:
+    """
+    Replaces the passwords of every machine in a scope, a chunk at a time.
+
+    Each chunk is generated before any write lock is taken (in a process pool
+    when workers > 1), then written in one short transaction that also saves
+    the replaced passwords to machine_password_history and advances the job's
+    resume point. Kickstart requests therefore only ever wait for one chunk's
+    write, and a job interrupted at any point resumes after its last
+    committed chunk. A finished job can be rolled back from its history.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        chunk_size: int = 500,
+        workers: int = 1,
+        passphrases: Optional[PassphraseIndex] = None,
+    ):
+        """
+        Initialize the rotator.
+
+        Args:
+            session_factory: Creates the sessions used to read and write chunks
+            chunk_size: Machines rotated per transaction
+            workers: Processes generating passwords (1 generates inline)
+            passphrases: Index keeping new passphrases unique across machines
+        """
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.passphrases = passphrases
+        self._threads: Dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _scope_query(self, db: Session, scope: RotationScope) -> Query:
+        """Query the ids of the machines in a scope."""
+        query = db.query(DBMachinePasswords.id).filter(
+            *InventoryService(db).search_filters(scope.prefix, scope.contains)
+        )
+        if scope.group:
+            query = query.filter(
+                DBMachinePasswords.identity_key.in_(
+                    select(DBMachineConfig.identity_key).where(
+                        DBMachineConfig.group_name == scope.group
+                    )
+                )
+            )
+        if scope.created_before:
+            query = query.filter(DBMachinePasswords.created_at < scope.created_before)
+        return query
+
+    def create_job(self, db: Session, scope: RotationScope) -> DBRotationJob:
+        """
+        Record a new rotation job covering the machines currently in `scope`.
+
+        Args:
+            db: Database session
+            scope: Which machines to rotate
+
+        Returns:
+            The pending job
+        """
+        max_id = db.query(func.max(DBMachinePasswords.id)).scalar() or 0
+        total = (
+            self._scope_query(db, scope).filter(DBMachinePasswords.id <= max_id).count()
+        )
+        job = DBRotationJob(
+            status=PENDING,
+            scope=scope.model_dump_json(exclude_none=True),
+            max_machine_id=max_id,
+            total=total,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def start(self, job_id: int) -> None:
+        """Run a job in a background thread."""
+        with self._lock:
+            thread = self._threads.get(job_id)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(
+                target=self._run_in_background,
+                args=(job_id,),
+                name=f"provisionr-rotation-{job_id}",
+                daemon=True,
+            )
+            self._threads[job_id] = thread
+            thread.start()
+
+    def resume_interrupted(self) -> List[int]:
+        """
+        Restart jobs that were running when the process last stopped.
+
+        Returns:
+            Ids of the resumed jobs
+        """
+        with self.session_factory() as db:
+            job_ids = [
+                job_id
+                for (job_id,) in db.query(DBRotationJob.id).filter(
+                    DBRotationJob.status == RUNNING
+                )
+            ]
+        for job_id in job_ids:
+            logger.info("Resuming password rotation job %d", job_id)
+            self.start(job_id)
+        return job_ids
+
+    def stop(self) -> None:
+        """Stop background jobs after their current chunk; they resume later."""
+        self._stop.set()
+        with self._lock:
+            threads = list(self._threads.values())
+            self._threads.clear()
+        for thread in threads:
+            thread.join()
+        self._stop.clear()
+
+    def is_active(self, job_id: int) -> bool:
+        """Whether a job is running in this process."""
+        thread = self._threads.get(job_id)
+        return thread is not None and thread.is_alive()
+
+    def _run_in_background(self, job_id: int) -> None:
+        try:
+            self.run(job_id)
+        except Exception:
+            logger.exception("Password rotation job %d failed", job_id)
+
+    def run(
+        self,
+        job_id: int,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> str:
+        """
+        Rotate passwords for a job until it completes or the rotator stops.
+
+        Args:
+            job_id: Job to run (pending, or interrupted running/failed)
+            on_progress: Called with (rotated, total) after each chunk
+
+        Returns:
+            The job's status afterwards (running if stopped early)
+
+        Raises:
+            RotationError: If the job doesn't exist or has already finished
+        """
+        with self.session_factory() as db:
+            job = db.get(DBRotationJob, job_id)
+            if job is None:
+                raise RotationError(f"Rotation job {job_id} not found")
+            # Claimed only if no rollback took the job since it was read
+            claimed = db.execute(
+                update(DBRotationJob)
+                .where(
+                    DBRotationJob.id == job_id,
+                    DBRotationJob.status.in_((PENDING, RUNNING, FAILED)),
+                )
+                .values(status=RUNNING, error=None)
+            ).rowcount
+            db.commit()
+            if not claimed:
+                db.refresh(job)
+                raise RotationError(f"Rotation job {job_id} is {job.status}")
+            scope = RotationScope.model_validate_json(job.scope)
+
+        executor = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            while not self._stop.is_set():
+                progress = self._rotate_chunk(job_id, scope, executor)
+                if progress is None:
+                    return self._finish(job_id, COMPLETED)
+                if on_progress is not None:
+                    on_progress(*progress)
+            return RUNNING
+        except Exception as e:
+            self._finish(job_id, FAILED, str(e))
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _generate(
+        self, count: int, executor: Optional[ProcessPoolExecutor]
+    ) -> List[Passwords]:
+        """Generate passwords for a chunk, split across the worker processes."""
+        if executor is None:
+            return generate_credentials(count)
+        share, extra = divmod(count, self.workers)
+        sizes = [share + (i < extra) for i in range(self.workers)]
+        credentials: List[Passwords] = []
+        for part in executor.map(generate_credentials, [s for s in sizes if s]):
+            credentials.extend(part)
+        return credentials
+
+    def _rotate_chunk(
+        self,
+        job_id: int,
+        scope: RotationScope,
+        executor: Optional[ProcessPoolExecutor],
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Rotate the next chunk of a job.
+
+        Returns:
+            (rotated, total) after the chunk, or None if nothing was left
+        """
+        with self.session_factory() as db:
+            job = db.get(DBRotationJob, job_id)
+            machine_ids = [
+                machine_id
+                for (machine_id,) in self._scope_query(db, scope)
+                .filter(
+                    DBMachinePasswords.id > job.last_machine_id,
+                    DBMachinePasswords.id <= job.max_machine_id,
+                )
+                .order_by(DBMachinePasswords.id)
+                .limit(self.chunk_size)
+            ]
+        if not machine_ids:
+            return None
+
+        # Generated outside the write transaction so the lock is held briefly
+        credentials = self._generate(len(machine_ids), executor)
+        if self.passphrases is not None:
+            # Workers can't see the index; redraw what they duplicated
+            with self.session_factory() as db:
+                credentials = self.passphrases.claim_credentials(db, credentials)
+        now = datetime.now(UTC)
+
+        with self.session_factory() as db:
+            previous = db.query(
+                DBMachinePasswords.id,
+                DBMachinePasswords.root_password,
+                DBMachinePasswords.user_password,
+                DBMachinePasswords.luks_password,
+            ).filter(DBMachinePasswords.id.in_(machine_ids))
+            history = [
+                {
+                    "job_id": job_id,
+                    "machine_id": row.id,
+                    "root_password": row.root_password,
+                    "user_password": row.user_password,
+                    "luks_password": row.luks_password,
+                    "rotated_at": now,
+                }
+                for row in previous
+            ]
+            if history:
+                db.execute(insert(DBPasswordHistory), history)
+                db.execute(
+                    update(DBMachinePasswords),
+                    [
+                        {
+                            "id": row["machine_id"],
+                            "root_password": root,
+                            "user_password": user,
+                            "luks_password": luks,
+                        }
+                        for row, (root, user, luks) in zip(history, credentials)
+                    ],
+                )
+            job = db.get(DBRotationJob, job_id)
+            job.last_machine_id = machine_ids[-1]
+            job.rotated += len(history)
+            db.commit()
+            metrics.inc(ROTATED_METRIC, len(history))
+            return job.rotated, job.total
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> str:
+        """Record a job's final status."""
+        with self.session_factory() as db:
+            job = db.get(DBRotationJob, job_id)
+            job.status = status
+            job.error = error
+            db.commit()
+        return status
+
+    def rollback(self, job_id: int) -> None:
+        """
+        Restore the passwords a job replaced.
+
+        Only a completed or failed job can be rolled back, and only the most
+        recent one that hasn't been, so a rollback never overwrites passwords
+        set by a later rotation. The job is marked rolling_back in the same
+        transaction that checks this, which keeps it from being run while its
+        passwords are restored; an interrupted rollback can be retried.
+
+        Args:
+            job_id: Job to roll back
+
+        Raises:
+            RotationError: If the job doesn't exist, hasn't finished, or a
+                later job must be rolled back first
+        """
+        if self.is_active(job_id):
+            raise RotationError(f"Rotation job {job_id} is still running")
+        with self.session_factory() as db:
+            job = db.get(DBRotationJob, job_id)
+            if job is None:
+                raise RotationError(f"Rotation job {job_id} not found")
+            if job.status == ROLLED_BACK:
+                return
+            later = (
+                db.query(DBRotationJob.id)
+                .filter(DBRotationJob.id > job_id, DBRotationJob.status != ROLLED_BACK)
+                .order_by(DBRotationJob.id.desc())
+                .first()
+            )
+            if later is not None:
+                raise RotationError(f"Roll back rotation job {later.id} first")
+            claimed = db.execute(
+                update(DBRotationJob)
+                .where(
+                    DBRotationJob.id == job_id,
+                    DBRotationJob.status.in_((COMPLETED, FAILED, ROLLING_BACK)),
+                )
+                .values(status=ROLLING_BACK)
+            ).rowcount
+            db.commit()
+            if not claimed:
+                db.refresh(job)
+                raise RotationError(f"Rotation job {job_id} is {job.status}")
+
+        last_id = 0
+        while True:
+            with self.session_factory() as db:
+                rows = (
+                    db.query(DBPasswordHistory)
+                    .filter(
+                        DBPasswordHistory.job_id == job_id,
+                        DBPasswordHistory.id > last_id,
+                    )
+                    .order_by(DBPasswordHistory.id)
+                    .limit(self.chunk_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                passwords = {
+                    row.machine_id: {
+                        "id": row.machine_id,
+                        "root_password": row.root_password,
+                        "user_password": row.user_password,
+                        "luks_password": row.luks_password,
+                    }
+                    for row in rows
+                }
+                # Machines archived since the rotation are restored in place
+                for model in (DBMachinePasswords, DBArchivedMachine):
+                    present = [
+                        machine_id
+                        for (machine_id,) in db.query(model.id).filter(
+                            model.id.in_(list(passwords))
+                        )
+                    ]
+                    if present:
+                        db.execute(update(model), [passwords[i] for i in present])
+                db.commit()
+                last_id = rows[-1].id
+
+        self._finish(job_id, ROLLED_BACK)
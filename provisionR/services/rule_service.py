@@ -0,0 +1,300 @@
+"""Rule-based template and value selection with a compiled matcher index."""
+
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from provisionR.models import DBTemplateRule, RuleMatchType, TemplateRule
+from provisionR.utils import MachineIdentity
+
+# Patterns using numbered/named backreferences can't be merged into one regex
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+@dataclass(frozen=True)
+class RuleMatch:
+    """The outcome of resolving rules for a machine."""
+
+    rule_id: int
+    template_name: Optional[str]
+    values: Dict[str, Any] = field(default_factory=dict)
+
+
+def _rank(rule: TemplateRule) -> Tuple[int, int]:
+    """Sort key: lower priority value first, then older rules first."""
+    return rule.priority, rule.id
+
+
+def _mac_hex(value: str) -> str:
+    """Strip separators from a MAC address or prefix."""
+    return re.sub(r"[\s:\-.]", "", value).upper()
+
+
+class _MacPrefixTrie:
+    """Trie over MAC hex digits; each node keeps the best rule for its prefix."""
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+
+    def add(self, prefix: str, rule: TemplateRule) -> None:
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        best = node.get(None)
+        if best is None or _rank(rule) < _rank(best):
+            node[None] = rule
+
+    def best(self, mac_hex: str) -> Optional[TemplateRule]:
+        """Best rule among all prefixes of the MAC (longest prefix breaks ties)."""
+        node = self.root
+        best = None
+        for char in mac_hex:
+            node = node.get(char)
+            if node is None:
+                break
+            rule = node.get(None)
+            if rule is not None and (best is None or _rank(rule) <= _rank(best)):
+                best = rule
+        return best
+
+
+class CompiledRules:
+    """
+    Matcher index built from a set of rules.
+
+    - MAC prefix rules live in a trie walked once per lookup, so the cost
+      depends on the MAC length rather than the number of rules.
+    - Serial patterns are merged into a single regex whose alternatives are
+      ordered by priority, so the first alternative to match is the winner.
+    - Query parameter rules are a dict keyed by (parameter, value).
+    """
+
+    def __init__(self, rules: List[TemplateRule]):
+        """Compile the rules into lookup structures."""
+        self.rules = sorted(rules, key=_rank)
+        self.mac_trie = _MacPrefixTrie()
+        self.query_rules: Dict[Tuple[str, str], TemplateRule] = {}
+        serial_rules: List[TemplateRule] = []
+
+        for rule in self.rules:
+            if rule.match_type == RuleMatchType.MAC_PREFIX:
+                self.mac_trie.add(_mac_hex(rule.pattern), rule)
+            elif rule.match_type == RuleMatchType.SERIAL_PATTERN:
+                serial_rules.append(rule)
+            else:
+                # Rules are sorted, so the first rule for a key is the best
+                self.query_rules.setdefault((rule.param_name, rule.pattern), rule)
+
+        self.query_params = frozenset(name for name, _ in self.query_rules)
+        self._compile_serial(serial_rules)
+
+    def _compile_serial(self, serial_rules: List[TemplateRule]) -> None:
+        """Compile serial patterns into one combined regex where possible."""
+        self.serial_rules = serial_rules
+        self.serial_regex: Optional[re.Pattern] = None
+        self.serial_patterns = [re.compile(rule.pattern) for rule in serial_rules]
+        if not serial_rules or any(
+            _BACKREFERENCE.search(rule.pattern) for rule in serial_rules
+        ):
+            return
+
+        # Map the group number of each wrapping group back to its rule
+        parts = []
+        self.serial_groups: Dict[int, TemplateRule] = {}
+        group = 1
+        for rule, compiled in zip(serial_rules, self.serial_patterns):
+            parts.append(f"((?:{rule.pattern}))")
+            self.serial_groups[group] = rule
+            group += 1 + compiled.groups
+        try:
+            self.serial_regex = re.compile("|".join(parts))
+        except re.error:
+            # e.g. the same named group in two patterns; match one by one
+            self.serial_regex = None
+
+    def _best_serial(self, serial: str) -> Optional[TemplateRule]:
+        if self.serial_regex is not None:
+            match = self.serial_regex.fullmatch(serial)
+            return self.serial_groups[match.lastindex] if match else None
+        for rule, compiled in zip(self.serial_rules, self.serial_patterns):
+            if compiled.fullmatch(serial):
+                return rule
+        return None
+
+    def match(
+        self, identity: MachineIdentity, query_params: Mapping[str, str]
+    ) -> Optional[TemplateRule]:
+        """
+        Find the best rule for a machine.
+
+        Args:
+            identity: Normalized machine identity
+            query_params: Query parameters of the kickstart request
+
+        Returns:
+            The matching rule with the lowest (priority, id), if any
+        """
+        candidates = []
+
+        rule = self.mac_trie.best(_mac_hex(identity.mac))
+        if rule is not None:
+            candidates.append(rule)
+
+        rule = self._best_serial(identity.serial)
+        if rule is not None:
+            candidates.append(rule)
+
+        for name in self.query_params:
+            value = query_params.get(name)
+            if value is not None:
+                rule = self.query_rules.get((name, value))
+                if rule is not None:
+                    candidates.append(rule)
+
+        return min(candidates, key=_rank) if candidates else None
+
+
+class RuleEngine:
+    """
+    Resolves the rule for a machine, caching results per identity.
+
+    Rules are loaded from the database and compiled on first use. Any change
+    made through the rule CRUD functions invalidates the compiled rules and
+    the resolution cache.
+    """
+
+    def __init__(self, cache_size: int = 65_536):
+        """
+        Initialize the engine.
+
+        Args:
+            cache_size: Maximum number of cached resolutions
+        """
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._compiled: Optional[CompiledRules] = None
+        # Bumped by invalidate(), so rules loaded before it aren't installed
+        self._generation = 0
+        self._cache: "OrderedDict[tuple, Optional[RuleMatch]]" = OrderedDict()
+
+    def invalidate(self) -> None:
+        """Drop compiled rules and cached resolutions (rules have changed)."""
+        with self._lock:
+            self._generation += 1
+            self._compiled = None
+            self._cache.clear()
+
+    def _get_compiled(self, db: Session) -> CompiledRules:
+        with self._lock:
+            compiled = self._compiled
+            generation = self._generation
+        if compiled is None:
+            # Compiled outside the lock, so resolutions with cached results
+            # don't wait; only installed if no invalidate() happened meanwhile
+            compiled = CompiledRules(list_rules(db))
+            with self._lock:
+                if self._generation == generation:
+                    self._compiled = compiled
+                    self._cache.clear()
+        return compiled
+
+    def resolve(
+        self,
+        db: Session,
+        identity: MachineIdentity,
+        query_params: Mapping[str, str],
+    ) -> Optional[RuleMatch]:
+        """
+        Resolve the rule for a machine.
+
+        Args:
+            db: Database session (used only when rules need loading)
+            identity: Normalized machine identity
+            query_params: Query parameters of the kickstart request
+
+        Returns:
+            Template name and values of the best rule, or None if none match
+        """
+        compiled = self._get_compiled(db)
+
+        # Only query parameters that some rule looks at affect the result
+        key = (
+            identity.mac,
+            identity.serial,
+            tuple(sorted((n, query_params.get(n)) for n in compiled.query_params)),
+        )
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        rule = compiled.match(identity, query_params)
+        result = None
+        if rule is not None:
+            result = RuleMatch(
+                rule_id=rule.id, template_name=rule.template_name, values=rule.values
+            )
+
+        with self._lock:
+            # Don't cache results computed from rules that were replaced meanwhile
+            if self._compiled is compiled:
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+
+def _to_rule(db_rule: DBTemplateRule) -> TemplateRule:
+    """Convert a DB rule to its Pydantic model."""
+    return TemplateRule(
+        id=db_rule.id,
+        priority=db_rule.priority,
+        match_type=RuleMatchType(db_rule.match_type),
+        pattern=db_rule.pattern,
+        param_name=db_rule.param_name,
+        template_name=db_rule.template_name,
+        values=json.loads(db_rule.values) if db_rule.values else {},
+    )
+
+
+def list_rules(db: Session) -> List[TemplateRule]:
+    """Get all rules, best first."""
+    db_rules = db.query(DBTemplateRule).order_by(
+        DBTemplateRule.priority, DBTemplateRule.id
+    )
+    return [_to_rule(db_rule) for db_rule in db_rules]
+
+
+def create_rule(db: Session, rule: TemplateRule, engine: RuleEngine) -> TemplateRule:
+    """Store a new rule and invalidate the engine."""
+    db_rule = DBTemplateRule(
+        priority=rule.priority,
+        match_type=rule.match_type.value,
+        pattern=rule.pattern,
+        param_name=rule.param_name,
+        template_name=rule.template_name,
+        values=json.dumps(rule.values),
+    )
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    engine.invalidate()
+    return _to_rule(db_rule)
+
+
+def delete_rule(db: Session, rule_id: int, engine: RuleEngine) -> bool:
+    """
+    Delete a rule and invalidate the engine.
+
+    Returns:
+        True if the rule existed
+    """
+    deleted = db.query(DBTemplateRule).filter(DBTemplateRule.id == rule_id).delete()
+    db.commit()
+    engine.invalidate()
+    return deleted > 0
@@ -0,0 +1,94 @@
+"""Service for reading fleet summary statistics."""
+
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from provisionR.fleet_stats import (
+    DAY_FORMAT,
+    FETCHES_PER_OS,
+    FETCHES_PER_TEMPLATE,
+    HOUR_FORMAT,
+    MACHINES,
+    MACHINES_PER_DAY,
+    MACHINES_PER_HOUR,
+)
+from provisionR.models import DBFleetStat
+
+
+class StatsService:
+    """
+    Reads the fleet_stats counters.
+
+    The counters are maintained by triggers as machines are stored and
+    fetches are logged, so a summary reads a handful of rows by primary key
+    however large the fleet is. Fetches are counted once the access log has
+    written them (within its flush interval).
+    """
+
+    def __init__(self, db: Session):
+        """Initialize the stats service with a database session."""
+        self.db = db
+
+    def summary(
+        self, days: int = 30, hours: int = 48, now: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """
+        Summarize the fleet.
+
+        Args:
+            days: Number of days of new-machine counts, including today
+            hours: Number of hours of new-machine counts, including this hour
+            now: Current time (defaults to now, in UTC)
+
+        Returns:
+            Total machines, new machines per day and per hour (oldest first,
+            zero for periods without any), and fetches per template and per
+            target OS
+        """
+        now = now or datetime.now(UTC)
+        day_buckets = [
+            (now - timedelta(days=n)).strftime(DAY_FORMAT)
+            for n in reversed(range(days))
+        ]
+        hour_buckets = [
+            (now - timedelta(hours=n)).strftime(HOUR_FORMAT)
+            for n in reversed(range(hours))
+        ]
+
+        conditions = [
+            DBFleetStat.metric.in_([MACHINES, FETCHES_PER_TEMPLATE, FETCHES_PER_OS])
+        ]
+        if day_buckets:
+            conditions.append(
+                and_(
+                    DBFleetStat.metric == MACHINES_PER_DAY,
+                    DBFleetStat.bucket >= day_buckets[0],
+                )
+            )
+        if hour_buckets:
+            conditions.append(
+                and_(
+                    DBFleetStat.metric == MACHINES_PER_HOUR,
+                    DBFleetStat.bucket >= hour_buckets[0],
+                )
+            )
+
+        counts: Dict[str, Dict[str, int]] = {}
+        rows = self.db.query(
+            DBFleetStat.metric, DBFleetStat.bucket, DBFleetStat.count
+        ).filter(or_(*conditions))
+        for metric, bucket, count in rows:
+            counts.setdefault(metric, {})[bucket] = count
+
+        per_day = counts.get(MACHINES_PER_DAY, {})
+        per_hour = counts.get(MACHINES_PER_HOUR, {})
+        return {
+            "total_machines": counts.get(MACHINES, {}).get("", 0),
+            "new_machines_per_day": {b: per_day.get(b, 0) for b in day_buckets},
+            "new_machines_per_hour": {b: per_hour.get(b, 0) for b in hour_buckets},
+            "fetches_per_template": counts.get(FETCHES_PER_TEMPLATE, {}),
+            "fetches_per_os": counts.get(FETCHES_PER_OS, {}),
+        }
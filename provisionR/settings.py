@@ -0,0 +1,212 @@
+"""Process-level settings read from PROVISIONR_* environment variables."""
+
+import os
+from functools import lru_cache
+from typing import Literal, Mapping, Optional
+
+from pydantic import BaseModel, Field
+
+ENV_PREFIX = "PROVISIONR_"
+
+
+class Settings(BaseModel):
+    """
+    Runtime settings for a provisionR process.
+
+    Unlike GlobalConfig, which is stored in the database and edited through the
+    API, these values are fixed for the lifetime of the process. Every field can
+    be overridden with an environment variable named PROVISIONR_<FIELD_NAME>,
+    e.g. PROVISIONR_RENDER_TIMEOUT_SECONDS=5.
+    """
+
+    db_path: str = Field(
+        default="provisionr.db",
+        description='SQLite database file (":memory:" for a throwaway database)',
+    )
+    render_timeout_seconds: float = Field(
+        default=2.0, gt=0, description="Wall-clock budget for a single render"
+    )
+    render_max_output_bytes: int = Field(
+        default=1024 * 1024, gt=0, description="Maximum size of a rendered template"
+    )
+    render_max_loop_iterations: int = Field(
+        default=100_000,
+        gt=0,
+        description="Maximum number of for-loop iterations across one render",
+    )
+    render_max_call_depth: int = Field(
+        default=64, gt=0, description="Maximum nesting of macro and function calls"
+    )
+    group_commit_window_ms: float = Field(
+        default=5.0,
+        ge=0,
+        description="How long new-machine inserts wait to be batched together",
+    )
+    group_commit_max_batch: int = Field(
+        default=256, gt=0, description="Maximum new-machine inserts per transaction"
+    )
+    access_log_queue_size: int = Field(
+        default=10_000,
+        gt=0,
+        description="Fetch events buffered before new ones are dropped",
+    )
+    access_log_batch_size: int = Field(
+        default=500, gt=0, description="Maximum fetch events written per transaction"
+    )
+    access_log_flush_interval_ms: float = Field(
+        default=1000.0,
+        gt=0,
+        description="Maximum delay before fetch events are written",
+    )
+    rule_cache_size: int = Field(
+        default=65_536, gt=0, description="Machines whose rule resolution is cached"
+    )
+    events_buffer_size: int = Field(
+        default=1024,
+        gt=0,
+        description="Events kept for event stream subscribers that fall behind",
+    )
+    events_heartbeat_seconds: float = Field(
+        default=15.0, gt=0, description="Idle time before an event stream keep-alive"
+    )
+    rotation_chunk_size: int = Field(
+        default=500, gt=0, description="Machines rotated per transaction"
+    )
+    rotation_workers: int = Field(
+        default=1,
+        gt=0,
+        description="Processes generating passwords during a rotation",
+    )
+    jobs_dir: str = Field(
+        default="jobs", description="Directory background job results are kept in"
+    )
+    jobs_max_concurrent: int = Field(
+        default=2, gt=0, description="Background jobs run at the same time"
+    )
+    jobs_stale_after_seconds: float = Field(
+        default=60.0,
+        gt=0,
+        description="Heartbeat age after which a running job is run again",
+    )
+    jobs_retention_hours: float = Field(
+        default=168.0,
+        gt=0,
+        description="How long finished jobs and their result files are kept",
+    )
+    ks_max_concurrent: int = Field(
+        default=32,
+        gt=0,
+        description="Kickstarts generated at the same time (also the DB pool size)",
+    )
+    ks_max_queue: int = Field(
+        default=256,
+        ge=0,
+        description="Kickstart requests waiting for a slot before new ones get 503",
+    )
+    ks_max_wait_seconds: float = Field(
+        default=10.0,
+        gt=0,
+        description="How long a kickstart request waits for a slot before 503",
+    )
+    ks_retry_after_seconds: int = Field(
+        default=5, gt=0, description="Retry-After sent with 503 responses"
+    )
+    prerender_enabled: bool = Field(
+        default=True, description="Pre-render kickstarts for known machines"
+    )
+    prerender_renders_per_second: float = Field(
+        default=50.0, gt=0, description="Maximum background pre-render rate"
+    )
+    prerender_max_entries: int = Field(
+        default=100_000, gt=0, description="Maximum pre-rendered kickstarts kept"
+    )
+    backup_pages_per_step: int = Field(
+        default=256, gt=0, description="Database pages copied per backup step"
+    )
+    backup_pause_ms: float = Field(
+        default=5.0,
+        ge=0,
+        description="Pause between backup steps, leaving the database to writers",
+    )
+    import_chunk_size: int = Field(
+        default=5000, gt=0, description="Imported machines written per transaction"
+    )
+    import_workers: int = Field(
+        default=1,
+        gt=0,
+        description="Processes generating passwords missing from imports",
+    )
+    archive_chunk_size: int = Field(
+        default=500, gt=0, description="Machines archived per transaction"
+    )
+    passphrase_index_capacity: int = Field(
+        default=1_000_000,
+        gt=0,
+        description="Passphrases the uniqueness index is first sized for",
+    )
+    passphrase_index_error_rate: float = Field(
+        default=0.01,
+        gt=0,
+        lt=1,
+        description="Share of new passphrases needlessly redrawn as possibly taken",
+    )
+    hash_cache_size: int = Field(
+        default=65_536, gt=0, description="Password hashes cached across machines"
+    )
+    hash_latency_budget_ms: Optional[float] = Field(
+        default=None,
+        gt=0,
+        description="Raise hash costs until one hash takes this long (calibrated)",
+    )
+    hash_costs: str = Field(
+        default="",
+        description='Fixed hash costs, e.g. "yescrypt=7,grub_pbkdf2=100000"',
+    )
+    public_url: Optional[str] = Field(
+        default=None,
+        description="Base URL machines reach provisionR at (defaults to the request's)",
+    )
+    credential_store: Literal["sql", "memory"] = Field(
+        default="sql",
+        description="Credential lookups from the database, or from memory",
+    )
+    credential_store_sync_seconds: float = Field(
+        default=1.0,
+        gt=0,
+        description="How often the memory store picks up rotated passwords",
+    )
+    replica_of: Optional[str] = Field(
+        default=None,
+        description="Base URL of the primary, making this a read-only replica",
+    )
+    replica_refresh_seconds: float = Field(
+        default=30.0, gt=0, description="How often a replica fetches a snapshot"
+    )
+    replica_timeout_seconds: float = Field(
+        default=10.0, gt=0, description="Timeout of a replica's requests to the primary"
+    )
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Settings":
+        """
+        Build settings from environment variables.
+
+        Args:
+            environ: Mapping to read from (defaults to os.environ)
+
+        Returns:
+            Settings with any PROVISIONR_* overrides applied
+        """
+        environ = os.environ if environ is None else environ
+        overrides = {}
+        for name in cls.model_fields:
+            key = f"{ENV_PREFIX}{name.upper()}"
+            if key in environ:
+                overrides[name] = environ[key]
+        return cls(**overrides)
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Get the settings for this process (read from the environment once)."""
+    return Settings.from_env()
@@ -1,6 +1,23 @@
 """Utility functions for provisionR."""
 
+from provisionR.utils.identity import MachineIdentity
+from provisionR.utils.merge_patch import apply_merge_patch
 from provisionR.utils.password_generator import PasswordGenerator
 from provisionR.utils.password_hasher import PasswordHasher
+from provisionR.utils.template_sandbox import (
+    GuardedEnvironment,
+    LazyValues,
+    RenderLimits,
+    TemplateRenderLimitExceeded,
+)
 
-__all__ = ["PasswordGenerator", "PasswordHasher"]
+__all__ = [
+    "MachineIdentity",
+    "PasswordGenerator",
+    "PasswordHasher",
+    "GuardedEnvironment",
+    "LazyValues",
+    "RenderLimits",
+    "TemplateRenderLimitExceeded",
+    "apply_merge_patch",
+]
@@ -0,0 +1,120 @@
+"""Normalization of machine identities (MAC, UUID, serial)."""
+
+import hashlib
+import re
+import uuid as uuid_lib
+from dataclasses import dataclass
+
+# Separators accepted between MAC address octets
+_MAC_SEPARATORS = re.compile(r"[\s:\-.]")
+_MAC_HEX = re.compile(r"^[0-9A-F]{12}$")
+
+# Separator used when hashing the identity (cannot appear in normalized values)
+_KEY_SEPARATOR = "\x1f"
+
+# Length of the identity key in hex characters
+IDENTITY_KEY_LENGTH = 32
+
+
+def normalize_mac(mac: str) -> str:
+    """
+    Normalize a MAC address to upper-case, colon-separated form.
+
+    00-11-22-aa-bb-cc, 0011.22aa.bbcc and 00:11:22:AA:BB:CC all normalize to
+    00:11:22:AA:BB:CC. Values that are not 48-bit MAC addresses are only
+    trimmed and upper-cased.
+
+    Args:
+        mac: MAC address as supplied by the caller
+
+    Returns:
+        Normalized MAC address
+    """
+    compact = _MAC_SEPARATORS.sub("", mac).upper()
+    if _MAC_HEX.match(compact):
+        return ":".join(compact[i : i + 2] for i in range(0, 12, 2))
+    return mac.strip().upper()
+
+
+def normalize_uuid(value: str) -> str:
+    """
+    Normalize a UUID to its lower-case, hyphenated canonical form.
+
+    Braced, URN and hyphen-less forms are accepted. Values that are not UUIDs
+    are only trimmed and lower-cased.
+
+    Args:
+        value: UUID as supplied by the caller
+
+    Returns:
+        Normalized UUID
+    """
+    value = value.strip()
+    try:
+        return str(uuid_lib.UUID(value))
+    except ValueError:
+        return value.lower()
+
+
+def normalize_serial(serial: str) -> str:
+    """
+    Normalize a serial number by trimming surrounding whitespace.
+
+    Serial numbers are vendor-defined, so their case is preserved.
+
+    Args:
+        serial: Serial number as supplied by the caller
+
+    Returns:
+        Normalized serial number
+    """
+    return serial.strip()
+
+
+@dataclass(frozen=True)
+class MachineIdentity:
+    """A normalized machine identity and its fixed-width lookup key."""
+
+    mac: str
+    uuid: str
+    serial: str
+    key: str
+
+    @classmethod
+    def from_raw(cls, mac: str, uuid: str, serial: str) -> "MachineIdentity":
+        """
+        Normalize raw identifiers and compute the identity key.
+
+        Args:
+            mac: MAC address of the machine
+            uuid: UUID of the machine
+            serial: Serial number of the machine
+
+        Returns:
+            Normalized identity
+        """
+        mac = normalize_mac(mac)
+        uuid = normalize_uuid(uuid)
+        serial = normalize_serial(serial)
+        return cls(
+            mac=mac, uuid=uuid, serial=serial, key=identity_key(mac, uuid, serial)
+        )
+
+
+def identity_key(mac: str, uuid: str, serial: str) -> str:
+    """
+    Compute the identity key for already-normalized identifiers.
+
+    The key is a 128-bit BLAKE2b digest rendered as 32 hex characters, so the
+    machine table can be probed through a single narrow unique index.
+
+    Args:
+        mac: Normalized MAC address
+        uuid: Normalized UUID
+        serial: Normalized serial number
+
+    Returns:
+        Identity key
+    """
+    material = _KEY_SEPARATOR.join((mac, uuid, serial)).encode("utf-8")
+    return hashlib.blake2b(material, digest_size=IDENTITY_KEY_LENGTH // 2).hexdigest()
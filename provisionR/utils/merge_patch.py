@@ -0,0 +1,31 @@
+"""JSON Merge Patch (RFC 7396)."""
+
+import copy
+from typing import Any
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    """
+    Apply a JSON Merge Patch to a document.
+
+    Objects in the patch are merged recursively, null removes a member, and
+    any other value (including arrays) replaces the target value. The target
+    is not modified.
+
+    Args:
+        target: Document to patch
+        patch: Merge patch
+
+    Returns:
+        Patched document
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
@@ -1,13 +1,208 @@
 """Password hashing utilities for kickstart files."""
 
+import ctypes
+import ctypes.util
+import os
 import secrets
 import string
-from passlib.hash import sha512_crypt
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+
+
+class HashFormatUnavailable(Exception):
+    """Raised when a hash format has no backend on this host."""
+
+
+@dataclass(frozen=True)
+class HashFormat:
+    """A password hash format templates can ask for."""
+
+    name: str
+    # (password, cost) -> hash string
+    hash: Callable[[str, int], str]
+    default_cost: int
+    max_cost: int
+    # Each cost step doubles the work (instead of adding a round)
+    exponential: bool = False
+    available: Callable[[], bool] = lambda: True
+
+
+# Hash formats by name; see register_hash_format
+HASH_FORMATS: Dict[str, HashFormat] = {}
+
+
+def register_hash_format(hash_format: HashFormat) -> None:
+    """Make a hash format available to templates (replacing one of that name)."""
+    HASH_FORMATS[hash_format.name] = hash_format
+
+
+def _salt(length: int = 16) -> str:
+    salt_chars = string.ascii_letters + string.digits + "./"
+    return "".join(secrets.choice(salt_chars) for _ in range(length))
+
+
+def _sha512_crypt(password: str, rounds: int) -> str:
+    # passlib is slow to import and only needed once a kickstart is rendered
+    from passlib.hash import sha512_crypt
+
+    return sha512_crypt.using(salt=_salt(), rounds=rounds).hash(password)
+
+
+def _grub_pbkdf2(password: str, rounds: int) -> str:
+    from passlib.hash import grub_pbkdf2_sha512
+
+    return grub_pbkdf2_sha512.using(rounds=rounds).hash(password)
+
+
+# sizeof(struct crypt_data) and CRYPT_GENSALT_OUTPUT_SIZE in libxcrypt
+_CRYPT_DATA_SIZE = 32768
+_GENSALT_OUTPUT_SIZE = 192
+
+
+@lru_cache(maxsize=None)
+def _libcrypt() -> Optional[ctypes.CDLL]:
+    """The system's libxcrypt (which has yescrypt), or None."""
+    name = ctypes.util.find_library("crypt")
+    if name is None:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+        crypt_rn = lib.crypt_rn
+        gensalt_rn = lib.crypt_gensalt_rn
+    except (OSError, AttributeError):
+        return None
+    crypt_rn.argtypes = [
+        ctypes.c_char_p,
+        ctypes.c_char_p,
+        ctypes.c_void_p,
+        ctypes.c_int,
+    ]
+    crypt_rn.restype = ctypes.c_char_p
+    gensalt_rn.argtypes = [
+        ctypes.c_char_p,
+        ctypes.c_ulong,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+    ]
+    gensalt_rn.restype = ctypes.c_char_p
+    return lib
+
+
+def _libcrypt_hash(prefix: str, password: str, cost: int) -> str:
+    """Hash with the system crypt(3) in the format `prefix` selects."""
+    lib = _libcrypt()
+    if lib is None:
+        raise HashFormatUnavailable(f"No libxcrypt for {prefix} hashes")
+    setting = ctypes.create_string_buffer(_GENSALT_OUTPUT_SIZE)
+    random_bytes = os.urandom(16)
+    if not lib.crypt_gensalt_rn(
+        prefix.encode(), cost, random_bytes, len(random_bytes), setting, len(setting)
+    ):
+        raise HashFormatUnavailable(f"libxcrypt can't make {prefix} hashes")
+    # crypt_rn is reentrant as long as every call has its own scratch space
+    data = ctypes.create_string_buffer(_CRYPT_DATA_SIZE)
+    hashed = lib.crypt_rn(password.encode(), setting.value, data, _CRYPT_DATA_SIZE)
+    if not hashed:
+        raise HashFormatUnavailable(f"libxcrypt can't make {prefix} hashes")
+    return hashed.decode()
+
+
+@lru_cache(maxsize=None)
+def _libcrypt_supports(prefix: str) -> bool:
+    try:
+        _libcrypt_hash(prefix, "probe", 0)
+    except HashFormatUnavailable:
+        return False
+    return True
+
+
+# SHA-512 crypt, what Anaconda's --iscrypted expects
+register_hash_format(
+    HashFormat(
+        name="sha512",
+        hash=_sha512_crypt,
+        default_cost=5000,
+        max_cost=999_999_999,
+    )
+)
+# yescrypt, the default of Debian/Ubuntu (and thus autoinstall's identity)
+register_hash_format(
+    HashFormat(
+        name="yescrypt",
+        hash=lambda password, cost: _libcrypt_hash("$y$", password, cost),
+        default_cost=5,
+        max_cost=11,
+        exponential=True,
+        available=lambda: _libcrypt_supports("$y$"),
+    )
+)
+# PBKDF2 as grub-mkpasswd-pbkdf2 writes it, for GRUB's password_pbkdf2
+register_hash_format(
+    HashFormat(
+        name="grub_pbkdf2",
+        hash=_grub_pbkdf2,
+        default_cost=10_000,
+        max_cost=2**31 - 1,
+    )
+)
+
+
+def calibrate_cost(hash_format: HashFormat, budget_seconds: float) -> int:
+    """
+    Find the highest cost whose hash fits a latency budget on this host.
+
+    One hash is timed at the default cost and the time extrapolated, so this
+    takes about as long as one hash. The cost never drops below the default.
+
+    Args:
+        hash_format: Format to calibrate
+        budget_seconds: Time one hash may take
+
+    Returns:
+        Cost to hash with
+    """
+    cost = hash_format.default_cost
+    start = time.perf_counter()
+    hash_format.hash("calibration-password", cost)
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    if hash_format.exponential:
+        while cost < hash_format.max_cost and elapsed * 2 <= budget_seconds:
+            cost += 1
+            elapsed *= 2
+    else:
+        cost = int(cost * budget_seconds / elapsed)
+    return min(max(cost, hash_format.default_cost), hash_format.max_cost)
 
 
 class PasswordHasher:
     """Hashes passwords for use in kickstart files."""
 
+    @staticmethod
+    def hash(password: str, format_name: str, cost: Optional[int] = None) -> str:
+        """
+        Hash a password in one of the registered formats.
+
+        Args:
+            password: Plain text password to hash
+            format_name: Name of a format in HASH_FORMATS
+            cost: Rounds or cost factor (defaults to the format's default)
+
+        Returns:
+            Hash with a new random salt
+
+        Raises:
+            KeyError: If the format isn't registered
+            HashFormatUnavailable: If this host can't compute the format
+        """
+        hash_format = HASH_FORMATS[format_name]
+        if not hash_format.available():
+            raise HashFormatUnavailable(f"{format_name} hashes aren't available")
+        return hash_format.hash(password, cost or hash_format.default_cost)
+
     @staticmethod
     def hash_sha512(password: str) -> str:
         """
@@ -19,11 +214,4 @@ class PasswordHasher:
         Returns:
             SHA-512 hashed password suitable for kickstart files
         """
-        # Generate a random salt
-        salt_chars = string.ascii_letters + string.digits + "./"
-        salt = "".join(secrets.choice(salt_chars) for _ in range(16))
-
-        # Hash the password with the salt using SHA-512
-        hashed = sha512_crypt.using(salt=salt, rounds=5000).hash(password)
-
-        return hashed
+        return _sha512_crypt(password, 5000)
@@ -0,0 +1,264 @@
+"""Manifest of the built frontend, computed once and used to serve assets."""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Set, Union
+
+from starlette.responses import FileResponse, Response
+
+# Vite's build manifest (build.manifest in gui/vite.config.ts), which lists
+# the content-hashed files it wrote, such as assets/index-BPH6GUYS.js
+BUILD_MANIFEST = ".vite/manifest.json"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Precompressed siblings we look for, in order of preference
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Files smaller than this are not worth compressing on the fly
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "image/svg+xml",
+    "text/javascript",
+}
+
+ENCODING_ETAG_SUFFIX = {"br": "-br", "gzip": "-gz"}
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    """A single file from the static directory."""
+
+    path: Path
+    media_type: str
+    etag: str
+    stat: os.stat_result
+    cache_control: str
+    # Content-Encoding -> precompressed file on disk, or bytes compressed at load
+    variants: Dict[str, Union[Path, bytes]] = field(default_factory=dict)
+    # Content-Encoding -> stat of the precompressed file on disk
+    variant_stats: Dict[str, os.stat_result] = field(default_factory=dict)
+
+
+def _is_compressible(media_type: str) -> bool:
+    """Check whether a media type benefits from compression."""
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+def read_hashed_files(static_dir: Path) -> Set[str]:
+    """
+    Read which files of a built frontend have content-hashed names.
+
+    Args:
+        static_dir: Directory containing the built frontend
+
+    Returns:
+        Paths relative to static_dir listed in Vite's build manifest (empty
+        if there is none)
+    """
+    try:
+        chunks = json.loads((static_dir / BUILD_MANIFEST).read_text())
+    except (OSError, ValueError):
+        return set()
+    hashed = set()
+    for chunk in chunks.values():
+        hashed.add(chunk["file"])
+        hashed.update(chunk.get("css", []))
+        hashed.update(chunk.get("assets", []))
+    return hashed
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weakly compare an If-None-Match header with an ETag (RFC 9110 13.1.2)."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """
+    Parse an Accept-Encoding header.
+
+    Args:
+        header: Raw header value
+
+    Returns:
+        Mapping of encoding to its q-value (only entries with q > 0)
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        encoding, _, params = part.strip().partition(";")
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted[encoding] = quality
+    return accepted
+
+
+class StaticManifest:
+    """
+    Index of the files in a static directory.
+
+    The directory is walked once when the manifest is built. Requests are then
+    answered from the in-memory index without touching the filesystem to
+    resolve or stat paths, and only paths present in the index can be served,
+    which rules out path traversal. Files Vite's build manifest lists as
+    content-hashed are cached as immutable; everything else is revalidated.
+    """
+
+    def __init__(self, assets: Dict[str, StaticAsset]):
+        """Initialize the manifest from prebuilt assets."""
+        self.assets = assets
+
+    @classmethod
+    def build(cls, static_dir: Path) -> "StaticManifest":
+        """
+        Walk a static directory and build its manifest.
+
+        Args:
+            static_dir: Directory containing the built frontend
+
+        Returns:
+            Manifest keyed by POSIX path relative to static_dir
+        """
+        assets: Dict[str, StaticAsset] = {}
+        if not static_dir.is_dir():
+            return cls(assets)
+
+        hashed = read_hashed_files(static_dir)
+        build_metadata = (static_dir / BUILD_MANIFEST).parent
+        files = sorted(
+            p
+            for p in static_dir.rglob("*")
+            if p.is_file() and build_metadata not in p.parents
+        )
+        names = {p.relative_to(static_dir).as_posix() for p in files}
+
+        for file_path in files:
+            rel_path = file_path.relative_to(static_dir).as_posix()
+
+            # Precompressed siblings are served as variants of their source file
+            if any(
+                rel_path.endswith(suffix) and rel_path[: -len(suffix)] in names
+                for suffix in PRECOMPRESSED_SUFFIXES.values()
+            ):
+                continue
+
+            content = file_path.read_bytes()
+            media_type = (
+                mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+            )
+
+            variants: Dict[str, Union[Path, bytes]] = {}
+            variant_stats: Dict[str, os.stat_result] = {}
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                if f"{rel_path}{suffix}" in names:
+                    variant = file_path.with_name(file_path.name + suffix)
+                    variants[encoding] = variant
+                    variant_stats[encoding] = variant.stat()
+            if (
+                "gzip" not in variants
+                and _is_compressible(media_type)
+                and len(content) >= MIN_COMPRESS_SIZE
+            ):
+                variants["gzip"] = gzip.compress(content, mtime=0)
+
+            if rel_path in hashed:
+                cache_control = IMMUTABLE_CACHE_CONTROL
+            else:
+                cache_control = REVALIDATE_CACHE_CONTROL
+
+            assets[rel_path] = StaticAsset(
+                path=file_path,
+                media_type=media_type,
+                etag=f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"',
+                stat=file_path.stat(),
+                cache_control=cache_control,
+                variants=variants,
+                variant_stats=variant_stats,
+            )
+
+        return cls(assets)
+
+    def get(self, rel_path: str) -> Optional[StaticAsset]:
+        """Look up an asset by its path relative to the static directory."""
+        return self.assets.get(rel_path)
+
+    def response(
+        self, asset: StaticAsset, request_headers: Mapping[str, str]
+    ) -> Response:
+        """
+        Build the response for an asset.
+
+        Picks the best precompressed variant allowed by Accept-Encoding and
+        answers conditional requests with 304 when the ETag matches (weakly,
+        so W/ tags added by proxies match too).
+
+        Args:
+            asset: Asset to serve
+            request_headers: Headers of the incoming request
+
+        Returns:
+            Response serving the asset
+        """
+        encoding = None
+        if asset.variants:
+            accepted = parse_accept_encoding(request_headers.get("accept-encoding"))
+            candidates = [e for e in asset.variants if e in accepted]
+            if candidates:
+                encoding = max(candidates, key=lambda e: accepted[e])
+
+        etag = asset.etag
+        if encoding is not None:
+            etag = f'{etag[:-1]}{ENCODING_ETAG_SUFFIX[encoding]}"'
+
+        headers = {"cache-control": asset.cache_control, "etag": etag}
+        if asset.variants:
+            headers["vary"] = "Accept-Encoding"
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding is None:
+            return FileResponse(
+                asset.path,
+                media_type=asset.media_type,
+                headers=headers,
+                stat_result=asset.stat,
+            )
+
+        headers["content-encoding"] = encoding
+        variant = asset.variants[encoding]
+        if isinstance(variant, bytes):
+            return Response(
+                content=variant, media_type=asset.media_type, headers=headers
+            )
+        return FileResponse(
+            variant,
+            media_type=asset.media_type,
+            headers=headers,
+            stat_result=asset.variant_stats[encoding],
+        )
@@ -0,0 +1,490 @@
+"""Sandboxed Jinja2 rendering with time, output-size and recursion budgets."""
+
+import re
+import time
+from collections import ChainMap
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Optional
+
+from jinja2 import nodes, pass_eval_context
+from jinja2.filters import make_attrgetter
+from jinja2.runtime import markup_join, str_join
+from jinja2.sandbox import SandboxedEnvironment
+from jinja2.visitor import NodeTransformer
+
+from provisionR.metrics import metrics
+from provisionR.settings import Settings
+
+# Name of the filter that every {% for %} iterable is wrapped in at parse time
+LOOP_GUARD_FILTER = "_provisionr_loop_guard"
+
+# Name of the filter that every `~` concatenation is rewritten to at parse time
+CONCAT_FILTER = "_provisionr_concat"
+
+LIMIT_EXCEEDED_METRIC = "provisionr_template_render_limit_exceeded_total"
+
+
+@dataclass(frozen=True)
+class RenderLimits:
+    """Budgets applied to a single template render."""
+
+    timeout_seconds: float = 2.0
+    max_output_bytes: int = 1024 * 1024
+    max_loop_iterations: int = 100_000
+    max_call_depth: int = 64
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "RenderLimits":
+        """Build render limits from process settings."""
+        return cls(
+            timeout_seconds=settings.render_timeout_seconds,
+            max_output_bytes=settings.render_max_output_bytes,
+            max_loop_iterations=settings.render_max_loop_iterations,
+            max_call_depth=settings.render_max_call_depth,
+        )
+
+
+class TemplateRenderLimitExceeded(Exception):
+    """Raised when a template exceeds one of its render budgets."""
+
+    def __init__(self, limit: str, message: str):
+        """
+        Initialize the error.
+
+        Args:
+            limit: Which budget was exceeded (time, output, loop or depth)
+            message: Human readable description of the breach
+        """
+        super().__init__(message)
+        self.limit = limit
+
+
+class LazyValues(Mapping):
+    """
+    Template variables, some of which are computed only if a template uses them.
+
+    GuardedEnvironment.render_template() resolves variables against this
+    mapping as the template looks them up, so an expensive value the template
+    never references is never computed. Anything that copies the mapping
+    (e.g. an include with loop variables in scope) computes every value.
+    """
+
+    def __init__(self, values: Mapping[str, Any], lazy: Dict[str, Callable[[], Any]]):
+        """
+        Initialize the variables.
+
+        Args:
+            values: Variables with their values
+            lazy: Variables computed on first lookup (these take precedence)
+        """
+        self._values = {k: v for k, v in values.items() if k not in lazy}
+        self._lazy = dict(lazy)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+        value = self._values[key] = self._lazy.pop(key)()
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._values or key in self._lazy
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([*self._values, *self._lazy])
+
+    def __len__(self) -> int:
+        return len(self._values) + len(self._lazy)
+
+    def copy(self) -> Dict[str, Any]:
+        """Copy the values computed so far (Jinja does for tracebacks)."""
+        return dict(self._values)
+
+
+class _RenderBudget:
+    """Mutable accounting for one in-flight render."""
+
+    __slots__ = ("limits", "deadline", "iterations", "depth", "output_bytes")
+
+    def __init__(self, limits: RenderLimits):
+        self.limits = limits
+        self.deadline = time.monotonic() + limits.timeout_seconds
+        self.iterations = 0
+        self.depth = 0
+        self.output_bytes = 0
+
+    def check_time(self) -> None:
+        if time.monotonic() > self.deadline:
+            raise TemplateRenderLimitExceeded(
+                "time",
+                f"Template rendering exceeded the time budget of "
+                f"{self.limits.timeout_seconds:g}s",
+            )
+
+    def check_output(self, size: int) -> None:
+        if size > self.limits.max_output_bytes:
+            raise TemplateRenderLimitExceeded(
+                "output",
+                f"Template output exceeded the size budget of "
+                f"{self.limits.max_output_bytes} bytes",
+            )
+
+    def add_output(self, chunk: str) -> None:
+        # Most kickstart output is ASCII, where len() is already the byte count
+        size = len(chunk) if chunk.isascii() else len(chunk.encode("utf-8"))
+        self.output_bytes += size
+        self.check_output(self.output_bytes)
+        self.check_time()
+
+    def tick_iteration(self) -> None:
+        self.iterations += 1
+        if self.iterations > self.limits.max_loop_iterations:
+            raise TemplateRenderLimitExceeded(
+                "loop",
+                f"Template exceeded the budget of "
+                f"{self.limits.max_loop_iterations} loop iterations",
+            )
+        # Checking the clock on every iteration is measurable, so sample it
+        if self.iterations & 0xFF == 0:
+            self.check_time()
+
+    def enter_call(self) -> None:
+        self.depth += 1
+        if self.depth > self.limits.max_call_depth:
+            raise TemplateRenderLimitExceeded(
+                "depth",
+                f"Template exceeded the maximum call depth of "
+                f"{self.limits.max_call_depth}",
+            )
+        self.check_time()
+
+    def guard(self, iterable: Iterable[Any]) -> Iterator[Any]:
+        for item in iterable:
+            self.tick_iteration()
+            yield item
+
+
+# The budget of the render running in the current thread/task, if any
+_active_budget: ContextVar[Optional[_RenderBudget]] = ContextVar(
+    "provisionr_render_budget", default=None
+)
+
+
+def _loop_guard(iterable: Iterable[Any]) -> Iterable[Any]:
+    """Count iterations of a template for-loop against the active budget."""
+    budget = _active_budget.get()
+    if budget is None:
+        return iterable
+    return budget.guard(iterable)
+
+
+def _length(value: Any) -> int:
+    return len(value) if isinstance(value, str) else len(str(value))
+
+
+def _padded_size(value: Any, width: Any = 80, *args: Any, **kwargs: Any) -> int:
+    """Size of center/ljust/rjust/zfill results."""
+    return max(_length(value), width if isinstance(width, int) else 0)
+
+
+def _indented_size(value: Any, width: Any = 4, *args: Any, **kwargs: Any) -> int:
+    """Size of an indent filter result (every line padded)."""
+    text = str(value)
+    padding = len(width) if isinstance(width, str) else int(width)
+    return len(text) + (text.count("\n") + 1) * max(padding, 0)
+
+
+def _replaced_size(
+    value: Any, old: Any, new: Any, count: Optional[int] = None, *args: Any
+) -> int:
+    """Size of a replace result."""
+    text, old, new = str(value), str(old), str(new)
+    matches = text.count(old) if old else len(text) + 1
+    if isinstance(count, int) and 0 <= count < matches:
+        matches = count
+    return len(text) + matches * (len(new) - len(old))
+
+
+def _expanded_size(value: Any, tabsize: Any = 8, *args: Any, **kwargs: Any) -> int:
+    """Size of an expandtabs result."""
+    text = str(value)
+    return len(text) + text.count("\t") * (tabsize if isinstance(tabsize, int) else 8)
+
+
+def _formatted_size(spec: Any, *args: Any, **kwargs: Any) -> int:
+    """
+    Upper bound of a %- or {}-formatted string's size.
+
+    Widths and precisions written in the spec count in full, and so do
+    integer arguments when the spec takes widths from its arguments.
+    """
+    spec = str(spec)
+    size = len(spec)
+    for digits in re.findall(r"\d+", spec):
+        size += int(digits) if len(digits) < 10 else 10**10
+    dynamic_width = "*" in spec or re.search(r"\{[^{}]*\{", spec) is not None
+    for arg in (*args, *kwargs.values()):
+        if dynamic_width and isinstance(arg, int):
+            size += abs(arg)
+        else:
+            size += _length(arg)
+    return size
+
+
+def _joined_size(separator: Any, items: list) -> int:
+    """Size of joining already materialized items."""
+    return sum(_length(item) for item in items) + _length(separator) * max(
+        len(items) - 1, 0
+    )
+
+
+# Size of a str method's result: name -> (string, *args, **kwargs) -> size
+_STR_METHOD_SIZES: Dict[str, Callable[..., int]] = {
+    "center": _padded_size,
+    "ljust": _padded_size,
+    "rjust": _padded_size,
+    "zfill": _padded_size,
+    "replace": _replaced_size,
+    "expandtabs": _expanded_size,
+}
+
+
+class _ConcatGuard(NodeTransformer):
+    """Rewrites `a ~ b` into a filter checking the result's size first."""
+
+    def visit_Concat(self, node: nodes.Concat) -> nodes.Filter:
+        node = self.generic_visit(node)
+        return nodes.Filter(
+            nodes.Tuple(node.nodes, "load", lineno=node.lineno),
+            CONCAT_FILTER,
+            [],
+            [],
+            None,
+            None,
+            lineno=node.lineno,
+        )
+
+
+class GuardedEnvironment(SandboxedEnvironment):
+    """
+    Sandboxed Jinja2 environment that enforces RenderLimits.
+
+    On top of the standard sandbox (no access to unsafe attributes, bounded
+    range()), every render started through render_template() is subject to:
+
+    - a wall-clock budget, checked between output chunks, on every call and
+      periodically inside loops
+    - a budget on the size of the rendered output
+    - a budget on the total number of for-loop iterations
+    - a budget on the nesting depth of macro/function calls (recursion)
+
+    Operations that build strings or lists from template data are checked
+    before they run, against the output budget: repetition, `+` and `~`
+    concatenation, exponentiation, the center, indent, format, join and
+    replace filters, the padding/replacing str methods, list.extend, and
+    the buffers of {% set %} blocks, macros and call blocks. Intermediate
+    values are thus never much larger than the output may be.
+    """
+
+    intercepted_binops = frozenset(["*", "**", "+"])
+
+    def __init__(self, limits: Optional[RenderLimits] = None, **kwargs: Any):
+        """
+        Initialize the environment.
+
+        Args:
+            limits: Render budgets (defaults to RenderLimits())
+            **kwargs: Passed through to the Jinja2 Environment
+        """
+        super().__init__(**kwargs)
+        self.limits = limits or RenderLimits()
+        self.filters[LOOP_GUARD_FILTER] = _loop_guard
+        self.filters[CONCAT_FILTER] = self._guarded_concat_filter()
+        for name, size in (
+            ("center", _padded_size),
+            ("indent", _indented_size),
+            ("format", _formatted_size),
+        ):
+            self.filters[name] = self._sized(self.filters[name], size)
+        self.filters["replace"] = self._sized(
+            self.filters["replace"], _replaced_size, pass_arg=True
+        )
+        self.filters["join"] = self._guarded_join_filter(self.filters["join"])
+
+    def check_size(self, size: int) -> None:
+        """Refuse to build a value of `size` characters past the output budget."""
+        max_bytes = self.limits.max_output_bytes
+        if size > max_bytes:
+            raise TemplateRenderLimitExceeded(
+                "output",
+                f"Template expression would exceed the size budget of "
+                f"{max_bytes} bytes",
+            )
+
+    def concat(self, parts: Iterable[str]) -> str:  # type: ignore[override]
+        """Join a block, macro or call buffer once its size is known to fit."""
+        parts = list(parts)
+        self.check_size(sum(len(part) for part in parts))
+        return "".join(parts)
+
+    def _sized(
+        self, func: Callable, size: Callable[..., int], pass_arg: bool = False
+    ) -> Callable:
+        """Wrap a filter so its result's size is checked before it is built."""
+
+        @wraps(func)
+        def sized(*args: Any, **kwargs: Any) -> Any:
+            self.check_size(size(*args[1:] if pass_arg else args, **kwargs))
+            return func(*args, **kwargs)
+
+        return sized
+
+    def _guarded_concat_filter(self) -> Callable:
+        @pass_eval_context
+        def concat(eval_ctx, items: tuple) -> str:
+            self.check_size(sum(_length(item) for item in items))
+            return markup_join(items) if eval_ctx.autoescape else str_join(items)
+
+        return concat
+
+    def _guarded_join_filter(self, join: Callable) -> Callable:
+        @wraps(join)
+        def guarded_join(
+            eval_ctx, value: Iterable[Any], d: str = "", attribute: Any = None
+        ) -> str:
+            if attribute is not None:
+                value = map(make_attrgetter(self, attribute), value)
+            items = list(value)
+            self.check_size(_joined_size(d, items))
+            return join(eval_ctx, items, d)
+
+        return guarded_join
+
+    def _parse(self, source: str, name: Optional[str], filename: Optional[str]):
+        """
+        Parse a template, wrapping every for-loop iterable in the loop guard
+        and every `~` concatenation in a size check.
+        """
+        tree = _ConcatGuard().visit(super()._parse(source, name, filename))
+        for loop in tree.find_all(nodes.For):
+            loop.iter = nodes.Filter(
+                loop.iter, LOOP_GUARD_FILTER, [], [], None, None, lineno=loop.lineno
+            )
+        return tree
+
+    def call(__self, __context, __obj, *args: Any, **kwargs: Any) -> Any:  # noqa: N805
+        """Call a function from a template, tracking the call depth."""
+        args = __self._check_method_size(__obj, args, kwargs)
+        budget = _active_budget.get()
+        if budget is None:
+            return super().call(__context, __obj, *args, **kwargs)
+        budget.enter_call()
+        try:
+            return super().call(__context, __obj, *args, **kwargs)
+        finally:
+            budget.depth -= 1
+
+    def _check_method_size(self, obj: Any, args: tuple, kwargs: dict) -> tuple:
+        """
+        Check the result size of str methods that pad, replace or join.
+
+        Returns:
+            The call's arguments (an iterable to join is materialized)
+        """
+        owner = getattr(obj, "__self__", None)
+        name = getattr(obj, "__name__", None)
+        if isinstance(owner, str):
+            if name == "join" and len(args) == 1:
+                args = (list(args[0]),)
+                self.check_size(_joined_size(owner, args[0]))
+            elif name in _STR_METHOD_SIZES:
+                self.check_size(_STR_METHOD_SIZES[name](owner, *args, **kwargs))
+        elif isinstance(owner, list) and name == "extend" and len(args) == 1:
+            if hasattr(args[0], "__len__"):
+                self.check_size(len(owner) + len(args[0]))
+        return args
+
+    def wrap_str_format(self, value: Any) -> Optional[Callable[..., str]]:
+        """Sandbox str.format/format_map, checking the result's size first."""
+        wrapper = super().wrap_str_format(value)
+        if wrapper is None:
+            return None
+        spec = value.__self__
+
+        @wraps(wrapper)
+        def sized(*args: Any, **kwargs: Any) -> str:
+            if value.__name__ == "format_map" and args:
+                self.check_size(_formatted_size(spec, **dict(args[0])))
+            else:
+                self.check_size(_formatted_size(spec, *args, **kwargs))
+            return wrapper(*args, **kwargs)
+
+        return sized
+
+    def call_binop(self, context, operator: str, left: Any, right: Any) -> Any:
+        """Refuse repetitions, concatenations and powers that blow the budget."""
+        if operator == "*":
+            for sequence, count in ((left, right), (right, left)):
+                if isinstance(sequence, (str, list, tuple)) and isinstance(count, int):
+                    self.check_size(len(sequence) * count)
+        elif operator == "+":
+            if isinstance(left, (str, list, tuple)) and isinstance(
+                right, (str, list, tuple)
+            ):
+                self.check_size(len(left) + len(right))
+        elif operator == "**":
+            if isinstance(left, int) and isinstance(right, int) and right > 0:
+                if abs(left) > 1:
+                    self.check_size(abs(left).bit_length() * right // 8)
+        return super().call_binop(context, operator, left, right)
+
+    def _render_chunks(self, template, context: Mapping[str, Any]) -> Iterator[str]:
+        """Render a template chunk by chunk, looking variables up lazily."""
+        if isinstance(context, dict):
+            yield from template.generate(**context)
+            return
+        # Shared, the context resolves names against the mapping itself
+        # instead of copying it
+        jinja_context = template.new_context(
+            ChainMap(context, template.globals), shared=True
+        )
+        try:
+            yield from template.root_render_func(jinja_context)
+        except Exception:
+            yield self.handle_exception()
+
+    def render_template(self, template, context: Mapping[str, Any]) -> str:
+        """
+        Render a template from this environment within the render budgets.
+
+        Args:
+            template: Template loaded from this environment
+            context: Variables available to the template (LazyValues are
+                only computed if the template uses them)
+
+        Returns:
+            Rendered template content
+
+        Raises:
+            TemplateRenderLimitExceeded: If any budget is exceeded
+        """
+        budget = _RenderBudget(self.limits)
+        token = _active_budget.set(budget)
+        try:
+            chunks = []
+            for chunk in self._render_chunks(template, context):
+                budget.add_output(chunk)
+                chunks.append(chunk)
+            return "".join(chunks)
+        except RecursionError:
+            exc = TemplateRenderLimitExceeded(
+                "depth", "Template recursion exceeded the interpreter stack"
+            )
+            metrics.inc(LIMIT_EXCEEDED_METRIC, limit=exc.limit)
+            raise exc from None
+        except TemplateRenderLimitExceeded as exc:
+            metrics.inc(LIMIT_EXCEEDED_METRIC, limit=exc.limit)
+            raise
+        finally:
+            _active_budget.reset(token)
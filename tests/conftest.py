@@ -1,25 +1,36 @@
 """Pytest configuration and fixtures."""
 
 import os
+import shutil
+import tempfile
+from pathlib import Path
+
 import pytest
 from fastapi.testclient import TestClient
-from provisionR.app import create_app
+
+# Point the process settings at a scratch database before anything reads them
+_DB_DIR = tempfile.mkdtemp(prefix="provisionr-test-")
+os.environ["PROVISIONR_DB_PATH"] = str(Path(_DB_DIR) / "provisionr.db")
+
+from provisionR.app import create_app  # noqa: E402
 
 
 @pytest.fixture(scope="session", autouse=True)
-def set_test_mode():
-    """Set test mode environment variable for all tests."""
-    os.environ["PROVISIONR_TEST_MODE"] = "true"
-    yield
-    os.environ.pop("PROVISIONR_TEST_MODE", None)
+def scratch_database_dir():
+    """Remove the scratch database once all tests have run."""
+    yield _DB_DIR
+    from provisionR.database import get_database
+
+    get_database().dispose()
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
 
 
 @pytest.fixture(autouse=True)
 def reset_database():
-    """Reset the in-memory database before each test."""
-    # Import after setting test mode
-    from provisionR.database import Base, engine
+    """Reset the scratch database before each test."""
+    from provisionR.database import Base, get_database
 
+    engine = get_database().engine
     # Drop all tables
     Base.metadata.drop_all(bind=engine)
     # Recreate all tables
@@ -1,7 +1,16 @@
 """Integration tests for API endpoints."""
 
+import asyncio
+import csv
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi.testclient import TestClient
 
+from provisionR.app import create_app
+from provisionR.utils import MachineIdentity
+
 
 class TestConfigEndpoint:
     """Tests for the configuration endpoints."""
@@ -34,6 +43,123 @@ class TestConfigEndpoint:
         assert get_response.json()["target_os"] == "Ubuntu25.04"
         assert get_response.json()["values"]["key1"] == "value1"
 
+    def test_get_config_not_modified(self, client: TestClient):
+        """Test that polling with If-None-Match returns 304 until a change."""
+        etag = client.get("/api/v1/config").headers["etag"]
+
+        response = client.get("/api/v1/config", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+        client.patch("/api/v1/config", json={"values": {"k": "v"}})
+        response = client.get("/api/v1/config", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    def test_patch_config_merges(self, client: TestClient):
+        """Test that PATCH applies RFC 7396 merge semantics."""
+        client.put(
+            "/api/v1/config",
+            json={"values": {"keep": 1, "drop": 2, "net": {"gw": "a", "dns": "b"}}},
+        )
+
+        response = client.patch(
+            "/api/v1/config",
+            json={"values": {"drop": None, "net": {"dns": "c"}, "new": 3}},
+            headers={"Content-Type": "application/merge-patch+json"},
+        )
+        assert response.status_code == 200
+        assert response.json()["values"] == {
+            "keep": 1,
+            "net": {"gw": "a", "dns": "c"},
+            "new": 3,
+        }
+        assert response.json()["target_os"] == "Rocky9"
+
+    def test_patch_config_invalid_result(self, client: TestClient):
+        """Test that a patch producing an invalid config is rejected."""
+        response = client.patch("/api/v1/config", json={"target_os": "Windows"})
+        assert response.status_code == 422
+
+    def test_if_match_precondition(self, client: TestClient):
+        """Test optimistic concurrency with If-Match."""
+        etag = client.get("/api/v1/config").headers["etag"]
+
+        first = client.patch(
+            "/api/v1/config", json={"values": {"a": 1}}, headers={"If-Match": etag}
+        )
+        assert first.status_code == 200
+
+        # A second writer still holding the old ETag loses
+        second = client.put(
+            "/api/v1/config", json={"values": {"b": 2}}, headers={"If-Match": etag}
+        )
+        assert second.status_code == 412
+        assert second.headers["etag"] == first.headers["etag"]
+        assert client.get("/api/v1/config").json()["values"] == {"a": 1}
+
+
+class TestLayeredConfig:
+    """Tests for group and machine config layers."""
+
+    MACHINE = {"mac": "00:11:22:33:44:55", "uuid": "test-uuid", "serial": "SN1"}
+
+    def test_effective_values_merge_layers(self, client: TestClient):
+        """Test that machine values override group values, then global ones."""
+        client.put(
+            "/api/v1/config",
+            json={"values": {"tz": "UTC", "role": "none", "dc": "ams"}},
+        )
+        response = client.put(
+            "/api/v1/config/groups/web", json={"values": {"role": "web"}}
+        )
+        assert response.status_code == 200
+        response = client.put(
+            "/api/v1/config/machines",
+            json={**self.MACHINE, "group": "web", "values": {"dc": "lon"}},
+        )
+        assert response.status_code == 200
+
+        data = client.get("/api/v1/config/machines", params=self.MACHINE).json()
+        assert data["group"] == "web"
+        assert data["values"] == {"tz": "UTC", "role": "web", "dc": "lon"}
+
+        # A global change is reflected in the materialized machine values
+        client.put("/api/v1/config", json={"values": {"tz": "CET"}})
+        data = client.get("/api/v1/config/machines", params=self.MACHINE).json()
+        assert data["values"] == {"tz": "CET", "role": "web", "dc": "lon"}
+
+        assert [g["name"] for g in client.get("/api/v1/config/groups").json()] == [
+            "web"
+        ]
+        assert client.delete("/api/v1/config/groups/web").status_code == 204
+        assert client.delete("/api/v1/config/groups/web").status_code == 404
+        response = client.delete("/api/v1/config/machines", params=self.MACHINE)
+        assert response.status_code == 204
+        data = client.get("/api/v1/config/machines", params=self.MACHINE).json()
+        assert data["machine"] is None
+
+
+class TestEventPublishing:
+    """Tests for the events published to /api/v1/events subscribers."""
+
+    def test_activity_published(self, client: TestClient):
+        """Test that kickstart fetches and config changes are published."""
+        params = {"mac": "00:11:22:33:44:55", "uuid": "test-uuid", "serial": "SN1"}
+        client.get("/api/v1/ks", params=params)
+        client.get("/api/v1/ks", params=params)
+        client.patch("/api/v1/config", json={"values": {"k": "v"}})
+
+        events, _ = client.app.state.event_bus.events_after(0)
+        assert [e.type for e in events] == [
+            "machine-created",
+            "kickstart-fetched",
+            "kickstart-fetched",
+            "config-changed",
+        ]
+        assert events[1].data["template_name"] == "default"
+        assert events[3].data["scope"] == "global"
+
 
 class TestHealthEndpoint:
     """Tests for the health check endpoint."""
@@ -47,6 +173,16 @@ class TestHealthEndpoint:
         assert data["service"] == "provisionR"
 
 
+class TestMetricsEndpoint:
+    """Tests for the metrics endpoint."""
+
+    def test_metrics_exposed_as_text(self, client: TestClient):
+        """Test that metrics are served in the Prometheus text format."""
+        response = client.get("/api/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+
+
 class TestKickstartEndpoint:
     """Tests for the kickstart generation endpoint."""
 
@@ -115,6 +251,118 @@ class TestKickstartEndpoint:
         assert "not found" in response.json()["detail"].lower()
 
 
+class TestKickstartPreviewEndpoint:
+    """Tests for the side-effect-free kickstart preview endpoint."""
+
+    def test_preview_unsaved_template(self, client: TestClient):
+        """Test rendering template content sent in the request body."""
+        response = client.post(
+            "/api/v1/ks/preview",
+            json={
+                "template": "host={{ hostname }} mac={{ mac }}\n"
+                "rootpw --iscrypted {{ root_password }}",
+                "values": {"hostname": "web01"},
+            },
+        )
+        assert response.status_code == 200
+        assert "host=web01 mac=00:11:22:33:44:55" in response.text
+        assert "$6$preview$" in response.text
+
+    def test_preview_stored_template(self, client: TestClient):
+        """Test rendering a stored template by name."""
+        response = client.post(
+            "/api/v1/ks/preview",
+            json={"template_name": "default", "serial": "SN-PREVIEW"},
+        )
+        assert response.status_code == 200
+        assert "SN-PREVIEW" in response.text
+
+    def test_preview_does_not_create_machines(self, client: TestClient):
+        """Test that previews leave no machine records behind."""
+        client.post("/api/v1/ks/preview", json={"template": "{{ root_password }}"})
+
+        export = client.get("/api/v1/machines/export")
+        assert len(export.text.strip().split("\n")) == 1  # Header only
+
+    def test_preview_syntax_error(self, client: TestClient):
+        """Test that a broken template returns 422 with the error line."""
+        response = client.post("/api/v1/ks/preview", json={"template": "ok\n{% if %}"})
+        assert response.status_code == 422
+        assert "line 2" in response.json()["detail"]
+
+    def test_preview_nonexistent_template(self, client: TestClient):
+        """Test that previewing a missing stored template returns 404."""
+        response = client.post(
+            "/api/v1/ks/preview", json={"template_name": "nonexistent_template"}
+        )
+        assert response.status_code == 404
+
+
+class TestTemplateRules:
+    """Tests for rule-based template selection."""
+
+    MACHINE = {"mac": "00:1a:2b:33:44:55", "uuid": "test-uuid", "serial": "SN1"}
+
+    def test_rule_crud(self, client: TestClient):
+        """Test creating, listing and deleting rules."""
+        response = client.post(
+            "/api/v1/rules",
+            json={"match_type": "mac_prefix", "pattern": "00:1A:2B"},
+        )
+        assert response.status_code == 201
+        rule_id = response.json()["id"]
+
+        assert [r["id"] for r in client.get("/api/v1/rules").json()] == [rule_id]
+        assert client.delete(f"/api/v1/rules/{rule_id}").status_code == 204
+        assert client.delete(f"/api/v1/rules/{rule_id}").status_code == 404
+        assert client.get("/api/v1/rules").json() == []
+
+    def test_invalid_rule_rejected(self, client: TestClient):
+        """Test that invalid patterns are rejected."""
+        response = client.post(
+            "/api/v1/rules", json={"match_type": "serial_pattern", "pattern": "SN["}
+        )
+        assert response.status_code == 422
+
+    def test_kickstart_uses_matching_rule(self, client: TestClient):
+        """Test that /v1/ks picks the template and values of the best rule."""
+        client.post(
+            "/api/v1/rules",
+            json={
+                "match_type": "query_param",
+                "param_name": "role",
+                "pattern": "web",
+                "template_name": "web_only",
+                "priority": 10,
+            },
+        )
+        client.post(
+            "/api/v1/rules",
+            json={
+                "match_type": "mac_prefix",
+                "pattern": "00:1A:2B",
+                "values": {"rack": "r42"},
+            },
+        )
+
+        resolved = client.get("/api/v1/rules/resolve", params=self.MACHINE).json()
+        assert resolved["template_name"] == "default"
+        assert resolved["values"] == {"rack": "r42"}
+        assert client.get("/api/v1/ks", params=self.MACHINE).status_code == 200
+
+        # The query parameter rule has a lower priority value, so it wins
+        response = client.get("/api/v1/ks", params={**self.MACHINE, "role": "web"})
+        assert response.status_code == 404
+        assert "web_only" in response.json()["detail"]
+
+        # An explicit template_name overrides the rules
+        response = client.get(
+            "/api/v1/ks",
+            params={**self.MACHINE, "role": "web", "template_name": "default"},
+        )
+        assert response.status_code == 200
+
+
 class TestStaticFileServing:
     """Tests for static file serving."""
 
@@ -134,6 +382,15 @@ class TestStaticFileServing:
         response = client.get("/../../../etc/passwd")
         assert response.status_code == 404
 
+    def test_index_revalidated_with_etag(self, client: TestClient):
+        """Test that index.html carries an ETag and honours If-None-Match."""
+        response = client.get("/")
+        assert response.headers["cache-control"] == "no-cache"
+        etag = response.headers["etag"]
+
+        response = client.get("/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
 
 class TestPasswordPersistence:
     """Tests for password persistence across multiple requests."""
@@ -173,6 +430,42 @@ class TestPasswordPersistence:
         # Content should be different (different passwords)
         assert response1.text != response2.text
 
+    def test_concurrent_new_machines_with_group_commit(self):
+        """Test concurrent first boots with the group-commit writer running."""
+        with TestClient(create_app()) as client:
+
+            def fetch(n: int) -> int:
+                params = {"mac": f"02:00:00:00:00:{n:02x}", "uuid": "u", "serial": "s"}
+                return client.get("/api/v1/ks", params=params).status_code
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                statuses = list(pool.map(fetch, range(16)))
+
+            export = client.get("/api/v1/machines/export")
+
+        assert statuses == [200] * 16
+        assert len(export.text.strip().split("\n")) == 17  # Header + 16 rows
+
+    def test_new_passphrases_unique_across_fleet(self):
+        """Test that new machines get passphrases no stored machine has."""
+        from provisionR.metrics import metrics
+        from provisionR.services.passphrase_index import ENTRIES_METRIC
+
+        with TestClient(create_app()) as client:
+            for n in range(10):
+                params = {"mac": f"02:00:00:00:01:{n:02x}", "uuid": "u", "serial": "s"}
+                assert client.get("/api/v1/ks", params=params).status_code == 200
+            export = client.get("/api/v1/machines/export").text
+
+        rows = list(csv.DictReader(io.StringIO(export)))
+        passphrases = {
+            row[name]
+            for row in rows
+            for name in ("root_password", "user_password", "luks_password")
+        }
+        assert len(passphrases) == 30
+        assert metrics.get(ENTRIES_METRIC) == 30
+
     def test_no_passwords_when_disabled(self, client: TestClient):
         """Test that passwords are not generated when generate_passwords is False."""
         # Disable password generation
@@ -191,6 +484,378 @@ class TestPasswordPersistence:
         # (actual assertion depends on template implementation)
 
 
+class TestKickstartAdmission:
+    """Tests for kickstart admission control."""
+
+    def test_saturated_returns_503_with_retry_after(self):
+        """Test that kickstarts are shed when saturated but health still works."""
+        from provisionR.services.admission import AdmissionController
+
+        app = create_app()
+        admission = AdmissionController(
+            max_concurrent=1, max_queue=0, retry_after_seconds=7
+        )
+        app.state.admission = admission
+        client = TestClient(app)
+        params = {"mac": "00:11:22:33:44:55", "uuid": "u", "serial": "s"}
+        assert client.get("/api/v1/ks", params=params).status_code == 200
+
+        # Take the only slot, as a long-running request would
+        assert asyncio.run(admission.acquire())
+        response = client.get("/api/v1/ks", params=params)
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "7"
+        assert client.get("/api/health").status_code == 200
+
+        admission.release()
+        assert client.get("/api/v1/ks", params=params).status_code == 200
+        assert admission.in_flight == 0
+
+    def test_overflowing_queue_sheds_load(self):
+        """Test that waiting requests hold no connection, so overflow gets 503s."""
+        from provisionR.settings import get_settings
+
+        settings = get_settings().model_copy(
+            update={
+                "ks_max_concurrent": 1,
+                "ks_max_queue": 16,
+                "ks_max_wait_seconds": 1.0,
+            }
+        )
+
+        def fetch(n: int) -> int:
+            params = {"mac": f"AA:BB:CC:00:01:{n:02X}", "uuid": "u", "serial": f"S{n}"}
+            return client.get("/api/v1/ks", params=params).status_code
+
+        with TestClient(create_app(settings)) as client:
+            admission = client.app.state.admission
+            # Take the only slot, as a long-running request would
+            assert client.portal.call(admission.acquire)
+            with ThreadPoolExecutor(max_workers=24) as pool:
+                statuses = pool.map(fetch, range(24))
+                # More waiters than the pool's 1 + 10 connections
+                deadline = time.monotonic() + 5
+                while admission.queue_depth < 16 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                assert admission.queue_depth == 16
+                assert list(statuses) == [503] * 24
+            client.portal.call(admission.release)
+            assert fetch(99) == 200
+
+
+class TestKickstartPrerender:
+    """Tests for serving pre-rendered kickstarts."""
+
+    def test_repeat_boot_served_from_cache(self):
+        """Test that a known machine's next plain request is a cache hit."""
+        from provisionR.metrics import metrics
+        from provisionR.services.prerender import HITS_METRIC
+
+        params = {"mac": "AA:BB:CC:00:00:01", "uuid": "u", "serial": "PRE-1"}
+        with TestClient(create_app()) as client:
+            first = client.get("/api/v1/ks", params=params)
+            hits = metrics.get(HITS_METRIC)
+            deadline = time.monotonic() + 5
+            while metrics.get(HITS_METRIC) == hits and time.monotonic() < deadline:
+                time.sleep(0.02)
+                cached = client.get("/api/v1/ks", params=params)
+
+        assert metrics.get(HITS_METRIC) == hits + 1
+        assert cached.text == first.text
+        assert "provisionr_prerender_hit_ratio" in client.get("/api/metrics").text
+
+
+class TestIpxeScript:
+    """Tests for per-machine iPXE boot scripts."""
+
+    def test_script_chains_to_kickstart(self, client: TestClient):
+        """Test that the script points inst.ks at the machine's kickstart."""
+        params = {"mac": "aa-bb-cc-00-00-03", "uuid": "u", "serial": "IPXE-1"}
+        response = client.get("/api/v1/ipxe", params=params)
+
+        assert response.status_code == 200
+        assert response.text.startswith("#!ipxe")
+        url = "http://testserver/api/v1/ks?mac=aa-bb-cc-00-00-03&uuid=u&serial=IPXE-1"
+        assert f"inst.ks={url}" in response.text
+        # No credentials until the kickstart itself is fetched
+        assert "IPXE-1" not in client.get("/api/v1/machines/export").text
+
+    def test_script_uses_public_url(self):
+        """Test that PROVISIONR_PUBLIC_URL overrides the request's base URL."""
+        from provisionR.settings import get_settings
+
+        settings = get_settings().model_copy(update={"public_url": "https://prov.lan/"})
+        client = TestClient(create_app(settings))
+        params = {"mac": "AA:BB:CC:00:00:04", "uuid": "u", "serial": "IPXE-2"}
+        response = client.get("/api/v1/ipxe", params=params)
+
+        assert "inst.ks=https://prov.lan/api/v1/ks?" in response.text
+
+    def test_kickstart_prefetched_after_script(self):
+        """Test that a known machine's kickstart is warm once it gets its script."""
+        from provisionR.metrics import metrics
+        from provisionR.services.prerender import HITS_METRIC
+
+        params = {"mac": "aa:bb:cc:00:00:05", "uuid": "u", "serial": "IPXE-3"}
+        with TestClient(create_app()) as client:
+            # Known, but last fetched with its identifiers spelled differently
+            client.get("/api/v1/ks", params={**params, "mac": "AA:BB:CC:00:00:05"})
+            client.get("/api/v1/ipxe", params=params)
+            hits = metrics.get(HITS_METRIC)
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                entry = client.app.state.kickstart_warmer._entries.get(
+                    MachineIdentity.from_raw(**params).key
+                )
+                if entry is not None and entry.form[0] == params["mac"]:
+                    break
+                time.sleep(0.02)
+            client.get("/api/v1/ks", params=params)
+
+        assert metrics.get(HITS_METRIC) == hits + 1
+
+
+class TestMemoryCredentialStore:
+    """Tests for serving kickstarts with the in-memory credential store."""
+
+    def test_passwords_reused_from_memory(self):
+        """Test that a returning machine gets its passwords from memory."""
+        from provisionR.metrics import metrics
+        from provisionR.services.credential_store import (
+            MEMORY_HITS_METRIC,
+            MemoryCredentialStore,
+        )
+
+        app = create_app()
+        app.state.credential_store = MemoryCredentialStore()
+        app.state.kickstart_warmer = None
+        client = TestClient(app)
+        params = {"mac": "AA:BB:CC:00:00:02", "uuid": "u", "serial": "MEM-1"}
+        first = client.get("/api/v1/ks", params=params)
+        hits = metrics.get(MEMORY_HITS_METRIC)
+
+        second = client.get("/api/v1/ks", params=params)
+        assert second.text == first.text
+        assert metrics.get(MEMORY_HITS_METRIC) == hits + 1
+        assert "MEM-1" in client.get("/api/v1/machines/export").text
+
+
+class TestMachineLastSeen:
+    """Tests for the kickstart access log."""
+
+    def test_last_seen_recorded_after_fetch(self, client: TestClient):
+        """Test that a kickstart fetch shows up as the machine's last-seen."""
+        params = {"mac": "AA:BB:CC:DD:EE:FF", "uuid": "uuid-1", "serial": "SN1"}
+        client.get("/api/v1/ks", params=params)
+        client.app.state.access_log.flush()
+
+        response = client.get("/api/v1/machines/last-seen", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["last_template"] == "default"
+        assert data["fetch_count"] == 1
+
+    def test_unknown_machine_returns_404(self, client: TestClient):
+        """Test that a machine that never fetched a kickstart returns 404."""
+        params = {"mac": "AA:BB:CC:DD:EE:FF", "uuid": "uuid-1", "serial": "SN1"}
+        response = client.get("/api/v1/machines/last-seen", params=params)
+        assert response.status_code == 404
+
+
+class TestMachineInventory:
+    """Tests for the paginated machine inventory."""
+
+    def test_list_machines_paginates_and_searches(self, client: TestClient):
+        """Test keyset pagination and search without exposing passwords."""
+        for n in range(3):
+            client.get(
+                "/api/v1/ks",
+                params={
+                    "mac": f"00:11:22:33:44:0{n}",
+                    "uuid": f"u-{n}",
+                    "serial": f"SN-{n}",
+                },
+            )
+
+        first = client.get("/api/v1/machines", params={"limit": 2}).json()
+        assert [m["serial"] for m in first["items"]] == ["SN-0", "SN-1"]
+        assert "root_password" not in first["items"][0]
+        second = client.get(
+            "/api/v1/machines", params={"limit": 2, "cursor": first["next_cursor"]}
+        ).json()
+        assert [m["serial"] for m in second["items"]] == ["SN-2"]
+        assert second["next_cursor"] is None
+
+        found = client.get("/api/v1/machines", params={"contains": "44:01"}).json()
+        assert [m["serial"] for m in found["items"]] == ["SN-1"]
+
+    def test_invalid_cursor(self, client: TestClient):
+        """Test that a malformed cursor is a client error."""
+        response = client.get("/api/v1/machines", params={"cursor": "bogus"})
+        assert response.status_code == 400
+
+
+class TestPasswordRotation:
+    """Tests for bulk password rotation jobs."""
+
+    def test_rotate_and_roll_back(self, client: TestClient):
+        """Test that a rotation job replaces passwords and can be rolled back."""
+        for n in range(2):
+            client.get(
+                "/api/v1/ks",
+                params={"mac": f"00:11:22:33:44:0{n}", "uuid": "u", "serial": f"R{n}"},
+            )
+        before = client.get("/api/v1/machines/export").text
+
+        response = client.post("/api/v1/machines/rotations", json={"prefix": "R1"})
+        assert response.status_code == 202
+        job = response.json()
+        assert job["total"] == 1
+        deadline = time.monotonic() + 10
+        while job["status"] != "completed" and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/api/v1/machines/rotations/{job['id']}").json()
+        assert job["rotated"] == 1
+
+        after = client.get("/api/v1/machines/export").text
+        changed = set(after.splitlines()) - set(before.splitlines())
+        assert [line.split(",")[2] for line in changed] == ["R1"]
+
+        response = client.post(f"/api/v1/machines/rotations/{job['id']}/rollback")
+        assert response.json()["status"] == "rolled_back"
+        assert client.get("/api/v1/machines/export").text == before
+
+    def test_unknown_job(self, client: TestClient):
+        """Test that unknown rotation jobs return 404."""
+        assert client.get("/api/v1/machines/rotations/99").status_code == 404
+        response = client.post("/api/v1/machines/rotations/99/rollback")
+        assert response.status_code == 404
+
+
+class TestJobs:
+    """Tests for background jobs."""
+
+    def test_export_job_result_download(self, tmp_path):
+        """Test running the export as a job and downloading its CSV."""
+        from provisionR.database import SessionLocal
+        from provisionR.services.export_service import export_job
+        from provisionR.services.job_runner import JobRunner
+
+        app = create_app()
+        app.state.job_runner = JobRunner(SessionLocal, tmp_path)
+        app.state.job_runner.register("export", export_job, "machines.csv", "text/csv")
+        client = TestClient(app)
+        client.get(
+            "/api/v1/ks",
+            params={"mac": "00:11:22:33:44:55", "uuid": "u", "serial": "SN-JOB"},
+        )
+
+        response = client.post("/api/v1/jobs", json={"kind": "export"})
+        assert response.status_code == 202
+        job = response.json()
+        deadline = time.monotonic() + 10
+        while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/api/v1/jobs/{job['id']}").json()
+        assert job["status"] == "completed"
+
+        response = client.get(f"/api/v1/jobs/{job['id']}/result")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "machines.csv" in response.headers["content-disposition"]
+        assert "SN-JOB" in response.text
+        assert client.post(f"/api/v1/jobs/{job['id']}/cancel").status_code == 409
+
+        assert client.delete(f"/api/v1/jobs/{job['id']}").status_code == 204
+        assert client.get(f"/api/v1/jobs/{job['id']}/result").status_code == 404
+        app.state.job_runner.stop()
+
+    def test_archive_job_export_and_restore(self, tmp_path):
+        """Test archiving idle machines, exporting them and restoring one."""
+        from provisionR.settings import get_settings
+
+        settings = get_settings().model_copy(update={"jobs_dir": str(tmp_path)})
+        client = TestClient(create_app(settings))
+        params = {"mac": "00:11:22:33:44:56", "uuid": "u", "serial": "SN-ARCH"}
+        client.get("/api/v1/ks", params=params)
+        exported = client.get("/api/v1/machines/export").text.splitlines()[1]
+
+        response = client.post(
+            "/api/v1/jobs", json={"kind": "archive", "params": {"idle_days": 0}}
+        )
+        assert response.status_code == 202
+        job = response.json()
+        deadline = time.monotonic() + 10
+        while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/api/v1/jobs/{job['id']}").json()
+        assert job["status"] == "completed"
+        result = client.get(f"/api/v1/jobs/{job['id']}/result").text
+        assert result.splitlines() == ["mac,uuid,serial", "00:11:22:33:44:56,u,SN-ARCH"]
+
+        export = client.get("/api/v1/machines/export").text
+        assert "SN-ARCH" not in export
+        archived = client.get("/api/v1/machines/export", params={"archived": True})
+        assert "SN-ARCH" in archived.text
+
+        # The machine coming back gets the same passwords
+        assert client.get("/api/v1/ks", params=params).status_code == 200
+        export = client.get("/api/v1/machines/export").text.splitlines()
+        assert export[1:] == [exported]
+
+    def test_unknown_kind_and_job(self, client: TestClient):
+        """Test that unknown job kinds and ids are rejected."""
+        response = client.post("/api/v1/jobs", json={"kind": "nope"})
+        assert response.status_code == 400
+        assert client.get("/api/v1/jobs/99").status_code == 404
+        assert client.get("/api/v1/jobs/99/result").status_code == 404
+        assert client.delete("/api/v1/jobs/99").status_code == 404
+
+
+class TestMachinePasswordsImport:
+    """Tests for importing machine credentials."""
+
+    def test_import_job(self, tmp_path):
+        """Test that an uploaded CSV is imported by a job reporting rejects."""
+        from provisionR.settings import get_settings
+
+        settings = get_settings().model_copy(update={"jobs_dir": str(tmp_path)})
+        app = create_app(settings)
+        client = TestClient(app)
+        body = (
+            "mac,uuid,serial,root_password,user_password,luks_password,created_at\n"
+            "00:11:22:33:44:01,u,SN-IMP-1,root1,user1,luks1,\n"
+            ",u,SN-IMP-2,root2,user2,luks2,\n"
+        )
+
+        response = client.post(
+            "/api/v1/machines/import",
+            content=body,
+            headers={"Content-Type": "text/csv"},
+        )
+        assert response.status_code == 202
+        job = response.json()
+        assert job["kind"] == "import"
+        deadline = time.monotonic() + 10
+        while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/api/v1/jobs/{job['id']}").json()
+        assert job["status"] == "completed"
+
+        rejects = client.get(f"/api/v1/jobs/{job['id']}/result").text
+        assert "SN-IMP-2" in rejects and "SN-IMP-1" not in rejects
+        assert not list((tmp_path / "uploads").iterdir())
+        # The machine's first kickstart uses the imported passwords
+        ks = client.get(
+            "/api/v1/ks",
+            params={"mac": "00-11-22-33-44-01", "uuid": "u", "serial": "SN-IMP-1"},
+        )
+        assert ks.status_code == 200
+        exported = client.get("/api/v1/machines/export").text
+        assert exported.count("SN-IMP-1") == 1 and "root1" in exported
+        app.state.job_runner.stop()
+
+
 class TestMachinePasswordsExport:
     """Tests for machine passwords CSV export."""
 
@@ -232,6 +897,144 @@ class TestMachinePasswordsExport:
         assert "SERIAL123" in lines[1]
 
 
+class TestBackup:
+    """Tests for database snapshots."""
+
+    def test_download_backup(self, client: TestClient, tmp_path):
+        """Test that the backup is a compressed copy of the live database."""
+        import gzip
+        import sqlite3
+
+        params = {"mac": "AA:BB:CC:DD:EE:FF", "uuid": "u", "serial": "BACKUP1"}
+        client.get("/api/v1/ks", params=params)
+
+        response = client.get("/api/v1/backup")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/gzip"
+        assert ".db.gz" in response.headers["content-disposition"]
+
+        snapshot = tmp_path / "snapshot.db"
+        snapshot.write_bytes(gzip.decompress(response.content))
+        with sqlite3.connect(snapshot) as conn:
+            serials = conn.execute("SELECT serial FROM machine_passwords").fetchall()
+        assert serials == [("BACKUP1",)]
+
+
+class TestReplica:
+    """Tests for a read-only replica of a primary in another process."""
+
+    def test_replica_serves_forwards_and_refuses_writes(self, tmp_path):
+        """Test a replica against a primary running as its own process."""
+        import os
+        import socket
+        import subprocess
+        import sys
+        from pathlib import Path
+
+        import httpx
+
+        from provisionR.metrics import metrics
+        from provisionR.services.password_service import PasswordService
+        from provisionR.services.primary_client import FORWARDED_METRIC
+        from provisionR.settings import get_settings
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        primary_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "PROVISIONR_DB_PATH": str(tmp_path / "primary.db"),
+            "PROVISIONR_JOBS_DIR": str(tmp_path / "jobs"),
+            "PYTHONPATH": str(Path(__file__).parents[2]),
+        }
+        primary = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "provisionR.app:create_app"]
+            + ["--factory", "--port", str(port), "--log-level", "warning"],
+            env=env,
+            cwd=tmp_path,
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    httpx.get(f"{primary_url}/api/health").raise_for_status()
+                    break
+                except httpx.HTTPError:
+                    assert time.monotonic() < deadline and primary.poll() is None
+                    time.sleep(0.1)
+            known = {"mac": "AA:BB:CC:00:10:01", "uuid": "u", "serial": "REPL1"}
+            assert httpx.get(f"{primary_url}/api/v1/ks", params=known).is_success
+
+            settings = get_settings().model_copy(
+                update={
+                    "db_path": str(tmp_path / "replica.db"),
+                    "replica_of": primary_url,
+                    "replica_refresh_seconds": 3600,
+                }
+            )
+            with TestClient(create_app(settings)) as replica:
+                replica.app.state.replica.refresh()
+                forwarded = metrics.get(FORWARDED_METRIC)
+
+                # Known machines are served from the snapshot
+                assert replica.get("/api/v1/ks", params=known).status_code == 200
+                assert metrics.get(FORWARDED_METRIC) == forwarded
+
+                # New machines are created by the primary
+                new = {"mac": "AA:BB:CC:00:10:02", "uuid": "u", "serial": "REPL2"}
+                assert replica.get("/api/v1/ks", params=new).status_code == 200
+                assert metrics.get(FORWARDED_METRIC) == forwarded + 1
+                on_primary = httpx.post(
+                    f"{primary_url}/api/v1/machines/credentials", params=new
+                ).json()
+                with replica.app.state.database.session_factory() as db:
+                    local = PasswordService(db).get_or_create_passwords(**new)
+                assert local == (
+                    on_primary["root_password"],
+                    on_primary["user_password"],
+                    on_primary["luks_password"],
+                )
+
+                assert replica.post("/api/v1/rules", json={}).status_code == 403
+                assert (
+                    "provisionr_replica_lag_seconds" in replica.get("/api/metrics").text
+                )
+
+                primary.terminate()
+                primary.wait(10)
+                other = {"mac": "AA:BB:CC:00:10:03", "uuid": "u", "serial": "REPL3"}
+                assert replica.get("/api/v1/ks", params=known).status_code == 200
+                assert replica.get("/api/v1/ks", params=other).status_code == 503
+        finally:
+            primary.terminate()
+            primary.wait(10)
+
+
+class TestFleetStats:
+    """Tests for the fleet statistics endpoint."""
+
+    def test_stats_count_machines_and_fetches(self, client: TestClient):
+        """Test that new machines and fetches show up in the stats."""
+        for serial in ("STATS1", "STATS2", "STATS1"):
+            params = {"mac": "AA:BB:CC:DD:EE:FF", "uuid": "u", "serial": serial}
+            assert client.get("/api/v1/ks", params=params).status_code == 200
+        client.app.state.access_log.flush()
+
+        response = client.get("/api/v1/stats", params={"days": 2, "hours": 3})
+        assert response.status_code == 200
+        stats = response.json()
+        assert stats["total_machines"] == 2
+        assert len(stats["new_machines_per_day"]) == 2
+        assert list(stats["new_machines_per_hour"].values())[-1] == 2
+        assert stats["fetches_per_template"] == {"default": 3}
+        assert stats["fetches_per_os"] == {"Rocky9": 3}
+
+    def test_stats_rejects_bad_window(self, client: TestClient):
+        """Test that the day and hour windows are bounded."""
+        assert client.get("/api/v1/stats", params={"days": 0}).status_code == 422
+
+
 class TestConfigValues:
     """Tests for custom values in config."""
 
@@ -0,0 +1,112 @@
+"""Unit tests for the kickstart access log."""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.metrics import metrics
+from provisionR.models import DBAccessLog, DBMachineLastSeen
+from provisionR.services.access_log import DROPPED_METRIC, AccessEvent, AccessLog
+from provisionR.utils import MachineIdentity
+
+T0 = datetime(2025, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def event(n: int, minutes: int, template: str = "default") -> AccessEvent:
+    """Build a fetch event for machine n at T0 + minutes."""
+    return AccessEvent(
+        identity=MachineIdentity.from_raw(f"00:00:00:00:00:{n:02x}", "uuid", "SN"),
+        template_name=template,
+        fetched_at=T0 + timedelta(minutes=minutes),
+    )
+
+
+class TestAccessLog:
+    """Tests for AccessLog."""
+
+    def test_flush_appends_log_and_coalesces_last_seen(self, session_factory):
+        """Test that every fetch is logged but last-seen has one row per machine."""
+        access_log = AccessLog(session_factory)
+        access_log.record(event(1, 0, "default"))
+        access_log.record(event(1, 5, "rocky"))
+        access_log.record(event(2, 1))
+
+        assert access_log.flush() == 3
+
+        with session_factory() as session:
+            assert session.query(DBAccessLog).count() == 3
+            rows = {row.identity_key: row for row in session.query(DBMachineLastSeen)}
+        machine = rows[event(1, 0).identity.key]
+        assert len(rows) == 2
+        assert machine.last_seen_at == T0 + timedelta(minutes=5)
+        assert machine.last_template == "rocky"
+        assert machine.fetch_count == 2
+
+    def test_out_of_order_batches_keep_latest_fetch(self, session_factory):
+        """Test that an older fetch flushed later doesn't rewind last-seen."""
+        access_log = AccessLog(session_factory)
+        access_log.record(event(1, 10, "newer"))
+        access_log.flush()
+        access_log.record(event(1, 0, "older"))
+        access_log.flush()
+
+        with session_factory() as session:
+            machine = session.query(DBMachineLastSeen).one()
+        assert machine.last_seen_at == T0 + timedelta(minutes=10)
+        assert machine.last_template == "newer"
+        assert machine.fetch_count == 2
+
+    def test_full_queue_drops_instead_of_blocking(self, session_factory):
+        """Test that record() sheds events once the queue is full."""
+        access_log = AccessLog(session_factory, max_queue=2)
+        dropped_before = metrics.get(DROPPED_METRIC)
+
+        results = [access_log.record(event(n, 0)) for n in range(3)]
+
+        assert results == [True, True, False]
+        assert metrics.get(DROPPED_METRIC) == dropped_before + 1
+
+    def test_dropped_events_still_update_last_seen(self, session_factory):
+        """Test that a full queue loses audit rows but not last-seen updates."""
+        access_log = AccessLog(session_factory, max_queue=1)
+        access_log.record(event(1, 0))
+        assert not access_log.record(event(1, 5, "rocky"))
+        assert not access_log.record(event(2, 1))
+
+        assert access_log.flush() == 1
+
+        with session_factory() as session:
+            assert session.query(DBAccessLog).count() == 1
+            rows = {row.identity_key: row for row in session.query(DBMachineLastSeen)}
+        machine = rows[event(1, 0).identity.key]
+        assert len(rows) == 2
+        assert machine.last_template == "rocky"
+        assert machine.fetch_count == 2
+
+    def test_background_thread_writes_batches(self, session_factory):
+        """Test that the background thread writes events and stop() drains."""
+        access_log = AccessLog(session_factory, flush_interval_seconds=0.01)
+        access_log.start()
+        for n in range(10):
+            access_log.record(event(n, n))
+        access_log.stop()
+
+        with session_factory() as session:
+            assert session.query(DBAccessLog).count() == 10
+            assert session.query(DBMachineLastSeen).count() == 10
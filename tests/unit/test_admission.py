@@ -0,0 +1,76 @@
+"""Unit tests for kickstart admission control."""
+
+import asyncio
+
+import pytest
+
+from provisionR.metrics import metrics
+from provisionR.services.admission import (
+    QUEUE_DEPTH_METRIC,
+    REJECTED_METRIC,
+    AdmissionController,
+)
+
+
+class TestAdmissionController:
+    """Tests for AdmissionController."""
+
+    @pytest.mark.asyncio
+    async def test_waiters_get_slots_as_they_are_released(self):
+        """Test that requests beyond the limit wait and then proceed."""
+        admission = AdmissionController(max_concurrent=1, max_wait_seconds=1)
+        assert await admission.acquire()
+
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0.01)
+        assert admission.queue_depth == 1
+        assert metrics.get(QUEUE_DEPTH_METRIC) == 1
+
+        admission.release()
+        assert await waiter
+        assert (admission.in_flight, admission.queue_depth) == (1, 0)
+        admission.release()
+        assert admission.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_full_queue_rejects_immediately(self):
+        """Test that requests are rejected once the queue is full."""
+        admission = AdmissionController(max_concurrent=1, max_queue=1)
+        before = metrics.get(REJECTED_METRIC, reason="queue_full")
+        assert await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0.01)
+
+        assert not await admission.acquire()
+        assert metrics.get(REJECTED_METRIC, reason="queue_full") == before + 1
+        admission.release()
+        assert await waiter
+
+    @pytest.mark.asyncio
+    async def test_wait_times_out(self):
+        """Test that a request waiting too long is rejected and dequeued."""
+        admission = AdmissionController(max_concurrent=1, max_wait_seconds=0.01)
+        assert await admission.acquire()
+
+        assert not await admission.acquire()
+        assert admission.queue_depth == 0
+        admission.release()
+        assert admission.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_priority_requests_served_first(self):
+        """Test that returning machines skip ahead and have their own queue."""
+        admission = AdmissionController(max_concurrent=1, max_queue=1)
+        assert await admission.acquire()
+        new_machine = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0.01)
+        returning = asyncio.ensure_future(admission.acquire(priority=True))
+        await asyncio.sleep(0.01)
+
+        admission.release()
+        await asyncio.sleep(0.01)
+        assert returning.done() and returning.result()
+        assert not new_machine.done()
+
+        admission.release()
+        assert await new_machine
@@ -0,0 +1,212 @@
+"""Unit tests for archiving decommissioned machines."""
+
+import io
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import (
+    DBArchivedMachine,
+    DBFleetStat,
+    DBMachineLastSeen,
+    DBMachinePasswords,
+    RotationScope,
+)
+from provisionR.services.archive_service import ArchiveService
+from provisionR.services.credential_store import MemoryCredentialStore
+from provisionR.services.export_service import ExportService
+from provisionR.services.import_service import ImportService
+from provisionR.services.inventory_service import InventoryService
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.services.password_service import PasswordService
+from provisionR.services.rotation_service import PasswordRotator
+from provisionR.services.stats_service import StatsService
+from provisionR.utils import MachineIdentity
+
+LONG_AGO = datetime(2020, 1, 1, tzinfo=UTC)
+CUTOFF = datetime.now(UTC) - timedelta(days=30)
+
+
+def identity(n: int) -> MachineIdentity:
+    """Identity of test machine n."""
+    return MachineIdentity.from_raw(f"00:00:00:00:01:{n:02x}", f"uuid-{n}", f"AR{n}")
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """
+    Create a scratch database with 6 machines created long ago.
+
+    Machines 0-1 never fetched a kickstart, 2-3 last did long ago and 4-5
+    did just now, so 0-3 are idle.
+    """
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        for n in range(6):
+            machine = identity(n)
+            session.add(
+                DBMachinePasswords(
+                    mac=machine.mac,
+                    uuid=machine.uuid,
+                    serial=machine.serial,
+                    identity_key=machine.key,
+                    root_password=f"root-{n}",
+                    user_password=f"user-{n}",
+                    luks_password=f"luks-{n}",
+                    created_at=LONG_AGO,
+                )
+            )
+            if n >= 2:
+                session.add(
+                    DBMachineLastSeen(
+                        identity_key=machine.key,
+                        last_seen_at=LONG_AGO if n < 4 else datetime.now(UTC),
+                        last_template="default",
+                    )
+                )
+        session.commit()
+    yield factory
+    engine.dispose()
+
+
+def serials(session, model) -> list:
+    """Serials of the machines in a table."""
+    return sorted(serial for (serial,) in session.query(model.serial))
+
+
+def fleet_stats(session) -> dict:
+    """Every fleet counter by (metric, bucket)."""
+    return {(row.metric, row.bucket): row.count for row in session.query(DBFleetStat)}
+
+
+class TestArchiveService:
+    """Tests for ArchiveService."""
+
+    def test_archive_idle_in_chunks(self, session_factory):
+        """Test that idle machines move to the archive a chunk at a time."""
+        chunks = []
+        with session_factory() as session:
+            archived = ArchiveService(session).archive_idle(
+                CUTOFF, chunk_size=3, on_chunk=chunks.append
+            )
+
+            assert archived == 4
+            assert [len(chunk) for chunk in chunks] == [3, 1]
+            assert serials(session, DBMachinePasswords) == ["AR4", "AR5"]
+            assert serials(session, DBArchivedMachine) == ["AR0", "AR1", "AR2", "AR3"]
+            # Search index and fleet counters follow the move
+            page = InventoryService(session).list_machines(contains="AR")
+            assert [item["serial"] for item in page.items] == ["AR4", "AR5"]
+            assert StatsService(session).summary()["total_machines"] == 2
+
+    def test_archive_scope(self, session_factory):
+        """Test that prefix/contains narrow down the archived machines."""
+        with session_factory() as session:
+            archive = ArchiveService(session)
+            assert archive.archive_idle(CUTOFF, contains="AR1") == 1
+            assert serials(session, DBArchivedMachine) == ["AR1"]
+
+    def test_returning_machine_restored(self, session_factory):
+        """Test that an archived machine gets its old passwords back."""
+        with session_factory() as session:
+            ArchiveService(session).archive_idle(CUTOFF)
+            old_id = session.execute(
+                text("SELECT id FROM machine_archive WHERE serial = 'AR0'")
+            ).scalar_one()
+            before = fleet_stats(session)
+
+            machine = identity(0)
+            credentials = PasswordService(session).get_or_create_passwords(
+                machine.mac, machine.uuid, machine.serial
+            )
+
+            assert credentials == ("root-0", "user-0", "luks-0")
+            restored = session.query(DBMachinePasswords).filter_by(serial="AR0").one()
+            assert restored.id == old_id
+            assert restored.created_at.year == 2020
+            assert serials(session, DBArchivedMachine) == ["AR1", "AR2", "AR3"]
+            # Back in the total, but not counted as a new machine again
+            assert fleet_stats(session) == {
+                **before,
+                ("machines", ""): before[("machines", "")] + 1,
+            }
+            assert ArchiveService(session).restore(machine) is None
+
+    def test_memory_store(self, session_factory):
+        """Test that the memory store forgets archived machines."""
+        store = MemoryCredentialStore()
+        machine = identity(0)
+        with session_factory() as session:
+            store.load(session)
+            ArchiveService(session, store=store).archive_idle(CUTOFF)
+            assert store.lookup(session, machine) is None
+
+            PasswordService(session, store=store).get_or_create_passwords(
+                machine.mac, machine.uuid, machine.serial
+            )
+            assert store._credentials[machine.key] == ("root-0", "user-0", "luks-0")
+
+    def test_export_archived(self, session_factory):
+        """Test that archived machines stay exportable."""
+        with session_factory() as session:
+            ArchiveService(session).archive_idle(CUTOFF)
+            output = io.StringIO()
+            written = ExportService(session).write_machine_passwords_csv(
+                output, archived=True
+            )
+
+        assert written == 4
+        lines = output.getvalue().splitlines()
+        assert lines[0].startswith("mac,uuid,serial,root_password")
+        assert "luks-3" in lines[4]
+
+    def test_import_replaces_archived(self, session_factory):
+        """Test that importing an archived machine brings it back."""
+        with session_factory() as session:
+            ArchiveService(session).archive_idle(CUTOFF)
+            machine = identity(0)
+            ImportService(session).import_machine_passwords_csv(
+                io.StringIO(
+                    "mac,uuid,serial,root_password,user_password,luks_password\n"
+                    f"{machine.mac},{machine.uuid},{machine.serial},r,u,l\n"
+                )
+            )
+
+            assert serials(session, DBArchivedMachine) == ["AR1", "AR2", "AR3"]
+            assert PasswordService(session).get_or_create_passwords(
+                machine.mac, machine.uuid, machine.serial
+            ) == ("r", "u", "l")
+
+    def test_rollback_reaches_archived(self, session_factory):
+        """Test that rolling back a rotation restores archived passwords too."""
+        rotator = PasswordRotator(session_factory)
+        with session_factory() as session:
+            job = rotator.create_job(session, RotationScope())
+        rotator.run(job.id)
+        with session_factory() as session:
+            ArchiveService(session).archive_idle(CUTOFF)
+
+        rotator.rollback(job.id)
+
+        with session_factory() as session:
+            for model in (DBMachinePasswords, DBArchivedMachine):
+                for row in session.query(model):
+                    n = row.serial[2:]
+                    assert row.luks_password == f"luks-{n}"
+
+    def test_passphrase_index_includes_archive(self, session_factory):
+        """Test that archived passphrases are never handed out again."""
+        with session_factory() as session:
+            ArchiveService(session).archive_idle(CUTOFF)
+            index = PassphraseIndex()
+            assert index.load(session) == 18
+            assert index.claim(session, ["root-0"]) != ["root-0"]
@@ -0,0 +1,122 @@
+"""Unit tests for online database snapshots."""
+
+import gzip
+import threading
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords
+from provisionR.services.backup_service import (
+    RESTARTS_METRIC,
+    BackupError,
+    gzip_chunks,
+    restore,
+    snapshot,
+)
+
+
+def machine_row(n: int) -> dict:
+    """Build a machine_passwords row for synthetic machine `n`."""
+    return {
+        "mac": f"00:00:00:00:{n // 256:02X}:{n % 256:02X}",
+        "uuid": f"uuid-{n}",
+        "serial": f"SN{n:05d}",
+        "identity_key": f"{n:032x}",
+        "root_password": "r" * 100,
+        "user_password": "u" * 100,
+        "luks_password": "l" * 100,
+    }
+
+
+def make_engine(path: Path, machines: int = 0):
+    """Create a database with `machines` synthetic machines."""
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    if machines:
+        with engine.begin() as conn:
+            conn.execute(
+                insert(DBMachinePasswords), [machine_row(n) for n in range(machines)]
+            )
+    return engine
+
+
+def count_machines(engine) -> int:
+    """Count machines in a database."""
+    with sessionmaker(bind=engine)() as session:
+        return session.query(DBMachinePasswords).count()
+
+
+class TestSnapshot:
+    """Tests for snapshot() and restore()."""
+
+    def test_snapshot_and_restore_compressed(self, tmp_path: Path):
+        """Test that a gzip-compressed snapshot restores into another database."""
+        source = make_engine(tmp_path / "live.db", machines=500)
+        progress = []
+        pages = snapshot(
+            source,
+            tmp_path / "snap.db",
+            pages_per_step=8,
+            pause_seconds=0,
+            on_progress=lambda done, total: progress.append(done),
+        )
+        assert pages > 8 and progress[-1] == pages
+        with open(tmp_path / "snap.db.gz", "wb") as output:
+            output.writelines(gzip_chunks(tmp_path / "snap.db"))
+        assert (
+            gzip.decompress((tmp_path / "snap.db.gz").read_bytes())
+            == (tmp_path / "snap.db").read_bytes()
+        )
+
+        target = make_engine(tmp_path / "restored.db", machines=3)
+        restore(tmp_path / "snap.db.gz", target)
+        assert count_machines(target) == 500
+
+    def test_writes_during_snapshot_are_not_blocked(self, tmp_path: Path):
+        """Test that writers commit between steps and the copy still finishes."""
+        source = make_engine(tmp_path / "live.db", machines=2000)
+        restarts = metrics.get(RESTARTS_METRIC)
+        written = []
+
+        def write_between_steps(done: int, total: int) -> None:
+            # Runs between backup steps, while no lock is held
+            if len(written) < 3:
+                thread = threading.Thread(target=write_one)
+                thread.start()
+                thread.join(timeout=5)
+
+        def write_one() -> None:
+            row = machine_row(10_000 + len(written))
+            with source.begin() as conn:
+                conn.execute(insert(DBMachinePasswords), [row])
+            written.append(True)
+
+        snapshot(
+            source,
+            tmp_path / "snap.db",
+            pages_per_step=4,
+            pause_seconds=0,
+            on_progress=write_between_steps,
+        )
+
+        assert len(written) == 3
+        assert metrics.get(RESTARTS_METRIC) > restarts
+        copy = create_engine(f"sqlite:///{tmp_path / 'snap.db'}")
+        assert count_machines(copy) in range(2000, 2004)
+
+    def test_restore_rejects_invalid_snapshot(self, tmp_path: Path):
+        """Test that a file that isn't a database leaves the target untouched."""
+        target = make_engine(tmp_path / "live.db", machines=3)
+        bogus = tmp_path / "bogus.db.gz"
+        bogus.write_bytes(gzip.compress(b"not a database" * 100))
+
+        with pytest.raises(BackupError):
+            restore(bogus, target)
+        assert count_machines(target) == 3
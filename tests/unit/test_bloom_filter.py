@@ -0,0 +1,36 @@
+"""Unit tests for the Bloom filter."""
+
+import pytest
+
+from provisionR.utils.bloom_filter import BloomFilter
+
+
+class TestBloomFilter:
+    """Tests for BloomFilter."""
+
+    def test_never_misses_added_items(self):
+        """Test that every added item is found and counted once."""
+        bloom = BloomFilter(1000)
+        items = [f"item-{n}" for n in range(1000)]
+        assert all(bloom.add(item) for item in items[:10])
+        for item in items[10:]:
+            bloom.add(item)
+
+        assert all(item in bloom for item in items)
+        assert not bloom.add("item-0")
+        assert len(bloom) <= 1000
+
+    def test_false_positive_rate_and_size(self):
+        """Test that the filter stays near its error rate at capacity."""
+        bloom = BloomFilter(10_000, error_rate=0.01)
+        for n in range(10_000):
+            bloom.add(f"in-{n}")
+
+        false_positives = sum(f"out-{n}" in bloom for n in range(10_000))
+        assert false_positives < 200
+        assert bloom.nbytes < 10_000 * 1.25
+
+    def test_rejects_bad_error_rate(self):
+        """Test that an error rate outside (0, 1) is refused."""
+        with pytest.raises(ValueError):
+            BloomFilter(10, error_rate=1)
@@ -2,7 +2,13 @@
 
 import pytest
 from sqlalchemy.orm import Session
-from provisionR.config import get_global_config_from_db, update_global_config_in_db
+from provisionR.config import (
+    ConfigVersionConflict,
+    get_global_config_from_db,
+    load_global_config,
+    save_global_config,
+    update_global_config_in_db,
+)
 from provisionR.models import GlobalConfig, TargetOS
 from provisionR.database import SessionLocal
 
@@ -55,3 +61,20 @@ class TestConfigFunctions:
         assert retrieved_config.target_os == TargetOS.UBUNTU2504
         assert retrieved_config.generate_passwords is False
         assert retrieved_config.values["test"] == "value"
+
+    def test_version_incremented_on_update(self, db_session: Session):
+        """Test that every update bumps the config version."""
+        _, version = load_global_config(db_session)
+        _, new_version = save_global_config(db_session, GlobalConfig())
+        assert new_version == version + 1
+
+    def test_stale_expected_version_rejected(self, db_session: Session):
+        """Test that a compare-and-swap against an old version fails."""
+        _, version = load_global_config(db_session)
+        save_global_config(db_session, GlobalConfig(values={"a": 1}), version)
+
+        with pytest.raises(ConfigVersionConflict) as exc_info:
+            save_global_config(db_session, GlobalConfig(values={"b": 2}), version)
+
+        assert exc_info.value.current_version == version + 1
+        assert get_global_config_from_db(db_session).values == {"a": 1}
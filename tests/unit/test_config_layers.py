@@ -0,0 +1,193 @@
+"""Unit tests for layered configuration."""
+
+import pytest
+from sqlalchemy.orm import Session
+
+from provisionR.config import ConfigVersionConflict, save_global_config
+from provisionR.database import SessionLocal
+from provisionR.metrics import metrics
+from provisionR.models import (
+    ConfigGroup,
+    DBMachineConfig,
+    GlobalConfig,
+    MachineConfig,
+)
+from provisionR.services.config_layers import (
+    REBUILT_METRIC,
+    ConfigLayers,
+    merge_values,
+)
+from provisionR.services.kickstart_service import KickstartService
+from provisionR.utils import MachineIdentity
+
+
+@pytest.fixture
+def db_session():
+    """Create a database session for unit tests."""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def machine(n: int, group: str = None, **values) -> MachineConfig:
+    """Build a machine layer."""
+    return MachineConfig(
+        mac=f"00:00:00:00:00:{n:02x}",
+        uuid=f"uuid-{n}",
+        serial=f"SN{n}",
+        group=group,
+        values=values,
+    )
+
+
+def identity(n: int) -> MachineIdentity:
+    """Identity of the machine built by machine(n)."""
+    return MachineIdentity.from_raw(f"00:00:00:00:00:{n:02x}", f"uuid-{n}", f"SN{n}")
+
+
+class TestMergeValues:
+    """Tests for merge_values."""
+
+    def test_nested_dicts_merged(self):
+        """Test that nested dicts merge and other values are replaced."""
+        base = {"net": {"gw": "10.0.0.1", "dns": "1.1.1.1"}, "tags": ["a"]}
+        merged = merge_values(base, {"net": {"dns": "9.9.9.9"}, "tags": ["b"]})
+
+        assert merged == {"net": {"gw": "10.0.0.1", "dns": "9.9.9.9"}, "tags": ["b"]}
+        assert base["net"]["dns"] == "1.1.1.1"
+
+
+class TestConfigLayers:
+    """Tests for ConfigLayers."""
+
+    def test_layers_override_in_order(self, db_session: Session):
+        """Test that machine values beat group values, which beat global ones."""
+        layers = ConfigLayers()
+        layers.update_global(
+            db_session, GlobalConfig(values={"tz": "UTC", "dc": "ams", "role": "x"})
+        )
+        layers.put_group(db_session, ConfigGroup(name="web", values={"role": "web"}))
+        layers.put_machine(db_session, machine(1, group="web", dc="lon"))
+
+        effective = layers.effective(db_session, identity(1))
+        assert effective.values == {"tz": "UTC", "dc": "lon", "role": "web"}
+        assert effective.group == "web"
+        assert effective.override_keys == {"role", "dc"}
+
+        # Machines without layers share the global entry
+        assert layers.effective(db_session, identity(2)).values["role"] == "x"
+
+    def test_changes_rebuild_only_affected_machines(self, db_session: Session):
+        """Test that a layer change only re-merges the machines it applies to."""
+        layers = ConfigLayers()
+        for n in range(5):
+            layers.put_machine(db_session, machine(n, group="web" if n < 2 else "db"))
+
+        before = metrics.get(REBUILT_METRIC)
+        layers.put_group(db_session, ConfigGroup(name="web", values={"role": "web"}))
+        assert metrics.get(REBUILT_METRIC) - before == 2
+
+        before = metrics.get(REBUILT_METRIC)
+        layers.put_machine(db_session, machine(4, group="web", extra=True))
+        assert metrics.get(REBUILT_METRIC) - before == 1
+        assert layers.effective(db_session, identity(4)).values["role"] == "web"
+
+        before = metrics.get(REBUILT_METRIC)
+        layers.put_group(db_session, ConfigGroup(name="web", values={"role": "api"}))
+        assert metrics.get(REBUILT_METRIC) - before == 3
+
+    def test_state_reloaded_from_database(self, db_session: Session):
+        """Test that a fresh instance materializes the stored layers."""
+        layers = ConfigLayers()
+        layers.put_group(db_session, ConfigGroup(name="web", values={"role": "web"}))
+        layers.put_machine(db_session, machine(1, group="web"))
+
+        reloaded = ConfigLayers()
+        assert reloaded.effective(db_session, identity(1)).values == {"role": "web"}
+
+    def test_invalidate_reloads(self, db_session: Session):
+        """Test that invalidated layers pick up changes made behind their back."""
+        layers = ConfigLayers()
+        layers.put_machine(db_session, machine(1, role="old"))
+        db_session.query(DBMachineConfig).update({"values": '{"role": "new"}'})
+        db_session.commit()
+        assert layers.effective(db_session, identity(1)).values == {"role": "old"}
+
+        layers.invalidate()
+        assert layers.effective(db_session, identity(1)).values == {"role": "new"}
+
+    def test_changes_by_other_workers_reloaded(self, db_session: Session):
+        """Test that layers written by another instance are served, not stale."""
+        layers = ConfigLayers()
+        other = ConfigLayers()
+        layers.put_machine(db_session, machine(1, group="web", role="old"))
+        assert layers.effective(db_session, identity(1)).values == {"role": "old"}
+
+        other.put_group(db_session, ConfigGroup(name="web", values={"tier": 1}))
+        other.put_machine(db_session, machine(1, group="web", role="new"))
+        assert layers.effective(db_session, identity(1)).values == {
+            "tier": 1,
+            "role": "new",
+        }
+
+        _, version = other.global_config(db_session)
+        other.update_global(db_session, GlobalConfig(values={"site": "b"}), version)
+        assert layers.global_config(db_session) == other.global_config(db_session)
+        assert layers.effective(db_session, identity(1)).values["site"] == "b"
+
+        layers.put_group(db_session, ConfigGroup(name="web", values={"tier": 2}))
+        assert other.effective(db_session, identity(1)).values["tier"] == 2
+
+    def test_version_conflict_reloads(self, db_session: Session, monkeypatch):
+        """Test that losing an update race leaves the instance on the new version."""
+        layers = ConfigLayers()
+        _, version = layers.global_config(db_session)
+        save_global_config(db_session, GlobalConfig(values={"site": "b"}), version)
+
+        # The other worker's write lands between the freshness check and ours
+        monkeypatch.setattr(layers, "_is_current", lambda db: True)
+        with pytest.raises(ConfigVersionConflict):
+            layers.update_global(db_session, GlobalConfig(), version)
+        monkeypatch.undo()
+
+        stored, current = layers.global_config(db_session)
+        assert (stored.values, current) == ({"site": "b"}, version + 1)
+        layers.update_global(db_session, GlobalConfig(values={"a": 1}), current)
+        assert layers.global_config(db_session)[1] == version + 2
+
+    def test_deleting_layers_falls_back(self, db_session: Session):
+        """Test that deleting a group or machine layer falls back a level."""
+        layers = ConfigLayers()
+        layers.update_global(db_session, GlobalConfig(values={"role": "none"}))
+        layers.put_group(db_session, ConfigGroup(name="web", values={"role": "web"}))
+        layers.put_machine(db_session, machine(1, group="web"))
+
+        assert layers.delete_group(db_session, "web")
+        assert layers.effective(db_session, identity(1)).values["role"] == "none"
+        assert layers.delete_machine(db_session, identity(1))
+        assert not layers.delete_machine(db_session, identity(1))
+        assert layers.get_machine(db_session, identity(1)) is None
+
+    def test_kickstart_context_uses_layers(self, db_session: Session):
+        """Test that rendering uses the machine's effective values."""
+        layers = ConfigLayers()
+        layers.update_global(
+            db_session, GlobalConfig(generate_passwords=False, values={"role": "x"})
+        )
+        layers.put_machine(db_session, machine(1, disks=["sda"]))
+        service = KickstartService(db_session, config_layers=layers)
+
+        rendered = service.generate_from_string(
+            mac="00:00:00:00:00:01",
+            uuid="uuid-1",
+            serial="SN1",
+            template_string="{{ role }} {% set _ = disks.append('sdb') %}{{ disks }}",
+            query_params={},
+            extra_values={"role": "rule", "disks": ["rule"]},
+        )
+
+        # Rule values beat global values only; nested values are copied
+        assert rendered == "rule ['sda', 'sdb']"
+        assert layers.effective(db_session, identity(1)).values["disks"] == ["sda"]
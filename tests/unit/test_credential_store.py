@@ -0,0 +1,167 @@
+"""Unit tests for the credential stores."""
+
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords, RotationScope
+from provisionR.services.credential_store import (
+    MEMORY_HITS_METRIC,
+    CredentialStore,
+    MemoryCredentialStore,
+    SqlCredentialStore,
+)
+from provisionR.services.export_service import ExportService
+from provisionR.services.password_service import PasswordService
+from provisionR.services.rotation_service import PasswordRotator
+from provisionR.utils import MachineIdentity
+
+KNOWN = MachineIdentity.from_raw("AA:BB:CC:DD:EE:01", "uuid-1", "SN-1")
+OTHER = MachineIdentity.from_raw("AA:BB:CC:DD:EE:02", "uuid-2", "SN-2")
+
+
+def add_machine(session, identity: MachineIdentity, password: str) -> None:
+    """Store a machine whose passwords are all `password`."""
+    session.add(
+        DBMachinePasswords(
+            mac=identity.mac,
+            uuid=identity.uuid,
+            serial=identity.serial,
+            identity_key=identity.key,
+            root_password=password,
+            user_password=password,
+            luks_password=password,
+        )
+    )
+    session.commit()
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database with one machine."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        add_machine(session, KNOWN, "old")
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture(params=["sql", "memory"])
+def store(request):
+    """Create each kind of credential store."""
+    if request.param == "memory":
+        return MemoryCredentialStore(sync_interval_seconds=0)
+    return SqlCredentialStore()
+
+
+class TestCredentialStores:
+    """Behaviour shared by every credential store."""
+
+    def test_lookup(self, session_factory, store):
+        """Test looking up known and unknown machines."""
+        with session_factory() as session:
+            assert store.lookup(session, KNOWN) == ("old", "old", "old")
+            assert store.lookup(session, OTHER) is None
+
+    def test_insert_then_lookup(self, session_factory, store):
+        """Test that inserted machines are found by the same and other stores."""
+        with session_factory() as session:
+            assert store.insert(session, OTHER, ("a", "b", "c")) == ("a", "b", "c")
+            assert store.lookup(session, OTHER) == ("a", "b", "c")
+            assert SqlCredentialStore().lookup(session, OTHER) == ("a", "b", "c")
+
+    def test_insert_conflict_returns_stored(self, session_factory, store):
+        """Test that inserting a known machine returns its existing passwords."""
+        with session_factory() as session:
+            assert store.insert(session, KNOWN, ("a", "b", "c")) == ("old",) * 3
+
+    def test_password_service(self, session_factory, store):
+        """Test that PasswordService reads and writes through the store."""
+        with session_factory() as session:
+            service = PasswordService(session, store=store)
+            created = service.get_or_create_passwords(
+                OTHER.mac, OTHER.uuid, OTHER.serial
+            )
+            assert store.lookup(session, OTHER) == created
+            assert (
+                service.get_or_create_passwords(
+                    KNOWN.mac.lower(), KNOWN.uuid, KNOWN.serial
+                )
+                == ("old",) * 3
+            )
+
+    def test_export(self, session_factory, store):
+        """Test that ExportService lists machines from the store."""
+        with session_factory() as session:
+            content = ExportService(session, store=store).export_machine_passwords_csv()
+        assert KNOWN.mac in content
+
+    def test_rotation_and_rollback_are_seen(self, session_factory, store):
+        """Test that lookups follow rotations and rollbacks."""
+        with session_factory() as session:
+            store.lookup(session, KNOWN)
+
+        rotator = PasswordRotator(session_factory)
+        with session_factory() as session:
+            job_id = rotator.create_job(session, RotationScope()).id
+        rotator.run(job_id)
+        with session_factory() as session:
+            rotated = store.lookup(session, KNOWN)
+            assert rotated != ("old",) * 3
+            assert rotated == SqlCredentialStore().lookup(session, KNOWN)
+
+        rotator.rollback(job_id)
+        with session_factory() as session:
+            assert store.lookup(session, KNOWN) == ("old",) * 3
+
+    def test_backends_must_implement_every_operation(self):
+        """Test that a store missing an operation can't be created."""
+
+        class LookupOnly(CredentialStore):
+            def lookup(self, db, identity):
+                return None
+
+        with pytest.raises(TypeError):
+            CredentialStore()
+        with pytest.raises(TypeError):
+            LookupOnly()
+
+
+class TestMemoryCredentialStore:
+    """Tests specific to MemoryCredentialStore."""
+
+    def test_loaded_machines_are_answered_from_memory(self, session_factory):
+        """Test that lookups after load() are served from memory."""
+        store = MemoryCredentialStore(sync_interval_seconds=60)
+        with session_factory() as session:
+            assert store.load(session) == 1
+        hits = metrics.get(MEMORY_HITS_METRIC)
+
+        with session_factory() as session:
+            session.query(DBMachinePasswords).update({"root_password": "changed"})
+            session.commit()
+            # Edits outside a rotation aren't picked up by a loaded store
+            assert store.lookup(session, KNOWN) == ("old",) * 3
+        assert metrics.get(MEMORY_HITS_METRIC) == hits + 1
+
+    def test_machines_stored_elsewhere_are_read_through(self, session_factory):
+        """Test that a miss falls back to SQL and is cached."""
+        store = MemoryCredentialStore(sync_interval_seconds=60)
+        with session_factory() as session:
+            store.load(session)
+            add_machine(session, OTHER, "new")
+            assert store.lookup(session, OTHER) == ("new",) * 3
+        hits = metrics.get(MEMORY_HITS_METRIC)
+
+        with session_factory() as session:
+            assert store.lookup(session, OTHER) == ("new",) * 3
+        assert metrics.get(MEMORY_HITS_METRIC) == hits + 1
@@ -0,0 +1,116 @@
+"""Unit tests for the group-commit credential writer."""
+
+import threading
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords, DBPassphrase
+from provisionR.services import PasswordService
+from provisionR.services.credential_writer import GroupCommitWriter
+from provisionR.services.passphrase_index import PassphraseIndex
+from provisionR.utils import MachineIdentity
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def identity(n: int) -> MachineIdentity:
+    """Build a distinct machine identity."""
+    return MachineIdentity.from_raw(f"00:00:00:00:00:{n:02x}", f"uuid-{n}", f"SN{n}")
+
+
+class TestGroupCommitWriter:
+    """Tests for GroupCommitWriter."""
+
+    def test_inline_write_when_not_started(self, session_factory):
+        """Test that submit() writes directly when the thread isn't running."""
+        writer = GroupCommitWriter(session_factory)
+
+        result = writer.submit(identity(1), ("r", "u", "l"))
+
+        assert result == (("r", "u", "l"), True)
+        with session_factory() as session:
+            assert session.query(DBMachinePasswords).count() == 1
+
+    def test_concurrent_inserts_share_transactions(self, session_factory):
+        """Test that concurrent submits are grouped and all become durable."""
+        writer = GroupCommitWriter(session_factory, window_seconds=0.05)
+        writer.start()
+        batches_before = metrics.get("provisionr_group_commit_batches_total")
+
+        results = {}
+        barrier = threading.Barrier(20)
+
+        def submit(n: int):
+            barrier.wait()
+            results[n] = writer.submit(identity(n), (f"r{n}", f"u{n}", f"l{n}"))
+
+        threads = [threading.Thread(target=submit, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+
+        assert results == {n: ((f"r{n}", f"u{n}", f"l{n}"), True) for n in range(20)}
+        batches = metrics.get("provisionr_group_commit_batches_total") - batches_before
+        assert 1 <= batches < 20
+        with session_factory() as session:
+            assert session.query(DBMachinePasswords).count() == 20
+
+    def test_racing_requests_get_the_first_stored_passwords(self, session_factory):
+        """Test that two creates of the same machine return the same passwords."""
+        writer = GroupCommitWriter(session_factory)
+
+        first = writer.submit(identity(1), ("r1", "u1", "l1"))
+        second = writer.submit(identity(1), ("r2", "u2", "l2"))
+
+        assert first == (("r1", "u1", "l1"), True)
+        assert second == (("r1", "u1", "l1"), False)
+        with session_factory() as session:
+            assert session.query(DBMachinePasswords).count() == 1
+
+    def test_password_service_uses_writer(self, session_factory):
+        """Test that PasswordService stores new machines through the writer."""
+        writer = GroupCommitWriter(session_factory)
+        writer.start()
+        try:
+            with session_factory() as session:
+                service = PasswordService(session, writer=writer)
+                created = service.get_or_create_passwords("AA:BB", "uuid", "SN")
+                reused = service.get_or_create_passwords("aa:bb", "UUID", " SN")
+        finally:
+            writer.stop()
+
+        assert created == reused
+
+    def test_passphrases_registered_in_batch(self, session_factory):
+        """Test that passphrases are registered with the machines, redrawn if taken."""
+        index = PassphraseIndex(generate=iter(["fresh"]).__next__)
+        writer = GroupCommitWriter(session_factory, passphrases=index)
+        with session_factory() as session:
+            index.load(session)
+            # Registered by another process since the index was synced
+            session.add(DBPassphrase(passphrase="u"))
+            session.commit()
+
+        stored, created = writer.submit(identity(1), ("r", "u", "l"))
+
+        assert (stored, created) == (("r", "fresh", "l"), True)
+        with session_factory() as session:
+            registered = {p for (p,) in session.query(DBPassphrase.passphrase)}
+            assert registered == {"r", "u", "fresh", "l"}
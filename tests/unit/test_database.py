@@ -1,10 +1,148 @@
 """Unit tests for database module."""
 
+from pathlib import Path
 
-class TestDatabase:
-    """Tests for database functionality."""
+from sqlalchemy import create_engine, inspect, text
 
-    def test_placeholder(self):
-        """Placeholder test for database functionality."""
-        # TODO: Add database tests when database is implemented
-        pass
+from provisionR.database import Base
+from provisionR.migrations import SCHEMA_VERSION, run_migrations
+from provisionR.utils import MachineIdentity
+
+# Schema of machine_passwords before identity keys were introduced
+LEGACY_MACHINE_PASSWORDS = """
+CREATE TABLE machine_passwords (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mac VARCHAR NOT NULL,
+    uuid VARCHAR NOT NULL,
+    serial VARCHAR NOT NULL,
+    root_password VARCHAR NOT NULL,
+    user_password VARCHAR NOT NULL,
+    luks_password VARCHAR NOT NULL,
+    created_at DATETIME
+)
+"""
+
+
+def make_engine(tmp_path: Path):
+    """Create an engine for a scratch SQLite database."""
+    return create_engine(f"sqlite:///{tmp_path / 'provisionr.db'}")
+
+
+class TestMigrations:
+    """Tests for schema migrations."""
+
+    def test_new_database_is_stamped(self, tmp_path: Path):
+        """Test that a new database is stamped without running migrations."""
+        engine = make_engine(tmp_path)
+        assert run_migrations(engine) == 0
+        Base.metadata.create_all(bind=engine)
+
+        with engine.connect() as conn:
+            version = conn.execute(text("PRAGMA user_version")).scalar_one()
+        assert version == SCHEMA_VERSION
+
+    def test_identity_key_backfilled_and_duplicates_set_aside(self, tmp_path: Path):
+        """Test that legacy rows are normalized and formatting duplicates kept."""
+        engine = make_engine(tmp_path)
+        with engine.begin() as conn:
+            conn.execute(text(LEGACY_MACHINE_PASSWORDS))
+            conn.execute(
+                text(
+                    "INSERT INTO machine_passwords (mac, uuid, serial, root_password,"
+                    " user_password, luks_password, created_at) VALUES "
+                    "('00:11:22:AA:BB:CC', 'uuid-1', 'SN1', 'r1', 'u1', 'l1',"
+                    " '2024-01-01 00:00:00'),"
+                    "('00-11-22-aa-bb-cc', 'UUID-1', ' SN1', 'r2', 'u2', 'l2',"
+                    " '2024-02-01 00:00:00'),"
+                    "('66:77:88:99:aa:bb', 'uuid-2', 'SN2', 'r3', 'u3', 'l3',"
+                    " '2024-03-01 00:00:00')"
+                )
+            )
+
+        assert run_migrations(engine) == SCHEMA_VERSION
+        Base.metadata.create_all(bind=engine)
+
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT mac, root_password, identity_key FROM machine_passwords "
+                    "ORDER BY id"
+                )
+            ).all()
+        assert [(row.mac, row.root_password) for row in rows] == [
+            ("00:11:22:AA:BB:CC", "r1"),
+            ("66:77:88:99:AA:BB", "r3"),
+        ]
+        assert (
+            rows[0].identity_key
+            == MachineIdentity.from_raw("00:11:22:aa:bb:cc", "uuid-1", "SN1").key
+        )
+
+        # The later duplicate's credentials are preserved as they were
+        with engine.connect() as conn:
+            duplicates = conn.execute(
+                text(
+                    "SELECT id, duplicate_of, mac, uuid, serial, root_password, "
+                    "user_password, luks_password FROM machine_passwords_duplicates"
+                )
+            ).all()
+        assert [tuple(row) for row in duplicates] == [
+            (2, 1, "00-11-22-aa-bb-cc", "UUID-1", " SN1", "r2", "u2", "l2")
+        ]
+
+        indexes = inspect(engine).get_indexes("machine_passwords")
+        assert any(
+            index["column_names"] == ["identity_key"] and index["unique"]
+            for index in indexes
+        )
+
+        # Existing rows are added to the substring search index
+        with engine.connect() as conn:
+            matches = conn.execute(
+                text(
+                    "SELECT rowid FROM machine_search "
+                    "WHERE machine_search MATCH '\"99:AA\"'"
+                )
+            ).all()
+        assert len(matches) == 1
+
+        # Stored passphrases are registered for the passphrase index
+        with engine.connect() as conn:
+            registered = conn.execute(text("SELECT passphrase FROM passphrases"))
+            assert {p for (p,) in registered} == {"r1", "u1", "l1", "r3", "u3", "l3"}
+
+    def test_migrations_are_idempotent(self, tmp_path: Path):
+        """Test that a migrated database is left alone on the next start."""
+        engine = make_engine(tmp_path)
+        with engine.begin() as conn:
+            conn.execute(text(LEGACY_MACHINE_PASSWORDS))
+
+        run_migrations(engine)
+        assert run_migrations(engine) == 0
+
+    def test_global_config_version_added(self, tmp_path: Path):
+        """Test that an existing global_config table gets its version columns."""
+        engine = make_engine(tmp_path)
+        with engine.begin() as conn:
+            conn.execute(text(LEGACY_MACHINE_PASSWORDS))
+            conn.execute(
+                text(
+                    "CREATE TABLE global_config (id INTEGER PRIMARY KEY, "
+                    "target_os VARCHAR NOT NULL, generate_passwords BOOLEAN NOT NULL,"
+                    ' "values" TEXT NOT NULL, updated_at DATETIME)'
+                )
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO global_config (target_os, generate_passwords, "
+                    "\"values\") VALUES ('Rocky9', 1, '{}')"
+                )
+            )
+
+        run_migrations(engine)
+
+        with engine.connect() as conn:
+            versions = conn.execute(
+                text("SELECT version, layers_revision FROM global_config")
+            ).one()
+        assert tuple(versions) == (1, 0)
@@ -0,0 +1,109 @@
+"""Unit tests for the provisioning event bus."""
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+from provisionR.services.event_bus import (
+    EVENTS_DROPPED,
+    KICKSTART_FETCHED,
+    MACHINE_CREATED,
+    EventBus,
+)
+
+
+def parse(message: str) -> dict:
+    """Parse an SSE message into its fields."""
+    fields = {}
+    for line in message.strip().split("\n"):
+        name, _, value = line.partition(": ")
+        fields[name] = value
+    return fields
+
+
+class TestEventBus:
+    """Tests for EventBus."""
+
+    def test_events_after(self):
+        """Test reading buffered events and detecting overwritten ones."""
+        bus = EventBus(buffer_size=3)
+        for n in range(5):
+            bus.publish(MACHINE_CREATED, {"n": n})
+
+        events, dropped = bus.events_after(0)
+        assert [e.data["n"] for e in events] == [2, 3, 4]
+        assert dropped == 2
+        assert bus.events_after(5) == ([], 0)
+
+    def test_listeners_called_on_publish(self):
+        """Test that listeners see every event published after they are added."""
+        bus = EventBus()
+        bus.publish(MACHINE_CREATED, {"n": 0})
+        seen = []
+        bus.add_listener(seen.append)
+
+        bus.publish(MACHINE_CREATED, {"n": 1})
+
+        assert [e.data["n"] for e in seen] == [1]
+
+    @pytest.mark.asyncio
+    async def test_subscriber_woken_by_publish_from_thread(self):
+        """Test that events published from worker threads reach subscribers."""
+        bus = EventBus()
+        stream = bus.subscribe(types={KICKSTART_FETCHED})
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+
+        def publish():
+            bus.publish(MACHINE_CREATED, {"mac": "filtered"})
+            bus.publish(KICKSTART_FETCHED, {"mac": "00:11"})
+
+        threading.Thread(target=publish).start()
+        message = parse(await asyncio.wait_for(first, 1))
+        await stream.aclose()
+
+        assert message["event"] == KICKSTART_FETCHED
+        assert message["id"] == "2"
+        assert json.loads(message["data"])["mac"] == "00:11"
+
+    @pytest.mark.asyncio
+    async def test_resume_and_slow_subscriber(self):
+        """Test Last-Event-ID resume and skipping ahead when too far behind."""
+        bus = EventBus(buffer_size=2)
+        for n in range(4):
+            bus.publish(MACHINE_CREATED, {"n": n})
+
+        stream = bus.subscribe(last_event_id=1)
+        messages = [parse(await stream.__anext__()) for _ in range(3)]
+        await stream.aclose()
+
+        assert messages[0]["event"] == EVENTS_DROPPED
+        assert json.loads(messages[0]["data"]) == {"count": 1}
+        assert "id" not in messages[0]
+        assert [m["id"] for m in messages[1:]] == ["3", "4"]
+
+    @pytest.mark.asyncio
+    async def test_resume_after_restart(self):
+        """Test that an id from a previous process resumes from the start."""
+        bus = EventBus(heartbeat_seconds=0.01)
+        for n in range(3):
+            bus.publish(MACHINE_CREATED, {"n": n})
+
+        stream = bus.subscribe(last_event_id=5000)
+        messages = [parse(await stream.__anext__()) for _ in range(4)]
+        await stream.aclose()
+
+        assert messages[0]["event"] == EVENTS_DROPPED
+        assert json.loads(messages[0]["data"]) == {"count": None}
+        assert [m["id"] for m in messages[1:]] == ["1", "2", "3"]
+
+    @pytest.mark.asyncio
+    async def test_keep_alive_when_idle(self):
+        """Test that idle streams send keep-alive comments."""
+        bus = EventBus(heartbeat_seconds=0.01)
+        stream = bus.subscribe()
+
+        assert await stream.__anext__() == ": keep-alive\n\n"
+        await stream.aclose()
@@ -0,0 +1,116 @@
+"""Unit tests for the per-machine password hash cache."""
+
+import pytest
+from sqlalchemy.orm import Session
+
+from provisionR.database import SessionLocal
+from provisionR.metrics import metrics
+from provisionR.services.hash_cache import (
+    COMPUTED_METRIC,
+    HashCache,
+    hash_variables,
+    parse_hash_costs,
+)
+from provisionR.services.kickstart_service import KickstartService
+from provisionR.utils.password_hasher import HASH_FORMATS
+
+MACHINE = {"mac": "AA:BB:CC:DD:EE:01", "uuid": "hash-uuid", "serial": "HASH1"}
+
+
+@pytest.fixture
+def db_session():
+    """Create a database session for unit tests."""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def render(service: KickstartService, template: str) -> str:
+    """Render a template string for MACHINE."""
+    return service.generate_from_string(
+        template_string=template, query_params={}, **MACHINE
+    )
+
+
+def computed(format_name: str) -> float:
+    """Hashes computed so far in a format."""
+    return metrics.get(COMPUTED_METRIC, format=format_name)
+
+
+class TestHashCache:
+    """Tests for HashCache."""
+
+    def test_only_referenced_hashes_computed(self, db_session: Session):
+        """Test that a template pays only for the hashes it uses."""
+        service = KickstartService(db_session, hash_cache=HashCache())
+        before = {name: computed(name) for name in HASH_FORMATS}
+
+        assert render(service, "{{ serial }}") == "HASH1"
+        assert {name: computed(name) for name in HASH_FORMATS} == before
+
+        result = render(service, "{{ grub_pbkdf2 }} {{ root_password_grub_pbkdf2 }}")
+        first, second = result.split()
+        assert first == second and first.startswith("grub.pbkdf2.sha512.10000.")
+        assert computed("grub_pbkdf2") == before["grub_pbkdf2"] + 1
+        assert computed("sha512") == before["sha512"]
+
+    def test_hashes_cached_per_machine(self, db_session: Session):
+        """Test that a returning machine gets the same hashes until rotated."""
+        cache = HashCache()
+        service = KickstartService(db_session, hash_cache=cache)
+        template = "{{ root_password }} {{ user_password_sha512 }}"
+
+        first = render(service, template)
+        assert render(KickstartService(db_session, hash_cache=cache), template) == (
+            first
+        )
+        assert first.startswith("$6$")
+
+        # A new password (e.g. after a rotation) is hashed afresh
+        computed_before = computed("sha512")
+        assert cache.hash("key", "new", "sha512") == cache.hash("key", "new", "sha512")
+        cache.hash("key", "rotated", "sha512")
+        assert computed("sha512") == computed_before + 2
+
+    def test_cache_bounded(self):
+        """Test that the least recently used hashes are dropped."""
+        cache = HashCache(max_entries=2, costs={"sha512": 1000})
+        first = cache.hash("a", "pw", "sha512")
+        cache.hash("b", "pw", "sha512")
+        cache.hash("c", "pw", "sha512")
+        assert cache.hash("a", "pw", "sha512") != first
+
+    @pytest.mark.skipif(
+        not HASH_FORMATS["yescrypt"].available(), reason="no libxcrypt yescrypt"
+    )
+    def test_yescrypt(self, db_session: Session):
+        """Test that Ubuntu-style yescrypt hashes are available to templates."""
+        service = KickstartService(db_session, hash_cache=HashCache())
+        assert render(service, "{{ luks_password_yescrypt }}").startswith("$y$")
+
+    def test_costs(self):
+        """Test configured, calibrated and default costs."""
+        assert HashCache(costs={"sha512": 7000}).cost("sha512") == 7000
+        assert HashCache().cost("grub_pbkdf2") == 10_000
+        calibrated = HashCache(latency_budget_ms=0.001)
+        assert calibrated.cost("sha512") == 5000
+        assert parse_hash_costs(" yescrypt=7, grub_pbkdf2=20000 ") == {
+            "yescrypt": 7,
+            "grub_pbkdf2": 20000,
+        }
+        with pytest.raises(ValueError):
+            parse_hash_costs("md5=1")
+
+    def test_preview_placeholders(self, db_session: Session):
+        """Test that previews fill every hash variable without hashing."""
+        service = KickstartService(db_session)
+        result = service.generate_from_string(
+            template_string=" ".join(f"{{{{ {name} }}}}" for name in hash_variables()),
+            query_params={},
+            preview=True,
+            **MACHINE,
+        )
+        assert "$preview$grub-pbkdf2-placeholder" in result
+        assert "$6$preview$root-password-placeholder" in result
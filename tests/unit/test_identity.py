@@ -0,0 +1,72 @@
+"""Unit tests for machine identity normalization."""
+
+from provisionR.utils import MachineIdentity
+from provisionR.utils.identity import (
+    IDENTITY_KEY_LENGTH,
+    normalize_mac,
+    normalize_serial,
+    normalize_uuid,
+)
+
+
+class TestNormalization:
+    """Tests for the identifier normalization helpers."""
+
+    def test_mac_formats_normalize_to_same_value(self):
+        """Test that common MAC spellings normalize identically."""
+        spellings = [
+            "00:11:22:AA:BB:CC",
+            "00-11-22-aa-bb-cc",
+            "0011.22aa.bbcc",
+            "001122aabbcc",
+            " 00:11:22:aa:bb:cc ",
+        ]
+        assert {normalize_mac(m) for m in spellings} == {"00:11:22:AA:BB:CC"}
+
+    def test_non_mac_value_is_trimmed_and_uppercased(self):
+        """Test that values that are not MAC addresses are kept recognisable."""
+        assert normalize_mac(" aa:bb:cc ") == "AA:BB:CC"
+
+    def test_uuid_formats_normalize_to_same_value(self):
+        """Test that UUID case, braces and hyphens don't matter."""
+        canonical = "550e8400-e29b-41d4-a716-446655440000"
+        spellings = [
+            canonical,
+            canonical.upper(),
+            "{550E8400-E29B-41D4-A716-446655440000}",
+            "550e8400e29b41d4a716446655440000",
+        ]
+        assert {normalize_uuid(u) for u in spellings} == {canonical}
+
+    def test_non_uuid_value_is_trimmed_and_lowercased(self):
+        """Test that values that are not UUIDs are kept recognisable."""
+        assert normalize_uuid(" Test-UUID ") == "test-uuid"
+
+    def test_serial_is_trimmed_but_case_preserved(self):
+        """Test that serials are trimmed without changing case."""
+        assert normalize_serial("  SN123abc\n") == "SN123abc"
+
+
+class TestMachineIdentity:
+    """Tests for MachineIdentity."""
+
+    def test_key_is_fixed_width(self):
+        """Test that the identity key has a fixed width."""
+        identity = MachineIdentity.from_raw("00:11:22:33:44:55", "uuid", "serial")
+        assert len(identity.key) == IDENTITY_KEY_LENGTH
+
+    def test_formatting_differences_share_a_key(self):
+        """Test that differently formatted identifiers share an identity key."""
+        first = MachineIdentity.from_raw(
+            "00:11:22:AA:BB:CC", "550E8400-E29B-41D4-A716-446655440000", "SN1"
+        )
+        second = MachineIdentity.from_raw(
+            "00-11-22-aa-bb-cc", "550e8400-e29b-41d4-a716-446655440000", " SN1 "
+        )
+        assert first == second
+
+    def test_different_machines_have_different_keys(self):
+        """Test that distinct machines get distinct identity keys."""
+        first = MachineIdentity.from_raw("00:11:22:33:44:55", "uuid", "SN1")
+        second = MachineIdentity.from_raw("00:11:22:33:44:55", "uuid", "SN2")
+        assert first.key != second.key
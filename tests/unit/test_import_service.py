@@ -0,0 +1,241 @@
+"""Unit tests for importing machine credentials from CSV."""
+
+import csv
+import io
+import time
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import DBJob, DBMachinePasswords
+from provisionR.services.credential_store import MemoryCredentialStore
+from provisionR.services.export_service import ExportService
+from provisionR.services.import_service import (
+    CsvImportError,
+    ImportService,
+    import_job,
+    upload_path,
+)
+from provisionR.services.inventory_service import InventoryService
+from provisionR.services.job_runner import (
+    FAILED,
+    JobContext,
+    JobInterrupted,
+    JobRunner,
+)
+from provisionR.services.stats_service import StatsService
+from provisionR.utils import MachineIdentity
+
+HEADER = "mac,uuid,serial,root_password,user_password,luks_password,created_at\n"
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'provisionr.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def machines(session_factory) -> dict:
+    """Map serial to (mac, root password, created_at) for stored machines."""
+    with session_factory() as db:
+        return {
+            m.serial: (m.mac, m.root_password, m.created_at)
+            for m in db.query(DBMachinePasswords)
+        }
+
+
+class TestImportService:
+    """Tests for ImportService."""
+
+    def test_export_round_trip(self, session_factory, tmp_path: Path):
+        """Test that an export imports into another database unchanged."""
+        source = io.StringIO(
+            HEADER
+            + "00-11-22-aa-bb-01,UUID-1,SN1,r1,u1,l1,2024-01-02T03:04:05\n"
+            + "00:11:22:AA:BB:02,uuid-2,SN2,r2,u2,l2,\n"
+            # Not 48 bits, but accepted by /v1/ks like any other MAC
+            + "20:00:55:04:01:fe:80,uuid-3,SN3,r3,u3,l3,\n"
+        )
+        with session_factory() as db:
+            result = ImportService(db, chunk_size=1).import_machine_passwords_csv(
+                source
+            )
+        assert (result.rows, result.inserted, result.rejected) == (3, 3, 0)
+
+        with session_factory() as db:
+            exported = ExportService(db).export_machine_passwords_csv()
+        other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+        Base.metadata.create_all(bind=other)
+        with sessionmaker(bind=other)() as db:
+            ImportService(db).import_machine_passwords_csv(io.StringIO(exported))
+            assert ExportService(db).export_machine_passwords_csv() == exported
+        other.dispose()
+
+        stored = machines(session_factory)
+        assert stored["SN1"][:2] == ("00:11:22:AA:BB:01", "r1")
+        assert stored["SN1"][2].isoformat() == "2024-01-02T03:04:05"
+        assert stored["SN3"][0] == "20:00:55:04:01:FE:80"
+
+    def test_rejects_and_generated_passwords(self, session_factory):
+        """Test that bad rows are reported and missing passwords generated."""
+        source = io.StringIO(
+            "serial,mac,uuid,root_password,user_password,luks_password,created_at\n"
+            "SN1,00:11:22:AA:BB:01,uuid-1,\n"
+            "SN2,00:11:22:AA:BB:02,uuid-2,r2,,,not-a-date\n"
+            "SN3,00:11:22:AA:BB:03,,r3\n"
+            "SN4,00:11:22:AA:BB:04,uuid-4,r4\n"
+        )
+        rejects = io.StringIO()
+        progress = []
+        with session_factory() as db:
+            result = ImportService(db, chunk_size=1).import_machine_passwords_csv(
+                source, rejects=rejects, on_progress=lambda r: progress.append(r.rows)
+            )
+
+        assert result.to_dict() == {
+            "rows": 4,
+            "inserted": 2,
+            "updated": 0,
+            "rejected": 2,
+            "generated": 2,
+        }
+        assert progress == [1, 2, 3, 4]
+        rows = list(csv.DictReader(io.StringIO(rejects.getvalue())))
+        assert [(r["line"], r["serial"]) for r in rows] == [("3", "SN2"), ("4", "SN3")]
+        assert "invalid created_at" in rows[0]["error"]
+        assert rows[1]["error"] == "missing uuid"
+
+        stored = machines(session_factory)
+        assert stored["SN4"][1] == "r4"
+        assert stored["SN1"][1]  # generated
+        with session_factory() as db:
+            machine = db.query(DBMachinePasswords).filter_by(serial="SN4").one()
+            assert machine.user_password and machine.luks_password
+
+    def test_upsert_keeps_first_seen(self, session_factory):
+        """Test that known machines get new passwords but keep created_at."""
+        first = HEADER + "00:11:22:AA:BB:01,uuid-1,SN1,r1,u1,l1,2024-01-01T00:00:00\n"
+        second = (
+            HEADER
+            + "00:11:22:aa:bb:01,UUID-1,SN1,new,u,l,2025-01-01T00:00:00\n"
+            + "00:11:22:AA:BB:02,uuid-2,SN2,r2,u2,l2,\n"
+        )
+        store = MemoryCredentialStore()
+        with session_factory() as db:
+            ImportService(db).import_machine_passwords_csv(io.StringIO(first))
+            result = ImportService(db, store=store).import_machine_passwords_csv(
+                io.StringIO(second)
+            )
+        assert (result.inserted, result.updated) == (1, 1)
+
+        stored = machines(session_factory)
+        assert stored["SN1"][1] == "new"
+        assert stored["SN1"][2].year == 2024
+        identity = MachineIdentity.from_raw("00:11:22:AA:BB:01", "uuid-1", "SN1")
+        with session_factory() as db:
+            assert store.lookup(db, identity) == ("new", "u", "l")
+
+    def test_search_index_and_stats_kept_current(self, session_factory):
+        """Test that bulk inserts are indexed and counted, and triggers restored."""
+        source = io.StringIO(
+            "mac,uuid,serial\n"
+            + "".join(f"00:11:22:AA:BB:{n:02X},uuid-{n},SN{n}\n" for n in range(5))
+        )
+        with session_factory() as db:
+            ImportService(db, chunk_size=2).import_machine_passwords_csv(source)
+            db.add(
+                DBMachinePasswords(
+                    mac="00:11:22:CC:DD:EE",
+                    uuid="uuid-x",
+                    serial="SNX",
+                    identity_key="x" * 32,
+                    root_password="r",
+                    user_password="u",
+                    luks_password="l",
+                )
+            )
+            db.commit()
+
+            stats = StatsService(db).summary(days=1, hours=1)
+            assert stats["total_machines"] == 6
+            assert sum(stats["new_machines_per_day"].values()) == 6
+            page = InventoryService(db).list_machines(contains="22:AA:BB")
+            assert len(page.items) == 5
+            page = InventoryService(db).list_machines(contains="SNX")
+            assert len(page.items) == 1
+
+    def test_blank_cells_keep_known_passwords(self, session_factory):
+        """Test that re-importing a machine without passwords keeps its own."""
+        with session_factory() as db:
+            ImportService(db).import_machine_passwords_csv(
+                io.StringIO(HEADER + "00:11:22:AA:BB:01,uuid-1,SN1,r1,u1,l1,\n")
+            )
+            result = ImportService(db).import_machine_passwords_csv(
+                io.StringIO(
+                    "mac,uuid,serial,root_password\n00:11:22:AA:BB:01,uuid-1,SN1,r2\n"
+                )
+            )
+        assert (result.updated, result.generated) == (1, 0)
+        with session_factory() as db:
+            machine = db.query(DBMachinePasswords).one()
+            assert (
+                machine.root_password,
+                machine.user_password,
+                machine.luks_password,
+            ) == ("r2", "u1", "l1")
+
+    def test_parallel_generation(self, session_factory):
+        """Test that worker processes generate passwords for a whole chunk."""
+        source = io.StringIO(
+            "mac,uuid,serial\n"
+            + "".join(f"00:11:22:AA:BB:{n:02X},uuid-{n},SN{n}\n" for n in range(10))
+        )
+        with session_factory() as db:
+            result = ImportService(db, workers=2).import_machine_passwords_csv(source)
+        assert result.generated == 10
+        assert len({p for _, p, _ in machines(session_factory).values()}) == 10
+
+    def test_missing_required_columns(self, session_factory):
+        """Test that a file without identity columns is refused up front."""
+        with session_factory() as db, pytest.raises(CsvImportError):
+            ImportService(db).import_machine_passwords_csv(io.StringIO("mac,foo\n"))
+
+    def test_failed_import_job_removes_upload(self, session_factory, tmp_path):
+        """Test that the uploaded file is deleted when its import job fails."""
+        runner = JobRunner(session_factory, tmp_path / "jobs")
+        runner.register("import", import_job, filename="rejects.csv")
+        upload = upload_path(runner.results_dir, "import-bad.csv")
+        upload.parent.mkdir(parents=True)
+        upload.write_text("mac,foo\n")
+
+        with session_factory() as db:
+            job_id = runner.submit(db, "import", {"upload": upload.name}).id
+        deadline = time.monotonic() + 5
+        with session_factory() as db:
+            while db.get(DBJob, job_id).status != FAILED:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+                db.expire_all()
+        runner.stop()
+        assert not upload.exists()
+
+    def test_interrupted_import_job_keeps_upload(self, session_factory, tmp_path):
+        """Test that an import stopped by shutdown keeps its upload to run again."""
+        runner = JobRunner(session_factory, tmp_path / "jobs")
+        upload = upload_path(runner.results_dir, "import-1.csv")
+        upload.parent.mkdir(parents=True)
+        upload.write_text(HEADER + "00:11:22:AA:BB:01,uuid-1,SN1,r1,u1,l1,\n")
+        context = JobContext(
+            runner, 1, {"upload": upload.name}, tmp_path / "jobs" / "rejects.csv"
+        )
+
+        runner.stop()
+        with pytest.raises(JobInterrupted):
+            import_job(context)
+        assert upload.exists()
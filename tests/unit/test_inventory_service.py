@@ -0,0 +1,122 @@
+"""Unit tests for the machine inventory service."""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from provisionR.database import SessionLocal
+from provisionR.models import DBMachinePasswords
+from provisionR.search_index import has_search_index
+from provisionR.services import InventoryService
+from provisionR.services.inventory_service import InvalidCursor
+from provisionR.utils import MachineIdentity
+
+
+@pytest.fixture
+def db_session():
+    """Create a database session with a few machines."""
+    db = SessionLocal()
+    start = datetime(2024, 1, 1)
+    machines = [
+        ("00:1A:2B:00:00:01", "aaaa-1111", "RACK1-SN001"),
+        ("00:1A:2B:00:00:02", "bbbb-2222", "RACK1-SN002"),
+        ("00:1A:2C:00:00:03", "cccc-3333", "RACK2-SN003"),
+        ("66:77:88:00:00:04", "dddd-4444", "rack2-sn004"),
+        ("66:77:88:00:00:05", "eeee-5555", "RACK3-SN005"),
+    ]
+    for n, (mac, uuid, serial) in enumerate(machines):
+        identity = MachineIdentity.from_raw(mac, uuid, serial)
+        db.add(
+            DBMachinePasswords(
+                mac=identity.mac,
+                uuid=identity.uuid,
+                serial=identity.serial,
+                identity_key=identity.key,
+                root_password="r",
+                user_password="u",
+                luks_password="l",
+                # Two machines share a timestamp to exercise the id tiebreak
+                created_at=start + timedelta(hours=min(n, 3)),
+            )
+        )
+    db.commit()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def all_pages(service: InventoryService, **kwargs) -> list:
+    """Follow cursors until the last page; return every serial."""
+    serials, cursor = [], None
+    while True:
+        page = service.list_machines(cursor=cursor, **kwargs)
+        serials.extend(item["serial"] for item in page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            return serials
+
+
+class TestInventoryService:
+    """Tests for InventoryService."""
+
+    def test_keyset_pages_cover_everything_once(self, db_session: Session):
+        """Test that paging visits each machine exactly once, in order."""
+        service = InventoryService(db_session)
+
+        assert all_pages(service, limit=2) == [
+            "RACK1-SN001",
+            "RACK1-SN002",
+            "RACK2-SN003",
+            "rack2-sn004",
+            "RACK3-SN005",
+        ]
+        assert all_pages(service, limit=2, descending=True) == [
+            "RACK3-SN005",
+            "rack2-sn004",
+            "RACK2-SN003",
+            "RACK1-SN002",
+            "RACK1-SN001",
+        ]
+        assert all_pages(service, limit=3, sort="mac")[-1] == "RACK3-SN005"
+
+    def test_prefix_search(self, db_session: Session):
+        """Test prefix matching on MAC (any format), UUID and serial."""
+        service = InventoryService(db_session)
+
+        assert all_pages(service, prefix="001a2b") == ["RACK1-SN001", "RACK1-SN002"]
+        assert all_pages(service, prefix="00:1a") == [
+            "RACK1-SN001",
+            "RACK1-SN002",
+            "RACK2-SN003",
+        ]
+        assert all_pages(service, prefix="CCCC") == ["RACK2-SN003"]
+        assert all_pages(service, prefix="RACK2") == ["RACK2-SN003"]
+
+    def test_substring_search(self, db_session: Session):
+        """Test case-insensitive substring matching, with and without trigrams."""
+        service = InventoryService(db_session)
+        assert has_search_index(db_session.connection())
+
+        assert all_pages(service, contains="sn00") == [
+            "RACK1-SN001",
+            "RACK1-SN002",
+            "RACK2-SN003",
+            "rack2-sn004",
+            "RACK3-SN005",
+        ]
+        assert all_pages(service, contains="rack2") == ["RACK2-SN003", "rack2-sn004"]
+        assert all_pages(service, contains="4444") == ["rack2-sn004"]
+        assert all_pages(service, contains="05") == ["RACK3-SN005"]
+        assert all_pages(service, contains='"') == []
+
+    def test_cursor_must_match_sort(self, db_session: Session):
+        """Test that cursors can't be reused with another sort or forged."""
+        service = InventoryService(db_session)
+        cursor = service.list_machines(limit=1).next_cursor
+
+        with pytest.raises(InvalidCursor):
+            service.list_machines(cursor=cursor, sort="mac")
+        with pytest.raises(InvalidCursor):
+            service.list_machines(cursor="not-a-cursor")
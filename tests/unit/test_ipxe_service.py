@@ -0,0 +1,80 @@
+"""Unit tests for iPXE boot script generation."""
+
+from pathlib import Path
+
+import pytest
+from jinja2 import DictLoader, TemplateNotFound
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.config import update_global_config_in_db
+from provisionR.database import Base
+from provisionR.models import DBMachinePasswords, GlobalConfig
+from provisionR.services.ipxe_service import IpxeService, kickstart_url
+from provisionR.services.kickstart_service import create_template_env
+from provisionR.settings import Settings
+from provisionR.utils import MachineIdentity
+
+IDENTITY = MachineIdentity.from_raw("aa:bb:cc:dd:ee:01", "uuid-1", "SN-1")
+PARAMS = {"mac": "aa:bb:cc:dd:ee:01", "uuid": "uuid-1", "serial": "SN-1"}
+KS_URL = "http://provisionr/api/v1/ks?mac=aa%3Abb%3Acc%3Add%3Aee%3A01"
+
+
+@pytest.fixture
+def db(tmp_path: Path):
+    """Create a session for a scratch SQLite database."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'provisionr.db'}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+    engine.dispose()
+
+
+class TestIpxeService:
+    """Tests for IpxeService."""
+
+    def test_default_template(self, db):
+        """Test that the bundled script boots the installer with the kickstart."""
+        script = IpxeService(db).generate(IDENTITY, KS_URL, PARAMS)
+
+        assert script.startswith("#!ipxe")
+        assert f"inst.ks={KS_URL}" in script
+        assert "/images/pxeboot/vmlinuz" in script
+        assert "boot" in script.splitlines()
+        # Scripts never create credentials
+        assert db.query(DBMachinePasswords).count() == 0
+
+    def test_config_values_and_per_os_template(self, db):
+        """Test that config values are used and a target OS template wins."""
+        update_global_config_in_db(
+            db,
+            GlobalConfig(
+                target_os="Ubuntu25.04",
+                values={"install_repo": "http://mirror/ubuntu"},
+            ),
+        )
+        env = create_template_env(Settings())
+        env.loader = DictLoader(
+            {
+                "default.ipxe.j2": "#!ipxe\ndefault",
+                "Ubuntu25.04.ipxe.j2": "#!ipxe\nkernel {{ install_repo }}/linux",
+            }
+        )
+
+        script = IpxeService(db, jinja_env=env).generate(IDENTITY, KS_URL, PARAMS)
+
+        assert script == "#!ipxe\nkernel http://mirror/ubuntu/linux"
+
+    def test_missing_template(self, db):
+        """Test that having no template at all raises TemplateNotFound."""
+        env = create_template_env(Settings())
+        env.loader = DictLoader({})
+
+        with pytest.raises(TemplateNotFound):
+            IpxeService(db, jinja_env=env).generate(IDENTITY, KS_URL, PARAMS)
+
+    def test_kickstart_url_keeps_spelling(self):
+        """Test that identifiers are passed as sent, and nothing else."""
+        url = kickstart_url("http://p/api/v1/ks", "AA-BB", "u 1", "S&N")
+
+        assert url == "http://p/api/v1/ks?mac=AA-BB&uuid=u+1&serial=S%26N"
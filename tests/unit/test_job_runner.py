@@ -0,0 +1,243 @@
+"""Unit tests for the background job runner."""
+
+import os
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import DBJob
+from provisionR.services.job_runner import (
+    CANCELLED,
+    COMPLETED,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    JobError,
+    JobRunner,
+)
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def write_lines(context):
+    """Job handler writing params["lines"] numbered lines."""
+    with open(context.output_path, "w") as output:
+        for n in range(context.params["lines"]):
+            output.write(f"{n}\n")
+            context.progress(n + 1, context.params["lines"])
+
+
+def wait_for(session_factory, job_id: int, *statuses: str) -> DBJob:
+    """Wait until a job reaches one of `statuses`."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with session_factory() as session:
+            job = session.get(DBJob, job_id)
+            if job.status in statuses:
+                return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is still {job.status}")
+
+
+def make_runner(session_factory, tmp_path: Path, **kwargs) -> JobRunner:
+    """Create a runner with the write_lines job kind registered as "lines"."""
+    runner = JobRunner(session_factory, tmp_path / "results", **kwargs)
+    runner.register("lines", write_lines, filename="lines.txt", media_type="text/plain")
+    return runner
+
+
+class TestJobRunner:
+    """Tests for JobRunner."""
+
+    def test_job_runs_and_result_can_be_downloaded(self, session_factory, tmp_path):
+        """Test that a completed job's result file is available."""
+        runner = make_runner(session_factory, tmp_path)
+        with session_factory() as session:
+            job_id = runner.submit(session, "lines", {"lines": 3}).id
+
+        job = wait_for(session_factory, job_id, COMPLETED, FAILED)
+
+        assert (job.status, job.progress, job.total) == (COMPLETED, 3, 3)
+        with session_factory() as session:
+            path, filename, media_type = runner.result(session, job_id)
+        assert path.read_text() == "0\n1\n2\n"
+        assert (filename, media_type) == ("lines.txt", "text/plain")
+        runner.stop()
+
+    def test_unknown_kind_rejected(self, session_factory, tmp_path):
+        """Test that only registered kinds can be submitted."""
+        runner = make_runner(session_factory, tmp_path)
+        with session_factory() as session, pytest.raises(JobError):
+            runner.submit(session, "nope", {})
+
+    def test_failed_job_records_error(self, session_factory, tmp_path):
+        """Test that a handler exception fails the job without a result."""
+        runner = make_runner(session_factory, tmp_path)
+        with session_factory() as session:
+            job_id = runner.submit(session, "lines", {}).id
+
+        job = wait_for(session_factory, job_id, COMPLETED, FAILED)
+
+        assert job.status == FAILED
+        assert "lines" in job.error
+        with session_factory() as session, pytest.raises(JobError):
+            runner.result(session, job_id)
+        runner.stop()
+
+    def test_bounded_concurrency_and_cancel(self, session_factory, tmp_path):
+        """Test that extra jobs wait queued and both states can be cancelled."""
+        release = threading.Event()
+
+        def block(context):
+            while not release.wait(0.01):
+                context.check_cancelled()
+
+        runner = make_runner(session_factory, tmp_path, max_concurrent=1)
+        runner.register("block", block, filename="block.txt")
+        with session_factory() as session:
+            first = runner.submit(session, "block", {}).id
+            second = runner.submit(session, "lines", {"lines": 1}).id
+        wait_for(session_factory, first, RUNNING)
+        with session_factory() as session:
+            assert session.get(DBJob, second).status == QUEUED
+            assert runner.cancel(session, second).status == CANCELLED
+            runner.cancel(session, first)
+        assert wait_for(session_factory, first, CANCELLED).status == CANCELLED
+        assert not list((tmp_path / "results").iterdir())
+        runner.stop()
+
+    def test_cancel_job_running_in_another_process(self, session_factory, tmp_path):
+        """Test that a job stops when a runner that doesn't run it cancels it."""
+
+        def block(context):
+            while True:
+                context.check_cancelled()
+                time.sleep(0.01)
+
+        runner = make_runner(session_factory, tmp_path, heartbeat_seconds=0.05)
+        runner.register("block", block, filename="b")
+        with session_factory() as session:
+            job_id = runner.submit(session, "block", {}).id
+        wait_for(session_factory, job_id, RUNNING)
+        runner.start()
+
+        other = make_runner(session_factory, tmp_path)
+        with session_factory() as session:
+            assert other.cancel(session, job_id).cancel_requested
+
+        assert wait_for(session_factory, job_id, CANCELLED).status == CANCELLED
+        runner.stop()
+
+    def test_unfinished_jobs_run_again_after_restart(self, session_factory, tmp_path):
+        """Test that jobs queued or running at shutdown are run by start()."""
+        with session_factory() as session:
+            session.add(DBJob(kind="lines", status=RUNNING, params='{"lines": 2}'))
+            session.commit()
+        runner = make_runner(session_factory, tmp_path)
+
+        runner.start()
+
+        assert wait_for(session_factory, 1, COMPLETED, FAILED).status == COMPLETED
+        runner.stop()
+
+    def test_only_abandoned_running_jobs_reclaimed(self, session_factory, tmp_path):
+        """Test that jobs with a live heartbeat stay with the runner running them."""
+        release = threading.Event()
+
+        def block(context):
+            release.wait(5)
+            context.output_path.write_text("done")
+
+        runner = make_runner(session_factory, tmp_path, heartbeat_seconds=0.05)
+        runner.register("block", block, filename="b")
+        with session_factory() as session:
+            job_id = runner.submit(session, "block", {}).id
+        wait_for(session_factory, job_id, RUNNING)
+        runner.start()
+
+        other = make_runner(session_factory, tmp_path, stale_after_seconds=1)
+        time.sleep(1.2)
+        assert other.reclaim() == []
+        with session_factory() as session:
+            assert session.get(DBJob, job_id).owner == runner.owner
+
+        release.set()
+        assert wait_for(session_factory, job_id, COMPLETED).status == COMPLETED
+        runner.stop()
+
+    def test_interrupted_jobs_queued_again(self, session_factory, tmp_path):
+        """Test that stopping a runner hands its running jobs back to the queue."""
+
+        def block(context):
+            while True:
+                context.check_cancelled()
+                time.sleep(0.01)
+
+        runner = make_runner(session_factory, tmp_path)
+        runner.register("block", block, filename="b")
+        with session_factory() as session:
+            job_id = runner.submit(session, "block", {}).id
+        wait_for(session_factory, job_id, RUNNING)
+
+        runner.stop()
+
+        with session_factory() as session:
+            job = session.get(DBJob, job_id)
+            assert (job.status, job.owner) == (QUEUED, None)
+
+    def test_delete_and_expiry_remove_results(self, session_factory, tmp_path):
+        """Test that deleted and expired jobs take their result files along."""
+        runner = make_runner(session_factory, tmp_path, retention_seconds=3600)
+        with session_factory() as session:
+            kept, deleted, expired = (
+                runner.submit(session, "lines", {"lines": 1}).id for _ in range(3)
+            )
+        for job_id in (kept, deleted, expired):
+            wait_for(session_factory, job_id, COMPLETED)
+        upload = tmp_path / "results" / "uploads" / "unused.csv"
+        upload.parent.mkdir()
+        upload.write_text("mac,uuid,serial\n")
+        an_hour_ago = time.time() - 3601
+        for path in (upload, runner.result_path(expired)):
+            os.utime(path, (an_hour_ago, an_hour_ago))
+        with session_factory() as session:
+            session.get(DBJob, expired).finished_at = datetime.now(UTC) - timedelta(
+                hours=2
+            )
+            session.commit()
+
+            runner.delete(session, deleted)
+            assert session.get(DBJob, deleted) is None
+            assert runner.sweep() == 1
+            assert session.get(DBJob, expired) is None
+
+        assert not runner.result_path(deleted).exists()
+        assert not runner.result_path(expired).exists()
+        assert not upload.exists()
+        assert runner.result_path(kept).exists()
+        runner.stop()
+
+    def test_unfinished_job_not_deleted(self, session_factory, tmp_path):
+        """Test that a queued job can't be deleted."""
+        runner = make_runner(session_factory, tmp_path)
+        with session_factory() as session:
+            session.add(DBJob(kind="lines", status=QUEUED, params="{}"))
+            session.commit()
+            with pytest.raises(JobError):
+                runner.delete(session, 1)
@@ -0,0 +1,38 @@
+"""Unit tests for JSON Merge Patch."""
+
+import pytest
+
+from provisionR.utils import apply_merge_patch
+
+
+class TestApplyMergePatch:
+    """Tests for apply_merge_patch, using the examples from RFC 7396."""
+
+    @pytest.mark.parametrize(
+        ("target", "patch", "expected"),
+        [
+            ({"a": "b"}, {"a": "c"}, {"a": "c"}),
+            ({"a": "b"}, {"b": "c"}, {"a": "b", "b": "c"}),
+            ({"a": "b"}, {"a": None}, {}),
+            ({"a": "b", "b": "c"}, {"a": None}, {"b": "c"}),
+            ({"a": ["b"]}, {"a": "c"}, {"a": "c"}),
+            ({"a": "c"}, {"a": ["b"]}, {"a": ["b"]}),
+            ({"a": {"b": "c"}}, {"a": {"b": "d", "c": None}}, {"a": {"b": "d"}}),
+            ({"a": [{"b": "c"}]}, {"a": [1]}, {"a": [1]}),
+            (["a", "b"], ["c", "d"], ["c", "d"]),
+            ({"a": "b"}, ["c"], ["c"]),
+            ({"a": "foo"}, None, None),
+            ({"e": None}, {"a": 1}, {"e": None, "a": 1}),
+            ([1, 2], {"a": "b", "c": None}, {"a": "b"}),
+            ({}, {"a": {"bb": {"ccc": None}}}, {"a": {"bb": {}}}),
+        ],
+    )
+    def test_rfc_examples(self, target, patch, expected):
+        """Test the RFC 7396 appendix A examples."""
+        assert apply_merge_patch(target, patch) == expected
+
+    def test_target_not_modified(self):
+        """Test that the target document is left untouched."""
+        target = {"a": {"b": 1}}
+        apply_merge_patch(target, {"a": {"b": 2}})
+        assert target == {"a": {"b": 1}}
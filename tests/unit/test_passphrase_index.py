@@ -0,0 +1,204 @@
+"""Unit tests for fleet-wide passphrase uniqueness."""
+
+import io
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords, DBPassphrase, RotationScope
+from provisionR.services.import_service import ImportService
+from provisionR.services.passphrase_index import REDRAWS_METRIC, PassphraseIndex
+from provisionR.services.password_service import PasswordService
+from provisionR.services.rotation_service import PasswordRotator
+from provisionR.utils import MachineIdentity
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database with one machine."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        add_machine(db, 0, ("root-0", "user-0", "luks-0"))
+    yield factory
+    engine.dispose()
+
+
+def add_machine(db, n: int, passwords) -> None:
+    """Store a machine with the given passwords."""
+    identity = MachineIdentity.from_raw(
+        f"00:00:00:00:00:{n:02x}", f"uuid-{n}", f"SN{n:03d}"
+    )
+    db.add(
+        DBMachinePasswords(
+            mac=identity.mac,
+            uuid=identity.uuid,
+            serial=identity.serial,
+            identity_key=identity.key,
+            root_password=passwords[0],
+            user_password=passwords[1],
+            luks_password=passwords[2],
+        )
+    )
+    db.commit()
+
+
+def drawing(*passphrases: str):
+    """A generator returning the given passphrases in turn."""
+    return iter(passphrases).__next__
+
+
+class TestPassphraseIndex:
+    """Tests for PassphraseIndex."""
+
+    def test_redraws_stored_and_repeated_passphrases(self, session_factory):
+        """Test that passphrases of stored machines and repeats are redrawn."""
+        index = PassphraseIndex(
+            generate=drawing("root-0", "a", "user-0", "a", "b", "c")
+        )
+        redraws = metrics.get(REDRAWS_METRIC)
+        with session_factory() as db:
+            assert index.new_credentials(db) == ("a", "b", "c")
+        assert metrics.get(REDRAWS_METRIC) - redraws == 3
+        assert len(index) == 6
+
+    def test_picks_up_other_processes(self, session_factory):
+        """Test that machines stored and rotated elsewhere are taken."""
+        index = PassphraseIndex(generate=drawing("x", "new-1", "y", "new-2", "z", "w"))
+        with session_factory() as db:
+            index.load(db)
+            add_machine(db, 1, ("x", "y", "z"))
+            assert index.new_credentials(db) == ("new-1", "new-2", "w")
+
+        rotator = PasswordRotator(session_factory)
+        with session_factory() as db:
+            job_id = rotator.create_job(db, RotationScope()).id
+        rotator.run(job_id)
+        with session_factory() as db:
+            rotated = [root for (root,) in db.query(DBMachinePasswords.root_password)]
+            index.generate = drawing(*rotated, "q1", "q2", "q3")
+            assert index.new_credentials(db) == ("q1", "q2", "q3")
+
+    def test_concurrent_claims_decided_by_database(self, session_factory):
+        """Test that a passphrase claimed by another process meanwhile is redrawn."""
+        first = PassphraseIndex(generate=drawing("s1", "s2", "s3"))
+        second = PassphraseIndex(generate=drawing("s1", "t2", "t3", "t4"))
+        with session_factory() as db:
+            second.load(db)
+            # The first claim lands between the second's sync and its insert
+            second._sync = lambda db: None
+            first.register(db, list(first.new_credentials(db)))
+            db.commit()
+            redraws = metrics.get(REDRAWS_METRIC)
+            drawn = list(second.new_credentials(db))
+            assert second.register(db, drawn) == ["t4", "t2", "t3"]
+        assert metrics.get(REDRAWS_METRIC) - redraws == 1
+
+    def test_picks_up_other_processes_imports(self, session_factory):
+        """Test that passwords imported over a known machine elsewhere are taken."""
+        index = PassphraseIndex(generate=drawing("imp-r", "n1", "n2", "n3"))
+        source = io.StringIO(
+            "mac,uuid,serial,root_password,user_password,luks_password\n"
+            "00:00:00:00:00:00,uuid-0,SN000,imp-r,imp-u,imp-l\n"
+        )
+        with session_factory() as db:
+            index.load(db)
+            ImportService(
+                db, passphrases=PassphraseIndex()
+            ).import_machine_passwords_csv(source)
+            assert index.new_credentials(db) == ("n1", "n2", "n3")
+
+    def test_claim_replaces_taken(self, session_factory):
+        """Test that claimed credentials only change where already taken."""
+        index = PassphraseIndex(generate=drawing("fresh-1", "fresh-2"))
+        with session_factory() as db:
+            claimed = index.claim_credentials(
+                db, [("a", "root-0", "b"), ("c", "d", "a")]
+            )
+        assert claimed == [("a", "fresh-1", "b"), ("c", "d", "fresh-2")]
+
+    def test_grows_past_capacity(self, session_factory):
+        """Test that a full filter is followed by a larger one."""
+        index = PassphraseIndex(capacity=10)
+        with session_factory() as db:
+            for _ in range(10):
+                index.new_credentials(db)
+        assert len(index._filters) > 1
+        assert len(index) == 33
+
+
+class TestUniqueGeneration:
+    """Tests for services generating passphrases through the index."""
+
+    def test_password_service(self, session_factory):
+        """Test that new machines never get a stored passphrase."""
+        index = PassphraseIndex(generate=drawing("root-0", "p1", "p2", "p3"))
+        with session_factory() as db:
+            created = PasswordService(db, passphrases=index).get_or_create_passwords(
+                "00:00:00:00:00:aa", "uuid-a", "SNA"
+            )
+            registered = {p for (p,) in db.query(DBPassphrase.passphrase)}
+        assert created == ("p1", "p2", "p3")
+        assert {"p1", "p2", "p3"} <= registered
+
+    def test_rotation_redraws_worker_duplicates(self, session_factory, monkeypatch):
+        """Test that rotated passphrases duplicated across a chunk are redrawn."""
+        monkeypatch.setattr(
+            "provisionR.services.rotation_service.generate_credentials",
+            lambda count: [("dup", "dup", "root-0")] * count,
+        )
+        with session_factory() as db:
+            add_machine(db, 1, ("root-1", "user-1", "luks-1"))
+        index = PassphraseIndex()
+        rotator = PasswordRotator(session_factory, passphrases=index)
+        with session_factory() as db:
+            job_id = rotator.create_job(db, RotationScope()).id
+        rotator.run(job_id)
+
+        with session_factory() as db:
+            stored = [
+                p
+                for row in db.query(
+                    DBMachinePasswords.root_password,
+                    DBMachinePasswords.user_password,
+                    DBMachinePasswords.luks_password,
+                )
+                for p in row
+            ]
+        assert len(set(stored)) == 6
+        assert stored.count("dup") == 1
+        assert "root-0" not in stored
+
+    def test_import_keeps_given_and_redraws_generated(
+        self, session_factory, monkeypatch
+    ):
+        """Test that imports redraw taken generated passwords only."""
+        monkeypatch.setattr(
+            "provisionR.services.import_service.generate_credentials",
+            lambda count: [("root-0", "x", "y")] * count,
+        )
+        index = PassphraseIndex(generate=drawing("fresh-1"))
+        source = io.StringIO(
+            "mac,uuid,serial,root_password,user_password,luks_password\n"
+            "00:00:00:00:00:00,uuid-0,SN000,root-0,user-0,luks-0\n"
+            "00:00:00:00:00:01,uuid-1,SN001,,user-0,luks-1\n"
+        )
+        with session_factory() as db:
+            result = ImportService(db, passphrases=index).import_machine_passwords_csv(
+                source
+            )
+            stored = {
+                m.serial: (m.root_password, m.user_password)
+                for m in db.query(DBMachinePasswords)
+            }
+        assert result.generated == 1
+        assert stored["SN000"] == ("root-0", "user-0")
+        assert stored["SN001"] == ("fresh-1", "user-0")
@@ -1,6 +1,7 @@
 """Unit tests for password hasher."""
 
 from provisionR.utils import PasswordHasher
+from provisionR.utils.password_hasher import HASH_FORMATS, HashFormat, calibrate_cost
 
 
 class TestPasswordHasher:
@@ -54,3 +55,27 @@ class TestPasswordHasher:
 
         assert hashed.startswith("$6$")
         assert len(hashed) > 50
+
+    def test_hash_formats(self):
+        """Test that each available registered format produces its own hash."""
+        prefixes = {"sha512": "$6$", "yescrypt": "$y$", "grub_pbkdf2": "grub.pbkdf2."}
+        for name, prefix in prefixes.items():
+            if not HASH_FORMATS[name].available():
+                continue
+            assert PasswordHasher.hash("secret", name).startswith(prefix)
+        assert "rounds=6000$" in PasswordHasher.hash("secret", "sha512", cost=6000)
+
+    def test_calibrate_cost(self):
+        """Test that calibration scales the cost to the budget, not below default."""
+        sha512 = HASH_FORMATS["sha512"]
+        assert calibrate_cost(sha512, 0) == sha512.default_cost
+        assert calibrate_cost(sha512, 60) > sha512.default_cost
+
+        slow = HashFormat(
+            name="slow",
+            hash=lambda password, cost: password,
+            default_cost=5,
+            max_cost=11,
+            exponential=True,
+        )
+        assert calibrate_cost(slow, 60) == 11
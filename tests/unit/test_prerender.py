@@ -0,0 +1,155 @@
+"""Unit tests for kickstart pre-rendering."""
+
+import time
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.metrics import metrics
+from provisionR.models import ConfigGroup, DBMachinePasswords, GlobalConfig
+from provisionR.services.config_layers import ConfigLayers
+from provisionR.services.event_bus import (
+    CONFIG_CHANGED,
+    KICKSTART_FETCHED,
+    EventBus,
+)
+from provisionR.services.prerender import HITS_METRIC, KickstartWarmer
+from provisionR.utils import MachineIdentity
+
+IDENTITY = MachineIdentity.from_raw("AA:BB:CC:DD:EE:01", "uuid-1", "SN-1")
+FORM = (IDENTITY.mac, IDENTITY.uuid, IDENTITY.serial)
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database with one machine."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        session.add(
+            DBMachinePasswords(
+                mac=IDENTITY.mac,
+                uuid=IDENTITY.uuid,
+                serial=IDENTITY.serial,
+                identity_key=IDENTITY.key,
+                root_password="root",
+                user_password="user",
+                luks_password="luks",
+            )
+        )
+        session.commit()
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def warmer(session_factory):
+    """Create a warmer that doesn't throttle."""
+    return KickstartWarmer(session_factory, renders_per_second=10_000)
+
+
+class TestKickstartWarmer:
+    """Tests for KickstartWarmer."""
+
+    def test_warm_then_hit(self, session_factory, warmer):
+        """Test that warmed machines are served from the cache."""
+        hits = metrics.get(HITS_METRIC)
+
+        assert warmer.warm() == 1
+
+        with session_factory() as session:
+            rendered = warmer.lookup(session, IDENTITY, "default", FORM)
+            assert rendered is not None and IDENTITY.mac in rendered
+            # Another template, or identifiers spelled differently, miss
+            assert warmer.lookup(session, IDENTITY, "rocky", FORM) is None
+            lower = (IDENTITY.mac.lower(), IDENTITY.uuid, IDENTITY.serial)
+            assert warmer.lookup(session, IDENTITY, "default", lower) is None
+        assert metrics.get(HITS_METRIC) == hits + 1
+
+    def test_missed_form_is_rendered_next(self, session_factory, warmer):
+        """Test that a miss teaches the warmer how the machine spells itself."""
+        lower = (IDENTITY.mac.lower(), IDENTITY.uuid, IDENTITY.serial)
+        with session_factory() as session:
+            assert warmer.lookup(session, IDENTITY, "default", lower) is None
+
+        warmer.warm()
+
+        with session_factory() as session:
+            rendered = warmer.lookup(session, IDENTITY, "default", lower)
+        assert IDENTITY.mac.lower() in rendered
+
+    def test_rotated_passwords_are_not_served(self, session_factory, warmer):
+        """Test that a render is dropped once the machine's passwords change."""
+        warmer.warm()
+        with session_factory() as session:
+            session.query(DBMachinePasswords).update({"root_password": "new"})
+            session.commit()
+
+            assert warmer.lookup(session, IDENTITY, "default", FORM) is None
+
+    def test_invalidated_by_config_events(self, session_factory, warmer):
+        """Test that config changes drop cached renders and other events don't."""
+        bus = EventBus()
+        bus.add_listener(warmer.on_event)
+        warmer.warm()
+
+        bus.publish(KICKSTART_FETCHED, {})
+        with session_factory() as session:
+            assert warmer.lookup(session, IDENTITY, "default", FORM) is not None
+        bus.publish(CONFIG_CHANGED, {"scope": "global"})
+        with session_factory() as session:
+            assert warmer.lookup(session, IDENTITY, "default", FORM) is None
+
+    def test_config_changed_by_another_process_not_served(
+        self, session_factory, warmer
+    ):
+        """Test that renders are dropped once the stored config layers change."""
+        other = ConfigLayers()
+        warmer.warm()
+        with session_factory() as session:
+            other.put_group(session, ConfigGroup(name="rack", values={"k": "v"}))
+            assert warmer.lookup(session, IDENTITY, "default", FORM) is None
+
+        warmer.warm()
+        with session_factory() as session:
+            assert warmer.lookup(session, IDENTITY, "default", FORM) is not None
+            other.update_global(session, GlobalConfig(values={"k": "v"}))
+            assert warmer.lookup(session, IDENTITY, "default", FORM) is None
+
+    def test_background_thread_warms_after_start(self, session_factory, warmer):
+        """Test that start() warms known machines in the background."""
+        warmer.start()
+        try:
+            deadline = time.monotonic() + 5
+            rendered = None
+            while rendered is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+                with session_factory() as session:
+                    rendered = warmer.lookup(session, IDENTITY, "default", FORM)
+        finally:
+            warmer.stop()
+        assert rendered is not None
+
+    def test_prefetch_renders_the_form_to_come(self, session_factory, warmer):
+        """Test that prefetch() readies the form the machine will request."""
+        lower = (IDENTITY.mac.lower(), IDENTITY.uuid, IDENTITY.serial)
+        warmer.start()
+        try:
+            warmer.prefetch(IDENTITY, lower)
+            deadline = time.monotonic() + 5
+            rendered = None
+            while rendered is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+                entry = warmer._entries.get(IDENTITY.key)
+                if entry is not None and entry.form == lower:
+                    rendered = entry.rendered
+        finally:
+            warmer.stop()
+        assert IDENTITY.mac.lower() in rendered
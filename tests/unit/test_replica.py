@@ -0,0 +1,255 @@
+"""Unit tests for read-only replicas."""
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from provisionR.database import Database
+from provisionR.metrics import metrics
+from provisionR.models import DBMachinePasswords, TemplateRule
+from provisionR.services.backup_service import gzip_chunks, snapshot
+from provisionR.services.credential_store import MemoryCredentialStore
+from provisionR.services.password_service import PasswordService
+from provisionR.services.primary_client import PrimaryUnavailable
+from provisionR.services.replica import (
+    REFRESHES_METRIC,
+    ReplicaSync,
+    config_fingerprint,
+)
+from provisionR.services.rule_service import RuleEngine, create_rule
+from provisionR.utils import MachineIdentity
+
+
+def identity(n: int) -> MachineIdentity:
+    """Identity of test machine n."""
+    return MachineIdentity.from_raw(f"00:00:00:00:02:{n:02x}", f"uuid-{n}", f"RP{n}")
+
+
+class FakePrimary:
+    """Primary serving snapshots of a local database, like PrimaryClient."""
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.taken_at = time.time()
+        self.available = True
+
+    def add_machine(self, n: int) -> None:
+        machine = identity(n)
+        with self.database.session_factory() as session:
+            session.add(
+                DBMachinePasswords(
+                    mac=machine.mac,
+                    uuid=machine.uuid,
+                    serial=machine.serial,
+                    identity_key=machine.key,
+                    root_password=f"root-{n}",
+                    user_password=f"user-{n}",
+                    luks_password=f"luks-{n}",
+                )
+            )
+            session.commit()
+
+    def download_snapshot(self, target: Path):
+        if not self.available:
+            raise PrimaryUnavailable("Primary is down")
+        plain = target.with_suffix(".plain")
+        snapshot(self.database.engine, plain)
+        with open(target, "wb") as output:
+            output.writelines(gzip_chunks(plain))
+        return self.taken_at, hashlib.sha256(target.read_bytes()).hexdigest()
+
+    def credentials(self, machine: MachineIdentity):
+        if not self.available:
+            raise PrimaryUnavailable("Primary is down")
+        return "root-new", "user-new", "luks-new"
+
+
+@pytest.fixture
+def primary(tmp_path: Path):
+    """Create a primary with one machine."""
+    database = Database(str(tmp_path / "primary.db"))
+    database.init()
+    primary = FakePrimary(database)
+    primary.add_machine(0)
+    yield primary
+    database.dispose()
+
+
+@pytest.fixture
+def replica_db(tmp_path: Path):
+    """Create an empty replica database."""
+    database = Database(str(tmp_path / "replica.db"))
+    database.init()
+    yield database
+    database.dispose()
+
+
+class TestReplicaSync:
+    """Tests for ReplicaSync."""
+
+    def test_refresh_applies_changed_snapshots(self, primary, replica_db):
+        """Test that snapshots are restored once and caches reloaded."""
+        store = MemoryCredentialStore()
+        sync = ReplicaSync(primary, replica_db, store=store)
+        applied = metrics.get(REFRESHES_METRIC, result="applied")
+        unchanged = metrics.get(REFRESHES_METRIC, result="unchanged")
+
+        assert sync.refresh()
+        assert store._credentials[identity(0).key] == ("root-0", "user-0", "luks-0")
+        assert not sync.refresh()
+
+        primary.add_machine(1)
+        primary.taken_at += 60
+        assert sync.refresh()
+        with replica_db.session_factory() as session:
+            assert store.lookup(session, identity(1)) == ("root-1", "user-1", "luks-1")
+        assert metrics.get(REFRESHES_METRIC, result="applied") - applied == 2
+        assert metrics.get(REFRESHES_METRIC, result="unchanged") - unchanged == 1
+
+    def test_reads_during_refresh(self, primary, replica_db):
+        """Test that requests read the old or the new copy while it is restored."""
+        with primary.database.session_factory() as session:
+            session.add_all(
+                DBMachinePasswords(
+                    mac=f"00:00:00:01:{n // 256:02x}:{n % 256:02x}",
+                    uuid=f"bulk-{n}",
+                    serial=f"BULK{n}",
+                    identity_key=f"bulk-{n}",
+                    root_password="r",
+                    user_password="u",
+                    luks_password="l",
+                )
+                for n in range(5000)
+            )
+            session.commit()
+        sync = ReplicaSync(primary, replica_db)
+        sync.refresh()
+        primary.add_machine(1)
+        primary.taken_at += 60
+
+        counts = set()
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                try:
+                    with replica_db.session_factory() as session:
+                        counts.add(session.query(DBMachinePasswords).count())
+                except Exception as e:
+                    errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for n in range(2, 5):
+                assert sync.refresh()
+                primary.add_machine(n)
+                primary.taken_at += 60
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+
+        assert errors == []
+        assert counts <= {5001, 5002, 5003, 5004}
+
+    def test_lag(self, primary, replica_db):
+        """Test that lag is the age of the snapshot served."""
+        sync = ReplicaSync(primary, replica_db)
+        primary.taken_at = time.time() - 120
+        sync.refresh()
+        assert 120 <= sync.lag_seconds() < 130
+
+        # Unchanged snapshots are as fresh as the primary's state
+        primary.taken_at = time.time()
+        sync.refresh()
+        assert sync.lag_seconds() < 10
+
+    def test_caches_invalidated_on_config_change(self, primary, replica_db):
+        """Test that rules are recompiled only when the config changed."""
+        engine = RuleEngine()
+        sync = ReplicaSync(primary, replica_db, rule_engine=engine)
+        sync.refresh()
+        invalidated = []
+        engine.invalidate = lambda: invalidated.append(True)
+
+        primary.add_machine(1)
+        sync.refresh()
+        assert invalidated == []
+
+        with primary.database.session_factory() as session:
+            create_rule(
+                session,
+                TemplateRule(
+                    match_type="serial_pattern", pattern="RP*", template_name="x"
+                ),
+                RuleEngine(),
+            )
+        sync.refresh()
+        assert invalidated == [True]
+
+    def test_failed_refresh_keeps_serving(self, primary, replica_db):
+        """Test that an unreachable primary leaves the replica's copy alone."""
+        sync = ReplicaSync(primary, replica_db, refresh_seconds=0.01)
+        sync.refresh()
+        primary.available = False
+        failed = metrics.get(REFRESHES_METRIC, result="failed")
+
+        sync.start()
+        deadline = time.time() + 5
+        while metrics.get(REFRESHES_METRIC, result="failed") == failed:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        sync.stop()
+
+        with replica_db.session_factory() as session:
+            assert session.query(DBMachinePasswords).count() == 1
+
+    def test_config_fingerprint(self, primary):
+        """Test that the fingerprint follows config and rules, not machines."""
+        with primary.database.session_factory() as session:
+            before = config_fingerprint(session)
+            primary.add_machine(1)
+            assert config_fingerprint(session) == before
+            create_rule(
+                session,
+                TemplateRule(
+                    match_type="serial_pattern", pattern="RP*", template_name="x"
+                ),
+                RuleEngine(),
+            )
+            assert config_fingerprint(session) != before
+
+
+class TestForwarding:
+    """Tests for new machines on a replica."""
+
+    def test_new_machine_created_by_primary(self, primary, replica_db):
+        """Test that the primary's passwords are served and kept locally."""
+        machine = identity(5)
+        with replica_db.session_factory() as session:
+            service = PasswordService(session, primary=primary)
+            assert service.get_or_create_passwords(
+                machine.mac, machine.uuid, machine.serial
+            ) == ("root-new", "user-new", "luks-new")
+            assert session.query(DBMachinePasswords).count() == 1
+
+    def test_known_machine_not_forwarded(self, primary, replica_db):
+        """Test that machines in the snapshot are served without the primary."""
+        ReplicaSync(primary, replica_db).refresh()
+        primary.available = False
+        machine = identity(0)
+        with replica_db.session_factory() as session:
+            service = PasswordService(session, primary=primary)
+            assert service.get_or_create_passwords(
+                machine.mac, machine.uuid, machine.serial
+            ) == ("root-0", "user-0", "luks-0")
+
+            with pytest.raises(PrimaryUnavailable):
+                new = identity(6)
+                service.get_or_create_passwords(new.mac, new.uuid, new.serial)
@@ -0,0 +1,204 @@
+"""Unit tests for fleet-wide password rotation."""
+
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.models import (
+    DBMachineConfig,
+    DBMachinePasswords,
+    DBPasswordHistory,
+    DBRotationJob,
+    RotationScope,
+)
+from provisionR.services.rotation_service import (
+    COMPLETED,
+    ROLLED_BACK,
+    ROLLING_BACK,
+    RUNNING,
+    PasswordRotator,
+    RotationError,
+    generate_credentials,
+)
+from provisionR.utils import MachineIdentity
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path):
+    """Create a session factory for a scratch SQLite database with 10 machines."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'provisionr.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        for n in range(10):
+            identity = MachineIdentity.from_raw(
+                f"00:00:00:00:00:{n:02x}", f"uuid-{n}", f"SN{n:03d}"
+            )
+            session.add(
+                DBMachinePasswords(
+                    mac=identity.mac,
+                    uuid=identity.uuid,
+                    serial=identity.serial,
+                    identity_key=identity.key,
+                    root_password=f"root-{n}",
+                    user_password=f"user-{n}",
+                    luks_password=f"luks-{n}",
+                )
+            )
+        session.commit()
+    yield factory
+    engine.dispose()
+
+
+def passwords(session_factory) -> dict:
+    """Map serial to (root, user, luks) for every machine."""
+    with session_factory() as session:
+        return {
+            m.serial: (m.root_password, m.user_password, m.luks_password)
+            for m in session.query(DBMachinePasswords)
+        }
+
+
+def start_job(rotator: PasswordRotator, session_factory, **scope) -> int:
+    """Create a rotation job and return its id."""
+    with session_factory() as session:
+        return rotator.create_job(session, RotationScope(**scope)).id
+
+
+def set_status(session_factory, job_id: int, status: str) -> None:
+    """Overwrite a job's stored status."""
+    with session_factory() as session:
+        session.get(DBRotationJob, job_id).status = status
+        session.commit()
+
+
+class TestPasswordRotator:
+    """Tests for PasswordRotator."""
+
+    def test_rotates_in_chunks_and_keeps_history(self, session_factory):
+        """Test that every machine gets new passwords, chunk by chunk."""
+        before = passwords(session_factory)
+        rotator = PasswordRotator(session_factory, chunk_size=3)
+        job_id = start_job(rotator, session_factory)
+        progress = []
+        status = rotator.run(job_id, on_progress=lambda *p: progress.append(p))
+
+        assert status == COMPLETED
+
+        after = passwords(session_factory)
+        assert all(before[serial] != after[serial] for serial in before)
+        assert progress == [(3, 10), (6, 10), (9, 10), (10, 10)]
+        with session_factory() as session:
+            job = session.get(DBRotationJob, job_id)
+            history = session.query(DBPasswordHistory).all()
+        assert (job.status, job.rotated, job.total) == (COMPLETED, 10, 10)
+        assert sorted(row.root_password for row in history) == sorted(
+            root for root, _, _ in before.values()
+        )
+
+    def test_scope_by_group(self, session_factory):
+        """Test that a group scope only rotates the group's machines."""
+        with session_factory() as session:
+            machine = session.query(DBMachinePasswords).filter_by(serial="SN004").one()
+            session.add(
+                DBMachineConfig(
+                    identity_key=machine.identity_key,
+                    mac=machine.mac,
+                    uuid=machine.uuid,
+                    serial=machine.serial,
+                    group_name="storage",
+                )
+            )
+            session.commit()
+        before = passwords(session_factory)
+        rotator = PasswordRotator(session_factory)
+
+        rotator.run(start_job(rotator, session_factory, group="storage"))
+
+        after = passwords(session_factory)
+        assert [s for s in before if before[s] != after[s]] == ["SN004"]
+
+    def test_interrupted_job_resumes_after_last_chunk(self, session_factory):
+        """Test that a stopped job keeps its progress and finishes on resume."""
+        rotator = PasswordRotator(session_factory, chunk_size=4)
+        job_id = start_job(rotator, session_factory)
+
+        def stop_after_first_chunk(rotated, total):
+            rotator._stop.set()
+
+        assert rotator.run(job_id, on_progress=stop_after_first_chunk) == RUNNING
+        rotator._stop.clear()
+        with session_factory() as session:
+            assert session.get(DBRotationJob, job_id).rotated == 4
+
+        assert rotator.run(job_id) == COMPLETED
+        with session_factory() as session:
+            assert session.get(DBRotationJob, job_id).rotated == 10
+            assert session.query(DBPasswordHistory).count() == 10
+
+    def test_rollback_restores_previous_generation(self, session_factory):
+        """Test that rolling back the latest job restores the old passwords."""
+        original = passwords(session_factory)
+        rotator = PasswordRotator(session_factory, chunk_size=3)
+        first = start_job(rotator, session_factory)
+        rotator.run(first)
+        rotated = passwords(session_factory)
+        second = start_job(rotator, session_factory, prefix="SN001")
+        rotator.run(second)
+
+        with pytest.raises(RotationError):
+            rotator.rollback(first)
+        rotator.rollback(second)
+        assert passwords(session_factory) == rotated
+        rotator.rollback(first)
+        assert passwords(session_factory) == original
+        with session_factory() as session:
+            assert session.get(DBRotationJob, first).status == ROLLED_BACK
+        with pytest.raises(RotationError):
+            rotator.run(first)
+
+    def test_rollback_requires_finished_job(self, session_factory):
+        """Test that only completed or failed jobs are rolled back."""
+        original = passwords(session_factory)
+        rotator = PasswordRotator(session_factory, chunk_size=3)
+        job_id = start_job(rotator, session_factory)
+        with pytest.raises(RotationError):
+            rotator.rollback(job_id)
+
+        # Running in another process
+        rotator.run(job_id)
+        rotated = passwords(session_factory)
+        set_status(session_factory, job_id, RUNNING)
+        with pytest.raises(RotationError):
+            rotator.rollback(job_id)
+        assert passwords(session_factory) == rotated
+
+        # An interrupted rollback can't be run, only finished
+        set_status(session_factory, job_id, ROLLING_BACK)
+        with pytest.raises(RotationError):
+            rotator.run(job_id)
+        rotator.rollback(job_id)
+        assert passwords(session_factory) == original
+
+    def test_parallel_generation(self, session_factory):
+        """Test that passwords can be generated in worker processes."""
+        before = passwords(session_factory)
+        rotator = PasswordRotator(session_factory, chunk_size=5, workers=2)
+
+        rotator.run(start_job(rotator, session_factory))
+
+        after = passwords(session_factory)
+        assert all(before[s] != after[s] for s in before)
+        assert len({root for root, _, _ in after.values()}) == 10
+
+    def test_generate_credentials(self):
+        """Test that each machine gets three distinct passphrases."""
+        credentials = generate_credentials(3)
+        assert len(credentials) == 3
+        assert all(len(set(triple)) == 3 for triple in credentials)
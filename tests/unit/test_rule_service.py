@@ -0,0 +1,161 @@
+"""Unit tests for template rule resolution."""
+
+import pytest
+from pydantic import ValidationError
+
+from provisionR.database import SessionLocal
+from provisionR.models import RuleMatchType, TemplateRule
+from provisionR.services import rule_service
+from provisionR.services.rule_service import (
+    CompiledRules,
+    RuleEngine,
+    create_rule,
+    delete_rule,
+)
+from provisionR.utils import MachineIdentity
+
+
+def rule(rule_id: int, match_type: str, pattern: str, **kwargs) -> TemplateRule:
+    """Build a rule with an explicit ID."""
+    return TemplateRule(
+        id=rule_id, match_type=RuleMatchType(match_type), pattern=pattern, **kwargs
+    )
+
+
+def machine(mac: str = "00:11:22:33:44:55", serial: str = "SN1") -> MachineIdentity:
+    """Build a machine identity."""
+    return MachineIdentity.from_raw(mac, "uuid", serial)
+
+
+class TestTemplateRule:
+    """Tests for TemplateRule validation."""
+
+    def test_invalid_mac_prefix_rejected(self):
+        """Test that MAC prefixes must be hex digits."""
+        with pytest.raises(ValidationError):
+            rule(1, "mac_prefix", "00:GG")
+
+    def test_invalid_regex_rejected(self):
+        """Test that serial patterns must compile."""
+        with pytest.raises(ValidationError):
+            rule(1, "serial_pattern", "SN[")
+
+    def test_query_param_requires_name(self):
+        """Test that query_param rules need a parameter name."""
+        with pytest.raises(ValidationError):
+            rule(1, "query_param", "web")
+
+
+class TestCompiledRules:
+    """Tests for the compiled matcher index."""
+
+    def test_mac_prefix_ignores_formatting(self):
+        """Test that MAC prefixes match regardless of separators and case."""
+        compiled = CompiledRules([rule(1, "mac_prefix", "00-11-2")])
+
+        assert compiled.match(machine("00:11:22:33:44:55"), {}).id == 1
+        assert compiled.match(machine("00:12:22:33:44:55"), {}) is None
+
+    def test_priority_beats_prefix_length(self):
+        """Test that a lower priority value wins over a longer prefix."""
+        compiled = CompiledRules(
+            [
+                rule(1, "mac_prefix", "00:11:22", priority=50),
+                rule(2, "mac_prefix", "00", priority=10),
+            ]
+        )
+
+        assert compiled.match(machine(), {}).id == 2
+
+    def test_serial_patterns_ordered_by_priority(self):
+        """Test that the combined serial regex returns the best matching rule."""
+        compiled = CompiledRules(
+            [
+                rule(1, "serial_pattern", r"SN(\d+)", priority=20),
+                rule(2, "serial_pattern", r"SN1\d*", priority=10),
+                rule(3, "serial_pattern", r"(?P<x>XX)\d+", priority=5),
+            ]
+        )
+
+        assert compiled.serial_regex is not None
+        assert compiled.match(machine(serial="SN123"), {}).id == 2
+        assert compiled.match(machine(serial="SN923"), {}).id == 1
+        assert compiled.match(machine(serial="XX1"), {}).id == 3
+        # Patterns must match the whole serial
+        assert compiled.match(machine(serial="ASN1"), {}) is None
+
+    def test_backreferences_fall_back_to_sequential_matching(self):
+        """Test that patterns that can't be merged are still matched."""
+        compiled = CompiledRules([rule(1, "serial_pattern", r"(\w)\1-\d+")])
+
+        assert compiled.serial_regex is None
+        assert compiled.match(machine(serial="AA-1"), {}).id == 1
+        assert compiled.match(machine(serial="AB-1"), {}) is None
+
+    def test_query_param_and_cross_type_priority(self):
+        """Test query parameter rules and ranking across match types."""
+        compiled = CompiledRules(
+            [
+                rule(1, "mac_prefix", "00:11", priority=100),
+                rule(2, "query_param", "web", param_name="role", priority=50),
+            ]
+        )
+
+        assert compiled.match(machine(), {"role": "web"}).id == 2
+        assert compiled.match(machine(), {"role": "db"}).id == 1
+
+
+class TestRuleEngine:
+    """Tests for RuleEngine caching and invalidation."""
+
+    def test_resolution_cached_until_rules_change(self):
+        """Test that rule changes invalidate cached resolutions."""
+        engine = RuleEngine()
+        with SessionLocal() as db:
+            assert engine.resolve(db, machine(), {}) is None
+
+            created = create_rule(
+                db,
+                rule(
+                    None,
+                    "mac_prefix",
+                    "00:11:22",
+                    template_name="rocky",
+                    values={"role": "web"},
+                ),
+                engine,
+            )
+            match = engine.resolve(db, machine(), {})
+            assert match.rule_id == created.id
+            assert match.template_name == "rocky"
+            assert match.values == {"role": "web"}
+
+            assert delete_rule(db, created.id, engine)
+            assert engine.resolve(db, machine(), {}) is None
+            assert not delete_rule(db, created.id, engine)
+
+    def test_cache_is_bounded(self):
+        """Test that the resolution cache evicts the least recently used."""
+        engine = RuleEngine(cache_size=2)
+        with SessionLocal() as db:
+            for n in range(5):
+                engine.resolve(db, machine(serial=f"SN{n}"), {})
+
+        assert len(engine._cache) == 2
+
+    def test_rules_loaded_before_invalidation_not_installed(self, monkeypatch):
+        """Test that a compile racing with a rule change isn't kept."""
+        engine = RuleEngine()
+        list_rules = rule_service.list_rules
+
+        def list_then_change(db):
+            rules = list_rules(db)
+            engine.invalidate()
+            return rules
+
+        monkeypatch.setattr(rule_service, "list_rules", list_then_change)
+        with SessionLocal() as db:
+            assert engine.resolve(db, machine(), {}) is None
+
+        assert engine._compiled is None
+        assert len(engine._cache) == 0
@@ -3,12 +3,13 @@
 import pytest
 from sqlalchemy.orm import Session
 
-from provisionR.services.kickstart_service import KickstartService
+from provisionR.services.kickstart_service import PREVIEW_PASSWORDS, KickstartService
 from provisionR.services.password_service import PasswordService
 from provisionR.services.export_service import ExportService
-from provisionR.models import GlobalConfig, TargetOS
+from provisionR.models import DBMachinePasswords, GlobalConfig, TargetOS
 from provisionR.config import update_global_config_in_db
 from provisionR.database import SessionLocal
+from provisionR.utils import TemplateRenderLimitExceeded
 
 
 @pytest.fixture
@@ -61,6 +62,24 @@ class TestPasswordService:
         assert user1 == user2
         assert luks1 == luks2
 
+    def test_formatting_differences_are_the_same_machine(self, db_session: Session):
+        """Test that identifier formatting doesn't create a second machine."""
+        service = PasswordService(db_session)
+
+        first = service.get_or_create_passwords(
+            mac="00:11:22:AA:BB:CC",
+            uuid="550E8400-E29B-41D4-A716-446655440000",
+            serial="SERIAL123",
+        )
+        second = service.get_or_create_passwords(
+            mac="00-11-22-aa-bb-cc",
+            uuid="550e8400-e29b-41d4-a716-446655440000",
+            serial=" SERIAL123 ",
+        )
+
+        assert first == second
+        assert db_session.query(DBMachinePasswords).count() == 1
+
 
 class TestKickstartService:
     """Tests for KickstartService."""
@@ -194,6 +213,37 @@ Timezone: {{ timezone }}"""
         assert "Hostname: server01" in result
         assert "Timezone: America/New_York" in result
 
+    def test_generate_from_string_preview(self, db_session: Session):
+        """Test that previews use placeholder credentials and store nothing."""
+        service = KickstartService(db_session)
+
+        result = service.generate_from_string(
+            mac="AA:BB:CC:DD:EE:FF",
+            uuid="test-uuid",
+            serial="SERIAL123",
+            template_string="{{ root_password }} {{ luks_password }}",
+            query_params={},
+            preview=True,
+        )
+
+        assert result == (
+            f"{PREVIEW_PASSWORDS['root_password']} {PREVIEW_PASSWORDS['luks_password']}"
+        )
+        assert db_session.query(DBMachinePasswords).count() == 0
+
+    def test_generate_from_string_enforces_render_limits(self, db_session: Session):
+        """Test that runaway templates are stopped by the render budgets."""
+        service = KickstartService(db_session)
+
+        with pytest.raises(TemplateRenderLimitExceeded):
+            service.generate_from_string(
+                mac="AA:BB:CC",
+                uuid="uuid",
+                serial="serial",
+                template_string="{% macro f() %}{{ f() }}{% endmacro %}{{ f() }}",
+                query_params={},
+            )
+
 
 class TestExportService:
     """Tests for ExportService."""
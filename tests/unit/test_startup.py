@@ -0,0 +1,54 @@
+"""Unit tests for side-effect-free application startup."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from provisionR.app import create_app
+from provisionR.settings import Settings
+
+# Runs in a fresh interpreter so modules imported by other tests don't count
+IMPORT_ONLY = """
+import json, sys
+from provisionR.app import create_app
+app = create_app()
+print(json.dumps({"passlib": "passlib.hash" in sys.modules}))
+"""
+
+
+class TestStartup:
+    """Tests for importing the package and creating apps."""
+
+    def test_import_and_create_app_have_no_side_effects(self, tmp_path: Path):
+        """Test that neither importing nor create_app() touches the database."""
+        db_path = tmp_path / "provisionr.db"
+        env = dict(os.environ, PROVISIONR_DB_PATH=str(db_path))
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_ONLY],
+            env=env,
+            cwd=tmp_path,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+        assert json.loads(output.splitlines()[-1]) == {"passlib": False}
+        assert list(tmp_path.iterdir()) == []
+
+    def test_app_uses_explicit_settings(self, tmp_path: Path):
+        """Test that an app created with settings uses its own database."""
+        settings = Settings(db_path=str(tmp_path / "other.db"), jobs_dir=str(tmp_path))
+        app = create_app(settings)
+        assert app.state.settings is settings
+
+        params = {"mac": "00:11:22:33:44:55", "uuid": "u", "serial": "s"}
+        with TestClient(app) as client:
+            assert client.get("/api/v1/ks", params=params).status_code == 200
+            exported = client.get("/api/v1/machines/export").text
+        assert "00:11:22:33:44:55" in exported
+        assert (tmp_path / "other.db").exists()
@@ -0,0 +1,150 @@
+"""Unit tests for the static asset manifest."""
+
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+
+from provisionR.utils.static_manifest import (
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    StaticManifest,
+    parse_accept_encoding,
+)
+
+BUNDLE = "console.log('provisionR');\n" * 100
+
+
+@pytest.fixture
+def static_dir(tmp_path: Path) -> Path:
+    """Create a small built-frontend directory."""
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "index.html").write_text("<html></html>")
+    (tmp_path / "assets" / "index-BPH6GUYS.js").write_text(BUNDLE)
+    (tmp_path / "assets" / "index-DcQMu5tE.css").write_text("body{}")
+    (tmp_path / "assets" / "index-DcQMu5tE.css.br").write_bytes(b"brotli-bytes")
+    # Copied from gui/public, so not content-hashed despite the hyphen
+    (tmp_path / "assets" / "vendor-polyfills.js").write_text(BUNDLE)
+    (tmp_path / ".vite").mkdir()
+    (tmp_path / ".vite" / "manifest.json").write_text(
+        json.dumps(
+            {
+                "index.html": {
+                    "file": "assets/index-BPH6GUYS.js",
+                    "src": "index.html",
+                    "isEntry": True,
+                    "css": ["assets/index-DcQMu5tE.css"],
+                }
+            }
+        )
+    )
+    return tmp_path
+
+
+class TestParseAcceptEncoding:
+    """Tests for Accept-Encoding parsing."""
+
+    def test_parses_quality_values(self):
+        """Test that q-values are parsed and q=0 entries dropped."""
+        accepted = parse_accept_encoding("gzip;q=0.5, br, identity;q=0")
+        assert accepted == {"gzip": 0.5, "br": 1.0}
+
+    def test_empty_header(self):
+        """Test that a missing header accepts nothing."""
+        assert parse_accept_encoding(None) == {}
+
+
+class TestStaticManifest:
+    """Tests for StaticManifest."""
+
+    def test_build_indexes_files(self, static_dir: Path):
+        """Test that every file except siblings and build metadata is indexed."""
+        manifest = StaticManifest.build(static_dir)
+        assert set(manifest.assets) == {
+            "index.html",
+            "assets/index-BPH6GUYS.js",
+            "assets/index-DcQMu5tE.css",
+            "assets/vendor-polyfills.js",
+        }
+
+    def test_missing_directory(self, tmp_path: Path):
+        """Test that a missing directory yields an empty manifest."""
+        assert StaticManifest.build(tmp_path / "missing").assets == {}
+
+    def test_cache_control(self, static_dir: Path):
+        """Test that hashed bundles are immutable and index.html revalidates."""
+        manifest = StaticManifest.build(static_dir)
+        assert (
+            manifest.get("assets/index-BPH6GUYS.js").cache_control
+            == IMMUTABLE_CACHE_CONTROL
+        )
+        assert manifest.get("index.html").cache_control == REVALIDATE_CACHE_CONTROL
+
+    def test_only_build_manifest_files_immutable(self, static_dir: Path):
+        """Test that hyphenated files Vite didn't hash are revalidated."""
+        manifest = StaticManifest.build(static_dir)
+        assert (
+            manifest.get("assets/index-DcQMu5tE.css").cache_control
+            == IMMUTABLE_CACHE_CONTROL
+        )
+        assert (
+            manifest.get("assets/vendor-polyfills.js").cache_control
+            == REVALIDATE_CACHE_CONTROL
+        )
+
+        (static_dir / ".vite" / "manifest.json").unlink()
+        manifest = StaticManifest.build(static_dir)
+        assert (
+            manifest.get("assets/index-BPH6GUYS.js").cache_control
+            == REVALIDATE_CACHE_CONTROL
+        )
+
+    def test_precompressed_variant_preferred(self, static_dir: Path):
+        """Test that a .br sibling is served when the client accepts brotli."""
+        manifest = StaticManifest.build(static_dir)
+        asset = manifest.get("assets/index-DcQMu5tE.css")
+
+        response = manifest.response(asset, {"accept-encoding": "gzip, br"})
+        assert response.headers["content-encoding"] == "br"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["content-length"] == str(len(b"brotli-bytes"))
+
+        response = manifest.response(asset, {"accept-encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+    def test_gzip_variant_computed_at_build(self, static_dir: Path):
+        """Test that large compressible files get a gzip variant at build time."""
+        manifest = StaticManifest.build(static_dir)
+        asset = manifest.get("assets/index-BPH6GUYS.js")
+
+        response = manifest.response(asset, {"accept-encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(response.body).decode() == BUNDLE
+
+    def test_conditional_request(self, static_dir: Path):
+        """Test that a matching If-None-Match returns 304."""
+        manifest = StaticManifest.build(static_dir)
+        asset = manifest.get("index.html")
+
+        response = manifest.response(asset, {"if-none-match": asset.etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == asset.etag
+
+    def test_conditional_request_weak_etag(self, static_dir: Path):
+        """Test that If-None-Match compares weakly, as W/ tags from proxies."""
+        manifest = StaticManifest.build(static_dir)
+        asset = manifest.get("index.html")
+
+        response = manifest.response(asset, {"if-none-match": f'"x", W/{asset.etag}'})
+        assert response.status_code == 304
+        assert manifest.response(asset, {"if-none-match": 'W/"x"'}).status_code == 200
+
+    def test_etag_differs_per_encoding(self, static_dir: Path):
+        """Test that compressed variants do not share the identity ETag."""
+        manifest = StaticManifest.build(static_dir)
+        asset = manifest.get("assets/index-BPH6GUYS.js")
+
+        plain = manifest.response(asset, {})
+        gzipped = manifest.response(asset, {"accept-encoding": "gzip"})
+        assert plain.headers["etag"] != gzipped.headers["etag"]
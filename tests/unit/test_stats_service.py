@@ -0,0 +1,158 @@
+"""Unit tests for fleet statistics."""
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from provisionR.database import Base
+from provisionR.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    _add_fleet_stats,
+    run_migrations,
+)
+from provisionR.models import DBAccessLog, DBMachinePasswords
+from provisionR.services.stats_service import StatsService
+
+NOW = datetime(2025, 3, 2, 10, 30)
+
+
+def machine_row(n: int, created_at: datetime) -> dict:
+    """Build a machine_passwords row for synthetic machine `n`."""
+    return {
+        "mac": f"00:00:00:00:00:{n:02X}",
+        "uuid": f"uuid-{n}",
+        "serial": f"SN{n}",
+        "identity_key": f"{n:032x}",
+        "root_password": "r",
+        "user_password": "u",
+        "luks_password": "l",
+        "created_at": created_at,
+    }
+
+
+def fetch_row(n: int, template: str, target_os) -> dict:
+    """Build a kickstart_access_log row for synthetic machine `n`."""
+    return {
+        "identity_key": f"{n:032x}",
+        "mac": f"00:00:00:00:00:{n:02X}",
+        "uuid": f"uuid-{n}",
+        "serial": f"SN{n}",
+        "template_name": template,
+        "fetched_at": NOW,
+        "target_os": target_os,
+    }
+
+
+@pytest.fixture
+def engine(tmp_path: Path):
+    """Create a scratch SQLite database with the current schema."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'provisionr.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def fill(engine) -> None:
+    """Insert a few machines and fetches."""
+    with engine.begin() as conn:
+        conn.execute(
+            insert(DBMachinePasswords),
+            [
+                machine_row(1, datetime(2025, 3, 1, 9, 5)),
+                machine_row(2, datetime(2025, 3, 2, 9, 10)),
+                machine_row(3, datetime(2025, 3, 2, 9, 50)),
+                machine_row(4, datetime(2025, 3, 2, 10, 1)),
+            ],
+        )
+        conn.execute(
+            insert(DBAccessLog),
+            [
+                fetch_row(1, "default", "Rocky9"),
+                fetch_row(2, "default", "Rocky9"),
+                fetch_row(3, "minimal", "Fedora41"),
+                fetch_row(4, "minimal", None),
+            ],
+        )
+
+
+def summary(engine, **kwargs) -> dict:
+    """Summarize the fleet in a database."""
+    with sessionmaker(bind=engine)() as db:
+        return StatsService(db).summary(now=NOW, **kwargs)
+
+
+class TestStatsService:
+    """Tests for the fleet_stats counters and StatsService."""
+
+    def test_counters_follow_inserts(self, engine):
+        """Test that triggers count machines and fetches as they are written."""
+        fill(engine)
+
+        stats = summary(engine, days=3, hours=3)
+
+        assert stats["total_machines"] == 4
+        assert stats["new_machines_per_day"] == {
+            "2025-02-28": 0,
+            "2025-03-01": 1,
+            "2025-03-02": 3,
+        }
+        assert stats["new_machines_per_hour"] == {
+            "2025-03-02T08": 0,
+            "2025-03-02T09": 2,
+            "2025-03-02T10": 1,
+        }
+        assert stats["fetches_per_template"] == {"default": 2, "minimal": 2}
+        assert stats["fetches_per_os"] == {"Rocky9": 2, "Fedora41": 1}
+
+    def test_deleting_machines_lowers_only_the_total(self, engine):
+        """Test that deleted machines leave the new-machine history alone."""
+        fill(engine)
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM machine_passwords WHERE id <= 2"))
+
+        stats = summary(engine, days=2, hours=1)
+
+        assert stats["total_machines"] == 2
+        assert stats["new_machines_per_day"] == {"2025-03-01": 1, "2025-03-02": 3}
+
+    def test_empty_database(self, engine):
+        """Test that a new database reports zeros."""
+        stats = summary(engine, days=1, hours=1)
+
+        assert stats == {
+            "total_machines": 0,
+            "new_machines_per_day": {"2025-03-02": 0},
+            "new_machines_per_hour": {"2025-03-02T10": 0},
+            "fetches_per_template": {},
+            "fetches_per_os": {},
+        }
+
+    def test_migration_backfills_counters(self, engine):
+        """Test that upgrading a database counts the rows it already has."""
+        fill(engine)
+        with engine.begin() as conn:
+            for trigger in ("machine_ai", "machine_ad", "fetch_ai"):
+                conn.execute(text(f"DROP TRIGGER fleet_stats_{trigger}"))
+            conn.execute(text("DROP TABLE fleet_stats"))
+            applied = MIGRATIONS.index(_add_fleet_stats)
+            conn.execute(text(f"PRAGMA user_version = {applied}"))
+
+        assert run_migrations(engine) == SCHEMA_VERSION - applied
+        stats = summary(engine, days=2, hours=2)
+        assert stats["total_machines"] == 4
+        assert stats["new_machines_per_hour"] == {
+            "2025-03-02T09": 2,
+            "2025-03-02T10": 1,
+        }
+        assert stats["fetches_per_os"] == {"Rocky9": 2, "Fedora41": 1}
+
+        # The triggers are in place for new rows
+        with engine.begin() as conn:
+            conn.execute(
+                insert(DBMachinePasswords), [machine_row(5, datetime(2025, 3, 2, 10))]
+            )
+        assert summary(engine, days=1, hours=1)["total_machines"] == 5
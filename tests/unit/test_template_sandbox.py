@@ -0,0 +1,207 @@
+"""Unit tests for sandboxed template rendering."""
+
+import pytest
+from jinja2 import DictLoader
+from jinja2.exceptions import SecurityError
+
+from provisionR.metrics import metrics
+from provisionR.settings import Settings
+from provisionR.utils import (
+    GuardedEnvironment,
+    LazyValues,
+    RenderLimits,
+    TemplateRenderLimitExceeded,
+)
+from provisionR.utils.template_sandbox import LIMIT_EXCEEDED_METRIC
+
+
+def render(source: str, limits: RenderLimits = RenderLimits(), **context) -> str:
+    """Render a template string with the given limits."""
+    env = GuardedEnvironment(limits=limits)
+    return env.render_template(env.from_string(source), context)
+
+
+class TestGuardedEnvironment:
+    """Tests for GuardedEnvironment."""
+
+    def test_renders_normal_template(self):
+        """Test that ordinary templates render unchanged."""
+        result = render(
+            "{% for pkg in packages %}{{ pkg }}\n{% endfor %}{{ loop_free }}",
+            packages=["vim", "git"],
+            loop_free="done",
+        )
+        assert result == "vim\ngit\ndone"
+
+    def test_loop_variable_still_available(self):
+        """Test that wrapping the iterable keeps loop.* helpers working."""
+        result = render(
+            "{% for x in items %}{{ loop.index }}/{{ loop.length }}"
+            "{% if not loop.last %},{% endif %}{% endfor %}",
+            items=["a", "b", "c"],
+        )
+        assert result == "1/3,2/3,3/3"
+
+    def test_loop_iteration_budget(self):
+        """Test that nested loops are stopped once the iteration budget is spent."""
+        limits = RenderLimits(max_loop_iterations=100)
+        with pytest.raises(TemplateRenderLimitExceeded) as exc_info:
+            render(
+                "{% for i in range(50) %}{% for j in range(50) %}"
+                "{% endfor %}{% endfor %}",
+                limits,
+            )
+        assert exc_info.value.limit == "loop"
+
+    def test_output_budget(self):
+        """Test that large output is rejected."""
+        limits = RenderLimits(max_output_bytes=64)
+        with pytest.raises(TemplateRenderLimitExceeded) as exc_info:
+            render("{% for i in range(100) %}{{ i }}-{% endfor %}", limits)
+        assert exc_info.value.limit == "output"
+
+    def test_string_repetition_checked_before_allocation(self):
+        """Test that a huge repetition fails without building the string."""
+        limits = RenderLimits(max_output_bytes=1024)
+        with pytest.raises(TemplateRenderLimitExceeded) as exc_info:
+            render("{{ 'x' * 1000000000000 }}", limits)
+        assert exc_info.value.limit == "output"
+
+    @pytest.mark.parametrize("operator", ["~", "+"])
+    def test_doubling_concatenation_rejected(self, operator):
+        """Test that a string doubled in a loop stops at the output budget."""
+        with pytest.raises(TemplateRenderLimitExceeded) as exc_info:
+            render(
+                "{% set ns = namespace(s='a') %}{% for i in range(40) %}"
+                f"{{% set ns.s = ns.s {operator} ns.s %}}{{% endfor %}}"
+            )
+        assert exc_info.value.limit == "output"
+
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "{{ ''|center(300000000) }}",
+            "{{ 'a'|indent(300000000, true) }}",
+            "{{ '%300000000s'|format('') }}",
+            "{{ '%*s'|format(300000000, '') }}",
+            "{{ ['a' * 1000000, 'b' * 1000000]|join }}",
+            "{{ ('a' * 1000000)|replace('a', 'aa') }}",
+            "{{ ''.center(300000000) }}",
+            "{{ '{:>300000000}'.format('') }}",
+            "{% set ns = namespace(s='a') %}{% for i in range(40) %}"
+            "{% set b %}{{ ns.s }}{{ ns.s }}{% endset %}{% set ns.s = b %}"
+            "{% endfor %}",
+        ],
+    )
+    def test_padding_and_joining_checked(self, source):
+        """Test that filters, str methods and blocks can't build huge strings."""
+        with pytest.raises(TemplateRenderLimitExceeded):
+            render(source)
+
+    def test_guarded_operations_render_unchanged(self):
+        """Test that small concatenations, paddings and joins still work."""
+        result = render(
+            "{{ 'a' ~ 1 }} {{ 'x'|center(5) }}|{{ items|join(',') }} "
+            "{{ '%s-%d'|format('a', 3) }} {{ '{}/{}'.format(1, 2) }} "
+            "{{ [1] + [2] }}",
+            items=["p", "q"],
+        )
+        assert result == "a1   x  |p,q a-3 1/2 [1, 2]"
+
+    def test_huge_power_rejected(self):
+        """Test that exponentiation producing a huge integer is rejected."""
+        with pytest.raises(TemplateRenderLimitExceeded):
+            render("{{ 9 ** 99999999999 }}")
+
+    def test_recursive_macro_depth_budget(self):
+        """Test that unbounded macro recursion hits the call depth budget."""
+        limits = RenderLimits(max_call_depth=10)
+        with pytest.raises(TemplateRenderLimitExceeded) as exc_info:
+            render("{% macro f(n) %}{{ f(n + 1) }}{% endmacro %}{{ f(0) }}", limits)
+        assert exc_info.value.limit == "depth"
+
+    def test_time_budget(self):
+        """Test that a long-running render is cut off by the wall-clock budget."""
+        limits = RenderLimits(timeout_seconds=0.05, max_loop_iterations=10**9)
+        with pytest.raises(TemplateRenderLimitExceeded) as exc_info:
+            render(
+                "{% for i in range(100000) %}{% for j in range(100000) %}"
+                "{% endfor %}{% endfor %}",
+                limits,
+            )
+        assert exc_info.value.limit == "time"
+
+    def test_loops_in_included_templates_are_guarded(self):
+        """Test that loops in templates loaded from the loader are guarded too."""
+        env = GuardedEnvironment(
+            limits=RenderLimits(max_loop_iterations=5),
+            loader=DictLoader(
+                {"part.j2": "{% for i in range(10) %}{{ i }}{% endfor %}"}
+            ),
+        )
+        template = env.from_string("{% include 'part.j2' %}")
+        with pytest.raises(TemplateRenderLimitExceeded):
+            env.render_template(template, {})
+
+    def test_unsafe_attribute_access_blocked(self):
+        """Test that the standard sandbox restrictions still apply."""
+        with pytest.raises(SecurityError):
+            render("{{ ''.__class__.__mro__[1].__subclasses__() }}")
+
+    def test_breach_increments_metric(self):
+        """Test that a budget breach is counted in the metrics registry."""
+        before = metrics.get(LIMIT_EXCEEDED_METRIC, limit="loop")
+        with pytest.raises(TemplateRenderLimitExceeded):
+            render(
+                "{% for i in range(10) %}{% endfor %}",
+                RenderLimits(max_loop_iterations=1),
+            )
+        assert metrics.get(LIMIT_EXCEEDED_METRIC, limit="loop") == before + 1
+
+    def test_lazy_values_computed_only_when_used(self):
+        """Test that lazy variables are computed once, and only if referenced."""
+        calls = []
+
+        def compute(name):
+            return lambda: calls.append(name) or name.upper()
+
+        env = GuardedEnvironment(loader=DictLoader({"part.j2": "{{ used }}"}))
+        context = LazyValues(
+            {"plain": "p", "used": "shadowed"},
+            {"used": compute("used"), "unused": compute("unused")},
+        )
+        template = env.from_string(
+            "{{ plain }} {{ used }} {{ used }} {{ range(2)|list }} "
+            "{% include 'part.j2' %}"
+        )
+
+        assert env.render_template(template, context) == "p USED USED [0, 1] USED"
+        assert calls == ["used"]
+
+    def test_lazy_values_errors_propagate(self):
+        """Test that budgets and template errors still raise with lazy values."""
+        env = GuardedEnvironment(limits=RenderLimits(max_loop_iterations=1))
+        context = LazyValues({}, {"x": lambda: 1 / 0})
+        with pytest.raises(TemplateRenderLimitExceeded):
+            env.render_template(
+                env.from_string("{% for i in range(5) %}{% endfor %}"), context
+            )
+        with pytest.raises(ZeroDivisionError):
+            env.render_template(env.from_string("{{ x }}"), context)
+
+
+class TestRenderLimits:
+    """Tests for RenderLimits."""
+
+    def test_from_settings(self):
+        """Test that limits are read from environment-backed settings."""
+        settings = Settings.from_env(
+            {
+                "PROVISIONR_RENDER_TIMEOUT_SECONDS": "0.5",
+                "PROVISIONR_RENDER_MAX_OUTPUT_BYTES": "2048",
+            }
+        )
+        limits = RenderLimits.from_settings(settings)
+        assert limits.timeout_seconds == 0.5
+        assert limits.max_output_bytes == 2048
+        assert limits.max_loop_iterations == Settings().render_max_loop_iterations